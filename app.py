@@ -3,10 +3,17 @@ from logging.handlers import RotatingFileHandler
 from flask import Flask, request, jsonify
 import os
 from config import Config
-from extensions import db, migrate, init_mongo
+from extensions import db, migrate, init_mongo, inicializar_banco
 from blueprints.main import main_bp
 from blueprints.auth import auth_bp
 from auth import init_login_manager, get_user_context
+import auditoria
+import backups
+import jobs
+import perfil_consultas
+import metricas
+import consultas_lentas
+import idempotencia
 
 
 def _is_api_request():
@@ -30,7 +37,8 @@ def create_app(config_class=Config):
     db.init_app(app)
     migrate.init_app(app, db)
 
-    # MongoDB (persistência oficial)
+    # MongoDB (persistência oficial): só cria o cliente; conexão no primeiro uso e nenhuma
+    # escrita no boot (coleções, índices e seed: scripts/inicializar_banco.py)
     try:
         init_mongo(app)
         app.config['MONGO_AVAILABLE'] = True
@@ -40,6 +48,15 @@ def create_app(config_class=Config):
         app.config['MONGO_AVAILABLE'] = False
         print(f"[WARN] MongoDB indisponível: {e}. Inicializando app sem Mongo para preview.")
 
+    # Auditoria em segundo plano (fila + insert_many)
+    auditoria.init_app(app)
+
+    # Backups agendados (thread por processo; executa só o líder)
+    backups.init_app(app)
+
+    # Jobs em segundo plano (relatórios e tarefas administrativas demoradas)
+    jobs.init_app(app)
+
     # Login manager
     init_login_manager(app)
 
@@ -52,6 +69,9 @@ def create_app(config_class=Config):
     app.register_blueprint(main_bp)
     app.register_blueprint(auth_bp)
 
+    # Rotas POST com Idempotency-Key (o fetchJson só repete essas após falha de rede)
+    idempotencia.init_app(app)
+
     try:
         app.config['START_TIME'] = app.config.get('START_TIME') or __import__('time').time()
     except Exception:
@@ -93,6 +113,15 @@ def create_app(config_class=Config):
         except Exception:
             pass
 
+    # Perfil dos comandos Mongo por requisição (Server-Timing + log + aviso de N+1)
+    perfil_consultas.init_app(app)
+
+    # Métricas Prometheus (GET /metrics), somadas entre os workers via METRICS_DIR
+    metricas.init_app(app)
+
+    # Comandos Mongo acima de MONGO_SLOW_MS: ocorrência + explain em 'consultas_lentas'
+    consultas_lentas.init_app(app)
+
     @app.after_request
     def _set_security_headers(resp):
         try:
@@ -128,10 +157,26 @@ def create_app(config_class=Config):
 
     return app
 
-# Expor o app para gunicorn
-app = create_app()
+def create_script_app():
+    """App para scripts/*.py: mesma configuração, sem as threads de segundo plano (ScriptConfig)."""
+    from config import ScriptConfig
+    return create_app(ScriptConfig)
+
+
+def __getattr__(name):
+    # Expor o app para gunicorn (app:app), criado só quando pedido: importar create_app ou
+    # create_script_app (testes e scripts) não sobe o runner de jobs nem os agendadores
+    if name == 'app':
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 if __name__ == '__main__':
+    app = create_app()
     port = int(os.environ.get('PORT', '5000'))
     host = os.environ.get('HOST', '127.0.0.1')
+    # Servidor de desenvolvimento: processo único, inicializa o banco (ou o mongomock) antes de servir
+    inicializar_banco(app)
     app.run(debug=True, host=host, port=port, use_reloader=False)
@@ -0,0 +1,187 @@
+"""Arquivamento em blocos com checkpoint e políticas de retenção.
+
+arquivar() move os documentos que casam com um filtro de uma coleção para a coleção de
+arquivo em blocos ordenados por _id: insert em lote no destino, delete_many do bloco na origem
+e checkpoint (último _id movido) em 'arquivamento_execucoes'. Se o processo cair no meio, a
+execução retomada reinsere o bloco pendente (duplicados no destino são ignorados) e o remove
+da origem, sem deixar cópias duplicadas nem documentos perdidos.
+
+As políticas de retenção (RETENCAO_POLITICAS na configuração; padrão abaixo) são executadas
+uma vez por dia pelo agendador em segundo plano (backups.BackupScheduler), no horário
+RETENCAO_HORARIO. Cada política vira uma execução '<coleção>:<data>' que continua do
+checkpoint até concluir.
+
+Movimentações arquivadas marcam seus dias como pendentes na visão de consumo diário
+(consumo_diario.marcar_dias), que é recalculada sem elas.
+"""
+import calendar
+import json
+import logging
+from datetime import datetime, timezone
+
+from bson import json_util
+from pymongo import InsertOne
+from pymongo.errors import BulkWriteError
+
+import consumo_diario
+import movimentacoes_repo
+
+logger = logging.getLogger(__name__)
+
+COLECAO_EXECUCOES = 'arquivamento_execucoes'
+
+# movimentacoes: pelo repositório (coleção plana ou buckets, conforme MOVIMENTACOES_STORAGE)
+POLITICAS_PADRAO = [
+    {'colecao': 'movimentacoes', 'campo': 'data_movimentacao', 'meses': 24},
+    {'colecao': 'logs_auditoria', 'campo': 'timestamp', 'meses': 12},
+]
+
+
+def destino_padrao(colecao: str) -> str:
+    return f'archive_{colecao}'
+
+
+def meses_atras(agora: datetime, meses: int) -> datetime:
+    ano, mes = divmod(agora.year * 12 + (agora.month - 1) - int(meses), 12)
+    mes += 1
+    dia = min(agora.day, calendar.monthrange(ano, mes)[1])
+    return agora.replace(year=ano, month=mes, day=dia)
+
+
+def filtro_politica(politica: dict, agora: datetime) -> dict:
+    corte = meses_atras(agora, politica.get('meses') or 12)
+    return {politica.get('campo') or 'created_at': {'$lt': corte}}
+
+
+def _inserir_ignorando_duplicados(coll, docs: list):
+    try:
+        coll.bulk_write([InsertOne(d) for d in docs], ordered=False)
+    except BulkWriteError as e:
+        # bloco reprocessado após queda: o que já estava no arquivo fica como está
+        outros = [w for w in (e.details or {}).get('writeErrors', []) if w.get('code') != 11000]
+        if outros:
+            raise
+
+
+def _proximo_bloco(src, filtro: dict, apos, chunk: int):
+    """(docs, posição) do próximo bloco; o repositório de movimentações pagina pelo próprio layout
+    (no de buckets a posição é o _id do bucket)."""
+    if isinstance(src, movimentacoes_repo.MovimentacoesRepository):
+        return src.proximo_bloco(filtro, apos, chunk)
+    q = {'$and': [filtro, {'_id': {'$gt': apos}}]} if apos is not None else filtro
+    docs = list(src.find(q).sort('_id', 1).limit(int(chunk)))
+    return docs, (docs[-1]['_id'] if docs else None)
+
+
+def arquivar(db, origem: str, filtro: dict, destino: str = None, chunk: int = 1000,
+             execucao_id=None, limite_blocos: int = None, progresso=None) -> dict:
+    """Move os documentos de `origem` que casam com `filtro` para `destino`, em blocos.
+
+    Com `execucao_id` de uma execução existente, continua do último bloco confirmado (o filtro
+    gravado na execução prevalece). `limite_blocos` encerra após N blocos com status 'pausado'
+    (a próxima chamada continua). `progresso(atual, total, mensagem)` é chamado a cada bloco.
+    Retorna o documento da execução.
+    """
+    controle = db[COLECAO_EXECUCOES]
+    agora = datetime.now(timezone.utc)
+    estado = controle.find_one({'_id': execucao_id}) if execucao_id is not None else None
+    if estado is None:
+        estado = {
+            'origem': origem,
+            'destino': destino or destino_padrao(origem),
+            # filtro como JSON estendido: operadores ($lt...) e datas não viram campos do documento
+            'filtro': json_util.dumps(filtro or {}),
+            'ultimo_id': None,
+            'layout': movimentacoes_repo.get_repo(db).layout if origem == 'movimentacoes' else None,
+            'movidos': 0,
+            'status': 'executando',
+            'inicio': agora,
+            'atualizado_em': agora,
+        }
+        if execucao_id is not None:
+            estado['_id'] = execucao_id
+        estado['_id'] = controle.insert_one(estado).inserted_id
+    elif estado.get('status') == 'concluido':
+        return estado
+    else:
+        controle.update_one({'_id': estado['_id']}, {'$set': {'status': 'executando', 'erro': None, 'atualizado_em': agora}})
+
+    src = movimentacoes_repo.get_repo(db) if estado['origem'] == 'movimentacoes' else db[estado['origem']]
+    dst = db[estado['destino']]
+    filtro = json_util.loads(estado['filtro'])
+    ultimo_id = estado.get('ultimo_id')
+    layout = src.layout if isinstance(src, movimentacoes_repo.MovimentacoesRepository) else None
+    if estado.get('layout', layout) != layout:
+        # layout trocado no meio: a posição (_id de movimentação ou de bucket) não vale mais
+        ultimo_id = None
+        controle.update_one({'_id': estado['_id']}, {'$set': {'ultimo_id': None, 'layout': layout}})
+    movidos = int(estado.get('movidos') or 0)
+    blocos = 0
+    try:
+        while True:
+            docs, posicao = _proximo_bloco(src, filtro, ultimo_id, chunk)
+            if posicao is None:
+                break
+            ids = [d['_id'] for d in docs]
+            if docs:
+                _inserir_ignorando_duplicados(dst, docs)
+                dias = [d.get('data_movimentacao') for d in docs] if estado['origem'] == 'movimentacoes' else []
+                if dias:
+                    # os dias saem da visão materializada de consumo na próxima atualização
+                    consumo_diario.marcar_dias(db, dias)
+                src.delete_many({'_id': {'$in': ids}})
+                if dias:
+                    # de novo após a remoção: uma atualização entre as duas chamadas recalculou os dias
+                    # com os documentos ainda na origem (a marcação anterior cobre queda antes daqui)
+                    consumo_diario.marcar_dias(db, dias)
+            ultimo_id = posicao
+            controle.update_one({'_id': estado['_id']}, {
+                '$set': {'ultimo_id': ultimo_id, 'atualizado_em': datetime.now(timezone.utc)},
+                '$inc': {'movidos': len(ids)}})
+            blocos += 1
+            movidos += len(ids)
+            if progresso is not None:
+                progresso(movidos, None, f"{estado['origem']}: {movidos} movidos")
+            if limite_blocos is not None and blocos >= limite_blocos:
+                controle.update_one({'_id': estado['_id']}, {'$set': {'status': 'pausado'}})
+                return controle.find_one({'_id': estado['_id']})
+    except Exception as e:
+        logger.error(f"[Arquivamento] {estado['origem']} interrompido: {e}")
+        controle.update_one({'_id': estado['_id']}, {'$set': {'status': 'erro', 'erro': str(e)}})
+        return controle.find_one({'_id': estado['_id']})
+    fim = datetime.now(timezone.utc)
+    controle.update_one({'_id': estado['_id']}, {'$set': {'status': 'concluido', 'fim': fim, 'atualizado_em': fim}})
+    return controle.find_one({'_id': estado['_id']})
+
+
+def politicas(app) -> list:
+    valor = app.config.get('RETENCAO_POLITICAS')
+    if isinstance(valor, str) and valor.strip():
+        try:
+            valor = json.loads(valor)
+        except Exception:
+            logger.warning('[Arquivamento] RETENCAO_POLITICAS inválido; usando o padrão')
+            valor = None
+    return list(valor) if isinstance(valor, list) else list(POLITICAS_PADRAO)
+
+
+def executar_politicas(db, lista: list, agora: datetime = None, chunk: int = 1000, progresso=None) -> list:
+    """Executa (ou continua) a execução do dia de cada política. Retorna as execuções.
+    `progresso(atual, total, mensagem)` é chamado a cada bloco e entre as políticas; uma exceção
+    dele interrompe o bloco (a execução continua na próxima chamada) e as políticas seguintes."""
+    agora = agora or datetime.now(timezone.utc)
+    dia = agora.strftime('%Y-%m-%d')
+    resultados = []
+    for p in lista:
+        colecao = p.get('colecao')
+        if not colecao:
+            continue
+        exec_id = f'{colecao}:{dia}'
+        estado = db[COLECAO_EXECUCOES].find_one({'_id': exec_id})
+        if estado is not None and estado.get('status') == 'concluido':
+            continue
+        resultados.append(arquivar(db, colecao, filtro_politica(p, agora), destino=p.get('destino'),
+                                   chunk=chunk, execucao_id=exec_id, progresso=progresso))
+        if progresso is not None:
+            progresso(None, None, f'{colecao}: política concluída')
+    return resultados
@@ -0,0 +1,177 @@
+"""Gravação assíncrona dos logs de auditoria.
+
+log_auditoria monta o documento dentro da requisição e o coloca em uma fila limitada; uma
+thread daemon drena a fila em lotes com insert_many em 'logs_auditoria'. A fila é esvaziada
+no encerramento do processo (atexit).
+
+Configuração (config.Config):
+- AUDIT_ASYNC: False grava de forma síncrona (usado nos testes)
+- AUDIT_QUEUE_SIZE: capacidade da fila
+- AUDIT_BATCH_SIZE: máximo de documentos por insert_many
+- AUDIT_FLUSH_INTERVAL: segundos máximos que um registro espera na fila
+- AUDIT_OVERFLOW: política com fila cheia
+    'sincrono'  grava o registro na própria requisição (padrão; nada é perdido)
+    'bloquear'  espera até AUDIT_OVERFLOW_TIMEOUT segundos por espaço e então grava síncrono
+    'descartar' descarta o registro novo (contado em estatisticas()['descartados'])
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+import extensions
+
+logger = logging.getLogger(__name__)
+
+COLECAO = 'logs_auditoria'
+POLITICAS_OVERFLOW = ('sincrono', 'bloquear', 'descartar')
+
+
+class AuditWriter:
+    def __init__(self, queue_size: int = 10000, batch_size: int = 200, flush_interval: float = 1.0,
+                 overflow: str = 'sincrono', overflow_timeout: float = 0.05):
+        if overflow not in POLITICAS_OVERFLOW:
+            raise ValueError(f'AUDIT_OVERFLOW inválido: {overflow}')
+        self.fila = queue.Queue(maxsize=max(1, int(queue_size)))
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = max(0.01, float(flush_interval))
+        self.overflow = overflow
+        self.overflow_timeout = float(overflow_timeout)
+        self._thread = None
+        self._pid = None
+        self._parar = threading.Event()
+        self._lock = threading.Lock()
+        self.gravados = 0
+        self.descartados = 0
+        self.falhas = 0
+
+    # Ciclo de vida
+    def iniciar(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._parar.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._executar, name='audit-writer', daemon=True)
+            self._thread.start()
+
+    def encerrar(self, timeout: float = 5.0):
+        """Para a thread e grava o que restou na fila."""
+        self._parar.set()
+        t = self._thread
+        if t is not None and t.is_alive():
+            t.join(timeout)
+        self.flush()
+
+    # Produção
+    def registrar(self, doc: dict):
+        if self._pid is not None and self._pid != os.getpid():
+            # processo filho (fork de servidor com preload): a thread não foi herdada
+            self.fila = queue.Queue(maxsize=self.fila.maxsize)
+            self._thread = None
+            self.iniciar()
+        try:
+            self.fila.put_nowait(doc)
+            return
+        except queue.Full:
+            pass
+        if self.overflow == 'descartar':
+            self.descartados += 1
+            return
+        if self.overflow == 'bloquear':
+            try:
+                self.fila.put(doc, timeout=self.overflow_timeout)
+                return
+            except queue.Full:
+                pass
+        self._gravar([doc])
+
+    # Consumo
+    def _drenar(self, primeiro=None) -> list:
+        lote = [primeiro] if primeiro is not None else []
+        while len(lote) < self.batch_size:
+            try:
+                lote.append(self.fila.get_nowait())
+            except queue.Empty:
+                break
+        return lote
+
+    def _gravar(self, docs: list):
+        if not docs:
+            return
+        db = extensions.mongo_db
+        if db is None:
+            self.falhas += len(docs)
+            return
+        try:
+            db[COLECAO].insert_many(docs, ordered=False)
+            self.gravados += len(docs)
+        except Exception as e:
+            self.falhas += len(docs)
+            logger.error(f'Erro ao gravar {len(docs)} logs de auditoria: {e}')
+
+    def _executar(self):
+        while not self._parar.is_set():
+            try:
+                primeiro = self.fila.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            # pequena janela para acumular um lote em rajadas (ex.: logins na troca de turno)
+            if self.fila.qsize() < self.batch_size:
+                time.sleep(min(0.05, self.flush_interval))
+            self._gravar(self._drenar(primeiro))
+
+    def flush(self):
+        while True:
+            lote = self._drenar()
+            if not lote:
+                return
+            self._gravar(lote)
+
+    def estatisticas(self) -> dict:
+        return {
+            'pendentes': self.fila.qsize(),
+            'gravados': self.gravados,
+            'descartados': self.descartados,
+            'falhas': self.falhas,
+            'politica_overflow': self.overflow,
+            'ativo': bool(self._thread is not None and self._thread.is_alive()),
+        }
+
+
+_writer = None
+
+
+def get_writer():
+    return _writer
+
+
+def init_app(app):
+    """Cria o writer conforme a configuração; com AUDIT_ASYNC=False os logs são síncronos."""
+    global _writer
+    if not app.config.get('AUDIT_ASYNC', True):
+        return None
+    if _writer is None:
+        _writer = AuditWriter(
+            queue_size=app.config.get('AUDIT_QUEUE_SIZE', 10000),
+            batch_size=app.config.get('AUDIT_BATCH_SIZE', 200),
+            flush_interval=app.config.get('AUDIT_FLUSH_INTERVAL', 1.0),
+            overflow=str(app.config.get('AUDIT_OVERFLOW') or 'sincrono').lower(),
+            overflow_timeout=app.config.get('AUDIT_OVERFLOW_TIMEOUT', 0.05),
+        )
+        atexit.register(_writer.encerrar)
+    _writer.iniciar()
+    return _writer
+
+
+def registrar(doc: dict, assincrono: bool = True):
+    """Enfileira o documento quando o writer está ativo; senão grava direto."""
+    w = _writer
+    if assincrono and w is not None:
+        w.registrar(doc)
+        return
+    db = extensions.mongo_db
+    if db is not None:
+        db[COLECAO].insert_one(doc)
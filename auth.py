@@ -1,11 +1,12 @@
 from functools import wraps
-from flask import request, jsonify, session, redirect, url_for, flash, current_app
+from flask import request, jsonify, session, redirect, url_for, flash, current_app, g, has_request_context
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from werkzeug.security import check_password_hash, generate_password_hash
 from datetime import datetime
 import json
 # Removido: from models.usuario import Usuario, LogAuditoria
 import extensions
+import auditoria
 from bson.objectid import ObjectId
 from config.ui_blocks import get_ui_blocks_config
 import secrets
@@ -140,8 +141,40 @@ class MongoUser:
         }
     
     # Acesso por escopo (MongoDB)
+    def _scope_memo(self):
+        """Memo por requisição dos documentos de hierarquia/produtos consultados nas checagens de escopo."""
+        if not has_request_context():
+            return None
+        memo = getattr(g, '_scope_memo', None)
+        if memo is None:
+            memo = {}
+            g._scope_memo = memo
+        return memo
+
+    def prime_scope_cache(self, coll_name: str, docs) -> None:
+        """Pré-carrega no memo documentos já resolvidos em lote (ex.: _find_many_by_ids)."""
+        memo = self._scope_memo()
+        if memo is None:
+            return
+        for doc in (docs.values() if isinstance(docs, dict) else docs or []):
+            if doc.get('id') is not None:
+                memo[(coll_name, str(doc.get('id')))] = doc
+            if doc.get('_id') is not None:
+                memo[(coll_name, str(doc.get('_id')))] = doc
+
     def _find_by_id(self, coll_name: str, raw_id):
         """Resolve um documento por id numérico, ObjectId ou string direta."""
+        memo = self._scope_memo()
+        key = (coll_name, str(raw_id))
+        if memo is not None and raw_id is not None and key in memo:
+            return memo[key]
+        doc = self._find_by_id_db(coll_name, raw_id)
+        # apenas resultados encontrados são memorizados (um local criado na mesma requisição ainda é visto)
+        if memo is not None and doc is not None:
+            memo[key] = doc
+        return doc
+
+    def _find_by_id_db(self, coll_name: str, raw_id):
         try:
             db = extensions.mongo_db
             if db is None:
@@ -633,7 +666,8 @@ def log_auditoria(acao, tabela=None, registro_id=None, dados_anteriores=None, da
     """Registra uma ação de auditoria (MongoDB)"""
     try:
         if current_user.is_authenticated and (extensions.mongo_db is not None):
-            extensions.mongo_db['logs_auditoria'].insert_one({
+            # gravação em lote pela thread de auditoria (síncrona quando AUDIT_ASYNC=False)
+            auditoria.registrar({
                 'usuario_id': current_user.get_id(),
                 'acao': acao,
                 'tabela': tabela,
@@ -643,7 +677,7 @@ def log_auditoria(acao, tabela=None, registro_id=None, dados_anteriores=None, da
                 'ip_address': request.remote_addr,
                 'user_agent': request.headers.get('User-Agent'),
                 'timestamp': datetime.utcnow(),
-            })
+            }, assincrono=bool(current_app.config.get('AUDIT_ASYNC', True)))
     except Exception as e:
         try:
             current_app.logger.error(f"Erro ao registrar log de auditoria: {e}")
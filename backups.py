@@ -0,0 +1,636 @@
+"""Backups do banco e agendador em segundo plano.
+
+criar_backup grava em backups/ um diretório por backup (gzip NDJSON por coleção + manifest
+com contagens e sha256), usado pelo botão manual e pelo agendador. Arquivos .json do formato
+antigo continuam listados e restauráveis.
+O agendamento salvo em config_backup ({'_id': 'backup_schedule', enabled, interval, time,
+retention}) é executado por BackupScheduler, uma thread daemon por processo; entre vários
+workers do gunicorn só o dono do documento de lock em 'scheduler_locks' executa. Cada horário
+agendado gera no máximo uma execução: o registro em 'backup_execucoes' usa o horário como _id.
+
+- time: horário local (HH:MM) da janela de menor uso; se o processo estiver parado nesse
+  horário, a execução só acontece até BACKUP_JANELA_HORAS depois, nunca em horário comercial
+- interval: 'daily' ou 'weekly' (7 dias desde a última execução agendada)
+- retention: quantidade de backups agendados mantidos; os mais antigos são apagados
+  (backups manuais não entram na retenção)
+
+O mesmo agendador executa as políticas de retenção de dados (arquivamento.py) quando
+RETENCAO_ATIVA está ligada, grava o snapshot diário de saldos (saldos.py) e, a cada ciclo,
+atualiza a visão materializada de consumo diário (consumo_diario.py). Backup, retenção e
+snapshot renovam o lock a cada lote; se outro processo assumiu, a etapa aborta e o ciclo termina.
+"""
+import atexit
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import socket
+import threading
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId, json_util
+from pymongo import InsertOne, ReplaceOne
+from pymongo.errors import DuplicateKeyError
+
+import arquivamento
+import consultas_lentas
+import consumo_diario
+import contadores
+import extensions
+import idempotencia
+import jobs
+import saldos
+
+logger = logging.getLogger(__name__)
+
+COLECAO_CONFIG = 'config_backup'
+COLECAO_EXECUCOES = 'backup_execucoes'
+COLECAO_LOCKS = 'scheduler_locks'
+COLECAO_RESTAURACOES = 'backup_restauracoes'
+# estado de execução (backup/restauração, jobs, agendador, idempotência, consultas lentas) e
+# contadores: nunca exportados nem sobrescritos por uma restauração. Restaurar 'jobs' apagaria o
+# job da própria restauração e reviveria jobs pendentes/executando do momento do backup; os
+# contadores são ressemeados dos códigos restaurados (só avançam, nunca voltam).
+_COLECOES_DE_CONTROLE = (COLECAO_LOCKS, COLECAO_RESTAURACOES, COLECAO_EXECUCOES, arquivamento.COLECAO_EXECUCOES,
+                         jobs.COLECAO, idempotencia.COLECAO, consultas_lentas.COLECAO, contadores.COLECAO)
+LOCK_ID = 'backup_scheduler'
+SUFIXO_AGENDADO = '-agendado'
+FORMATO = 'ndjson-gz'
+MANIFEST = 'manifest.json'
+# JSON estendido relaxado: datas e ObjectId voltam com o mesmo tipo na restauração
+JSON_OPTIONS = json_util.RELAXED_JSON_OPTIONS
+
+
+class LiderancaPerdida(RuntimeError):
+    """Outro processo assumiu o lock do agendador durante uma etapa."""
+
+
+def diretorio_backups(app) -> str:
+    return app.config.get('BACKUP_DIR') or os.path.join(app.root_path, 'backups')
+
+
+class _HashWriter:
+    """Arquivo de saída que calcula sha256 e tamanho dos bytes gravados (já comprimidos)."""
+    def __init__(self, raw):
+        self.raw = raw
+        self.sha = hashlib.sha256()
+        self.bytes = 0
+
+    def write(self, b):
+        self.sha.update(b)
+        self.bytes += len(b)
+        return self.raw.write(b)
+
+    def flush(self):
+        self.raw.flush()
+
+
+def _sha256_arquivo(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for bloco in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(bloco)
+    return h.hexdigest()
+
+
+def _exportar_colecao(coll, path: str, batch_size: int, progresso=None) -> dict:
+    n = 0
+    with open(path, 'wb') as raw:
+        hw = _HashWriter(raw)
+        with gzip.GzipFile(fileobj=hw, mode='wb', mtime=0) as gz:
+            for doc in coll.find({}).batch_size(batch_size):
+                gz.write(json_util.dumps(doc, json_options=JSON_OPTIONS).encode('utf-8'))
+                gz.write(b'\n')
+                n += 1
+                if progresso is not None and n % batch_size == 0:
+                    progresso()
+    return {'documentos': n, 'bytes': hw.bytes, 'sha256': hw.sha.hexdigest()}
+
+
+def _nome_livre(backup_dir: str, base: str, sufixo: str) -> str:
+    nome = f'{base}{sufixo}'
+    n = 1
+    while os.path.exists(os.path.join(backup_dir, nome)) or os.path.exists(os.path.join(backup_dir, nome + '.json')):
+        # dois backups no mesmo segundo não se sobrescrevem
+        nome = f'{base}-{n}{sufixo}'
+        n += 1
+    return nome
+
+
+def criar_backup(db, backup_dir: str, collections=None, agendado: bool = False, batch_size: int = 1000,
+                 progresso=None) -> dict:
+    """Exporta as coleções para o diretório backups/backup-<db>-<timestamp>[-agendado]/.
+
+    Um arquivo <coleção>.ndjson.gz por coleção (um documento em JSON estendido por linha, lido
+    do cursor em lotes de `batch_size`) e manifest.json com contagens e sha256 de cada arquivo.
+    A memória usada não depende do tamanho do banco. O diretório é gravado com sufixo .tmp e
+    renomeado no fim: a listagem nunca mostra um backup incompleto. `progresso()`, quando
+    informado, é chamado a cada lote e a cada coleção (o agendador renova o lock por ele).
+    """
+    nomes = [n for n in db.list_collection_names() if not n.startswith('system.') and n not in _COLECOES_DE_CONTROLE]
+    if isinstance(collections, list) and collections:
+        nomes = [c for c in nomes if c in collections]
+    os.makedirs(backup_dir, exist_ok=True)
+    nome = _nome_livre(backup_dir, f"backup-{db.name}-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}",
+                       SUFIXO_AGENDADO if agendado else '')
+    destino = os.path.join(backup_dir, nome)
+    tmp = destino + '.tmp'
+    os.makedirs(tmp)
+    try:
+        manifest = {
+            'formato': FORMATO,
+            'versao': 1,
+            'database': db.name,
+            'created_at': datetime.utcnow().isoformat(),
+            'collections': [],
+        }
+        for cname in sorted(nomes):
+            arquivo = f'{cname}.ndjson.gz'
+            info = _exportar_colecao(db[cname], os.path.join(tmp, arquivo), batch_size, progresso)
+            manifest['collections'].append(dict(info, nome=cname, arquivo=arquivo))
+            if progresso is not None:
+                progresso()
+        with open(os.path.join(tmp, MANIFEST), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, destino)
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return {
+        'file': nome,
+        'size': sum(c['bytes'] for c in manifest['collections']),
+        'collections': len(manifest['collections']),
+        'documentos': sum(c['documentos'] for c in manifest['collections']),
+    }
+
+
+def ler_manifest(path: str) -> dict:
+    with open(os.path.join(path, MANIFEST), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def verificar_backup(path: str) -> list:
+    """Confere o sha256 de cada arquivo com o manifest; retorna a lista de problemas."""
+    problemas = []
+    for c in ler_manifest(path).get('collections') or []:
+        fpath = os.path.join(path, c['arquivo'])
+        if not os.path.isfile(fpath):
+            problemas.append(f"{c['arquivo']}: arquivo ausente")
+        elif _sha256_arquivo(fpath) != c.get('sha256'):
+            problemas.append(f"{c['arquivo']}: checksum divergente")
+    return problemas
+
+
+def ler_colecao(path: str, arquivo: str):
+    """Itera os documentos de um arquivo .ndjson.gz, com tipos BSON restaurados."""
+    with gzip.open(os.path.join(path, arquivo), 'rt', encoding='utf-8') as f:
+        for linha in f:
+            if linha.strip():
+                yield json_util.loads(linha, json_options=JSON_OPTIONS)
+
+
+def listar_backups(backup_dir: str) -> list:
+    """Backups no diretório: formato atual (diretório com manifest) e arquivos .json antigos."""
+    items = []
+    try:
+        nomes = sorted(os.listdir(backup_dir))
+    except FileNotFoundError:
+        return items
+    for name in nomes:
+        fpath = os.path.join(backup_dir, name)
+        if os.path.isdir(fpath) and os.path.isfile(os.path.join(fpath, MANIFEST)):
+            try:
+                m = ler_manifest(fpath)
+                cols = m.get('collections') or []
+                items.append({'name': name, 'formato': FORMATO, 'size': sum(c.get('bytes') or 0 for c in cols),
+                              'documentos': sum(c.get('documentos') or 0 for c in cols),
+                              'modified_at': datetime.utcfromtimestamp(os.stat(fpath).st_mtime).isoformat()})
+            except Exception:
+                items.append({'name': name, 'formato': FORMATO})
+        elif name.lower().endswith('.json') and os.path.isfile(fpath):
+            try:
+                stat = os.stat(fpath)
+                items.append({'name': name, 'formato': 'json', 'size': stat.st_size,
+                              'modified_at': datetime.utcfromtimestamp(stat.st_mtime).isoformat()})
+            except Exception:
+                items.append({'name': name, 'formato': 'json'})
+    return items
+
+
+def aplicar_retencao(backup_dir: str, manter: int) -> list:
+    """Apaga os backups agendados mais antigos, mantendo os `manter` mais recentes."""
+    manter = max(1, int(manter or 1))
+    try:
+        nomes = [n for n in os.listdir(backup_dir)
+                 if n.startswith('backup-') and SUFIXO_AGENDADO in n and not n.endswith('.tmp')]
+    except FileNotFoundError:
+        return []
+    nomes.sort(key=lambda n: (os.path.getmtime(os.path.join(backup_dir, n)), n), reverse=True)
+    removidos = []
+    for n in nomes[manter:]:
+        fpath = os.path.join(backup_dir, n)
+        try:
+            if os.path.isdir(fpath):
+                shutil.rmtree(fpath)
+            else:
+                os.remove(fpath)
+            removidos.append(n)
+        except OSError as e:
+            logger.warning(f'[Backup] Falha ao remover {n}: {e}')
+    return removidos
+
+
+def _colecoes_do_backup(path: str):
+    """[(coleção, iterador de documentos)] do backup, no formato atual ou no .json antigo."""
+    if os.path.isdir(path):
+        return [(c['nome'], (lambda arq=c['arquivo']: ler_colecao(path, arq)))
+                for c in ler_manifest(path).get('collections') or []]
+    # formato antigo: o arquivo inteiro é um único JSON (_id como string de ObjectId)
+    with open(path, 'r', encoding='utf-8') as f:
+        payload = json.load(f)
+
+    def _docs(docs):
+        for d in docs:
+            d = dict(d)
+            if ObjectId.is_valid(str(d.get('_id', ''))):
+                d['_id'] = ObjectId(str(d['_id']))
+            yield d
+    return [(nome, (lambda docs=docs: _docs(docs))) for nome, docs in (payload.get('collections') or {}).items()]
+
+
+def restaurar_backup(db, path: str, mode: str = 'replace', batch_size: int = 1000,
+                     restauracao_id=None, logger_=None, progresso=None) -> dict:
+    """Restaura um backup aplicando lotes de ReplaceOne(upsert) com bulk_write(ordered=False).
+
+    O progresso é gravado em 'backup_restauracoes' a cada lote confirmado (coleção atual,
+    documentos já aplicados nela e coleções concluídas). Chamando de novo com o mesmo
+    `restauracao_id` a restauração continua do último lote confirmado; como cada operação é um
+    upsert por _id, reaplicar um lote interrompido não duplica documentos.
+
+    mode='replace' esvazia cada coleção e remove seus índices antes da carga; ao final os
+    índices da aplicação são recriados (ensure_collections_and_indexes). Falhas não propagam:
+    o documento de controle retorna com status 'erro'. `progresso(atual, total, mensagem)` é
+    chamado a cada lote confirmado (ex.: jobs.reportar_progresso).
+    """
+    controle = db[COLECAO_RESTAURACOES]
+    agora = datetime.now(timezone.utc)
+    estado = controle.find_one({'_id': restauracao_id}) if restauracao_id is not None else None
+    if estado is None:
+        estado = {
+            'arquivo': os.path.basename(path),
+            'mode': mode,
+            'status': 'executando',
+            'colecoes_concluidas': [],
+            'colecao_atual': None,
+            'aplicados_colecao': 0,
+            'documentos': 0,
+            'inicio': agora,
+            'atualizado_em': agora,
+        }
+        if restauracao_id is not None:
+            estado['_id'] = restauracao_id
+        restauracao_id = controle.insert_one(estado).inserted_id
+        estado['_id'] = restauracao_id
+    else:
+        mode = estado.get('mode') or mode
+        controle.update_one({'_id': restauracao_id}, {'$set': {'status': 'executando', 'erro': None, 'atualizado_em': agora}})
+
+    log = logger_ or logger
+    concluidas = list(estado.get('colecoes_concluidas') or [])
+    try:
+        for nome, docs in _colecoes_do_backup(path):
+            if nome in concluidas or nome in _COLECOES_DE_CONTROLE:
+                continue
+            pular = int(estado.get('aplicados_colecao') or 0) if estado.get('colecao_atual') == nome else 0
+            coll = db[nome]
+            if pular == 0 and mode == 'replace':
+                coll.delete_many({})
+                try:
+                    coll.drop_indexes()
+                except Exception:
+                    pass
+            controle.update_one({'_id': restauracao_id}, {'$set': {'colecao_atual': nome, 'aplicados_colecao': pular}})
+            aplicados = 0
+            lote = []
+            for doc in docs():
+                aplicados += 1
+                if aplicados <= pular:
+                    continue
+                lote.append(ReplaceOne({'_id': doc['_id']}, doc, upsert=True) if '_id' in doc else InsertOne(doc))
+                if len(lote) >= batch_size:
+                    coll.bulk_write(lote, ordered=False)
+                    lote = []
+                    controle.update_one({'_id': restauracao_id}, {
+                        '$set': {'aplicados_colecao': aplicados, 'atualizado_em': datetime.now(timezone.utc)},
+                        '$inc': {'documentos': batch_size}})
+                    if progresso is not None:
+                        progresso(aplicados, None, f'{nome}: {aplicados} documentos')
+            if lote:
+                coll.bulk_write(lote, ordered=False)
+            concluidas.append(nome)
+            controle.update_one({'_id': restauracao_id}, {
+                '$set': {'colecao_atual': None, 'aplicados_colecao': 0, 'atualizado_em': datetime.now(timezone.utc)},
+                '$push': {'colecoes_concluidas': nome},
+                '$inc': {'documentos': len(lote)}})
+            log.info(f'[Backup] Restaurada coleção {nome}: {aplicados} documentos')
+        extensions.ensure_collections_and_indexes(db, logger=logger_)
+        contadores.semear_contadores(db)
+    except Exception as e:
+        # estado fica gravado para retomar com o mesmo restauracao_id
+        log.error(f'[Backup] Restauração {restauracao_id} interrompida: {e}')
+        controle.update_one({'_id': restauracao_id}, {'$set': {'status': 'erro', 'erro': str(e), 'atualizado_em': datetime.now(timezone.utc)}})
+        return controle.find_one({'_id': restauracao_id})
+    fim = datetime.now(timezone.utc)
+    controle.update_one({'_id': restauracao_id}, {'$set': {'status': 'concluido', 'fim': fim, 'atualizado_em': fim}})
+    return controle.find_one({'_id': restauracao_id})
+
+
+def registrar_execucao(db, origem: str, inicio: datetime, fim: datetime, resultado: dict = None,
+                       erro: str = None, _id=None, removidos=None) -> None:
+    doc = {
+        'origem': origem,
+        'status': 'erro' if erro else 'sucesso',
+        'inicio': inicio,
+        'fim': fim,
+        'duracao_segundos': round((fim - inicio).total_seconds(), 3),
+        'arquivo': (resultado or {}).get('file'),
+        'tamanho': (resultado or {}).get('size'),
+        'documentos': (resultado or {}).get('documentos'),
+        'removidos': removidos or [],
+        'erro': erro,
+        'host': socket.gethostname(),
+        'pid': os.getpid(),
+    }
+    if _id is not None:
+        db[COLECAO_EXECUCOES].update_one({'_id': _id}, {'$set': doc}, upsert=True)
+    else:
+        db[COLECAO_EXECUCOES].insert_one(doc)
+
+
+def _horario(schedule: dict):
+    try:
+        hh, mm = str(schedule.get('time') or '02:00').split(':')[:2]
+        return max(0, min(23, int(hh))), max(0, min(59, int(mm)))
+    except Exception:
+        return 2, 0
+
+
+def ultimo_horario(schedule: dict, agora: datetime) -> datetime:
+    """Horário agendado mais recente <= agora (hora local, sem tzinfo)."""
+    hh, mm = _horario(schedule)
+    slot = agora.replace(hour=hh, minute=mm, second=0, microsecond=0)
+    if slot > agora:
+        slot -= timedelta(days=1)
+    return slot
+
+
+def proximo_horario(schedule: dict, agora: datetime, ultima_execucao: datetime = None) -> datetime:
+    slot = ultimo_horario(schedule, agora) + timedelta(days=1)
+    if str(schedule.get('interval') or 'daily') == 'weekly' and ultima_execucao is not None:
+        while slot < ultima_execucao + timedelta(days=7) - timedelta(hours=1):
+            slot += timedelta(days=1)
+    return slot
+
+
+class BackupScheduler:
+    def __init__(self, app, intervalo: float = 60.0, janela_horas: float = 4.0, lock_segundos: float = None):
+        self.app = app
+        self.intervalo = max(1.0, float(intervalo))
+        self.janela = timedelta(hours=float(janela_horas))
+        self.lock_segundos = float(lock_segundos or max(self.intervalo * 3, 180))
+        self.dono = f'{socket.gethostname()}:{os.getpid()}:{id(self)}'
+        self._thread = None
+        self._parar = threading.Event()
+
+    # Ciclo de vida
+    def iniciar(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._executar, name='backup-scheduler', daemon=True)
+        self._thread.start()
+
+    def encerrar(self, timeout: float = 5.0):
+        self._parar.set()
+        t = self._thread
+        if t is not None and t.is_alive():
+            t.join(timeout)
+        self._liberar_lock()
+
+    def _executar(self):
+        etapas = (
+            (self.verificar, '[Backup] Agendador falhou'),
+            (self.verificar_retencao, '[Arquivamento] Retenção falhou'),
+            (self.verificar_snapshot_estoque, '[Snapshot Estoque] Agendamento falhou'),
+            (self.atualizar_consumo_diario, '[Relatórios] Atualização do consumo diário falhou'),
+        )
+        while not self._parar.wait(self.intervalo):
+            for etapa, mensagem in etapas:
+                try:
+                    etapa()
+                except LiderancaPerdida as e:
+                    # outro processo é o líder: as etapas seguintes ficam com ele
+                    logger.warning(f'[Backup] {e}; encerrando o ciclo')
+                    break
+                except Exception as e:
+                    logger.error(f'{mensagem}: {e}')
+
+    # Liderança entre processos
+    def _db(self):
+        return extensions.mongo_db
+
+    def obter_lock(self, agora: datetime = None) -> bool:
+        db = self._db()
+        if db is None:
+            return False
+        agora = agora or datetime.now(timezone.utc)
+        try:
+            db[COLECAO_LOCKS].find_one_and_update(
+                {'_id': LOCK_ID, '$or': [{'dono': self.dono}, {'expira_em': {'$lt': agora}}]},
+                {'$set': {'dono': self.dono, 'expira_em': agora + timedelta(seconds=self.lock_segundos), 'renovado_em': agora}},
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            # lock válido de outro processo
+            return False
+
+    def batimento(self, ao_renovar=None):
+        """Função para os callbacks de progresso das etapas longas: renova o lock no máximo a
+        cada 1/3 de lock_segundos e levanta LiderancaPerdida se outro processo o assumiu (e em
+        toda chamada seguinte). `ao_renovar(agora)` é chamado a cada renovação."""
+        estado = {'ultimo': datetime.now(timezone.utc), 'perdida': False}
+
+        def _batimento(*_args, **_kwargs):
+            if estado['perdida']:
+                raise LiderancaPerdida('lock do agendador perdido')
+            agora = datetime.now(timezone.utc)
+            if (agora - estado['ultimo']).total_seconds() < self.lock_segundos / 3:
+                return
+            estado['ultimo'] = agora
+            if not self.obter_lock(agora):
+                estado['perdida'] = True
+                raise LiderancaPerdida('lock do agendador perdido')
+            if ao_renovar is not None:
+                ao_renovar(agora)
+        return _batimento
+
+    def _liberar_lock(self):
+        db = self._db()
+        if db is None:
+            return
+        try:
+            db[COLECAO_LOCKS].delete_one({'_id': LOCK_ID, 'dono': self.dono})
+        except Exception:
+            pass
+
+    # Agendamento
+    def verificar(self, agora_local: datetime = None) -> dict:
+        """Executa o backup agendado se for a hora e este processo for o líder.
+        Retorna o registro da execução, ou None quando nada foi feito."""
+        db = self._db()
+        if db is None:
+            return None
+        schedule = db[COLECAO_CONFIG].find_one({'_id': 'backup_schedule'}) or {}
+        if not schedule.get('enabled'):
+            return None
+        if not self.obter_lock():
+            return None
+        agora_local = agora_local or datetime.now()
+        slot = ultimo_horario(schedule, agora_local)
+        if agora_local - slot > self.janela:
+            return None
+        execs = db[COLECAO_EXECUCOES]
+        if str(schedule.get('interval') or 'daily') == 'weekly':
+            ultima = execs.find_one({'origem': 'agendado', 'status': 'sucesso'}, sort=[('slot', -1)])
+            if ultima and isinstance(ultima.get('slot'), datetime) and ultima['slot'] > slot - timedelta(days=6, hours=23):
+                return None
+        # _id pelo horário: nenhum outro processo executa o mesmo horário
+        exec_id = f"agendado:{slot.strftime('%Y-%m-%dT%H:%M')}"
+        agora = datetime.now(timezone.utc)
+        doc = {'origem': 'agendado', 'status': 'executando', 'slot': slot, 'inicio': agora,
+               'atualizado_em': agora, 'dono': self.dono, 'host': socket.gethostname(), 'pid': os.getpid()}
+        try:
+            execs.insert_one(dict(doc, _id=exec_id))
+        except DuplicateKeyError:
+            # 'executando' sem batimento há mais de lock_segundos: o processo caiu no meio do
+            # backup (o lock já expirou, senão não estaríamos aqui); retoma o mesmo horário
+            limite = agora - timedelta(seconds=self.lock_segundos)
+            retomada = execs.find_one_and_update(
+                {'_id': exec_id, 'status': 'executando', '$or': [
+                    {'atualizado_em': {'$lt': limite}},
+                    {'atualizado_em': {'$exists': False}, 'inicio': {'$lt': limite}},
+                ]},
+                {'$set': doc, '$inc': {'tentativas': 1}}
+            )
+            if retomada is None:
+                return None
+            logger.warning(f'[Backup] Retomando {exec_id}: execução anterior de {retomada.get("host")}:{retomada.get("pid")} abandonada')
+        return self._rodar(db, schedule, exec_id)
+
+    def verificar_retencao(self, agora_local: datetime = None) -> list:
+        """Políticas de retenção (arquivamento), uma vez por dia a partir de RETENCAO_HORARIO e
+        dentro da mesma janela do backup. Execuções interrompidas continuam no próximo ciclo."""
+        if not self.app.config.get('RETENCAO_ATIVA'):
+            return []
+        db = self._db()
+        if db is None or not self.obter_lock():
+            return []
+        agora_local = agora_local or datetime.now()
+        slot = ultimo_horario({'time': self.app.config.get('RETENCAO_HORARIO') or '03:00'}, agora_local)
+        if agora_local - slot > self.janela:
+            return []
+        return arquivamento.executar_politicas(db, arquivamento.politicas(self.app),
+                                               chunk=int(self.app.config.get('RETENCAO_CHUNK') or 1000),
+                                               progresso=self.batimento())
+
+    def verificar_snapshot_estoque(self, agora_local: datetime = None) -> dict:
+        """Snapshot diário de saldos (saldos.gerar_snapshot) a partir de SNAPSHOT_ESTOQUE_HORARIO,
+        dentro da janela, seguido da retenção dos snapshots. Retorna o snapshot gravado ou None."""
+        if not self.app.config.get('SNAPSHOT_ESTOQUE_ATIVO'):
+            return None
+        db = self._db()
+        if db is None or not self.obter_lock():
+            return None
+        agora_local = agora_local or datetime.now()
+        slot = ultimo_horario({'time': self.app.config.get('SNAPSHOT_ESTOQUE_HORARIO') or '00:05'}, agora_local)
+        if agora_local - slot > self.janela:
+            return None
+        if db['estoque_snapshots_execucoes'].find_one({'slot': slot}, {'_id': 1}):
+            return None
+        res = saldos.gerar_snapshot(db, logger=logger, slot=slot, progresso=self.batimento())
+        saldos.aplicar_retencao_snapshots(db, int(self.app.config.get('SNAPSHOT_ESTOQUE_RETENCAO_DIAS') or 90))
+        return res
+
+    def atualizar_consumo_diario(self) -> bool:
+        """Atualiza a visão materializada de consumo diário fora das requisições (só o líder)."""
+        db = self._db()
+        if db is None or not self.obter_lock():
+            return False
+        consumo_diario.atualizar(db, self.app.config.get('CONSUMO_DIARIO_MARGEM_SEGUNDOS', consumo_diario.MARGEM_PADRAO_SEGUNDOS))
+        return True
+
+    def _rodar(self, db, schedule: dict, exec_id: str) -> dict:
+        backup_dir = diretorio_backups(self.app)
+        inicio = datetime.now(timezone.utc)
+        resultado, erro, removidos = None, None, []
+        # a execução também é marcada como viva: sem batimento ela pode ser retomada (verificar)
+        batimento = self.batimento(lambda agora: db[COLECAO_EXECUCOES].update_one(
+            {'_id': exec_id}, {'$set': {'atualizado_em': agora}}))
+        perdida = None
+        try:
+            resultado = criar_backup(db, backup_dir, agendado=True, progresso=batimento)
+            removidos = aplicar_retencao(backup_dir, schedule.get('retention') or 7)
+        except Exception as e:
+            erro = str(e)
+            perdida = e if isinstance(e, LiderancaPerdida) else None
+            logger.error(f'[Backup] Backup agendado falhou: {e}')
+        fim = datetime.now(timezone.utc)
+        registrar_execucao(db, 'agendado', inicio, fim, resultado, erro=erro, _id=exec_id, removidos=removidos)
+        if perdida is not None:
+            raise perdida
+        if not erro:
+            logger.info(f"[Backup] {resultado['file']} em {(fim - inicio).total_seconds():.1f}s; removidos={len(removidos)}")
+        return db[COLECAO_EXECUCOES].find_one({'_id': exec_id})
+
+
+_scheduler = None
+
+
+def get_scheduler():
+    return _scheduler
+
+
+def init_app(app):
+    """Inicia o agendador (BACKUP_SCHEDULER_ENABLED=False desliga, ex.: testes e scripts)."""
+    global _scheduler
+    if not app.config.get('BACKUP_SCHEDULER_ENABLED', True):
+        return None
+    if _scheduler is None:
+        _scheduler = BackupScheduler(
+            app,
+            intervalo=app.config.get('BACKUP_SCHEDULER_INTERVAL', 60),
+            janela_horas=app.config.get('BACKUP_JANELA_HORAS', 4),
+        )
+        atexit.register(_scheduler.encerrar)
+    _scheduler.iniciar()
+    return _scheduler
+
+
+def status_agendamento(db, agora_local: datetime = None) -> dict:
+    schedule = db[COLECAO_CONFIG].find_one({'_id': 'backup_schedule'}) or {}
+    ultima = db[COLECAO_EXECUCOES].find_one({'origem': 'agendado'}, sort=[('inicio', -1)])
+    proximo = None
+    if schedule.get('enabled'):
+        proximo = proximo_horario(schedule, agora_local or datetime.now(), (ultima or {}).get('slot'))
+    lock = db[COLECAO_LOCKS].find_one({'_id': LOCK_ID}) or {}
+    return {
+        'enabled': bool(schedule.get('enabled')),
+        'interval': schedule.get('interval') or 'daily',
+        'time': schedule.get('time') or '02:00',
+        'retention': schedule.get('retention') or 7,
+        'proxima_execucao': proximo.isoformat() if proximo else None,
+        'lider': lock.get('dono'),
+    }
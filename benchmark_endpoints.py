@@ -0,0 +1,261 @@
+"""Benchmark dos endpoints mais usados contra a massa sintética (dataset_sintetico.py).
+
+Cada cenário é repetido N vezes (após um aquecimento) pelo test client do Flask ou por HTTP
+contra um gunicorn local. Por cenário são medidos p50/p95/p99 da latência e o número de
+comandos Mongo por requisição, lido do cabeçalho Server-Timing do perfil de consultas
+(perfil_consultas.py), então o mesmo número sai nos dois modos. O pico de RSS é o do processo
+(test client) ou o maior entre os workers (gunicorn).
+
+Os parâmetros variam a cada repetição (página, termo, produto, e um '_=' distinto por requisição)
+para que o cache de respostas não transforme a medição em acertos de cache. O resultado é um JSON comparável com uma linha de base
+gravada: comparar() aponta os cenários cujo p95, comandos por requisição ou pico de RSS passaram
+da tolerância. CLI: scripts/benchmark_endpoints.py.
+"""
+import json
+import math
+import os
+import platform
+import re
+import resource
+import time
+from datetime import datetime, timezone
+
+import dataset_sintetico
+
+_TERMOS_BUSCA = ('ser', 'luva', 'sor', 'dip', 'gaze', 'cat', 'agu', 'sonda')
+_SERVER_TIMING_CMDS = re.compile(r'db;dur=([\d.]+);desc="(\d+) cmds"')
+
+
+def percentil(valores: list, p: float):
+    """Percentil por posição mais próxima (p em 0..100)."""
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    k = max(0, min(len(ordenados) - 1, math.ceil(p / 100.0 * len(ordenados)) - 1))
+    return ordenados[k]
+
+
+def ler_server_timing(valor: str):
+    """(comandos, ms no banco) do cabeçalho Server-Timing, ou (None, None)."""
+    m = _SERVER_TIMING_CMDS.search(valor or '')
+    if not m:
+        return None, None
+    return int(m.group(2)), float(m.group(1))
+
+
+def contexto(db) -> dict:
+    """Ids reais da massa para montar os cenários (produtos, locais com saldo, setores)."""
+    def _pid(doc):
+        return doc['id'] if doc.get('id') is not None else str(doc['_id'])
+
+    produtos = [_pid(p) for p in db['produtos'].find({}, {'id': 1}).sort('_id', 1).limit(200)]
+    origens = list(db['estoques'].find(
+        {'local_tipo': 'almoxarifado', 'quantidade_disponivel': {'$gte': 50}},
+        {'produto_id': 1, 'local_id': 1},
+    ).sort('_id', 1).limit(200))
+    subs = [_pid(s) for s in db['sub_almoxarifados'].find({}, {'id': 1}).sort('_id', 1).limit(50)]
+    setores = [_pid(s) for s in db['setores'].find({}, {'id': 1}).sort('_id', 1).limit(50)]
+    info = db[dataset_sintetico.COLECAO_INFO].find_one({'_id': 'sintetico'}) or {}
+    return {
+        'produtos': produtos,
+        'origens': [(o['produto_id'], o['local_id']) for o in origens],
+        'sub_almoxarifados': subs,
+        'setores': setores,
+        'dataset': {'seed': info.get('seed'), 'escala': info.get('escala')},
+    }
+
+
+def cenarios(ctx: dict, escrita: bool = True) -> list:
+    """Lista de cenários: {'nome', 'metodo', 'requisicao': i -> (caminho, corpo)}."""
+    produtos = ctx['produtos'] or [1]
+    lista = [
+        {'nome': 'estoque_hierarquia', 'metodo': 'GET',
+         'requisicao': lambda i: (f'/api/estoque/hierarquia?page={i % 10 + 1}&per_page=20&_={i}', None)},
+        {'nome': 'movimentacoes', 'metodo': 'GET',
+         'requisicao': lambda i: (f'/api/movimentacoes?page={i % 10 + 1}&per_page=50&_={i}', None)},
+        {'nome': 'produtos_busca_rapida', 'metodo': 'GET',
+         'requisicao': lambda i: (f'/api/produtos/busca-rapida?q={_TERMOS_BUSCA[i % len(_TERMOS_BUSCA)]}&limit=10&_={i}', None)},
+        {'nome': 'compras_sugestoes', 'metodo': 'GET',
+         'requisicao': lambda i: (f'/api/compras/sugestoes?page={i % 5 + 1}&_={i}', None)},
+        {'nome': 'dashboard_stats_general', 'metodo': 'GET',
+         'requisicao': lambda i: (f'/api/dashboard/stats-general?_={i}', None)},
+        {'nome': 'dashboard_estoque_baixo', 'metodo': 'GET',
+         'requisicao': lambda i: (f'/api/dashboard/estoque-baixo?_={i}', None)},
+        {'nome': 'dashboard_vencimentos', 'metodo': 'GET',
+         'requisicao': lambda i: (f'/api/dashboard/vencimentos?_={i}', None)},
+        {'nome': 'dashboard_movimentacoes_recentes', 'metodo': 'GET',
+         'requisicao': lambda i: (f'/api/dashboard/movimentacoes-recentes?_={i}', None)},
+        {'nome': 'produto_estoque', 'metodo': 'GET',
+         'requisicao': lambda i: (f'/api/produtos/{produtos[i % len(produtos)]}/estoque', None)},
+    ]
+    if escrita and ctx['origens'] and ctx['sub_almoxarifados'] and ctx['setores']:
+        origens, subs, setores = ctx['origens'], ctx['sub_almoxarifados'], ctx['setores']
+        lista.append({'nome': 'transferencia', 'metodo': 'POST', 'requisicao': lambda i: ('/api/movimentacoes/transferencia', {
+            'produto_id': origens[i % len(origens)][0],
+            'quantidade': 1,
+            'motivo': 'benchmark',
+            'origem': {'tipo': 'almoxarifado', 'id': origens[i % len(origens)][1]},
+            'destino': {'tipo': 'sub_almoxarifado', 'id': subs[i % len(subs)]},
+        })})
+        lista.append({'nome': 'distribuicao', 'metodo': 'POST', 'requisicao': lambda i: ('/api/movimentacoes/distribuicao', {
+            'produto_id': origens[(i + 1) % len(origens)][0],
+            'quantidade_total': 2,
+            'motivo': 'benchmark',
+            'origem': {'tipo': 'almoxarifado', 'id': origens[(i + 1) % len(origens)][1]},
+            'setores_destino': [setores[i % len(setores)], setores[(i + 1) % len(setores)]],
+        })})
+    return lista
+
+
+class ClienteFlask:
+    """Requisições pelo test client, no mesmo processo."""
+    modo = 'flask'
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def login(self, usuario: str, senha: str) -> bool:
+        r = self.client.post('/auth/login', json={'username': usuario, 'password': senha})
+        return r.status_code == 200
+
+    def requisitar(self, metodo: str, caminho: str, corpo=None):
+        r = self.client.open(caminho, method=metodo, json=corpo, headers={'Accept': 'application/json'})
+        r.close()
+        return r.status_code, r.headers.get('Server-Timing')
+
+    def rss_pico_mb(self):
+        return rss_pico_mb_processo()
+
+
+class ClienteHttp:
+    """Requisições HTTP (gunicorn local) com sessão por cookie."""
+    modo = 'http'
+
+    def __init__(self, base_url: str, pids=None):
+        import requests
+        self.base_url = base_url.rstrip('/')
+        self.sessao = requests.Session()
+        self.pids = pids or (lambda: [])
+
+    def login(self, usuario: str, senha: str) -> bool:
+        r = self.sessao.post(self.base_url + '/auth/login', json={'username': usuario, 'password': senha}, timeout=30)
+        return r.status_code == 200
+
+    def requisitar(self, metodo: str, caminho: str, corpo=None):
+        r = self.sessao.request(metodo, self.base_url + caminho, json=corpo,
+                                headers={'Accept': 'application/json'}, timeout=120)
+        return r.status_code, r.headers.get('Server-Timing')
+
+    def rss_pico_mb(self):
+        return max([rss_pico_mb_pid(p) or 0 for p in self.pids()] or [0]) or None
+
+
+def rss_pico_mb_processo():
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss vem em KB no Linux e em bytes no macOS
+    return round(pico / (1024.0 * 1024.0) if platform.system() == 'Darwin' else pico / 1024.0, 1)
+
+
+def rss_pico_mb_pid(pid: int):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for linha in f:
+                if linha.startswith('VmHWM:'):
+                    return round(int(linha.split()[1]) / 1024.0, 1)
+    except OSError:
+        return None
+    return None
+
+
+def medir(cliente, lista: list, repeticoes: int = 30, aquecimento: int = 3, progresso=None) -> dict:
+    resultado = {}
+    for cenario in lista:
+        for i in range(aquecimento):
+            caminho, corpo = cenario['requisicao'](10 ** 6 + i)
+            cliente.requisitar(cenario['metodo'], caminho, corpo)
+        tempos, comandos, db_ms, status = [], [], [], {}
+        for i in range(repeticoes):
+            caminho, corpo = cenario['requisicao'](i)
+            inicio = time.perf_counter()
+            codigo, server_timing = cliente.requisitar(cenario['metodo'], caminho, corpo)
+            tempos.append((time.perf_counter() - inicio) * 1000.0)
+            status[str(codigo)] = status.get(str(codigo), 0) + 1
+            n, ms = ler_server_timing(server_timing)
+            if n is not None:
+                comandos.append(n)
+                db_ms.append(ms)
+        resultado[cenario['nome']] = {
+            'metodo': cenario['metodo'],
+            'n': repeticoes,
+            'status': status,
+            'p50_ms': round(percentil(tempos, 50), 2),
+            'p95_ms': round(percentil(tempos, 95), 2),
+            'p99_ms': round(percentil(tempos, 99), 2),
+            'media_ms': round(sum(tempos) / len(tempos), 2),
+            'comandos_p50': percentil(comandos, 50),
+            'comandos_max': max(comandos) if comandos else None,
+            'db_ms_p50': round(percentil(db_ms, 50), 2) if db_ms else None,
+        }
+        if progresso is not None:
+            progresso(cenario['nome'], resultado[cenario['nome']])
+    return resultado
+
+
+def executar(cliente, ctx: dict, repeticoes: int = 30, aquecimento: int = 3, escrita: bool = True,
+             apenas=None, progresso=None) -> dict:
+    lista = cenarios(ctx, escrita=escrita)
+    if apenas:
+        lista = [c for c in lista if c['nome'] in apenas]
+    medidos = medir(cliente, lista, repeticoes=repeticoes, aquecimento=aquecimento, progresso=progresso)
+    return {
+        'meta': {
+            'gerado_em': datetime.now(timezone.utc).isoformat(),
+            'modo': cliente.modo,
+            'repeticoes': repeticoes,
+            'aquecimento': aquecimento,
+            'dataset': ctx.get('dataset'),
+            'python': platform.python_version(),
+            'host': platform.node(),
+            'cpus': os.cpu_count(),
+        },
+        'cenarios': medidos,
+        'rss_pico_mb': cliente.rss_pico_mb(),
+    }
+
+
+def comparar(atual: dict, base: dict, tolerancia: float = 0.2) -> list:
+    """Regressões de `atual` contra a linha de base: lista de mensagens (vazia = dentro da tolerância).
+
+    p95 e pico de RSS podem crescer até `tolerancia` (fração); comandos por requisição são
+    determinísticos para a mesma massa e só toleram o arredondamento (+1).
+    """
+    regressoes = []
+    for nome, b in (base.get('cenarios') or {}).items():
+        a = (atual.get('cenarios') or {}).get(nome)
+        if a is None:
+            continue
+        if b.get('p95_ms') and a.get('p95_ms') is not None and a['p95_ms'] > b['p95_ms'] * (1 + tolerancia):
+            regressoes.append(f"{nome}: p95 {a['p95_ms']}ms > {b['p95_ms']}ms (+{tolerancia:.0%})")
+        if b.get('comandos_p50') is not None and a.get('comandos_p50') is not None and a['comandos_p50'] > b['comandos_p50'] + 1:
+            regressoes.append(f"{nome}: {a['comandos_p50']} comandos Mongo por requisição > {b['comandos_p50']}")
+        erros_base = sum(v for k, v in (b.get('status') or {}).items() if k.startswith('5'))
+        erros = sum(v for k, v in (a.get('status') or {}).items() if k.startswith('5'))
+        if erros > erros_base:
+            regressoes.append(f'{nome}: {erros} respostas 5xx (linha de base: {erros_base})')
+    if base.get('rss_pico_mb') and atual.get('rss_pico_mb') and atual['rss_pico_mb'] > base['rss_pico_mb'] * (1 + tolerancia):
+        regressoes.append(f"pico de RSS {atual['rss_pico_mb']}MB > {base['rss_pico_mb']}MB (+{tolerancia:.0%})")
+    return regressoes
+
+
+def gravar(resultado: dict, caminho: str):
+    os.makedirs(os.path.dirname(os.path.abspath(caminho)), exist_ok=True)
+    with open(caminho, 'w', encoding='utf-8') as f:
+        json.dump(resultado, f, ensure_ascii=False, indent=2, sort_keys=True)
+
+
+def carregar(caminho: str):
+    try:
+        with open(caminho, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
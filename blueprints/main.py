@@ -10,7 +10,19 @@ from auth import (require_any_level, require_manager_or_above, require_admin_or_
                   ScopeFilter, ensure_csrf_token, extract_csrf_header, get_csrf_token, log_auditoria)
 from config.ui_blocks import get_ui_blocks_config
 import extensions
-from pymongo import ReturnDocument
+import saldos
+import movimentacoes_repo
+import consumo_diario
+import contadores
+import fefo
+import backups
+import arquivamento
+import jobs
+import metricas
+import consultas_lentas
+from idempotencia import idempotente
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
 from datetime import datetime, timezone
 from datetime import timedelta
 from bson import ObjectId
@@ -20,6 +32,7 @@ import os
 import json as _json
 from urllib.request import Request as _UrlRequest, urlopen as _urlopen
 from urllib.error import URLError as _URLError, HTTPError as _HTTPError
+from urllib.parse import urlencode as _urlencode
 from werkzeug.security import generate_password_hash
 
 main_bp = Blueprint('main', __name__)
@@ -141,6 +154,117 @@ def _find_by_id(coll_name: str, value):
         doc = coll.find_one({'id': value}) or coll.find_one({'_id': value})
     return doc
 
+# Histórico de movimentações (coleção única ou buckets, conforme MOVIMENTACOES_STORAGE)
+def _mov_repo():
+    return movimentacoes_repo.get_repo(extensions.mongo_db)
+
+# Helper compartilhado para resolver vários documentos de uma vez (evita N+1 e $lookup por $toString)
+def _find_many_by_ids(coll_name: str, values, projection=None) -> dict:
+    """Resolve vários documentos com uma única consulta indexada em 'id' e '_id'.
+    Retorna um mapa str(id) / str(_id) -> documento (ambas as chaves apontam para o mesmo doc).
+    """
+    seq_ids = set()
+    str_ids = set()
+    oid_ids = set()
+    for v in values or []:
+        if v is None:
+            continue
+        if isinstance(v, ObjectId):
+            oid_ids.add(v)
+            continue
+        if isinstance(v, int) and not isinstance(v, bool):
+            seq_ids.add(v)
+            continue
+        s = str(v)
+        str_ids.add(s)
+        if s.isdigit():
+            seq_ids.add(int(s))
+        elif len(s) == 24:
+            try:
+                oid_ids.add(ObjectId(s))
+            except Exception:
+                pass
+    or_terms = []
+    if seq_ids:
+        or_terms.append({'id': {'$in': list(seq_ids)}})
+    if str_ids:
+        or_terms.append({'id': {'$in': list(str_ids)}})
+        or_terms.append({'_id': {'$in': list(str_ids)}})
+    if oid_ids:
+        or_terms.append({'_id': {'$in': list(oid_ids)}})
+    out = {}
+    if not or_terms:
+        return out
+    for doc in extensions.mongo_db[coll_name].find({'$or': or_terms}, projection):
+        if doc.get('id') is not None:
+            out[str(doc.get('id'))] = doc
+        if doc.get('_id') is not None:
+            out[str(doc.get('_id'))] = doc
+    return out
+
+# Coleção do local de um registro de estoque, na precedência usada pelas listagens de hierarquia
+_CAMPOS_LOCAL_ESTOQUE = (
+    ('setor_id', 'setores'),
+    ('sub_almoxarifado_id', 'sub_almoxarifados'),
+    ('almoxarifado_id', 'almoxarifados'),
+    ('central_id', 'centrais'),
+)
+
+def _refs_estoques(docs) -> tuple:
+    """Resolve produtos e locais de uma lista de registros de estoque com uma consulta por coleção.
+    Retorna (mapa de produtos, {coleção: mapa de locais}) no formato de _find_many_by_ids.
+    """
+    locais = {}
+    for s in docs:
+        for campo, coll_name in _CAMPOS_LOCAL_ESTOQUE:
+            if s.get(campo) is not None:
+                locais.setdefault(coll_name, set()).add(s.get(campo))
+                break
+    produtos = _find_many_by_ids('produtos', {s.get('produto_id') for s in docs})
+    return produtos, {coll_name: _find_many_by_ids(coll_name, ids) for coll_name, ids in locais.items()}
+
+# Decremento condicional de estoque: a verificação de saldo vai no próprio filtro do update,
+# então duas saídas concorrentes não conseguem deixar o estoque negativo.
+def _filtro_saldo_suficiente(quantidade: float) -> dict:
+    """Saldo >= quantidade, na mesma ordem de precedência usada nas leituras
+    (quantidade_disponivel, senão quantidade, senão quantidade_atual)."""
+    return {'$or': [
+        {'quantidade_disponivel': {'$gte': quantidade}},
+        {'quantidade_disponivel': {'$exists': False}, 'quantidade': {'$gte': quantidade}},
+        {'quantidade_disponivel': {'$exists': False}, 'quantidade': {'$exists': False}, 'quantidade_atual': {'$gte': quantidade}},
+    ]}
+
+def _decrementar_estoque(estoques, filtros, quantidade: float, now, mongo_session=None, campos=('quantidade', 'quantidade_disponivel')):
+    """Aplica $inc negativo no primeiro documento de 'filtros' com saldo suficiente.
+    Retorna o documento atualizado ou None (sem estoque ou saldo insuficiente).
+    Sem repetição manual: um $inc reenviado após AutoReconnect/WriteConcernError pode ser
+    aplicado duas vezes. retryWrites do driver repete o findAndModify com segurança (o servidor
+    deduplica pelo txnNumber) e, dentro de transação, quem repete é run_transaction.
+    """
+    update = {'$inc': {c: -quantidade for c in campos}, '$set': {'updated_at': now}}
+    for filtro in filtros:
+        if not filtro:
+            continue
+        guarded = {'$and': [filtro, _filtro_saldo_suficiente(quantidade)]}
+        doc = estoques.find_one_and_update(guarded, update, return_document=ReturnDocument.AFTER, session=mongo_session)
+        if doc is not None:
+            return doc
+    return None
+
+def _nome_local_doc(doc, default='Local'):
+    return (doc or {}).get('nome') or (doc or {}).get('descricao') or default
+
+def _saldo_doc(doc) -> float:
+    doc = doc or {}
+    return float(doc.get('quantidade_disponivel', doc.get('quantidade', doc.get('quantidade_atual', 0))) or 0)
+
+def _falha_decremento(estoques, filtros, msg_insuficiente='Quantidade insuficiente na origem'):
+    """Mensagem de erro após decremento recusado (leitura apenas no caminho de falha)."""
+    for filtro in filtros:
+        if filtro and estoques.find_one(filtro, {'_id': 1}):
+            return msg_insuficiente
+    return 'Não há estoque no local de origem para este produto'
+
 
 @main_bp.route('/')
 @require_any_level
@@ -859,33 +983,59 @@ def api_categorias_list():
         page = max(1, min(page, pages))
         skip = max(0, (page - 1) * per_page)
 
-        cursor = coll.find(filter_query).sort('nome', 1).skip(skip).limit(per_page)
-
-        # Pré-carregar coleções relacionadas para contagem
-        produtos_coll = extensions.mongo_db['produtos']
-        usuarios_coll = extensions.mongo_db['usuarios']
+        categorias = list(coll.find(filter_query).sort('nome', 1).skip(skip).limit(per_page))
+
+        # Contagens da página com uma consulta por coleção: chave de cada referência -> índice da
+        # categoria (ObjectId e sua forma texto apontam para a mesma categoria)
+        def _chave(v):
+            return str(v) if isinstance(v, ObjectId) else v
+
+        por_chave = {}
+        por_oid_str = {}
+        for i, c in enumerate(categorias):
+            if c.get('id') is not None:
+                por_chave[_chave(c.get('id'))] = i
+            if c.get('_id') is not None:
+                por_chave[_chave(c.get('_id'))] = i
+                por_oid_str[str(c.get('_id'))] = i
+        candidatos = [c.get('id') for c in categorias if c.get('id') is not None]
+        candidatos += [c.get('_id') for c in categorias if c.get('_id') is not None]
+        candidatos += list(por_oid_str.keys())
+
+        produtos_count = [0] * len(categorias)
+        usuarios_count = [0] * len(categorias)
+        if categorias:
+            for g in extensions.mongo_db['produtos'].aggregate([
+                {'$match': {'categoria_id': {'$in': candidatos}}},
+                {'$group': {'_id': '$categoria_id', 'n': {'$sum': 1}}},
+            ]):
+                i = por_chave.get(_chave(g.get('_id')))
+                if i is not None:
+                    produtos_count[i] += int(g.get('n') or 0)
+            for u in extensions.mongo_db['usuarios'].find({
+                '$or': [
+                    {'categoria_id': {'$in': candidatos}},
+                    {'categorias_especificas': {'$in': list(por_oid_str.keys())}}
+                ]
+            }, {'categoria_id': 1, 'categorias_especificas': 1}):
+                indices = set()
+                cat = u.get('categoria_id')
+                if cat is not None and not isinstance(cat, list) and _chave(cat) in por_chave:
+                    indices.add(por_chave[_chave(cat)])
+                especificas = u.get('categorias_especificas')
+                if not isinstance(especificas, list):
+                    especificas = [especificas]
+                for e in especificas:
+                    if isinstance(e, str) and e in por_oid_str:
+                        indices.add(por_oid_str[e])
+                for i in indices:
+                    usuarios_count[i] += 1
 
         items = []
-        for c in cursor:
+        for i, c in enumerate(categorias):
             cid_seq = c.get('id')
             cid_oid = c.get('_id')
             cid_oid_str = str(cid_oid) if cid_oid else None
-            # candidatos de comparação para produtos/usuarios
-            pid_candidates = []
-            if cid_seq is not None:
-                pid_candidates.append(cid_seq)
-            if cid_oid is not None:
-                pid_candidates.append(cid_oid)
-            if cid_oid_str is not None:
-                pid_candidates.append(cid_oid_str)
-
-            produtos_count = produtos_coll.count_documents({'categoria_id': {'$in': pid_candidates}})
-            usuarios_count = usuarios_coll.count_documents({
-                '$or': [
-                    {'categoria_id': {'$in': pid_candidates}},
-                    {'categorias_especificas': {'$in': [cid_oid_str] if cid_oid_str else []}}
-                ]
-            })
 
             items.append({
                 'id': cid_seq if cid_seq is not None else cid_oid_str,
@@ -894,8 +1044,8 @@ def api_categorias_list():
                 'descricao': c.get('descricao'),
                 'cor': c.get('cor') or '#6c757d',
                 'ativo': bool(c.get('ativo', True)),
-                'produtos_count': int(produtos_count),
-                'usuarios_count': int(usuarios_count)
+                'produtos_count': produtos_count[i],
+                'usuarios_count': usuarios_count[i]
             })
 
         return jsonify({
@@ -1239,41 +1389,21 @@ def api_admin_reset_db():
 
 @main_bp.route('/api/admin/backup/create', methods=['POST'])
 @require_admin_or_above
+@jobs.assincrono('backup_create')
 def api_admin_backup_create():
     try:
         db = extensions.mongo_db
         if db is None:
             return jsonify({'error': 'MongoDB não inicializado'}), 503
         body = request.get_json(silent=True) or {}
-        include = body.get('collections')
-        collections = db.list_collection_names()
-        if isinstance(include, list) and include:
-            collections = [c for c in collections if c in include]
-        data = {'database': db.name, 'created_at': datetime.utcnow().isoformat(), 'collections': {}}
-        def _normalize(v):
-            if isinstance(v, ObjectId):
-                return str(v)
-            if isinstance(v, datetime):
-                try:
-                    return v.isoformat()
-                except Exception:
-                    return str(v)
-            if isinstance(v, dict):
-                return {k: _normalize(v[k]) for k in v}
-            if isinstance(v, list):
-                return [_normalize(x) for x in v]
-            return v
-        for name in collections:
-            docs = []
-            for d in db[name].find({}):
-                docs.append(_normalize(d))
-            data['collections'][name] = docs
-        backup_dir = os.path.join(current_app.root_path, 'backups')
-        os.makedirs(backup_dir, exist_ok=True)
-        fname = f"backup-{db.name}-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.json"
-        fpath = os.path.join(backup_dir, fname)
-        with open(fpath, 'w', encoding='utf-8') as f:
-            f.write(_json.dumps(data, ensure_ascii=False))
+        inicio = datetime.now(timezone.utc)
+        try:
+            res = backups.criar_backup(db, backups.diretorio_backups(current_app), collections=body.get('collections'))
+        except Exception as e:
+            backups.registrar_execucao(db, 'manual', inicio, datetime.now(timezone.utc), erro=str(e))
+            raise
+        backups.registrar_execucao(db, 'manual', inicio, datetime.now(timezone.utc), res)
+        fname = res['file']
         try:
             log_auditoria('BACKUP_CREATE')
         except Exception:
@@ -1290,25 +1420,20 @@ def api_admin_backup_create():
 @require_admin_or_above
 def api_admin_backup_list():
     try:
-        backup_dir = os.path.join(current_app.root_path, 'backups')
+        backup_dir = backups.diretorio_backups(current_app)
         os.makedirs(backup_dir, exist_ok=True)
-        items = []
-        for name in sorted(os.listdir(backup_dir)):
-            if not name.lower().endswith('.json'):
-                continue
-            fpath = os.path.join(backup_dir, name)
-            try:
-                stat = os.stat(fpath)
-                items.append({'name': name, 'size': stat.st_size, 'modified_at': datetime.utcfromtimestamp(stat.st_mtime).isoformat()})
-            except Exception:
-                items.append({'name': name})
-        return jsonify({'items': items})
+        return jsonify({'items': backups.listar_backups(backup_dir)})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @main_bp.route('/api/admin/backup/restore', methods=['POST'])
 @require_admin_or_above
+@jobs.assincrono('backup_restore')
 def api_admin_backup_restore():
+    """Restaura um backup em lotes (bulk_write de ReplaceOne, ordered=False).
+    Body: {file, mode: 'replace'|'merge', batch_size?, restauracao_id?}; com restauracao_id de
+    uma restauração interrompida, continua do último lote confirmado.
+    """
     try:
         db = extensions.mongo_db
         if db is None:
@@ -1316,45 +1441,83 @@ def api_admin_backup_restore():
         body = request.get_json(silent=True) or {}
         name = str(body.get('file') or '')
         mode = str(body.get('mode') or 'replace')
-        backup_dir = os.path.join(current_app.root_path, 'backups')
+        batch_size = max(1, min(int(body.get('batch_size') or 1000), 10000))
+        backup_dir = backups.diretorio_backups(current_app)
+        if not name or os.path.basename(name) != name:
+            return jsonify({'error': 'Nome de backup inválido'}), 400
         fpath = os.path.join(backup_dir, name)
-        if not os.path.isfile(fpath):
+        if os.path.isdir(fpath) and os.path.isfile(os.path.join(fpath, backups.MANIFEST)):
+            # arquivos por coleção conferidos pelo checksum antes de qualquer escrita
+            problemas = backups.verificar_backup(fpath)
+            if problemas:
+                return jsonify({'error': 'Backup corrompido', 'problemas': problemas}), 400
+        elif not os.path.isfile(fpath):
             return jsonify({'error': 'Arquivo de backup não encontrado'}), 404
-        with open(fpath, 'r', encoding='utf-8') as f:
-            payload = _json.loads(f.read())
-        def _to_oid(v):
+        restauracao_id = body.get('restauracao_id')
+        if restauracao_id:
             try:
-                return ObjectId(str(v))
+                restauracao_id = ObjectId(str(restauracao_id))
             except Exception:
-                return v
-        for coll_name, docs in (payload.get('collections') or {}).items():
-            if mode == 'replace':
-                db[coll_name].delete_many({})
-            for d in docs:
-                doc = {}
-                for k, v in d.items():
-                    if k == '_id':
-                        doc['_id'] = _to_oid(v)
-                    else:
-                        doc[k] = v
-                try:
-                    if '_id' in doc:
-                        db[coll_name].replace_one({'_id': doc['_id']}, doc, upsert=True)
-                    else:
-                        db[coll_name].insert_one(doc)
-                except Exception:
-                    db[coll_name].insert_one({k: v for k, v in doc.items() if k != '_id'})
+                return jsonify({'error': 'restauracao_id inválido'}), 400
+            # id registrado por uma tentativa do job que caiu antes de gravar o estado: começa com ele
+            if db[backups.COLECAO_RESTAURACOES].find_one({'_id': restauracao_id}) is None \
+                    and jobs.checkpoint('restauracao_id') != str(restauracao_id):
+                return jsonify({'error': 'Restauração não encontrada'}), 404
+        else:
+            restauracao_id = ObjectId()
+        jobs.registrar_checkpoint(restauracao_id=str(restauracao_id))
+        estado = backups.restaurar_backup(db, fpath, mode=mode, batch_size=batch_size,
+                                          restauracao_id=restauracao_id, logger_=current_app.logger,
+                                          progresso=jobs.reportar_progresso)
+        if estado.get('status') != 'concluido':
+            return jsonify({'error': f"Restauração interrompida: {estado.get('erro')}", 'restauracao': _restauracao_json(estado)}), 500
         try:
             log_auditoria('BACKUP_RESTORE')
         except Exception:
             pass
-        return jsonify({'ok': True})
+        return jsonify({'ok': True, 'restauracao': _restauracao_json(estado)})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def _restauracao_json(doc):
+    doc = doc or {}
+    return {
+        'id': str(doc.get('_id')),
+        'arquivo': doc.get('arquivo'),
+        'mode': doc.get('mode'),
+        'status': doc.get('status'),
+        'colecao_atual': doc.get('colecao_atual'),
+        'aplicados_colecao': doc.get('aplicados_colecao'),
+        'colecoes_concluidas': doc.get('colecoes_concluidas') or [],
+        'documentos': doc.get('documentos'),
+        'erro': doc.get('erro'),
+        'inicio': doc.get('inicio').isoformat() if isinstance(doc.get('inicio'), datetime) else None,
+        'fim': doc.get('fim').isoformat() if isinstance(doc.get('fim'), datetime) else None,
+    }
+
+@main_bp.route('/api/admin/backup/restore/<string:restauracao_id>', methods=['GET'])
+@require_admin_or_above
+def api_admin_backup_restore_status(restauracao_id):
+    """Progresso de uma restauração (consultável enquanto ela roda em outra requisição)."""
+    db = extensions.mongo_db
+    if db is None:
+        return jsonify({'error': 'MongoDB não inicializado'}), 503
+    try:
+        doc = db[backups.COLECAO_RESTAURACOES].find_one({'_id': ObjectId(restauracao_id)})
+    except Exception:
+        doc = None
+    if not doc:
+        return jsonify({'error': 'Restauração não encontrada'}), 404
+    return jsonify({'restauracao': _restauracao_json(doc)})
+
 @main_bp.route('/api/admin/archive', methods=['POST'])
 @require_admin_or_above
+@jobs.assincrono('archive')
 def api_admin_archive():
+    """Move documentos para a coleção de arquivo em blocos ordenados por _id, com checkpoint.
+    Body: {collection, query, archive_to?, chunk?, execucao_id?}; com execucao_id de uma
+    execução interrompida, continua do último bloco confirmado.
+    """
     try:
         db = extensions.mongo_db
         if db is None:
@@ -1362,27 +1525,68 @@ def api_admin_archive():
         body = request.get_json(silent=True) or {}
         coll_name = str(body.get('collection') or '')
         query = body.get('query') or {}
-        archive_name = str(body.get('archive_to') or f"archive_{coll_name}")
-        if not coll_name:
+        archive_name = str(body.get('archive_to') or arquivamento.destino_padrao(coll_name))
+        chunk = max(1, min(int(body.get('chunk') or 1000), 10000))
+        execucao_id = body.get('execucao_id')
+        if execucao_id:
+            checkpoint_job = jobs.checkpoint('execucao_id') == str(execucao_id)
+            try:
+                execucao_id = ObjectId(str(execucao_id))
+            except Exception:
+                pass
+            if db[arquivamento.COLECAO_EXECUCOES].find_one({'_id': execucao_id}) is None and not checkpoint_job:
+                return jsonify({'error': 'Execução não encontrada'}), 404
+        elif not coll_name:
             return jsonify({'error': 'collection obrigatório'}), 400
-        src = db[coll_name]
-        dst = db[archive_name]
-        docs = list(src.find(query))
-        if docs:
-            for d in docs:
-                try:
-                    dst.replace_one({'_id': d.get('_id')}, d, upsert=True)
-                except Exception:
-                    dst.insert_one(d)
-            src.delete_many({'_id': {'$in': [d.get('_id') for d in docs if d.get('_id')]}})
+        else:
+            execucao_id = ObjectId()
+        jobs.registrar_checkpoint(execucao_id=str(execucao_id))
+        estado = arquivamento.arquivar(db, coll_name, query, destino=archive_name, chunk=chunk, execucao_id=execucao_id,
+                                       progresso=jobs.reportar_progresso)
         try:
             log_auditoria('ARCHIVE_MOVE')
         except Exception:
             pass
-        return jsonify({'ok': True, 'moved': len(docs), 'from': coll_name, 'to': archive_name})
+        resposta = {
+            'ok': estado.get('status') == 'concluido',
+            'moved': int(estado.get('movidos') or 0),
+            'from': estado.get('origem'),
+            'to': estado.get('destino'),
+            'execucao_id': str(estado.get('_id')),
+            'status': estado.get('status'),
+        }
+        if estado.get('status') == 'erro':
+            resposta['error'] = estado.get('erro')
+            return jsonify(resposta), 500
+        return jsonify(resposta)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@main_bp.route('/api/admin/archive/execucoes', methods=['GET'])
+@require_admin_or_above
+def api_admin_archive_execucoes():
+    """Execuções de arquivamento (manuais e das políticas de retenção) e políticas ativas."""
+    db = extensions.mongo_db
+    if db is None:
+        return jsonify({'error': 'MongoDB não inicializado'}), 503
+    items = []
+    for d in db[arquivamento.COLECAO_EXECUCOES].find({}).sort('inicio', -1).limit(50):
+        items.append({
+            'id': str(d.get('_id')),
+            'origem': d.get('origem'),
+            'destino': d.get('destino'),
+            'status': d.get('status'),
+            'movidos': d.get('movidos'),
+            'erro': d.get('erro'),
+            'inicio': d.get('inicio').isoformat() if isinstance(d.get('inicio'), datetime) else None,
+            'fim': d.get('fim').isoformat() if isinstance(d.get('fim'), datetime) else None,
+        })
+    return jsonify({
+        'items': items,
+        'retencao_ativa': bool(current_app.config.get('RETENCAO_ATIVA')),
+        'politicas': arquivamento.politicas(current_app),
+    })
+
 @main_bp.route('/api/admin/backup/schedule', methods=['POST'])
 @require_admin_or_above
 def api_admin_backup_schedule():
@@ -1404,15 +1608,158 @@ def api_admin_backup_schedule():
             log_auditoria('BACKUP_SCHEDULE_SET')
         except Exception:
             pass
-        return jsonify({'ok': True, 'schedule': {
-            'enabled': doc['enabled'],
-            'interval': doc['interval'],
-            'time': doc['time'],
-            'retention': doc['retention']
-        }})
+        return jsonify({'ok': True, 'schedule': backups.status_agendamento(db)})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@main_bp.route('/api/admin/backup/schedule', methods=['GET'])
+@require_admin_or_above
+def api_admin_backup_schedule_get():
+    db = extensions.mongo_db
+    if db is None:
+        return jsonify({'error': 'MongoDB não inicializado'}), 503
+    return jsonify({'schedule': backups.status_agendamento(db)})
+
+@main_bp.route('/api/admin/backup/historico', methods=['GET'])
+@require_admin_or_above
+def api_admin_backup_historico():
+    """Execuções de backup (manuais e agendadas), mais recentes primeiro."""
+    db = extensions.mongo_db
+    if db is None:
+        return jsonify({'error': 'MongoDB não inicializado'}), 503
+    try:
+        limit = max(1, min(int(request.args.get('limit', 20)), 200))
+    except Exception:
+        return jsonify({'error': 'Parâmetros inválidos'}), 400
+    items = []
+    for d in db[backups.COLECAO_EXECUCOES].find({}).sort('inicio', -1).limit(limit):
+        items.append({
+            'id': str(d.get('_id')),
+            'origem': d.get('origem'),
+            'status': d.get('status'),
+            'inicio': d.get('inicio').isoformat() if isinstance(d.get('inicio'), datetime) else d.get('inicio'),
+            'duracao_segundos': d.get('duracao_segundos'),
+            'arquivo': d.get('arquivo'),
+            'tamanho': d.get('tamanho'),
+            'removidos': d.get('removidos') or [],
+            'erro': d.get('erro'),
+        })
+    return jsonify({'items': items})
+
+@main_bp.route('/api/admin/consultas-lentas', methods=['GET'])
+@require_admin_or_above
+def api_admin_consultas_lentas():
+    """Formas de consulta com maior tempo acumulado acima de MONGO_SLOW_MS, com o plano resumido.
+    Query: horas (janela, padrão 24), limit (padrão 20)."""
+    db = extensions.mongo_db
+    if db is None:
+        return jsonify({'error': 'MongoDB não inicializado'}), 503
+    try:
+        horas = max(1, min(int(request.args.get('horas', 24)), 24 * 30))
+        limit = max(1, min(int(request.args.get('limit', 20)), 100))
+    except Exception:
+        return jsonify({'error': 'Parâmetros inválidos'}), 400
+    desde = datetime.now(timezone.utc) - timedelta(hours=horas)
+    items = []
+    for d in consultas_lentas.piores_formas(db, desde, limit):
+        items.append({
+            'forma': d.get('_id'),
+            'colecao': d.get('colecao'),
+            'total_ms': round(float(d.get('total_ms') or 0), 1),
+            'ocorrencias': d.get('ocorrencias'),
+            'media_ms': round(float(d.get('total_ms') or 0) / max(1, int(d.get('ocorrencias') or 1)), 1),
+            'max_ms': d.get('max_ms'),
+            'ultima': d.get('ultima').isoformat() if isinstance(d.get('ultima'), datetime) else None,
+            'endpoint': d.get('endpoint'),
+            'plano': d.get('plano'),
+        })
+    return jsonify({'items': items, 'horas': horas, 'registrador': consultas_lentas.registrador.estatisticas()})
+
+# ==================== JOBS EM SEGUNDO PLANO ====================
+
+def _job_json(doc, resultado: bool = True):
+    doc = doc or {}
+    out = {
+        'id': str(doc.get('_id')),
+        'tipo': doc.get('tipo'),
+        'status': doc.get('status'),
+        'progresso': doc.get('progresso'),
+        'tentativas': doc.get('tentativas'),
+        'status_http': doc.get('status_http'),
+        'erro': doc.get('erro'),
+        'created_at': doc.get('created_at').isoformat() if isinstance(doc.get('created_at'), datetime) else None,
+        'iniciado_em': doc.get('iniciado_em').isoformat() if isinstance(doc.get('iniciado_em'), datetime) else None,
+        'concluido_em': doc.get('concluido_em').isoformat() if isinstance(doc.get('concluido_em'), datetime) else None,
+    }
+    if resultado and doc.get('resultado') is not None:
+        if doc.get('mimetype') == 'application/json':
+            try:
+                out['resultado'] = _json.loads(doc['resultado'])
+            except Exception:
+                out['resultado'] = doc['resultado']
+        else:
+            out['resultado'] = doc['resultado']
+    return out
+
+@main_bp.route('/api/jobs', methods=['POST'])
+@require_any_level
+def api_jobs_create():
+    """Cria um job em segundo plano. Body: {tipo, params}; params vira a query string (rotas GET)
+    ou o corpo JSON (rotas POST) da rota do tipo (jobs.TIPOS). Responde 202 com o id do job."""
+    db = extensions.mongo_db
+    if db is None:
+        return jsonify({'error': 'MongoDB não inicializado'}), 503
+    body = request.get_json(silent=True) or {}
+    tipo = str(body.get('tipo') or '')
+    if tipo not in jobs.TIPOS:
+        return jsonify({'error': 'Tipo de job inválido', 'tipos': sorted(jobs.TIPOS)}), 400
+    metodo, caminho, niveis = jobs.TIPOS[tipo]
+    if niveis and getattr(current_user, 'nivel_acesso', None) not in niveis:
+        return jsonify({'error': 'Acesso negado - nível insuficiente'}), 403
+    params = body.get('params') or {}
+    if not isinstance(params, dict):
+        return jsonify({'error': 'params deve ser um objeto'}), 400
+    if metodo == 'GET':
+        job = jobs.enfileirar(db, tipo, metodo, caminho, _urlencode(params, doseq=True), None, current_user.get_id())
+    else:
+        job = jobs.enfileirar(db, tipo, metodo, caminho, '', params, current_user.get_id())
+    return jobs.resposta_aceita(job)
+
+@main_bp.route('/api/jobs', methods=['GET'])
+@require_any_level
+def api_jobs_list():
+    """Jobs do usuário logado, mais recentes primeiro (sem o resultado)."""
+    db = extensions.mongo_db
+    if db is None:
+        return jsonify({'error': 'MongoDB não inicializado'}), 503
+    if not current_user.is_authenticated:
+        return jsonify({'error': 'Usuário não autenticado'}), 401
+    try:
+        limit = max(1, min(int(request.args.get('limit', 20)), 100))
+    except Exception:
+        return jsonify({'error': 'Parâmetros inválidos'}), 400
+    cursor = db[jobs.COLECAO].find({'usuario_id': current_user.get_id()}, {'resultado': 0}).sort('created_at', -1).limit(limit)
+    return jsonify({'items': [_job_json(d, resultado=False) for d in cursor]})
+
+@main_bp.route('/api/jobs/<string:job_id>', methods=['GET'])
+@require_any_level
+def api_job_status(job_id):
+    """Status, progresso e (quando finalizado) a resposta da rota executada pelo job."""
+    db = extensions.mongo_db
+    if db is None:
+        return jsonify({'error': 'MongoDB não inicializado'}), 503
+    if not current_user.is_authenticated:
+        return jsonify({'error': 'Usuário não autenticado'}), 401
+    try:
+        doc = db[jobs.COLECAO].find_one({'_id': ObjectId(job_id)})
+    except Exception:
+        doc = None
+    if not doc:
+        return jsonify({'error': 'Job não encontrado'}), 404
+    if doc.get('usuario_id') != current_user.get_id() and getattr(current_user, 'nivel_acesso', None) not in ('super_admin', 'admin_central', 'secretario'):
+        return jsonify({'error': 'Acesso negado'}), 403
+    return jsonify({'job': _job_json(doc)})
+
 @main_bp.route('/relatorios')
 @require_any_level
 def relatorios():
@@ -1435,8 +1782,59 @@ def relatorios_admin():
 
 # ==================== RELATÓRIOS ADMINISTRATIVOS ====================
 
+def _consumo_gastos_por_produto(db, data_inicio, data_fim, produto_ids=None):
+    """Consumo/gastos agregados por produto no período [data_inicio, data_fim].
+    Dias completos vêm da visão materializada; as bordas parciais do período são agregadas ao vivo
+    (faixas pequenas, cobertas por idx_mov_data_movimentacao). Retorna mapa str(produto_id) -> totais.
+    """
+    consumo_diario.atualizar_se_preciso(db, current_app.config.get('CONSUMO_DIARIO_REFRESH_SEGUNDOS', 60),
+                                        current_app.config.get('CONSUMO_DIARIO_MARGEM_SEGUNDOS', 300))
+    di = data_inicio.astimezone(timezone.utc).replace(tzinfo=None) if data_inicio.tzinfo else data_inicio
+    df = data_fim.astimezone(timezone.utc).replace(tzinfo=None) if data_fim.tzinfo else data_fim
+    dia_ini = consumo_diario.dia_utc(di)
+    if dia_ini < di:
+        dia_ini = dia_ini + timedelta(days=1)
+    dia_fim_excl = consumo_diario.dia_utc(df + timedelta(microseconds=1))
+
+    totais = {}
+    def _acumular(key, raw_pid, consumo, gastos):
+        t = totais.setdefault(key, {'produto_id': raw_pid, 'total_consumo': 0.0, 'total_gastos': 0.0})
+        t['total_consumo'] += float(consumo or 0.0)
+        t['total_gastos'] += float(gastos or 0.0)
+
+    faixas_ao_vivo = []
+    if dia_ini >= dia_fim_excl:
+        faixas_ao_vivo.append({'$gte': di, '$lte': df})
+    else:
+        if di < dia_ini:
+            faixas_ao_vivo.append({'$gte': di, '$lt': dia_ini})
+        if dia_fim_excl <= df:
+            faixas_ao_vivo.append({'$gte': dia_fim_excl, '$lte': df})
+        mat_match = {'dia': {'$gte': dia_ini, '$lt': dia_fim_excl}}
+        if produto_ids is not None:
+            mat_match['produto_key'] = {'$in': list({str(x) for x in produto_ids})}
+        for row in db['relatorio_consumo_diario'].aggregate([
+            {'$match': mat_match},
+            {'$group': {
+                '_id': '$produto_key',
+                'produto_id': {'$first': '$produto_id'},
+                'total_consumo': {'$sum': '$total_consumo'},
+                'total_gastos': {'$sum': '$total_gastos'}
+            }}
+        ]):
+            _acumular(row.get('_id'), row.get('produto_id'), row.get('total_consumo'), row.get('total_gastos'))
+
+    for faixa in faixas_ao_vivo:
+        match_stage = {'data_movimentacao': faixa}
+        if produto_ids is not None:
+            match_stage['produto_id'] = {'$in': list(produto_ids)}
+        for row in _mov_repo().aggregate([{'$match': match_stage}, consumo_diario.group_stage()]):
+            _acumular(str(row.get('_id')), row.get('_id'), row.get('total_consumo'), row.get('total_gastos'))
+    return totais
+
 @main_bp.route('/api/relatorios/admin/consumo-gastos', methods=['GET'])
 @require_level('super_admin', 'admin_central', 'secretario')
+@jobs.assincrono('relatorio_consumo_gastos')
 def api_relatorios_admin_consumo_gastos():
     """Relatório administrativo: consumo médio e valores gastos por produto.
     - Filtra por faixa de datas (data_inicio, data_fim) em 'data_movimentacao'.
@@ -1449,7 +1847,6 @@ def api_relatorios_admin_consumo_gastos():
         if db is None:
             return jsonify({'error': 'MongoDB não inicializado'}), 503
 
-        coll_mov = db['movimentacoes']
         coll_prod = db['produtos']
 
         # parâmetros
@@ -1504,82 +1901,16 @@ def api_relatorios_admin_consumo_gastos():
             except Exception:
                 central_ids = None
 
-        # pipeline único com agregação por produto
-        tipos_saida = ['transferencia', 'saida', 'consumo', 'retirada']
-        match_stage = {'data_movimentacao': {'$gte': data_inicio, '$lte': data_fim}}
-        if central_ids:
-            match_stage['produto_id'] = {'$in': central_ids}
-        pipeline = [
-            {'$match': match_stage},
-            {
-                '$group': {
-                    '_id': '$produto_id',
-                    'total_consumo': {
-                        '$sum': {
-                            '$cond': [
-                                {'$in': ['$tipo', tipos_saida]},
-                                '$quantidade',
-                                0
-                            ]
-                        }
-                    },
-                    'total_gastos': {
-                        '$sum': {
-                            '$cond': [
-                                {'$eq': ['$tipo', 'entrada']},
-                                {'$multiply': [
-                                    {'$ifNull': ['$quantidade', 0]},
-                                    {'$ifNull': ['$preco_unitario', 0]}
-                                ]},
-                                0
-                            ]
-                        }
-                    }
-                }
-            },
-            {
-                '$lookup': {
-                    'from': 'produtos',
-                    'localField': '_id',
-                    'foreignField': 'id',
-                    'as': 'prod_by_id'
-                }
-            },
-            {
-                '$lookup': {
-                    'from': 'produtos',
-                    'let': {'pid': '$_id'},
-                    'pipeline': [
-                        {'$match': {'$expr': {'$eq': [{'$toString': '$_id'}, {'$toString': '$$pid'}]}}},
-                        {'$project': {'_id': 1, 'nome': 1, 'codigo': 1, 'central_id': 1}}
-                    ],
-                    'as': 'prod_by_oid'
-                }
-            },
-            {
-                '$set': {
-                    'prod': {
-                        '$ifNull': [
-                            {'$arrayElemAt': ['$prod_by_id', 0]},
-                            {'$arrayElemAt': ['$prod_by_oid', 0]}
-                        ]
-                    }
-                }
-            }
-        ]
-        if nivel == 'admin_central':
-            cid = getattr(current_user, 'central_id', None)
-            if cid is not None:
-                pipeline.append({
-                    '$match': {
-                        '$or': [
-                            {'prod.central_id': cid},
-                            {'prod.central_id': str(cid)}
-                        ]
-                    }
-                })
+        # agregação por produto: dias completos da visão materializada + bordas ao vivo
+        totais_por_produto = _consumo_gastos_por_produto(db, data_inicio, data_fim, central_ids or None)
+        # resolver produtos em lote (consulta indexada por 'id'/'_id', sem $lookup por $toString)
+        prod_map = _find_many_by_ids(
+            'produtos',
+            [t.get('produto_id') for t in totais_por_produto.values()],
+            {'_id': 1, 'id': 1, 'nome': 1, 'codigo': 1, 'central_id': 1}
+        )
+        admin_cid = getattr(current_user, 'central_id', None) if nivel == 'admin_central' else None
 
-        agg_items = list(coll_mov.aggregate(pipeline))
         # dias no período
         days_periodo = max(1, int((data_fim - data_inicio).days) or 1)
         # paginação
@@ -1593,19 +1924,15 @@ def api_relatorios_admin_consumo_gastos():
             page = 1
 
         items = []
-        for row in agg_items:
-            pid = row.get('_id')
+        for key, row in totais_por_produto.items():
+            pid = row.get('produto_id')
             total_consumo = float(row.get('total_consumo') or 0.0)
             total_gastos = float(row.get('total_gastos') or 0.0)
             media_diaria = round(total_consumo / float(days_periodo), 4)
             # resolver produto
-            pdoc = None
-            pbid = (row.get('prod_by_id') or [])
-            pboid = (row.get('prod_by_oid') or [])
-            if pbid:
-                pdoc = pbid[0]
-            elif pboid:
-                pdoc = pboid[0]
+            pdoc = prod_map.get(key)
+            if admin_cid is not None and str((pdoc or {}).get('central_id')) != str(admin_cid):
+                continue
             nome = (pdoc or {}).get('nome') or '-'
             codigo = (pdoc or {}).get('codigo') or '-'
             pid_out = pid
@@ -1755,6 +2082,7 @@ def compras_aprovacao():
 
 @main_bp.route('/api/compras/sugestoes')
 @require_any_level
+@jobs.assincrono('compras_sugestoes')
 def api_compras_sugestoes():
     """Sugere compras de produtos com base em:
     - Estoque disponível agregado por produto (estoques)
@@ -1787,12 +2115,6 @@ def api_compras_sugestoes():
         use_ai = str(request.args.get('use_ai', 'false')).lower() in ('1', 'true', 'yes', 'sim')
 
         # Helpers
-        def _resolve_prod(prod_id):
-            try:
-                return _find_by_id('produtos', prod_id)
-            except Exception:
-                return None
-
         def _local_from_estoque(s):
             tipo = None
             local_id = None
@@ -1843,7 +2165,8 @@ def api_compras_sugestoes():
         now = datetime.utcnow()
         try:
             lotes = db['lotes']
-            for l in lotes.find({}):
+            for l in lotes.find({'quantidade_atual': {'$gt': 0}, 'data_vencimento': {'$ne': None}},
+                                {'produto_id': 1, 'quantidade_atual': 1, 'data_vencimento': 1}):
                 pid = l.get('produto_id')
                 if pid is None:
                     continue
@@ -1881,7 +2204,7 @@ def api_compras_sugestoes():
         consumo_map = {}
         start_dt = now - timedelta(days=max(1, days_to_cover))
         try:
-            movs = db['movimentacoes']
+            movs = _mov_repo()
             query = {
                 '$and': [
                     {'data_movimentacao': {'$gte': start_dt}},
@@ -1923,6 +2246,9 @@ def api_compras_sugestoes():
 
         # 4) Montar sugestões por produto
         union_pids = set(list(stock_map.keys()) + list(lotes_map.keys()) + list(consumo_map.keys()))
+        produtos_map = _find_many_by_ids('produtos', [
+            (stock_map.get(k) or lotes_map.get(k) or consumo_map.get(k))['produto_id'] for k in union_pids
+        ])
         items = []
         for pid_key in union_pids:
             pid_val = None
@@ -1935,7 +2261,7 @@ def api_compras_sugestoes():
             except Exception:
                 pid_val = pid_key
 
-            pdoc = _resolve_prod(pid_val)
+            pdoc = produtos_map.get(str(pid_val))
             produto_nome = (pdoc or {}).get('nome') or '-'
             produto_codigo = (pdoc or {}).get('codigo') or '-'
             produto_id_out = (pdoc or {}).get('id')
@@ -3159,7 +3485,14 @@ def api_produtos_create():
 
     # Removido: categorias_especificas na criação para garantir categoria única
 
-    res = coll.insert_one(doc)
+    try:
+        res = coll.insert_one(doc)
+    except DuplicateKeyError:
+        # Criação concorrente com o mesmo código (índice único em produtos.codigo)
+        existing = coll.find_one({'codigo': codigo}) or {}
+        pid_out = existing.get('id') if existing.get('id') is not None else str(existing.get('_id'))
+        return jsonify({'id': pid_out, 'message': 'Produto existente'}), 200
+    contadores.registrar_codigo_produto(extensions.mongo_db, codigo)
     return jsonify({'id': str(res.inserted_id)})
 
 @main_bp.route('/api/produtos/gerar-codigo', methods=['POST'])
@@ -3213,13 +3546,8 @@ def api_produtos_gerar_codigo():
     # Removido: categoria secundária. Prefixo apenas com central e categoria
     prefix = f"{central_part}-{cat_part}-"
 
-    coll = db['produtos']
-    seq = coll.count_documents({'codigo': {'$regex': f'^{prefix}'}}) + 1
-    while True:
-        codigo = f"{prefix}{seq:04d}"
-        if not coll.find_one({'codigo': codigo}):
-            break
-        seq += 1
+    # Sequência atômica por prefixo (coleção 'contadores')
+    codigo = contadores.proximo_codigo_produto(db, prefix)
 
     return jsonify({'success': True, 'codigo': codigo})
 
@@ -3759,7 +4087,7 @@ def api_almoxarifados_delete(id):
     except Exception:
         vinc_estoques = 0
     try:
-        movs_coll = db['movimentacoes']
+        movs_coll = _mov_repo()
         vinc_movs = movs_coll.count_documents({'$or': [
             {'origem_tipo': 'almoxarifado', 'origem_id': {'$in': candidates}},
             {'destino_tipo': 'almoxarifado', 'destino_id': {'$in': candidates}},
@@ -4031,7 +4359,7 @@ def api_sub_almoxarifados_delete(id):
         vinc_estoques = 0
 
     try:
-        movs_coll = db['movimentacoes']
+        movs_coll = _mov_repo()
         vinc_movs = movs_coll.count_documents({'$or': [
             {'origem_tipo': 'sub_almoxarifado', 'origem_id': {'$in': candidates}},
             {'destino_tipo': 'sub_almoxarifado', 'destino_id': {'$in': candidates}},
@@ -4530,7 +4858,7 @@ def api_setores_delete(id):
     except Exception:
         vinc_estoques = 0
     try:
-        movs_coll = db['movimentacoes']
+        movs_coll = _mov_repo()
         vinc_movs = movs_coll.count_documents({'$or': [
             {'origem_tipo': 'setor', 'origem_id': {'$in': candidates}},
             {'destino_tipo': 'setor', 'destino_id': {'$in': candidates}},
@@ -4948,13 +5276,18 @@ def api_produto_update(produto_id):
     else:
         query = {'id': produto_id}
 
-    res = extensions.mongo_db['produtos'].find_one_and_update(
-        query,
-        {'$set': update_fields},
-        return_document=ReturnDocument.AFTER
-    )
+    try:
+        res = extensions.mongo_db['produtos'].find_one_and_update(
+            query,
+            {'$set': update_fields},
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        return jsonify({'error': 'Código de produto já existe'}), 400
     if not res:
         return jsonify({'error': 'Produto não encontrado'}), 404
+    if 'codigo' in update_fields:
+        contadores.registrar_codigo_produto(extensions.mongo_db, update_fields['codigo'])
 
     # Resolver categoria por nome novamente
     categoria_nome = None
@@ -5090,6 +5423,8 @@ def api_produto_lotes(produto_id):
         for l in coll.find({'produto_id': {'$in': pid_candidates}}).limit(50):
             items.append({
                 'numero_lote': l.get('lote') or l.get('numero_lote'),
+                'local_tipo': l.get('local_tipo') or ('almoxarifado' if l.get('almoxarifado_id') is not None else None),
+                'local_id': l.get('local_id', l.get('almoxarifado_id')),
                 'quantidade_atual': l.get('quantidade_atual', 0),
                 'data_fabricacao': l.get('data_fabricacao'),
                 'data_vencimento': l.get('data_vencimento'),
@@ -5117,26 +5452,30 @@ def api_produto_movimentacoes(produto_id):
     items = []
     total = 0
 
-    # Helper: resolve documento de local por tipo/id
-    def resolve_local(tipo, lid):
+    # Helper: coleção do local por tipo
+    def colecao_local(tipo):
         if not tipo:
             return None
-        coll_name = None
         t = str(tipo).lower()
         if t in ('setor', 'setores'):
-            coll_name = 'setores'
+            return 'setores'
         elif t in ('subalmoxarifado', 'sub_almoxarifado', 'sub_almoxarifados'):
-            coll_name = 'sub_almoxarifados'
+            return 'sub_almoxarifados'
         elif t in ('almoxarifado', 'almoxarifados'):
-            coll_name = 'almoxarifados'
+            return 'almoxarifados'
         elif t in ('central', 'centrais'):
-            coll_name = 'centrais'
-        if not coll_name:
-            return None
-        try:
-            return _find_by_id(coll_name, lid)
-        except Exception:
+            return 'centrais'
+        return None
+
+    # Locais da página, resolvidos de uma vez por coleção (coleção -> mapa de _find_many_by_ids)
+    locais_map = {}
+
+    # Helper: resolve documento de local por tipo/id
+    def resolve_local(tipo, lid):
+        coll_name = colecao_local(tipo)
+        if not coll_name or lid is None:
             return None
+        return locais_map.get(coll_name, {}).get(str(lid))
 
     # Parse de data_inicio (ISO)
     def parse_date_iso(s):
@@ -5146,7 +5485,7 @@ def api_produto_movimentacoes(produto_id):
             return None
 
     try:
-        coll = extensions.mongo_db['movimentacoes']
+        mov_repo = _mov_repo()
 
         # Normalizar candidatos de produto_id
         pid_candidates = []
@@ -5219,7 +5558,7 @@ def api_produto_movimentacoes(produto_id):
         # Primeiro, calcular total acessível aplicando filtro de escopo em memória
         total_accessible = 0
         try:
-            for m2 in coll.find(query):
+            for m2 in mov_repo.find(query):
                 o_tipo2 = m2.get('origem_tipo') or m2.get('local_tipo')
                 o_id2 = m2.get('origem_id') or m2.get('local_id')
                 d_tipo2 = m2.get('destino_tipo')
@@ -5235,13 +5574,23 @@ def api_produto_movimentacoes(produto_id):
                 if allowed2:
                     total_accessible += 1
         except Exception:
-            total_accessible = coll.count_documents(query)
+            total_accessible = mov_repo.count(query)
 
         total = total_accessible
         skip = max(0, (page - 1) * per_page)
 
-        cursor = coll.find(query).sort('data_movimentacao', -1).skip(skip).limit(per_page)
-        for m in cursor:
+        pagina = list(mov_repo.find(query, sort=[('data_movimentacao', -1)], skip=skip, limit=per_page))
+        ids_locais = {}
+        for m in pagina:
+            for tipo_ref, id_ref in ((m.get('origem_tipo') or m.get('local_tipo'), m.get('origem_id') or m.get('local_id')),
+                                     (m.get('destino_tipo'), m.get('destino_id'))):
+                coll_name = colecao_local(tipo_ref)
+                if coll_name and id_ref is not None:
+                    ids_locais.setdefault(coll_name, set()).add(id_ref)
+        for coll_name, ids in ids_locais.items():
+            locais_map[coll_name] = _find_many_by_ids(coll_name, ids)
+
+        for m in pagina:
             tipo_mov = (m.get('tipo') or m.get('tipo_movimentacao') or '').lower()
 
             # Origem/Destino nomes com fallback por resolução de local
@@ -5298,7 +5647,7 @@ def api_produto_movimentacoes(produto_id):
 
         # Garantir inclusão de transferências caso algum filtro/variação de id tenha omitido
         try:
-            extra_transfer = coll.find({'produto_id': {'$in': pid_candidates}, 'tipo': 'transferencia'}).sort('data_movimentacao', -1).limit(per_page)
+            extra_transfer = mov_repo.find({'produto_id': {'$in': pid_candidates}, 'tipo': 'transferencia'}, sort=[('data_movimentacao', -1)], limit=per_page)
             existing_keys = set((it['data_movimentacao'], it['tipo'], it['quantidade']) for it in items)
             for m in extra_transfer:
                 tipo_mov = 'transferencia'
@@ -5377,24 +5726,6 @@ def api_estoque_hierarquia():
     def normalize_tipo(t):
         return str(t or '').lower().replace('-', '').replace('_', '')
 
-    def _find_by_id(coll_name: str, value):
-        """Resolve documento por id sequencial ou ObjectId string."""
-        coll = extensions.mongo_db[coll_name]
-        doc = None
-        try:
-            if str(value).isdigit():
-                doc = coll.find_one({'id': int(value)})
-        except Exception:
-            doc = None
-        if not doc:
-            try:
-                doc = coll.find_one({'_id': ObjectId(str(value))})
-            except Exception:
-                doc = None
-        if not doc and isinstance(value, str):
-            doc = coll.find_one({'id': value}) or coll.find_one({'_id': value})
-        return doc
-
     # Preparar candidatos de produto por texto/id
     accepted_prod_ids = []
     if produto_filtro:
@@ -5429,15 +5760,6 @@ def api_estoque_hierarquia():
         except Exception:
             pass
 
-    # Caches
-    prod_cache = {}
-    local_cache = {
-        'centrais': {},
-        'almoxarifados': {},
-        'sub_almoxarifados': {},
-        'setores': {}
-    }
-
     items_all = []
     try:
         coll = extensions.mongo_db['estoques']
@@ -5503,16 +5825,12 @@ def api_estoque_hierarquia():
             batch_limit = min(per_page * 3, 300)
             cursor = coll.find(query, projection).sort('updated_at', -1).skip(skip).limit(batch_limit)
 
-        for s in cursor:
+        estoques_docs = list(cursor)
+        produtos_map, locais_map = _refs_estoques(estoques_docs)
+        for s in estoques_docs:
             # Produto
             raw_pid = s.get('produto_id')
-            pdoc = prod_cache.get(str(raw_pid))
-            if pdoc is None:
-                try:
-                    pdoc = _find_by_id('produtos', raw_pid)
-                except Exception:
-                    pdoc = None
-                prod_cache[str(raw_pid)] = pdoc
+            pdoc = produtos_map.get(str(raw_pid))
             produto_nome = (pdoc or {}).get('nome') or '-'
             produto_codigo = (pdoc or {}).get('codigo') or '-'
             produto_id_out = (pdoc or {}).get('id')
@@ -5547,14 +5865,7 @@ def api_estoque_hierarquia():
 
             local_nome = s.get('local_nome') or s.get('nome_local') or 'Local'
             if coll_name and local_id is not None:
-                cache = local_cache[coll_name]
-                ldoc = cache.get(str(local_id))
-                if ldoc is None:
-                    try:
-                        ldoc = _find_by_id(coll_name, local_id)
-                    except Exception:
-                        ldoc = None
-                    cache[str(local_id)] = ldoc
+                ldoc = locais_map.get(coll_name, {}).get(str(local_id))
                 if ldoc is not None:
                     local_nome = ldoc.get('nome') or ldoc.get('descricao') or local_nome
                     lid_out = ldoc.get('id')
@@ -5668,23 +5979,6 @@ def api_estoque_hierarquia_export():
     def normalize_tipo(t):
         return str(t or '').lower().replace('-', '').replace('_', '')
 
-    def _find_by_id(coll_name: str, value):
-        coll = extensions.mongo_db[coll_name]
-        doc = None
-        try:
-            if str(value).isdigit():
-                doc = coll.find_one({'id': int(value)})
-        except Exception:
-            doc = None
-        if not doc:
-            try:
-                doc = coll.find_one({'_id': ObjectId(str(value))})
-            except Exception:
-                doc = None
-        if not doc and isinstance(value, str):
-            doc = coll.find_one({'id': value}) or coll.find_one({'_id': value})
-        return doc
-
     # candidatos de produto
     accepted_prod_ids = []
     if produto_filtro:
@@ -5715,31 +6009,17 @@ def api_estoque_hierarquia_export():
         except Exception:
             pass
 
-    prod_cache = {}
-    local_cache = {
-        'centrais': {},
-        'almoxarifados': {},
-        'sub_almoxarifados': {},
-        'setores': {}
-    }
-
     items = []
     try:
         coll = extensions.mongo_db['estoques']
         query = {}
         if accepted_prod_ids:
             query['produto_id'] = {'$in': accepted_prod_ids}
-        cursor = coll.find(query)
-
-        for s in cursor:
+        estoques_docs = list(coll.find(query))
+        produtos_map, locais_map = _refs_estoques(estoques_docs)
+        for s in estoques_docs:
             raw_pid = s.get('produto_id')
-            pdoc = prod_cache.get(str(raw_pid))
-            if pdoc is None:
-                try:
-                    pdoc = _find_by_id('produtos', raw_pid)
-                except Exception:
-                    pdoc = None
-                prod_cache[str(raw_pid)] = pdoc
+            pdoc = produtos_map.get(str(raw_pid))
             produto_nome = (pdoc or {}).get('nome') or '-'
             produto_codigo = (pdoc or {}).get('codigo') or '-'
             produto_id_out = (pdoc or {}).get('id')
@@ -5773,14 +6053,7 @@ def api_estoque_hierarquia_export():
 
             local_nome = s.get('local_nome') or s.get('nome_local') or 'Local'
             if coll_name and local_id is not None:
-                cache = local_cache[coll_name]
-                ldoc = cache.get(str(local_id))
-                if ldoc is None:
-                    try:
-                        ldoc = _find_by_id(coll_name, local_id)
-                    except Exception:
-                        ldoc = None
-                    cache[str(local_id)] = ldoc
+                ldoc = locais_map.get(coll_name, {}).get(str(local_id))
                 if ldoc is not None:
                     local_nome = ldoc.get('nome') or ldoc.get('descricao') or local_nome
                     lid_out = ldoc.get('id')
@@ -5863,6 +6136,69 @@ def api_estoque_hierarquia_export():
     response.headers['Content-Disposition'] = 'attachment; filename="estoque_hierarquia.csv"'
     return response
 
+@main_bp.route('/api/estoque/saldo-em')
+@require_any_level
+def api_estoque_saldo_em():
+    """Saldo de um produto em um local numa data (auditoria / fechamento de mês).
+    Parâmetros: produto_id, local_tipo (central|almoxarifado|sub_almoxarifado|setor), local_id,
+    data (YYYY-MM-DD = fim do dia, ou ISO com horário).
+    Usa o snapshot mais próximo de 'data' e aplica apenas as movimentações entre ele e a data.
+    """
+    try:
+        db = extensions.mongo_db
+        if db is None:
+            return jsonify({'error': 'MongoDB não inicializado'}), 503
+        raw_pid = (request.args.get('produto_id') or '').strip()
+        local_tipo = saldos.normalizar_tipo_local(request.args.get('local_tipo'))
+        raw_lid = (request.args.get('local_id') or '').strip()
+        raw_data = (request.args.get('data') or '').strip()
+        if not raw_pid or not raw_lid or not local_tipo:
+            return jsonify({'error': 'produto_id, local_tipo e local_id são obrigatórios'}), 400
+        if not raw_data:
+            return jsonify({'error': 'data é obrigatória'}), 400
+        try:
+            if len(raw_data) <= 10:
+                data_ref = datetime.strptime(raw_data, '%Y-%m-%d') + timedelta(days=1) - timedelta(microseconds=1)
+            else:
+                data_ref = datetime.fromisoformat(raw_data.replace('Z', '+00:00'))
+        except Exception:
+            return jsonify({'error': 'data inválida'}), 400
+
+        prod_doc = _find_by_id('produtos', raw_pid)
+        if not prod_doc:
+            return jsonify({'error': 'Produto não encontrado'}), 404
+        coll_local = {'setor': 'setores', 'sub_almoxarifado': 'sub_almoxarifados',
+                      'almoxarifado': 'almoxarifados', 'central': 'centrais'}[local_tipo]
+        local_doc = _find_by_id(coll_local, raw_lid)
+        if not local_doc:
+            return jsonify({'error': 'Local não encontrado'}), 404
+        try:
+            if not current_user.can_access_produto(raw_pid) or not current_user.can_access_local(local_tipo, raw_lid):
+                return jsonify({'error': 'Fora do seu escopo'}), 403
+        except Exception:
+            return jsonify({'error': 'Falha ao verificar escopo'}), 403
+
+        produto_ids = [raw_pid, prod_doc.get('id'), prod_doc.get('_id')]
+        local_ids = [raw_lid, local_doc.get('id'), local_doc.get('_id')]
+        res = saldos.saldo_em(db, [x for x in produto_ids if x is not None], local_tipo,
+                               [x for x in local_ids if x is not None], data_ref)
+        ck = res['checkpoint']
+        return jsonify({
+            'produto_id': prod_doc.get('id') if prod_doc.get('id') is not None else str(prod_doc.get('_id')),
+            'local_tipo': local_tipo,
+            'local_id': local_doc.get('id') if local_doc.get('id') is not None else str(local_doc.get('_id')),
+            'data': data_ref.isoformat(),
+            'saldo': res['saldo'],
+            'checkpoint': {
+                'origem': ck['origem'],
+                'data_referencia': ck['data_referencia'].replace(tzinfo=timezone.utc).isoformat(),
+                'quantidade': ck['quantidade'],
+            },
+            'movimentacoes_aplicadas': res['movimentacoes_aplicadas'],
+        })
+    except Exception as e:
+        return jsonify({'error': f'Falha ao calcular saldo: {e}'}), 500
+
 @main_bp.route('/api/hierarquia/locais')
 @require_any_level
 def api_hierarquia_locais():
@@ -6101,6 +6437,7 @@ def api_dashboard_estoque_baixo():
             pass
 
         # Montar lista de produtos com estoque baixo
+        produtos_map = _find_many_by_ids('produtos', [rec['raw_pid'] for rec in agg.values()])
         items = []
         for key, rec in agg.items():
             raw_pid = rec['raw_pid']
@@ -6108,7 +6445,7 @@ def api_dashboard_estoque_baixo():
             # Confiamos no filtro por locais acima (central/almox/sub/setor) para respeitar o escopo.
             # Se futuras regras exigirem checagem por produto, aplicar aqui de forma tolerante.
 
-            pdoc = _find_by_id('produtos', raw_pid)
+            pdoc = produtos_map.get(str(raw_pid))
             nome = (pdoc or {}).get('nome') or 'Produto'
             unidade = (pdoc or {}).get('unidade_medida')
             estoque_min = None
@@ -6171,7 +6508,6 @@ def api_dashboard_vencimentos():
     try:
         db = extensions.mongo_db
         coll_lotes = db['lotes']
-        coll_produtos = db['produtos']
 
         # parâmetros
         limit = int(request.args.get('limit', 5))
@@ -6200,35 +6536,34 @@ def api_dashboard_vencimentos():
                 dt = dt.replace(tzinfo=local_tz)
             return dt
 
-        def _resolve_produto(pid):
-            try:
-                # id sequencial
-                if str(pid).isdigit():
-                    return coll_produtos.find_one({'id': int(pid)})
-                # ObjectId
-                try:
-                    return coll_produtos.find_one({'_id': ObjectId(str(pid))})
-                except Exception:
-                    pass
-                # string direta
-                return coll_produtos.find_one({'id': pid}) or coll_produtos.find_one({'_id': pid})
-            except Exception:
-                return None
-
         total_vencidos = 0
         total_proximos = 0
         items = []
 
-        # Buscar lotes com quantidade atual positiva quando disponível
+        # Saldo vivo dos lotes (baixado pela alocação FEFO): só lotes com saldo dentro da janela
+        # de aviso, em ordem de vencimento (idx_lotes_vencimento). Lotes antigos sem
+        # quantidade_atual continuam listados (como antes): não há saldo que diga que estão zerados.
+        # Datas gravadas como texto não entram na faixa e são avaliadas abaixo.
+        limite = (now + timedelta(days=dias_aviso + 1)).replace(tzinfo=None)
         try:
-            cursor = coll_lotes.find({'$or': [
-                {'quantidade_atual': {'$gt': 0}},
-                {'quantidade_atual': {'$exists': False}}
-            ]}).limit(500)
+            cursor = coll_lotes.find({
+                '$and': [
+                    {'$or': [
+                        {'quantidade_atual': {'$gt': 0}},
+                        {'quantidade_atual': {'$exists': False}}
+                    ]},
+                    {'$or': [
+                        {'data_vencimento': {'$lte': limite}},
+                        {'data_vencimento': {'$type': 'string'}}
+                    ]}
+                ]
+            }).sort('data_vencimento', 1).limit(500)
+            lotes_docs = list(cursor)
         except Exception:
-            cursor = []
+            lotes_docs = []
+        produtos_map = _find_many_by_ids('produtos', [l.get('produto_id') for l in lotes_docs])
 
-        for l in cursor:
+        for l in lotes_docs:
             raw_pid = l.get('produto_id')
             # Verificação de escopo de acesso ao produto
             try:
@@ -6261,7 +6596,7 @@ def api_dashboard_vencimentos():
                 continue
 
             # Resolver dados do produto
-            pdoc = _resolve_produto(raw_pid)
+            pdoc = produtos_map.get(str(raw_pid))
             produto_nome = (pdoc or {}).get('nome') or 'Produto'
             produto_id_out = (pdoc or {}).get('id')
             if produto_id_out is None and pdoc is not None:
@@ -6299,7 +6634,7 @@ def api_dashboard_vencimentos():
 def api_dashboard_movimentacoes_recentes():
     try:
         db = extensions.mongo_db
-        coll = db['movimentacoes']
+        coll = _mov_repo()
 
         limit = int(request.args.get('limit', 5))
         limit = max(1, min(limit, 20))
@@ -6517,8 +6852,6 @@ def api_movimentacoes():
         'updated_since': (request.args.get('updated_since') or '').strip()
     }
 
-    coll = extensions.mongo_db['movimentacoes']
-
     # Montar filtro de consulta
     query = {}
 
@@ -6722,7 +7055,8 @@ def api_movimentacoes():
             pass
 
     ordem_param = (request.args.get('ordem') or '').strip().lower() or 'desc'
-    total = coll.count_documents(query or {})
+    mov_repo = _mov_repo()
+    total = mov_repo.count(query or {})
     page = max(1, page)
     per_page = max(1, min(per_page, 100))
     skip = max(0, (page - 1) * per_page)
@@ -6759,7 +7093,7 @@ def api_movimentacoes():
     }
 
     sort_fields = [('data_movimentacao', -1 if ordem_param != 'asc' else 1), ('_id', 1)]
-    cursor = coll.find(query or {}, projection).sort(sort_fields).skip(skip).limit(per_page)
+    cursor = mov_repo.find(query or {}, projection, sort=sort_fields, skip=skip, limit=per_page)
 
     docs = list(cursor)
     fallback_used = False
@@ -6767,7 +7101,7 @@ def api_movimentacoes():
     # Fallback: se nada retornou e há restrição ativa, tentar sem pré-filtro de escopo e aplicar checagem no loop
     if restricted and not docs:
         try:
-            alt_cursor = coll.find({}, projection).sort(sort_fields).skip(skip).limit(per_page)
+            alt_cursor = mov_repo.find({}, projection, sort=sort_fields, skip=skip, limit=per_page)
             docs = list(alt_cursor)
             fallback_used = True
             if os.environ.get('VERBOSE_LOG','').lower() in ('1','true','yes'):
@@ -7089,6 +7423,7 @@ def api_produto_almoxarifados(produto_id):
 
 @main_bp.route('/api/produtos/<string:produto_id>/recebimento', methods=['POST'])
 @require_any_level
+@idempotente
 def api_produto_recebimento(produto_id):
     """Registra recebimento de produto em um almoxarifado.
     - Atualiza/incrementa estoque em 'estoques'
@@ -7101,7 +7436,6 @@ def api_produto_recebimento(produto_id):
         produtos = db['produtos']
         almoxarifados = db['almoxarifados']
         estoques = db['estoques']
-        movimentacoes = db['movimentacoes']
         lotes = db['lotes']
 
         data = request.get_json(silent=True) or {}
@@ -7208,7 +7542,7 @@ def api_produto_recebimento(produto_id):
             'local_id': aid_out,
             'created_at': now
         }
-        mov_ins = movimentacoes.insert_one(mov_doc)
+        mov_ins = _mov_repo().insert_one(mov_doc)
 
         # Atualizar/registrar lote se informado
         lote_num = (data.get('lote') or '').strip()
@@ -7222,6 +7556,8 @@ def api_produto_recebimento(produto_id):
                     'produto_id': pid_out,
                     'lote': lote_num,
                     'almoxarifado_id': aid_out,
+                    'local_tipo': 'almoxarifado',
+                    'local_id': aid_out,
                     'data_fabricacao': data_fabricacao,
                     'data_vencimento': data_vencimento,
                     'fornecedor': data.get('fornecedor'),
@@ -7252,17 +7588,280 @@ def api_produto_recebimento(produto_id):
     except Exception as e:
         return jsonify({'error': f'Falha ao registrar recebimento: {e}'}), 500
 
-@main_bp.route('/api/produtos/<string:produto_id>/lotes/<string:numero_lote>/entrada', methods=['GET', 'PATCH'])
-@require_level('super_admin', 'admin_central', 'secretario')
-def api_produto_lote_entrada(produto_id, numero_lote):
-    """Permite leitura e edição dos dados de entrada de um lote específico.
-    - GET: retorna última movimentação de entrada para o lote informado
-    - PATCH: atualiza campos editáveis (data_recebimento, nota_fiscal, preco_unitario, fornecedor, observacoes)
-    Somente 'super_admin' e 'admin_central' podem acessar.
-    """
+# Colunas aceitas na importação de recebimento (CSV) -> campo do item
+_COLUNAS_RECEBIMENTO = {
+    'produto': 'produto', 'produto_id': 'produto', 'codigo': 'produto', 'código': 'produto',
+    'quantidade': 'quantidade', 'qtd': 'quantidade', 'qtde': 'quantidade',
+    'lote': 'lote',
+    'vencimento': 'data_vencimento', 'data_vencimento': 'data_vencimento', 'validade': 'data_vencimento',
+    'fabricacao': 'data_fabricacao', 'fabricação': 'data_fabricacao', 'data_fabricacao': 'data_fabricacao',
+    'preco': 'preco_unitario', 'preço': 'preco_unitario', 'preco_unitario': 'preco_unitario', 'valor_unitario': 'preco_unitario',
+}
+
+def _itens_recebimento_csv(texto: str) -> list:
+    """Converte o CSV da nota (separador ';' ou ',') em itens {linha, produto, quantidade, ...}."""
+    texto = (texto or '').lstrip('\ufeff')
+    amostra = texto[:2048]
+    delim = ';' if amostra.count(';') >= amostra.count(',') else ','
+    reader = csv.reader(io.StringIO(texto), delimiter=delim)
+    itens = []
+    header = None
+    for num, row in enumerate(reader, start=1):
+        if not row or all(not (c or '').strip() for c in row):
+            continue
+        if header is None:
+            header = [_COLUNAS_RECEBIMENTO.get((c or '').strip().lower()) for c in row]
+            continue
+        item = {'linha': num}
+        for campo, valor in zip(header, row):
+            if campo:
+                item[campo] = (valor or '').strip()
+        itens.append(item)
+    return itens
+
+def _numero_br(value):
+    """Número em formato '1.234,56' ou '1234.56'; None quando inválido."""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    s = str(value).strip()
+    if ',' in s:
+        s = s.replace('.', '').replace(',', '.')
+    try:
+        return float(s)
+    except ValueError:
+        return None
+
+def _data_recebimento(value):
+    """Data ISO (YYYY-MM-DD[THH:MM]) ou DD/MM/AAAA; None quando ausente ou inválida."""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value
+    s = str(value).strip()
+    for fmt in ('%d/%m/%Y', '%d/%m/%y'):
+        try:
+            return datetime.strptime(s, fmt)
+        except ValueError:
+            pass
+    try:
+        return datetime.fromisoformat(s)
+    except ValueError:
+        return None
+
+@main_bp.route('/api/recebimentos/lote', methods=['POST'])
+@require_any_level
+@idempotente
+def api_recebimento_lote():
+    """Registra o recebimento de uma nota fiscal inteira em um almoxarifado.
+    Aceita JSON {almoxarifado_id, nota_fiscal, fornecedor, data_recebimento, observacoes, parcial,
+    itens: [{produto_id|codigo, quantidade, lote, data_vencimento, data_fabricacao, preco_unitario}]}
+    ou CSV (corpo text/csv ou arquivo 'arquivo' em multipart, demais campos no formulário/query)
+    com as colunas produto;quantidade;lote;vencimento;preco.
+    As linhas são validadas em lote e aplicadas com bulk_write/insert_many. Com parcial=false
+    (padrão true) nada é gravado se alguma linha tiver erro.
+    """
+    try:
+        db = extensions.mongo_db
+        estoques = db['estoques']
+        lotes = db['lotes']
+
+        # Entrada: JSON ou CSV
+        if request.is_json:
+            data = request.get_json(silent=True) or {}
+            itens = []
+            for idx, it in enumerate(data.get('itens') or data.get('linhas') or [], start=1):
+                it = dict(it) if isinstance(it, dict) else {}
+                it.setdefault('linha', idx)
+                it['produto'] = it.get('produto_id') if it.get('produto_id') is not None else (it.get('codigo') or it.get('produto'))
+                itens.append(it)
+        else:
+            data = dict(request.form or {})
+            for k, v in request.args.items():
+                data.setdefault(k, v)
+            arquivo = request.files.get('arquivo') or request.files.get('file')
+            if arquivo is not None:
+                bruto = arquivo.read()
+            else:
+                bruto = request.get_data() or b''
+            try:
+                texto = bruto.decode('utf-8')
+            except UnicodeDecodeError:
+                texto = bruto.decode('latin-1')
+            itens = _itens_recebimento_csv(texto)
+        if not itens:
+            return jsonify({'error': 'Nenhum item informado para recebimento'}), 400
+        if len(itens) > 5000:
+            return jsonify({'error': 'Máximo de 5000 itens por recebimento'}), 400
+        parcial = str(data.get('parcial', 'true')).lower() not in ('0', 'false', 'nao', 'não')
+
+        # Almoxarifado
+        raw_aid = data.get('almoxarifado_id')
+        if raw_aid is None or (isinstance(raw_aid, str) and raw_aid.strip() == ''):
+            return jsonify({'error': 'almoxarifado_id é obrigatório'}), 400
+        almox = _find_by_id('almoxarifados', raw_aid)
+        if not almox:
+            return jsonify({'error': 'Almoxarifado informado não existe'}), 400
+        aid_out = almox.get('id') if almox.get('id') is not None else str(almox.get('_id'))
+        almox_nome = almox.get('nome') or almox.get('descricao') or 'Almoxarifado'
+
+        # Produtos: uma consulta por código e uma por id/_id (código tem precedência, ex.: códigos numéricos)
+        tokens = list({str(it.get('produto')).strip() for it in itens if it.get('produto') not in (None, '')})
+        por_codigo = {}
+        for p in db['produtos'].find({'codigo': {'$in': tokens}}):
+            por_codigo[str(p.get('codigo'))] = p
+        por_id = _find_many_by_ids('produtos', [t for t in tokens if t not in por_codigo])
+
+        now = datetime.now(timezone.utc)
+        data_recebimento = _data_recebimento(data.get('data_recebimento')) or now
+        fornecedor = data.get('fornecedor')
+        nota_fiscal = data.get('nota_fiscal')
+
+        erros = []
+        validos = []
+        for it in itens:
+            token = str(it.get('produto')).strip() if it.get('produto') not in (None, '') else ''
+            if not token:
+                erros.append({'linha': it['linha'], 'error': 'Produto não informado'})
+                continue
+            produto = por_codigo.get(token) or por_id.get(token)
+            if not produto:
+                erros.append({'linha': it['linha'], 'produto': token, 'error': 'Produto não encontrado'})
+                continue
+            quantidade = _numero_br(it.get('quantidade'))
+            if quantidade is None or quantidade <= 0:
+                erros.append({'linha': it['linha'], 'produto': token, 'error': 'Quantidade deve ser maior que zero'})
+                continue
+            preco = _numero_br(it.get('preco_unitario'))
+            if it.get('preco_unitario') not in (None, '') and (preco is None or preco < 0):
+                erros.append({'linha': it['linha'], 'produto': token, 'error': 'Preço unitário inválido'})
+                continue
+            venc = _data_recebimento(it.get('data_vencimento'))
+            if it.get('data_vencimento') and venc is None:
+                erros.append({'linha': it['linha'], 'produto': token, 'error': 'Data de vencimento inválida'})
+                continue
+            validos.append({
+                'linha': it['linha'],
+                'pid_out': produto.get('id') if produto.get('id') is not None else str(produto.get('_id')),
+                'quantidade': quantidade,
+                'preco_unitario': preco,
+                'lote': str(it.get('lote') or '').strip(),
+                'data_vencimento': venc,
+                'data_fabricacao': _data_recebimento(it.get('data_fabricacao')),
+                'observacoes': it.get('observacoes'),
+            })
+
+        if not validos or (erros and not parcial):
+            return jsonify({'success': False, 'aplicadas': 0, 'falhas': len(erros), 'erros': erros}), 400
+
+        # Agrupar por estoque (produto) e por lote; uma movimentação por linha
+        por_produto = {}
+        por_lote = {}
+        mov_docs = []
+        for v in validos:
+            chave_p = (type(v['pid_out']).__name__, str(v['pid_out']))
+            por_produto.setdefault(chave_p, [v['pid_out'], 0.0])[1] += v['quantidade']
+            if v['lote']:
+                chave_l = chave_p + (v['lote'],)
+                atual = por_lote.setdefault(chave_l, {'pid_out': v['pid_out'], 'lote': v['lote'], 'quantidade': 0.0,
+                                                      'data_vencimento': None, 'data_fabricacao': None})
+                atual['quantidade'] += v['quantidade']
+                for campo in ('data_vencimento', 'data_fabricacao'):
+                    if atual[campo] is None:
+                        atual[campo] = v[campo]
+            mov_docs.append({
+                'produto_id': v['pid_out'],
+                'tipo': 'entrada',
+                'quantidade': v['quantidade'],
+                'data_movimentacao': data_recebimento,
+                'origem_nome': fornecedor or 'Fornecedor',
+                'destino_nome': almox_nome,
+                'usuario_responsavel': getattr(current_user, 'username', None),
+                'observacoes': v['observacoes'] or data.get('observacoes'),
+                'nota_fiscal': nota_fiscal,
+                'preco_unitario': v['preco_unitario'],
+                'lote': v['lote'] or None,
+                'local_tipo': 'almoxarifado',
+                'local_id': aid_out,
+                'created_at': now
+            })
+
+        estoque_ops = [UpdateOne(
+            {'produto_id': pid_out, 'local_tipo': 'almoxarifado', 'local_id': aid_out},
+            {
+                '$inc': {'quantidade': q, 'quantidade_disponivel': q},
+                '$set': {
+                    'produto_id': pid_out,
+                    'local_tipo': 'almoxarifado',
+                    'local_id': aid_out,
+                    'almoxarifado_id': aid_out,
+                    'nome_local': almox_nome,
+                    'updated_at': now
+                },
+                '$setOnInsert': {'created_at': now}
+            },
+            upsert=True
+        ) for pid_out, q in por_produto.values()]
+        lote_ops = []
+        for l in por_lote.values():
+            set_fields = {
+                'produto_id': l['pid_out'],
+                'lote': l['lote'],
+                'almoxarifado_id': aid_out,
+                'local_tipo': 'almoxarifado',
+                'local_id': aid_out,
+                'updated_at': now
+            }
+            on_insert = {'created_at': now}
+            # campo não informado não apaga o que o lote já tem (só entra na criação)
+            for campo, valor in (('data_fabricacao', l['data_fabricacao']), ('data_vencimento', l['data_vencimento']),
+                                 ('fornecedor', fornecedor or None)):
+                (set_fields if valor is not None else on_insert)[campo] = valor
+            lote_ops.append(UpdateOne(
+                {'produto_id': l['pid_out'], 'lote': l['lote'], 'almoxarifado_id': aid_out},
+                {'$inc': {'quantidade_atual': l['quantidade']}, '$set': set_fields, '$setOnInsert': on_insert},
+                upsert=True
+            ))
+
+        def _gravar(mongo_session):
+            estoques.bulk_write(estoque_ops, ordered=False, session=mongo_session)
+            if lote_ops:
+                lotes.bulk_write(lote_ops, ordered=False, session=mongo_session)
+            return _mov_repo().insert_many(mov_docs, session=mongo_session)
+
+        extensions.run_transaction(_gravar)
+
+        try:
+            extensions.response_cache.clear_prefix('mov:')
+            extensions.response_cache.clear_prefix('estq:')
+            extensions.response_cache.clear_prefix('resd:')
+        except Exception:
+            pass
+        return jsonify({
+            'success': not erros,
+            'nota_fiscal': nota_fiscal,
+            'almoxarifado_id': aid_out,
+            'aplicadas': len(validos),
+            'falhas': len(erros),
+            'produtos_atualizados': len(estoque_ops),
+            'lotes_atualizados': len(lote_ops),
+            'erros': erros
+        })
+    except Exception as e:
+        return jsonify({'error': f'Falha ao registrar recebimento em lote: {e}'}), 500
+
+@main_bp.route('/api/produtos/<string:produto_id>/lotes/<string:numero_lote>/entrada', methods=['GET', 'PATCH'])
+@require_level('super_admin', 'admin_central', 'secretario')
+def api_produto_lote_entrada(produto_id, numero_lote):
+    """Permite leitura e edição dos dados de entrada de um lote específico.
+    - GET: retorna última movimentação de entrada para o lote informado
+    - PATCH: atualiza campos editáveis (data_recebimento, nota_fiscal, preco_unitario, fornecedor, observacoes)
+    Somente 'super_admin' e 'admin_central' podem acessar.
+    """
     try:
         db = extensions.mongo_db
-        coll = db['movimentacoes']
+        coll = _mov_repo()
 
         # Construir candidatos de produto_id (id sequencial, ObjectId, string)
         pid_candidates = [produto_id]
@@ -7387,6 +7986,8 @@ def api_produto_lote_entrada(produto_id, numero_lote):
         set_fields = {'updated_at': now}
         if dr is not None:
             set_fields['data_movimentacao'] = dr
+            # o dia antigo precisa ser reagregado na visão materializada de consumo/gastos
+            consumo_diario.marcar_dias(extensions.mongo_db, [entrada.get('data_movimentacao')])
         if 'nota_fiscal' in payload:
             set_fields['nota_fiscal'] = payload.get('nota_fiscal')
         if 'preco_unitario' in payload:
@@ -7478,7 +8079,7 @@ def api_produto_lote_entrada(produto_id, numero_lote):
         except Exception:
             pass
 
-        res = coll.update_one({'_id': entrada.get('_id')}, {'$set': set_fields})
+        res = _mov_repo().update_one({'_id': entrada.get('_id')}, {'$set': set_fields})
         ok = bool(getattr(res, 'modified_count', 0))
         return jsonify({'success': True, 'updated': ok})
     except Exception as e:
@@ -7488,7 +8089,7 @@ def api_produto_lote_entrada(produto_id, numero_lote):
 @require_level('super_admin', 'admin_central')
 def api_produto_entradas_sem_lote(produto_id):
     try:
-        coll = extensions.mongo_db['movimentacoes']
+        coll = _mov_repo()
         pid_candidates = [produto_id]
         try:
             if str(produto_id).isdigit():
@@ -7525,7 +8126,7 @@ def api_produto_entradas_sem_lote(produto_id):
 def api_mov_definir_lote(mov_id):
     try:
         db = extensions.mongo_db
-        movs = db['movimentacoes']
+        movs = _mov_repo()
         lotes = db['lotes']
         m = movs.find_one({'_id': ObjectId(mov_id)})
         if not m:
@@ -7558,6 +8159,8 @@ def api_mov_definir_lote(mov_id):
                             'produto_id': pid_out,
                             'lote': novo_lote,
                             'almoxarifado_id': almox_id,
+                            'local_tipo': 'almoxarifado',
+                            'local_id': almox_id,
                             'updated_at': now
                         },
                         '$setOnInsert': {'created_at': now}
@@ -7566,7 +8169,7 @@ def api_mov_definir_lote(mov_id):
                 )
             except Exception:
                 pass
-        movs.update_one({'_id': m.get('_id')}, {'$set': {'lote': novo_lote, 'updated_at': now}})
+        _mov_repo().update_one({'_id': m.get('_id')}, {'$set': {'lote': novo_lote, 'updated_at': now}})
         df = payload.get('data_fabricacao')
         dv = payload.get('data_vencimento')
         set_extra = {}
@@ -7588,6 +8191,7 @@ def api_mov_definir_lote(mov_id):
 
 @main_bp.route('/api/movimentacoes/transferencia', methods=['POST'])
 @require_level('super_admin', 'admin_central', 'gerente_almox', 'resp_sub_almox', 'secretario')
+@idempotente
 def api_movimentacoes_transferencia():
     """Executa transferência de estoque entre dois locais.
     Payload esperado:
@@ -7604,7 +8208,6 @@ def api_movimentacoes_transferencia():
         db = extensions.mongo_db
         produtos = db['produtos']
         estoques = db['estoques']
-        movimentacoes = db['movimentacoes']
 
         data = request.get_json(silent=True) or {}
         # validação básica
@@ -7785,35 +8388,12 @@ def api_movimentacoes_transferencia():
 
         now = datetime.now(timezone.utc)
 
-        # localizar estoque de origem e validar disponibilidade
+        # filtros do estoque de origem (formato padrão e fallback por campo específico)
         origem_filter1 = {'produto_id': pid_out, 'local_tipo': str(origem_tipo).lower(), 'local_id': origem_id_out}
-        origem_doc_estoque = estoques.find_one(origem_filter1)
-        if not origem_doc_estoque:
-            # fallback por campo específico
-            ofield = _field_by_tipo(origem_tipo)
-            if ofield:
-                origem_doc_estoque = estoques.find_one({'produto_id': pid_out, ofield: origem_id_out})
-        if not origem_doc_estoque:
-            return jsonify({'error': 'Não há estoque no local de origem para este produto'}), 400
-        disponivel = float(origem_doc_estoque.get('quantidade_disponivel', origem_doc_estoque.get('quantidade', 0)) or 0)
-        if disponivel < quantidade:
-            return jsonify({'error': 'Quantidade insuficiente na origem'}), 400
-
-        # decrementar origem
-        estoques.find_one_and_update(
-            origem_filter1,
-            {
-                '$inc': {
-                    'quantidade': -quantidade,
-                    'quantidade_disponivel': -quantidade
-                },
-                '$set': {
-                    'updated_at': now
-                }
-            }
-        )
+        ofield = _field_by_tipo(origem_tipo)
+        origem_filtros = [origem_filter1, ({'produto_id': pid_out, ofield: origem_id_out} if ofield else None)]
 
-        # incrementar destino (upsert)
+        # destino (upsert)
         dfield = _field_by_tipo(destino_tipo)
         set_fields = {
             'produto_id': pid_out,
@@ -7825,40 +8405,59 @@ def api_movimentacoes_transferencia():
         if dfield:
             set_fields[dfield] = destino_id_out
         dest_filter = {'produto_id': pid_out, 'local_tipo': str(destino_tipo).lower(), 'local_id': destino_id_out}
-        dest_res = estoques.find_one_and_update(
-            dest_filter,
-            {
-                '$inc': {
-                    'quantidade': quantidade,
-                    'quantidade_disponivel': quantidade
+
+        def _executar(mongo_session):
+            # decrementar origem somente se houver saldo (verificação e escrita atômicas)
+            if _decrementar_estoque(estoques, origem_filtros, quantidade, now, mongo_session=mongo_session) is None:
+                return None
+            # lotes: baixa FEFO na origem e crédito dos mesmos lotes no destino
+            alocados, sem_lote = fefo.alocar(db['lotes'], pid_out, str(origem_tipo).lower(), origem_id_out, quantidade, now, session=mongo_session)
+            lote_ops = fefo.operacoes_credito(alocados, pid_out, str(destino_tipo).lower(), destino_id_out, now)
+            if lote_ops:
+                db['lotes'].bulk_write(lote_ops, ordered=False, session=mongo_session)
+            dest_res = estoques.find_one_and_update(
+                dest_filter,
+                {
+                    '$inc': {
+                        'quantidade': quantidade,
+                        'quantidade_disponivel': quantidade
+                    },
+                    '$set': set_fields,
+                    '$setOnInsert': {
+                        'created_at': now
+                    }
                 },
-                '$set': set_fields,
-                '$setOnInsert': {
-                    'created_at': now
-                }
-            },
-            return_document=ReturnDocument.AFTER,
-            upsert=True
-        )
+                return_document=ReturnDocument.AFTER,
+                upsert=True,
+                session=mongo_session
+            )
 
-        # registrar movimentação
-        mov_doc = {
-            'produto_id': pid_out,
-            'tipo': 'transferencia',
-            'quantidade': quantidade,
-            'data_movimentacao': now,
-            'origem_tipo': str(origem_tipo).lower(),
-            'origem_id': origem_id_out,
-            'origem_nome': origem_nome,
-            'destino_tipo': str(destino_tipo).lower(),
-            'destino_id': destino_id_out,
-            'destino_nome': destino_nome,
-            'usuario_responsavel': getattr(current_user, 'username', None),
-            'motivo': data.get('motivo'),
-            'observacoes': data.get('observacoes'),
-            'created_at': now
-        }
-        mov_ins = movimentacoes.insert_one(mov_doc)
+            # registrar movimentação
+            mov_doc = {
+                'produto_id': pid_out,
+                'tipo': 'transferencia',
+                'quantidade': quantidade,
+                'data_movimentacao': now,
+                'origem_tipo': str(origem_tipo).lower(),
+                'origem_id': origem_id_out,
+                'origem_nome': origem_nome,
+                'destino_tipo': str(destino_tipo).lower(),
+                'destino_id': destino_id_out,
+                'destino_nome': destino_nome,
+                'usuario_responsavel': getattr(current_user, 'username', None),
+                'motivo': data.get('motivo'),
+                'observacoes': data.get('observacoes'),
+                'lotes_alocados': fefo.resumo(alocados),
+                'quantidade_sem_lote': sem_lote,
+                'created_at': now
+            }
+            mov_ins = _mov_repo().insert_one(mov_doc, session=mongo_session)
+            return dest_res, mov_ins
+
+        resultado = extensions.run_transaction(_executar)
+        if resultado is None:
+            return jsonify({'error': _falha_decremento(estoques, origem_filtros)}), 400
+        dest_res, mov_ins = resultado
 
         return jsonify({
             'success': True,
@@ -7881,6 +8480,7 @@ def api_movimentacoes_transferencia():
 
 @main_bp.route('/api/movimentacoes/distribuicao', methods=['POST'])
 @require_level('super_admin', 'admin_central', 'gerente_almox', 'resp_sub_almox', 'secretario')
+@idempotente
 def api_movimentacoes_distribuicao():
     """Executa distribuição (saída) de estoque de um local de origem para um ou mais setores.
     Payload esperado:
@@ -7898,7 +8498,6 @@ def api_movimentacoes_distribuicao():
         db = extensions.mongo_db
         produtos = db['produtos']
         estoques = db['estoques']
-        movimentacoes = db['movimentacoes']
 
         data = request.get_json(silent=True) or {}
 
@@ -8008,37 +8607,35 @@ def api_movimentacoes_distribuicao():
 
         now = datetime.now(timezone.utc)
 
-        # estoque origem e disponibilidade
+        # filtros do estoque de origem; o saldo é verificado no próprio decremento
         origem_filter1 = {'produto_id': pid_out, 'local_tipo': str(origem_tipo).lower(), 'local_id': origem_id_out}
-        origem_doc_estoque = estoques.find_one(origem_filter1)
-        if not origem_doc_estoque:
-            ofield = _field_by_tipo(origem_tipo)
-            if ofield:
-                origem_doc_estoque = estoques.find_one({'produto_id': pid_out, ofield: origem_id_out})
-        if not origem_doc_estoque:
-            return jsonify({'error': 'Não há estoque no local de origem para este produto'}), 400
-        disponivel = float(origem_doc_estoque.get('quantidade_disponivel', origem_doc_estoque.get('quantidade', 0)) or 0)
-
-        # novo formato com destinos detalhados; compatível com formato antigo
-        mov_count = 0
-        total_distribuido = 0.0
-
-        if isinstance(destinos_payload, list) and len(destinos_payload) > 0:
-            destinos_resolvidos = []
-            for d in destinos_payload:
-                raw_sid = d.get('id')
-                q = float(d.get('quantidade') or 0)
-                if raw_sid is None:
-                    return jsonify({'error': 'Destino inválido: id ausente'}), 400
-                if q <= 0:
-                    return jsonify({'error': f'Quantidade inválida para setor {raw_sid}'}), 400
-                sdoc = _find_by_id('setores', raw_sid)
+        ofield = _field_by_tipo(origem_tipo)
+        origem_filtros = [origem_filter1, ({'produto_id': pid_out, ofield: origem_id_out} if ofield else None)]
+
+        def _resolver_destinos(pares):
+            """Resolve os setores de destino em lote e valida o escopo de cada um.
+            pares = [(raw_sid, q)]; retorna ([(sdoc, raw_sid, q)], None) ou (None, resposta de erro).
+            """
+            setores_map = _find_many_by_ids('setores', [raw_sid for raw_sid, _ in pares])
+            gerente = getattr(current_user, 'nivel_acesso', None) == 'gerente_almox'
+            if not gerente:
+                # checagens de escopo reaproveitam os setores já carregados e a hierarquia comum
+                try:
+                    current_user.prime_scope_cache('setores', setores_map)
+                except Exception:
+                    pass
+            permitido = {}
+            itens = []
+            for raw_sid, q in pares:
+                sdoc = setores_map.get(str(raw_sid))
                 if not sdoc:
-                    return jsonify({'error': f'Setor de destino não encontrado: {raw_sid}'}), 400
-                # Verificação de movimento permitido origem -> setor
+                    return None, (jsonify({'error': f'Setor de destino não encontrado: {raw_sid}'}), 400)
+                # Verificação de movimento permitido origem -> setor (uma vez por setor)
+                chave = str(sdoc.get('_id'))
                 try:
-                    allowed_dest = True if getattr(current_user, 'nivel_acesso', None) == 'gerente_almox' else current_user.can_move_between({'tipo': origem_tipo, 'id': origem_id_raw}, {'tipo': 'setor', 'id': raw_sid})
-                    if not allowed_dest:
+                    if chave not in permitido:
+                        permitido[chave] = True if gerente else current_user.can_move_between({'tipo': origem_tipo, 'id': origem_id_raw}, {'tipo': 'setor', 'id': raw_sid})
+                    if not permitido[chave]:
                         try:
                             log_auditoria('MOV_DENIED', 'movimentacoes', None, None, {
                                 'produto_id': pid_out,
@@ -8049,34 +8646,29 @@ def api_movimentacoes_distribuicao():
                             })
                         except Exception:
                             pass
-                        return jsonify({'error': f'Setor de destino fora do seu escopo: {raw_sid}'}), 403
+                        return None, (jsonify({'error': f'Setor de destino fora do seu escopo: {raw_sid}'}), 403)
                 except Exception:
-                    return jsonify({'error': 'Falha ao verificar escopo do destino'}), 403
-                destinos_resolvidos.append({'doc': sdoc, 'raw_sid': raw_sid, 'quantidade': q})
-            total_distribuido = sum(d['quantidade'] for d in destinos_resolvidos)
-            if total_distribuido > disponivel:
-                return jsonify({'error': 'Quantidade alocada excede o disponível na origem'}), 400
-
-            # decrementar origem
-            estoques.find_one_and_update(
-                origem_filter1,
-                {
-                    '$inc': {
-                        'quantidade': -total_distribuido,
-                        'quantidade_disponivel': -total_distribuido
-                    },
-                    '$set': {
-                        'updated_at': now
-                    }
-                }
-            )
-
-            for item in destinos_resolvidos:
-                sdoc = item['doc']
-                raw_sid = item['raw_sid']
-                q = item['quantidade']
+                    return None, (jsonify({'error': 'Falha ao verificar escopo do destino'}), 403)
+                itens.append((sdoc, raw_sid, q))
+            return itens, None
+
+        def _executar(mongo_session, itens):
+            """Decrementa a origem pelo total, credita os setores com um bulk_write e
+            registra as saídas com um insert_many; itens = [(sdoc, raw_sid, q)]."""
+            total = sum(q for _, _, q in itens)
+            origem_atual = _decrementar_estoque(estoques, origem_filtros, total, now, mongo_session=mongo_session)
+            if origem_atual is None:
+                return None
+            # lotes: uma baixa FEFO pelo total, repartida entre os setores na ordem do payload
+            alocados, _ = fefo.alocar(db['lotes'], pid_out, str(origem_tipo).lower(), origem_id_out, total, now, session=mongo_session)
+            partes = fefo.dividir(alocados, [q for _, _, q in itens])
+            ops = []
+            lote_ops = []
+            mov_docs = []
+            for (sdoc, raw_sid, q), parte in zip(itens, partes):
                 setor_nome = _nome_por_doc(sdoc, 'Setor')
                 setor_id_out = _id_out(sdoc, raw_sid)
+                lote_ops.extend(fefo.operacoes_credito(parte, pid_out, 'setor', setor_id_out, now))
 
                 dest_filter = {'produto_id': pid_out, 'local_tipo': 'setor', 'local_id': setor_id_out}
                 dest_set_fields = {
@@ -8087,7 +8679,7 @@ def api_movimentacoes_distribuicao():
                     'setor_id': setor_id_out,
                     'updated_at': now
                 }
-                estoques.find_one_and_update(
+                ops.append(UpdateOne(
                     dest_filter,
                     {
                         '$inc': {
@@ -8099,11 +8691,10 @@ def api_movimentacoes_distribuicao():
                             'created_at': now
                         }
                     },
-                    upsert=True,
-                    return_document=ReturnDocument.AFTER
-                )
+                    upsert=True
+                ))
 
-                mov_doc = {
+                mov_docs.append({
                     'produto_id': pid_out,
                     'tipo': 'saida',
                     'quantidade': q,
@@ -8117,10 +8708,40 @@ def api_movimentacoes_distribuicao():
                     'usuario_responsavel': getattr(current_user, 'username', None),
                     'motivo': data.get('motivo'),
                     'observacoes': data.get('observacoes'),
+                    'lotes_alocados': fefo.resumo(parte),
+                    'quantidade_sem_lote': max(0.0, q - sum(a['quantidade'] for a in parte)),
                     'created_at': now
-                }
-                movimentacoes.insert_one(mov_doc)
-                mov_count += 1
+                })
+            if ops:
+                estoques.bulk_write(ops, ordered=True, session=mongo_session)
+                if lote_ops:
+                    db['lotes'].bulk_write(lote_ops, ordered=False, session=mongo_session)
+                _mov_repo().insert_many(mov_docs, session=mongo_session)
+            return origem_atual
+
+        # novo formato com destinos detalhados; compatível com formato antigo
+        mov_count = 0
+        total_distribuido = 0.0
+
+        if isinstance(destinos_payload, list) and len(destinos_payload) > 0:
+            pares = []
+            for d in destinos_payload:
+                raw_sid = d.get('id')
+                q = float(d.get('quantidade') or 0)
+                if raw_sid is None:
+                    return jsonify({'error': 'Destino inválido: id ausente'}), 400
+                if q <= 0:
+                    return jsonify({'error': f'Quantidade inválida para setor {raw_sid}'}), 400
+                pares.append((raw_sid, q))
+            destinos_resolvidos, erro_resp = _resolver_destinos(pares)
+            if erro_resp is not None:
+                return erro_resp
+            total_distribuido = sum(q for _, _, q in destinos_resolvidos)
+            origem_atual = extensions.run_transaction(lambda mongo_session: _executar(mongo_session, destinos_resolvidos))
+            if origem_atual is None:
+                erro = _falha_decremento(estoques, origem_filtros, 'Quantidade alocada excede o disponível na origem')
+                return jsonify({'error': erro}), 400
+            mov_count = len(destinos_resolvidos)
 
             try:
                 extensions.response_cache.clear_prefix('mov:')
@@ -8128,7 +8749,7 @@ def api_movimentacoes_distribuicao():
                 extensions.response_cache.clear_prefix('resd:')
             except Exception:
                 pass
-            return jsonify({'success': True, 'movimentacoes_criadas': mov_count, 'total_distribuido': total_distribuido, 'saldo_origem': float(disponivel - total_distribuido)})
+            return jsonify({'success': True, 'movimentacoes_criadas': mov_count, 'total_distribuido': total_distribuido, 'saldo_origem': _saldo_doc(origem_atual)})
 
         # formato antigo: divisão igual
         # validar quantidade total e destinos no formato antigo
@@ -8136,100 +8757,21 @@ def api_movimentacoes_distribuicao():
             return jsonify({'error': 'Quantidade total deve ser maior que zero'}), 400
         if not isinstance(setores_destino, list) or len(setores_destino) == 0:
             return jsonify({'error': 'Pelo menos um setor de destino deve ser informado'}), 400
-        if disponivel < quantidade_total:
-            return jsonify({'error': 'Quantidade insuficiente na origem para distribuição'}), 400
-        destinos_docs = []
-        for raw_sid in setores_destino:
-            sdoc = _find_by_id('setores', raw_sid)
-            if not sdoc:
-                return jsonify({'error': f'Setor de destino não encontrado: {raw_sid}'}), 400
-            # Verificação de movimento permitido origem -> setor
-            try:
-                allowed_dest2 = True if getattr(current_user, 'nivel_acesso', None) == 'gerente_almox' else current_user.can_move_between({'tipo': origem_tipo, 'id': origem_id_raw}, {'tipo': 'setor', 'id': raw_sid})
-                if not allowed_dest2:
-                    try:
-                        log_auditoria('MOV_DENIED', 'movimentacoes', None, None, {
-                            'produto_id': pid_out,
-                            'tipo': 'distribuicao',
-                            'origem': {'tipo': origem_tipo, 'id': origem_id_out},
-                            'destino': {'tipo': 'setor', 'id': raw_sid},
-                            'quantidade': quantidade_total / max(1, len(setores_destino))
-                        })
-                    except Exception:
-                        pass
-                    return jsonify({'error': f'Setor de destino fora do seu escopo: {raw_sid}'}), 403
-            except Exception:
-                return jsonify({'error': 'Falha ao verificar escopo do destino'}), 403
-            destinos_docs.append((sdoc, raw_sid))
+        q_each = quantidade_total / len(setores_destino)
+        destinos_docs, erro_resp = _resolver_destinos([(raw_sid, q_each) for raw_sid in setores_destino])
+        if erro_resp is not None:
+            return erro_resp
 
         # calcular distribuição por setor
         n = len(destinos_docs)
-        q_each = quantidade_total / n
         total_distribuido = quantidade_total
 
-        # decrementar origem uma vez pelo total
-        estoques.find_one_and_update(
-            origem_filter1,
-            {
-                '$inc': {
-                    'quantidade': -quantidade_total,
-                    'quantidade_disponivel': -quantidade_total
-                },
-                '$set': {
-                    'updated_at': now
-                }
-            }
-        )
-
-        # incrementar destino(s) e registrar movimentações de saída
-        mov_count = 0
-        for sdoc, raw_sid in destinos_docs:
-            setor_nome = _nome_por_doc(sdoc, 'Setor')
-            setor_id_out = _id_out(sdoc, raw_sid)
-
-            dest_filter = {'produto_id': pid_out, 'local_tipo': 'setor', 'local_id': setor_id_out}
-            dest_set_fields = {
-                'produto_id': pid_out,
-                'local_tipo': 'setor',
-                'local_id': setor_id_out,
-                'nome_local': setor_nome,
-                'setor_id': setor_id_out,
-                'updated_at': now
-            }
-            estoques.find_one_and_update(
-                dest_filter,
-                {
-                    '$inc': {
-                        'quantidade': q_each,
-                        'quantidade_disponivel': q_each
-                    },
-                    '$set': dest_set_fields,
-                    '$setOnInsert': {
-                        'created_at': now
-                    }
-                },
-                upsert=True,
-                return_document=ReturnDocument.AFTER
-            )
-
-            mov_doc = {
-                'produto_id': pid_out,
-                'tipo': 'saida',
-                'quantidade': q_each,
-                'data_movimentacao': now,
-                'origem_tipo': str(origem_tipo).lower(),
-                'origem_id': origem_id_out,
-                'origem_nome': origem_nome,
-                'destino_tipo': 'setor',
-                'destino_id': setor_id_out,
-                'destino_nome': setor_nome,
-                'usuario_responsavel': getattr(current_user, 'username', None),
-                'motivo': data.get('motivo'),
-                'observacoes': data.get('observacoes'),
-                'created_at': now
-            }
-            movimentacoes.insert_one(mov_doc)
-            mov_count += 1
+        # decrementar origem uma vez pelo total, creditar setores e registrar saídas
+        origem_atual = extensions.run_transaction(lambda mongo_session: _executar(mongo_session, destinos_docs))
+        if origem_atual is None:
+            erro = _falha_decremento(estoques, origem_filtros, 'Quantidade insuficiente na origem para distribuição')
+            return jsonify({'error': erro}), 400
+        mov_count = n
 
         try:
             extensions.response_cache.clear_prefix('mov:')
@@ -8237,10 +8779,316 @@ def api_movimentacoes_distribuicao():
             extensions.response_cache.clear_prefix('resd:')
         except Exception:
             pass
-        return jsonify({'success': True, 'movimentacoes_criadas': mov_count, 'total_distribuido': total_distribuido, 'saldo_origem': float(disponivel - total_distribuido)}), 200
+        return jsonify({'success': True, 'movimentacoes_criadas': mov_count, 'total_distribuido': total_distribuido, 'saldo_origem': _saldo_doc(origem_atual)}), 200
     except Exception as e:
         return jsonify({'error': f'Falha ao executar distribuição: {e}'}), 500
 
+# Tipos de local aceitos nas movimentações -> coleção e campo de id no estoque
+_COLECAO_POR_TIPO_LOCAL = {
+    'setor': 'setores', 'setores': 'setores',
+    'subalmoxarifado': 'sub_almoxarifados', 'sub_almoxarifado': 'sub_almoxarifados', 'sub_almoxarifados': 'sub_almoxarifados',
+    'almoxarifado': 'almoxarifados', 'almoxarifados': 'almoxarifados',
+    'central': 'centrais', 'centrais': 'centrais',
+}
+_CAMPO_POR_COLECAO = {
+    'setores': 'setor_id',
+    'sub_almoxarifados': 'sub_almoxarifado_id',
+    'almoxarifados': 'almoxarifado_id',
+    'centrais': 'central_id',
+}
+
+class _LoteConcorrente(Exception):
+    """Saldo de alguma origem mudou entre o planejamento e a escrita do lote."""
+
+@main_bp.route('/api/movimentacoes/lote', methods=['POST'])
+@require_level('super_admin', 'admin_central', 'gerente_almox', 'resp_sub_almox', 'secretario')
+@idempotente
+def api_movimentacoes_lote():
+    """Aplica várias linhas de transferência/distribuição em uma única requisição.
+    Payload esperado:
+    {
+        motivo: <str|null>, observacoes: <str|null>,
+        linhas: [
+            { tipo: 'transferencia'|'distribuicao', produto_id: <id>, quantidade: <float>,
+              origem: { tipo, id }, destino: { tipo, id }, motivo?: <str>, observacoes?: <str> }
+        ]
+    }
+    Produtos, locais e escopo são resolvidos uma vez para o lote; as baixas nas origens, os
+    créditos nos destinos e as movimentações são gravados em lote (em transação quando suportado).
+    Resposta: { success, aplicadas, falhas, resultados: [{ indice, success, movimentacao_id | error }] }
+    """
+    try:
+        db = extensions.mongo_db
+        estoques = db['estoques']
+        data = request.get_json(silent=True) or {}
+        linhas = data.get('linhas') or data.get('itens') or []
+        if not isinstance(linhas, list) or len(linhas) == 0:
+            return jsonify({'error': 'Informe ao menos uma linha em linhas'}), 400
+        if len(linhas) > 1000:
+            return jsonify({'error': 'Máximo de 1000 linhas por lote'}), 400
+
+        resultados = [None] * len(linhas)
+
+        def _falha(i, msg):
+            resultados[i] = {'indice': i, 'success': False, 'error': msg}
+
+        # validação sintática e coleta de ids para resolução em lote
+        parsed = []
+        ids_por_colecao = {}
+        pids = []
+        for i, ln in enumerate(linhas):
+            ln = ln if isinstance(ln, dict) else {}
+            try:
+                quantidade = float(ln.get('quantidade') or 0)
+            except (TypeError, ValueError):
+                quantidade = 0
+            tipo_mov = str(ln.get('tipo') or 'transferencia').lower()
+            origem = ln.get('origem') or {}
+            destino = ln.get('destino') or {}
+            otipo = str(origem.get('tipo') or '').lower()
+            dtipo = str(destino.get('tipo') or '').lower()
+            if tipo_mov not in ('transferencia', 'distribuicao'):
+                _falha(i, 'Tipo de movimentação inválido')
+                continue
+            if quantidade <= 0:
+                _falha(i, 'Quantidade deve ser maior que zero')
+                continue
+            if ln.get('produto_id') is None:
+                _falha(i, 'produto_id é obrigatório')
+                continue
+            if not otipo or origem.get('id') is None or not dtipo or destino.get('id') is None:
+                _falha(i, 'origem e destino (tipo e id) são obrigatórios')
+                continue
+            ocoll = _COLECAO_POR_TIPO_LOCAL.get(otipo)
+            dcoll = _COLECAO_POR_TIPO_LOCAL.get(dtipo)
+            if not ocoll or not dcoll:
+                _falha(i, 'Tipo de origem/destino inválido')
+                continue
+            if tipo_mov == 'distribuicao' and dcoll != 'setores':
+                _falha(i, 'Distribuição deve ter um setor como destino')
+                continue
+            if ocoll == dcoll and str(origem.get('id')) == str(destino.get('id')):
+                _falha(i, 'Origem e destino não podem ser o mesmo local')
+                continue
+            ids_por_colecao.setdefault(ocoll, []).append(origem.get('id'))
+            ids_por_colecao.setdefault(dcoll, []).append(destino.get('id'))
+            pids.append(ln.get('produto_id'))
+            parsed.append({'i': i, 'linha': ln, 'tipo_mov': tipo_mov, 'quantidade': quantidade,
+                           'otipo': otipo, 'oid_raw': origem.get('id'), 'ocoll': ocoll,
+                           'dtipo': dtipo, 'did_raw': destino.get('id'), 'dcoll': dcoll})
+
+        produtos_map = _find_many_by_ids('produtos', pids)
+        locais_map = {coll: _find_many_by_ids(coll, ids) for coll, ids in ids_por_colecao.items()}
+        try:
+            current_user.prime_scope_cache('produtos', produtos_map)
+            for coll, mapa in locais_map.items():
+                current_user.prime_scope_cache(coll, mapa)
+        except Exception:
+            pass
+
+        def _id_out(doc):
+            return doc.get('id') if doc.get('id') is not None else str(doc.get('_id'))
+
+        # resolução e escopo (cada produto/par de locais é verificado uma única vez)
+        gerente = getattr(current_user, 'nivel_acesso', None) == 'gerente_almox'
+        acesso_produto = {}
+        acesso_par = {}
+        validas = []
+        for item in parsed:
+            i = item['i']
+            prod_doc = produtos_map.get(str(item['linha'].get('produto_id')))
+            if not prod_doc:
+                _falha(i, 'Produto não encontrado')
+                continue
+            odoc = locais_map.get(item['ocoll'], {}).get(str(item['oid_raw']))
+            ddoc = locais_map.get(item['dcoll'], {}).get(str(item['did_raw']))
+            if odoc is None:
+                _falha(i, 'Local de origem não encontrado')
+                continue
+            if ddoc is None:
+                _falha(i, 'Local de destino não encontrado')
+                continue
+            pkey = str(prod_doc.get('_id'))
+            try:
+                if pkey not in acesso_produto:
+                    acesso_produto[pkey] = bool(current_user.can_access_produto(item['linha'].get('produto_id')))
+                par = (item['otipo'], str(odoc.get('_id')), item['dtipo'], str(ddoc.get('_id')))
+                if par not in acesso_par:
+                    acesso_par[par] = True if gerente else bool(current_user.can_move_between(
+                        {'tipo': item['otipo'], 'id': item['oid_raw']}, {'tipo': item['dtipo'], 'id': item['did_raw']}))
+            except Exception:
+                _falha(i, 'Falha ao verificar escopo da movimentação')
+                continue
+            if not acesso_produto[pkey] or not acesso_par[par]:
+                try:
+                    log_auditoria('MOV_DENIED', 'movimentacoes', None, None, {
+                        'produto_id': str(item['linha'].get('produto_id')),
+                        'tipo': item['tipo_mov'],
+                        'origem': {'tipo': item['otipo'], 'id': str(item['oid_raw'])},
+                        'destino': {'tipo': item['dtipo'], 'id': str(item['did_raw'])},
+                        'quantidade': item['quantidade'],
+                        'lote': True
+                    })
+                except Exception:
+                    pass
+                _falha(i, 'Produto fora do seu escopo' if not acesso_produto[pkey] else 'Movimentação fora do escopo autorizado')
+                continue
+            item.update({'pid_out': _id_out(prod_doc), 'odoc': odoc, 'ddoc': ddoc,
+                         'origem_id_out': _id_out(odoc), 'destino_id_out': _id_out(ddoc)})
+            validas.append(item)
+
+        def _filtros_origem(item):
+            ofield = _CAMPO_POR_COLECAO.get(item['ocoll'])
+            return [{'produto_id': item['pid_out'], 'local_tipo': item['otipo'], 'local_id': item['origem_id_out']},
+                    {'produto_id': item['pid_out'], ofield: item['origem_id_out']}]
+
+        def _casa(doc, filtro):
+            return all(doc.get(k) == v for k, v in filtro.items())
+
+        def _planejar():
+            """Lê todas as origens em uma consulta e aloca as linhas em ordem sobre o saldo lido."""
+            termos = []
+            for item in validas:
+                termos.extend(_filtros_origem(item))
+            docs = list(estoques.find({'$or': termos})) if termos else []
+            saldo = {}
+            plano = []
+            for item in validas:
+                odoc_est = None
+                for filtro in _filtros_origem(item):
+                    odoc_est = next((d for d in docs if _casa(d, filtro)), None)
+                    if odoc_est is not None:
+                        break
+                if odoc_est is None:
+                    plano.append((item, None, 'Não há estoque no local de origem para este produto'))
+                    continue
+                chave = odoc_est['_id']
+                saldo.setdefault(chave, _saldo_doc(odoc_est))
+                if saldo[chave] < item['quantidade']:
+                    plano.append((item, None, 'Quantidade insuficiente na origem'))
+                    continue
+                saldo[chave] -= item['quantidade']
+                plano.append((item, chave, None))
+            return plano
+
+        now = datetime.now(timezone.utc)
+        motivo_lote = data.get('motivo')
+        obs_lote = data.get('observacoes')
+
+        def _aplicar(mongo_session, plano):
+            totais = {}
+            for item, chave, erro in plano:
+                if chave is not None:
+                    totais[chave] = totais.get(chave, 0.0) + item['quantidade']
+            recusadas = set()
+            if mongo_session is not None:
+                # em transação: todas as baixas em um bulk_write; se alguma guarda falhar, aborta e replaneja
+                ops = [UpdateOne({'$and': [{'_id': chave}, _filtro_saldo_suficiente(total)]},
+                                 {'$inc': {'quantidade': -total, 'quantidade_disponivel': -total}, '$set': {'updated_at': now}})
+                       for chave, total in totais.items()]
+                if ops:
+                    res = estoques.bulk_write(ops, ordered=False, session=mongo_session)
+                    if res.matched_count != len(ops):
+                        raise _LoteConcorrente()
+            else:
+                # sem transação: baixa condicional por origem, para saber exatamente qual foi aplicada
+                for chave, total in totais.items():
+                    if _decrementar_estoque(estoques, [{'_id': chave}], total, now) is None:
+                        recusadas.add(chave)
+
+            dest_ops = []
+            lote_ops = []
+            mov_docs = []
+            aplicadas = []
+            # lotes de todas as origens do lote numa única leitura; alocar() só relê em conflito
+            lotes_origem = fefo.candidatos_em_lote(db['lotes'], [
+                (item['pid_out'], item['otipo'], item['origem_id_out'])
+                for item, chave, erro in plano if chave is not None and chave not in recusadas
+            ], now, session=mongo_session)
+            for item, chave, erro in plano:
+                if chave is None or chave in recusadas:
+                    continue
+                q = item['quantidade']
+                origem_lotes = (item['pid_out'], item['otipo'], item['origem_id_out'])
+                alocados, sem_lote = fefo.alocar(db['lotes'], *origem_lotes, q, now, session=mongo_session,
+                                                 candidatos=lotes_origem.get(origem_lotes))
+                lote_ops.extend(fefo.operacoes_credito(alocados, item['pid_out'], item['dtipo'], item['destino_id_out'], now))
+                dfield = _CAMPO_POR_COLECAO.get(item['dcoll'])
+                destino_nome = _nome_local_doc(item['ddoc'], 'Destino')
+                set_fields = {
+                    'produto_id': item['pid_out'],
+                    'local_tipo': item['dtipo'],
+                    'local_id': item['destino_id_out'],
+                    'nome_local': destino_nome,
+                    'updated_at': now
+                }
+                if dfield:
+                    set_fields[dfield] = item['destino_id_out']
+                dest_ops.append(UpdateOne(
+                    {'produto_id': item['pid_out'], 'local_tipo': item['dtipo'], 'local_id': item['destino_id_out']},
+                    {'$inc': {'quantidade': q, 'quantidade_disponivel': q}, '$set': set_fields, '$setOnInsert': {'created_at': now}},
+                    upsert=True
+                ))
+                mov_docs.append({
+                    'produto_id': item['pid_out'],
+                    'tipo': 'saida' if item['tipo_mov'] == 'distribuicao' else 'transferencia',
+                    'quantidade': q,
+                    'data_movimentacao': now,
+                    'origem_tipo': item['otipo'],
+                    'origem_id': item['origem_id_out'],
+                    'origem_nome': _nome_local_doc(item['odoc'], 'Origem'),
+                    'destino_tipo': item['dtipo'],
+                    'destino_id': item['destino_id_out'],
+                    'destino_nome': destino_nome,
+                    'usuario_responsavel': getattr(current_user, 'username', None),
+                    'motivo': item['linha'].get('motivo') or motivo_lote,
+                    'observacoes': item['linha'].get('observacoes') or obs_lote,
+                    'lotes_alocados': fefo.resumo(alocados),
+                    'quantidade_sem_lote': sem_lote,
+                    'created_at': now
+                })
+                aplicadas.append(item['i'])
+            if dest_ops:
+                estoques.bulk_write(dest_ops, ordered=True, session=mongo_session)
+                if lote_ops:
+                    db['lotes'].bulk_write(lote_ops, ordered=False, session=mongo_session)
+                ins = _mov_repo().insert_many(mov_docs, session=mongo_session)
+                return recusadas, list(zip(aplicadas, ins.inserted_ids))
+            return recusadas, []
+
+        plano = []
+        aplicadas = []
+        recusadas = set()
+        for tentativa in range(3):
+            plano = _planejar()
+            try:
+                recusadas, aplicadas = extensions.run_transaction(lambda mongo_session: _aplicar(mongo_session, plano))
+                break
+            except _LoteConcorrente:
+                if tentativa == 2:
+                    return jsonify({'error': 'Saldo das origens alterado durante o lote. Tente novamente.'}), 409
+
+        for item, chave, erro in plano:
+            if erro:
+                _falha(item['i'], erro)
+            elif chave in recusadas:
+                _falha(item['i'], 'Quantidade insuficiente na origem')
+        for i, mov_id in aplicadas:
+            resultados[i] = {'indice': i, 'success': True, 'movimentacao_id': str(mov_id)}
+
+        if aplicadas:
+            try:
+                extensions.response_cache.clear_prefix('mov:')
+                extensions.response_cache.clear_prefix('estq:')
+                extensions.response_cache.clear_prefix('resd:')
+            except Exception:
+                pass
+        falhas = sum(1 for r in resultados if not (r or {}).get('success'))
+        body = {'success': falhas == 0, 'aplicadas': len(aplicadas), 'falhas': falhas, 'resultados': resultados}
+        return jsonify(body), (200 if aplicadas else 400)
+    except Exception as e:
+        return jsonify({'error': f'Falha ao executar lote de movimentações: {e}'}), 500
+
 # ==================== API: DEMANDAS ====================
 
 @main_bp.route('/api/demandas', methods=['GET', 'POST'])
@@ -8925,7 +9773,7 @@ def api_setor_produto_resumo_dia(setor_id, produto_id):
         return jsonify({'error': 'Acesso negado'}), 403
 
     db = extensions.mongo_db
-    movimentacoes = db['movimentacoes']
+    movimentacoes = _mov_repo()
     estoques = db['estoques']
 
     # Janela do dia (00:00:00 até 23:59:59)
@@ -9087,13 +9935,13 @@ def api_setor_produto_resumo_dia(setor_id, produto_id):
 
 @main_bp.route('/api/setor/registro', methods=['POST'])
 @require_any_level
+@idempotente
 def api_setor_registro_consumo():
     """Registra consumo diário de um produto no setor do usuário.
     Espera JSON com {produto_id, saida_dia} e ajusta estoque do setor.
     """
     db = extensions.mongo_db
     estoques = db['estoques']
-    movimentacoes = db['movimentacoes']
     setores = db['setores']
 
     data = request.get_json(silent=True) or {}
@@ -9261,20 +10109,13 @@ def api_setor_registro_consumo():
             return jsonify({'error': 'Estoque insuficiente no setor', 'disponivel': disponivel}), 400
 
     now = datetime.now(timezone.utc)
-    # ajustar estoque (incrementar o campo de quantidade que existir e sempre ajustar quantidade_disponivel)
-    inc_fields = {
-        'quantidade_disponivel': -qtd
-    }
-    if estoque_doc:
-        if 'quantidade' in estoque_doc:
-            inc_fields['quantidade'] = -qtd
-        elif 'quantidade_atual' in estoque_doc:
-            inc_fields['quantidade_atual'] = -qtd
-        else:
-            # fallback: usar 'quantidade' para criar se não existir
-            inc_fields['quantidade'] = -qtd
+    # ajustar estoque (decrementar o campo de quantidade que existir e sempre ajustar quantidade_disponivel)
+    campos_dec = ['quantidade_disponivel']
+    if estoque_doc and 'quantidade' not in estoque_doc and 'quantidade_atual' in estoque_doc:
+        campos_dec.append('quantidade_atual')
     else:
-        inc_fields['quantidade'] = -qtd
+        # fallback: usar 'quantidade' para criar se não existir
+        campos_dec.append('quantidade')
 
     target_filter = ({'_id': estoque_doc.get('_id')} if estoque_doc and estoque_doc.get('_id') is not None else {
         '$and': [
@@ -9282,16 +10123,6 @@ def api_setor_registro_consumo():
             {'$or': [{'local_tipo': 'setor'}, {'tipo': 'setor'}]}
         ]
     })
-    estoques.find_one_and_update(
-        target_filter,
-        {
-            '$inc': inc_fields,
-            '$set': {
-                'updated_at': now
-            }
-        },
-        return_document=ReturnDocument.AFTER
-    )
 
     # nome do setor para log
     setor_doc = None
@@ -9301,23 +10132,38 @@ def api_setor_registro_consumo():
         setor_doc = setores.find_one({'id': raw_sid})
     setor_nome = setor_doc.get('nome') if setor_doc else None
 
-    # registrar movimentação de consumo
-    mov_doc = {
-        'produto_id': str(raw_pid),
-        'tipo': 'consumo',
-        'quantidade': qtd,
-        'data_movimentacao': now,
-        'origem_tipo': 'setor',
-        'origem_id': str(raw_sid),
-        'origem_nome': setor_nome,
-        'destino_tipo': 'consumo',
-        'destino_id': None,
-        'destino_nome': 'Consumo do dia',
-        'usuario_responsavel': getattr(current_user, 'username', None),
-        'observacoes': data.get('observacoes'),
-        'created_at': now
-    }
-    movimentacoes.insert_one(mov_doc)
+    def _executar(mongo_session):
+        # o saldo lido acima pode ter mudado: a guarda no filtro garante que não fique negativo
+        estoque_atual = _decrementar_estoque(estoques, [target_filter], qtd, now, mongo_session=mongo_session, campos=tuple(campos_dec))
+        if estoque_atual is None:
+            return False
+        alocados, sem_lote = fefo.alocar(extensions.mongo_db['lotes'], estoque_atual.get('produto_id'),
+                                         estoque_atual.get('local_tipo') or 'setor', estoque_atual.get('local_id'),
+                                         qtd, now, session=mongo_session)
+        # registrar movimentação de consumo
+        mov_doc = {
+            'produto_id': str(raw_pid),
+            'tipo': 'consumo',
+            'quantidade': qtd,
+            'data_movimentacao': now,
+            'origem_tipo': 'setor',
+            'origem_id': str(raw_sid),
+            'origem_nome': setor_nome,
+            'destino_tipo': 'consumo',
+            'destino_id': None,
+            'destino_nome': 'Consumo do dia',
+            'usuario_responsavel': getattr(current_user, 'username', None),
+            'observacoes': data.get('observacoes'),
+            'lotes_alocados': fefo.resumo(alocados),
+            'quantidade_sem_lote': sem_lote,
+            'created_at': now
+        }
+        _mov_repo().insert_one(mov_doc, session=mongo_session)
+        return True
+
+    if not extensions.run_transaction(_executar):
+        disponivel = _saldo_doc(estoques.find_one(target_filter))
+        return jsonify({'error': 'Estoque insuficiente no setor', 'disponivel': disponivel}), 400
 
     try:
         extensions.response_cache.clear_prefix('mov:')
@@ -9326,6 +10172,25 @@ def api_setor_registro_consumo():
     except Exception:
         pass
     return jsonify({'success': True, 'quantidade_registrada': qtd})
+@main_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Exposição no formato texto do Prometheus, somando todos os workers (metricas.py)."""
+    if not current_app.config.get('METRICS_ENABLED', True):
+        return jsonify({'error': 'Métricas desabilitadas'}), 404
+    token = current_app.config.get('METRICS_TOKEN')
+    if token:
+        if (request.headers.get('Authorization') or '') != f'Bearer {token}':
+            return jsonify({'error': 'Token de métricas inválido'}), 401
+    elif not current_app.config.get('DEBUG') and not (
+            current_user.is_authenticated and getattr(current_user, 'nivel_acesso', None) == 'super_admin'):
+        # sem METRICS_TOKEN, fora do DEBUG: só super_admin logado
+        return jsonify({'error': 'Autenticação necessária (defina METRICS_TOKEN para o coletor)'}), 401
+    try:
+        texto = metricas.exposicao(metricas.diretorio(current_app))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    return current_app.response_class(texto, mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 @main_bp.route('/health/app', methods=['GET'])
 def health_app():
     try:
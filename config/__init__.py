@@ -19,6 +19,54 @@ class Config:
     # Configuração de banco de dados MongoDB (persistência oficial)
     MONGO_URI = os.environ.get('MONGO_URI') or 'mongodb://localhost:27017/almox_sms'
     MONGO_DB = os.environ.get('MONGO_DB') or 'almox_sms'
+    # Layout do histórico de movimentações: 'colecao' (padrão) ou 'buckets' (produto/mês)
+    MOVIMENTACOES_STORAGE = os.environ.get('MOVIMENTACOES_STORAGE') or 'colecao'
+    # Validade das respostas gravadas por Idempotency-Key (segundos)
+    IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS') or 86400)
+    # Auditoria assíncrona: fila limitada drenada por thread com insert_many
+    AUDIT_ASYNC = str(os.environ.get('AUDIT_ASYNC', 'true')).lower() in ('1', 'true', 'yes')
+    AUDIT_QUEUE_SIZE = int(os.environ.get('AUDIT_QUEUE_SIZE') or 10000)
+    AUDIT_BATCH_SIZE = int(os.environ.get('AUDIT_BATCH_SIZE') or 200)
+    AUDIT_FLUSH_INTERVAL = float(os.environ.get('AUDIT_FLUSH_INTERVAL') or 1.0)
+    AUDIT_OVERFLOW = os.environ.get('AUDIT_OVERFLOW') or 'sincrono'  # sincrono | bloquear | descartar
+    # Agendador de backups (config_backup); um processo líder por vez via lock no Mongo
+    BACKUP_SCHEDULER_ENABLED = str(os.environ.get('BACKUP_SCHEDULER_ENABLED', 'true')).lower() in ('1', 'true', 'yes')
+    BACKUP_SCHEDULER_INTERVAL = int(os.environ.get('BACKUP_SCHEDULER_INTERVAL') or 60)
+    BACKUP_JANELA_HORAS = float(os.environ.get('BACKUP_JANELA_HORAS') or 4)
+    BACKUP_DIR = os.environ.get('BACKUP_DIR') or None
+    # Políticas de retenção (arquivamento diário pelo mesmo agendador); JSON opcional, ex.:
+    # [{"colecao": "movimentacoes", "campo": "data_movimentacao", "meses": 24}]
+    RETENCAO_ATIVA = str(os.environ.get('RETENCAO_ATIVA', 'false')).lower() in ('1', 'true', 'yes')
+    RETENCAO_HORARIO = os.environ.get('RETENCAO_HORARIO') or '03:00'
+    RETENCAO_POLITICAS = os.environ.get('RETENCAO_POLITICAS') or None
+    RETENCAO_CHUNK = int(os.environ.get('RETENCAO_CHUNK') or 1000)
+    # Snapshot diário de saldos para /api/estoque/saldo-em (agendador) e retenção dos antigos
+    SNAPSHOT_ESTOQUE_ATIVO = str(os.environ.get('SNAPSHOT_ESTOQUE_ATIVO', 'true')).lower() in ('1', 'true', 'yes')
+    SNAPSHOT_ESTOQUE_HORARIO = os.environ.get('SNAPSHOT_ESTOQUE_HORARIO') or '00:05'
+    SNAPSHOT_ESTOQUE_RETENCAO_DIAS = int(os.environ.get('SNAPSHOT_ESTOQUE_RETENCAO_DIAS') or 90)
+    # Visão materializada de consumo diário: o agendador atualiza a cada ciclo; a rota do
+    # relatório só reprocessa com dias pendentes ou se a última atualização for mais antiga
+    CONSUMO_DIARIO_REFRESH_SEGUNDOS = float(os.environ.get('CONSUMO_DIARIO_REFRESH_SEGUNDOS') or 60)
+    CONSUMO_DIARIO_MARGEM_SEGUNDOS = float(os.environ.get('CONSUMO_DIARIO_MARGEM_SEGUNDOS') or 300)
+    # Jobs em segundo plano (coleção 'jobs'): threads por processo, reivindicação por lease
+    JOBS_WORKERS = int(os.environ.get('JOBS_WORKERS') or 2)
+    JOBS_POLL_SECONDS = float(os.environ.get('JOBS_POLL_SECONDS') or 2)
+    JOBS_LEASE_SECONDS = int(os.environ.get('JOBS_LEASE_SECONDS') or 300)
+    JOBS_TTL_DIAS = float(os.environ.get('JOBS_TTL_DIAS') or 7)
+    # Perfil dos comandos Mongo por requisição: Server-Timing, linha de log e aviso de N+1
+    MONGO_PROFILER_ENABLED = str(os.environ.get('MONGO_PROFILER_ENABLED', 'true')).lower() in ('1', 'true', 'yes')
+    MONGO_PROFILER_NPLUS1 = int(os.environ.get('MONGO_PROFILER_NPLUS1') or 10)
+    MONGO_PROFILER_TOP = int(os.environ.get('MONGO_PROFILER_TOP') or 3)
+    # Métricas Prometheus em /metrics; retratos por processo em METRICS_DIR (compartilhado entre workers)
+    METRICS_ENABLED = str(os.environ.get('METRICS_ENABLED', 'true')).lower() in ('1', 'true', 'yes')
+    METRICS_DIR = os.environ.get('METRICS_DIR') or None
+    METRICS_FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS') or 5)
+    # sem token, /metrics exige sessão de super_admin (aberto só com DEBUG)
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or None
+    # Consultas lentas: comandos acima de MONGO_SLOW_MS são gravados com o plano (explain executionStats)
+    MONGO_SLOW_ENABLED = str(os.environ.get('MONGO_SLOW_ENABLED', 'true')).lower() in ('1', 'true', 'yes')
+    MONGO_SLOW_MS = float(os.environ.get('MONGO_SLOW_MS') or 200)
+    MONGO_SLOW_EXPLAIN_INTERVAL = float(os.environ.get('MONGO_SLOW_EXPLAIN_INTERVAL') or 300)
     
     # Configurações da aplicação
     ITEMS_PER_PAGE = 20
@@ -64,11 +112,25 @@ class ProductionConfig(Config):
 
 class TestingConfig(Config):
     TESTING = True
+    AUDIT_ASYNC = False
+    BACKUP_SCHEDULER_ENABLED = False
+    JOBS_WORKERS = 0
+    CONSUMO_DIARIO_REFRESH_SEGUNDOS = 0
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
 
+class ScriptConfig(Config):
+    """Processos de execução única (scripts/*.py): sem runner de jobs, agendador de backup,
+    exportador de métricas e registro de consultas lentas, que ficam com os workers do app."""
+    AUDIT_ASYNC = False
+    BACKUP_SCHEDULER_ENABLED = False
+    JOBS_WORKERS = 0
+    METRICS_ENABLED = False
+    MONGO_SLOW_ENABLED = False
+
 config = {
     'development': DevelopmentConfig,
     'production': ProductionConfig,
     'testing': TestingConfig,
+    'script': ScriptConfig,
     'default': DevelopmentConfig
 }
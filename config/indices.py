@@ -0,0 +1,105 @@
+"""
+Catálogo declarativo dos índices MongoDB por coleção.
+Fonte única para o boot (extensions.ensure_collections_and_indexes) e para a CLI
+scripts/sincronizar_indices.py, que compara o catálogo com os índices existentes.
+"""
+
+from pymongo import ASCENDING, DESCENDING
+
+
+def indice(nome: str, chaves: list, **opcoes) -> dict:
+    """Especificação de um índice: nome, chaves [(campo, direção)] e opções do create_index
+    (unique, sparse, partialFilterExpression, expireAfterSeconds)."""
+    return {'nome': nome, 'chaves': list(chaves), 'opcoes': opcoes}
+
+
+CATALOGO = {
+    'usuarios': [
+        indice('idx_unique_username', [('username', ASCENDING)], unique=True),
+    ],
+    'produtos': [
+        # criado por _ensure_produtos_codigo_unico (migra o antigo idx_prod_codigo não único)
+        indice('idx_prod_codigo_unico', [('codigo', ASCENDING)], unique=True,
+               partialFilterExpression={'codigo': {'$type': 'string'}}),
+        indice('idx_prod_nome', [('nome', ASCENDING)]),
+    ],
+    'movimentacoes': [
+        indice('idx_mov_data_movimentacao', [('data_movimentacao', ASCENDING)]),
+        indice('idx_mov_tipo', [('tipo', ASCENDING)]),
+        indice('idx_mov_produto', [('produto_id', ASCENDING)]),
+        indice('idx_mov_created_at', [('created_at', DESCENDING)]),
+        indice('idx_mov_prod_data', [('produto_id', ASCENDING), ('data_movimentacao', DESCENDING)]),
+        indice('idx_mov_updated_at', [('updated_at', ASCENDING)], sparse=True),
+    ],
+    # layout agrupado do histórico (MOVIMENTACOES_STORAGE=buckets)
+    'movimentacoes_buckets': [
+        indice('idx_bkt_produto_mes', [('produto_key', ASCENDING), ('mes', ASCENDING), ('n', ASCENDING)]),
+        indice('idx_bkt_produto_datas', [('produto_key', ASCENDING), ('data_max', DESCENDING), ('data_min', ASCENDING)]),
+        indice('idx_bkt_datas', [('data_max', DESCENDING), ('data_min', ASCENDING)]),
+        indice('idx_bkt_item_id', [('itens._id', ASCENDING)]),
+    ],
+    # visão materializada do relatório de consumo/gastos (dia x produto)
+    'relatorio_consumo_diario': [
+        indice('idx_rcd_dia_produto', [('dia', ASCENDING), ('produto_key', ASCENDING)], unique=True),
+    ],
+    # checkpoints de saldo por (produto, local) usados por /api/estoque/saldo-em
+    'estoque_snapshots': [
+        indice('idx_snap_produto_local_data', [('produto_key', ASCENDING), ('local_tipo', ASCENDING),
+                                               ('local_key', ASCENDING), ('data_referencia', DESCENDING)]),
+        indice('idx_snap_data', [('data_referencia', ASCENDING)]),
+    ],
+    'estoque_snapshots_execucoes': [
+        indice('idx_snap_exec_data', [('data_referencia', DESCENDING)]),
+    ],
+    # respostas gravadas por Idempotency-Key; o TTL remove cada registro em 'expira_em'
+    'idempotency_keys': [
+        indice('idx_idem_ttl', [('expira_em', ASCENDING)], expireAfterSeconds=0),
+    ],
+    # jobs em segundo plano: reivindicação (status + lease), listagem por usuário e TTL dos finalizados
+    'jobs': [
+        indice('idx_jobs_status_created', [('status', ASCENDING), ('created_at', ASCENDING)]),
+        indice('idx_jobs_status_lease', [('status', ASCENDING), ('lease_ate', ASCENDING)]),
+        indice('idx_jobs_usuario', [('usuario_id', ASCENDING), ('created_at', DESCENDING)]),
+        indice('idx_jobs_ttl', [('expira_em', ASCENDING)], expireAfterSeconds=0),
+    ],
+    'consultas_lentas': [
+        indice('idx_lentas_ts', [('ts', ASCENDING)]),
+    ],
+    'estoques': [
+        # filtro de todo upsert/decremento de saldo; também atende buscas só por produto_id
+        indice('idx_est_produto_local', [('produto_id', ASCENDING), ('local_tipo', ASCENDING), ('local_id', ASCENDING)]),
+        indice('idx_est_local', [('local_tipo', ASCENDING), ('local_id', ASCENDING)]),
+        indice('idx_est_updated', [('updated_at', DESCENDING)]),
+    ],
+    'lotes': [
+        # alocação FEFO por (produto, local) e painel de vencimentos sobre o saldo vivo dos lotes
+        indice('idx_lotes_fefo', [('produto_id', ASCENDING), ('local_tipo', ASCENDING), ('local_id', ASCENDING),
+                                  ('data_vencimento', ASCENDING)]),
+        indice('idx_lotes_vencimento', [('data_vencimento', ASCENDING), ('quantidade_atual', ASCENDING)]),
+        # recebimento/ajuste de lote no almoxarifado
+        indice('idx_lotes_produto_lote', [('produto_id', ASCENDING), ('lote', ASCENDING), ('almoxarifado_id', ASCENDING)]),
+    ],
+    'demandas': [
+        indice('idx_dem_status_created', [('status', ASCENDING), ('created_at', DESCENDING)]),
+        indice('idx_dem_setor_created', [('setor_id', ASCENDING), ('created_at', DESCENDING)]),
+        indice('idx_dem_updated', [('updated_at', DESCENDING)]),
+    ],
+    'listas_demandas': [
+        indice('idx_ldem_usuario_setor', [('usuario_id', ASCENDING), ('setor_id', ASCENDING), ('created_at', DESCENDING)]),
+    ],
+    'compras': [
+        indice('idx_compras_status_created', [('status', ASCENDING), ('created_at', DESCENDING)]),
+        indice('idx_compras_usuario_created', [('usuario_id', ASCENDING), ('created_at', DESCENDING)]),
+    ],
+    'setor_registros': [
+        indice('idx_setreg_produto_setor_data', [('produto_id', ASCENDING), ('setor_id', ASCENDING), ('data_registro', ASCENDING)]),
+    ],
+    'logs_auditoria': [
+        indice('idx_audit_time', [('timestamp', ASCENDING)]),
+        indice('idx_audit_user', [('usuario_id', ASCENDING)]),
+    ],
+    'listas_compras': [
+        indice('idx_lista_usuario', [('usuario_id', ASCENDING)]),
+        indice('idx_lista_created', [('created_at', ASCENDING)]),
+    ],
+}
@@ -0,0 +1,292 @@
+"""Registro de comandos MongoDB lentos com captura automática do plano (explain).
+
+Um CommandListener (registrado em extensions.init_mongo) compara a duração de cada comando com
+MONGO_SLOW_MS. Os lentos vão para uma fila; uma thread em segundo plano grava cada ocorrência
+na coleção limitada (capped) 'consultas_lentas' e, no máximo uma vez por forma de consulta a
+cada MONGO_SLOW_EXPLAIN_INTERVAL segundos, reexecuta o mesmo comando com
+explain('executionStats') para resumir o plano: COLLSCAN ou IXSCAN (e quais índices), documentos
+e chaves examinados contra documentos retornados. O último plano conhecido da forma acompanha as
+ocorrências seguintes.
+
+A forma é a mesma do perfil por requisição (perfil_consultas.forma_do_comando). O explain de
+update/delete/findAndModify não altera dados. A fila é limitada: com ela cheia, ocorrências são
+descartadas (contadas em estatisticas()).
+
+GET /api/admin/consultas-lentas lista as formas com maior tempo acumulado na janela pedida.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+from flask import g, has_request_context, request
+from pymongo import monitoring
+
+import perfil_consultas
+
+logger = logging.getLogger(__name__)
+
+COLECAO = 'consultas_lentas'
+TAMANHO_PADRAO = 16 * 1024 * 1024
+COMANDOS_EXPLICAVEIS = ('find', 'aggregate', 'count', 'distinct', 'findAndModify', 'update', 'delete')
+# campos de sessão/transação que o explain não aceita
+_CAMPOS_SESSAO = ('lsid', '$clusterTime', '$db', 'txnNumber', 'autocommit', 'startTransaction',
+                  '$readPreference', 'readConcern', 'writeConcern', 'apiVersion', 'apiStrict',
+                  'apiDeprecationErrors')
+
+
+def garantir_colecao(db, tamanho: int = TAMANHO_PADRAO):
+    try:
+        if COLECAO not in set(db.list_collection_names()):
+            db.create_collection(COLECAO, capped=True, size=int(tamanho))
+    except Exception:
+        # mongomock não cria coleções limitadas; a coleção comum é criada no primeiro insert
+        pass
+    try:
+        db[COLECAO].create_index([('ts', 1)], name='idx_lentas_ts')
+    except Exception:
+        pass
+
+
+def comando_para_explain(cmd: dict, nome: str) -> dict:
+    limpo = {k: v for k, v in cmd.items() if k not in _CAMPOS_SESSAO}
+    # update/delete em lote: o plano do primeiro comando representa a forma
+    if nome == 'update' and len(limpo.get('updates') or []) > 1:
+        limpo['updates'] = limpo['updates'][:1]
+    if nome == 'delete' and len(limpo.get('deletes') or []) > 1:
+        limpo['deletes'] = limpo['deletes'][:1]
+    return limpo
+
+
+def _procurar(doc, chave):
+    """Primeiro valor de `chave` em qualquer nível (o explain de aggregate aninha o plano)."""
+    if isinstance(doc, dict):
+        if chave in doc:
+            return doc[chave]
+        for v in doc.values():
+            achado = _procurar(v, chave)
+            if achado is not None:
+                return achado
+    elif isinstance(doc, list):
+        for v in doc:
+            achado = _procurar(v, chave)
+            if achado is not None:
+                return achado
+    return None
+
+
+def _estagios(plano, estagios: list, indices: list):
+    if isinstance(plano, dict):
+        if plano.get('stage'):
+            estagios.append(plano['stage'])
+        if plano.get('indexName'):
+            indices.append(plano['indexName'])
+        for chave in ('inputStage', 'queryPlan', 'outerStage', 'innerStage'):
+            _estagios(plano.get(chave), estagios, indices)
+        for sub in plano.get('inputStages') or []:
+            _estagios(sub, estagios, indices)
+
+
+def resumir_plano(explain: dict) -> dict:
+    planner = _procurar(explain, 'queryPlanner') or {}
+    estagios, indices = [], []
+    _estagios(planner.get('winningPlan'), estagios, indices)
+    stats = _procurar(explain, 'executionStats') or {}
+    return {
+        'collscan': 'COLLSCAN' in estagios,
+        'estagios': estagios,
+        'indices': sorted(set(indices)),
+        'docs_examinados': stats.get('totalDocsExamined'),
+        'chaves_examinadas': stats.get('totalKeysExamined'),
+        'retornados': stats.get('nReturned'),
+        'tempo_explain_ms': stats.get('executionTimeMillis'),
+    }
+
+
+class RegistradorLento(monitoring.CommandListener):
+    def __init__(self, limite_ms: float = None, intervalo_explain: float = 300.0, fila: int = 1000,
+                 executar_explain=None):
+        self.limite_ms = limite_ms
+        self.intervalo_explain = float(intervalo_explain)
+        self.fila = queue.Queue(maxsize=max(1, int(fila)))
+        self._executar_explain = executar_explain
+        self._pendentes = {}
+        self._lock = threading.Lock()
+        self._planos = {}
+        self._explicado_em = {}
+        self._local = threading.local()
+        self._thread = None
+        self._parar = threading.Event()
+        self.registrados = 0
+        self.descartados = 0
+        self.explains = 0
+
+    # Listener
+    def started(self, event):
+        if self.limite_ms is None or event.command_name not in COMANDOS_EXPLICAVEIS or getattr(self._local, 'ativo', False):
+            return
+        contexto = None
+        if has_request_context():
+            contexto = {'request_id': g.get('request_id'), 'endpoint': request.endpoint}
+        with self._lock:
+            self._pendentes[(event.request_id, event.connection_id)] = (event.command, event.database_name, contexto)
+
+    def _concluir(self, event):
+        with self._lock:
+            item = self._pendentes.pop((event.request_id, event.connection_id), None)
+        if item is None:
+            return
+        duracao_ms = event.duration_micros / 1000.0
+        if duracao_ms < self.limite_ms:
+            return
+        cmd, banco, contexto = item
+        try:
+            self.fila.put_nowait({
+                'comando': comando_para_explain(cmd, event.command_name),
+                'nome': event.command_name,
+                'banco': banco,
+                'duracao_ms': round(duracao_ms, 3),
+                'contexto': contexto,
+                'ts': datetime.now(timezone.utc),
+            })
+        except queue.Full:
+            self.descartados += 1
+
+    def succeeded(self, event):
+        self._concluir(event)
+
+    def failed(self, event):
+        with self._lock:
+            self._pendentes.pop((event.request_id, event.connection_id), None)
+
+    # Processamento
+    def _explicar(self, item: dict):
+        if self._executar_explain is not None:
+            return self._executar_explain(item)
+        import extensions
+        return extensions.mongo_client[item['banco']].command(
+            {'explain': item['comando'], 'verbosity': 'executionStats'})
+
+    def processar(self, item: dict) -> dict:
+        import extensions
+        nome = item['nome']
+        forma = perfil_consultas.forma_do_comando(item['comando'], nome)
+        agora = time.monotonic()
+        plano = self._planos.get(forma)
+        ultimo = self._explicado_em.get(forma)
+        if ultimo is None or agora - ultimo >= self.intervalo_explain:
+            self._explicado_em[forma] = agora
+            # os comandos do próprio explain não entram no registro
+            self._local.ativo = True
+            try:
+                plano = resumir_plano(self._explicar(item))
+                self._planos[forma] = plano
+                self.explains += 1
+            except Exception as e:
+                logger.warning(f'[Consultas lentas] explain falhou para {forma}: {e}')
+            finally:
+                self._local.ativo = False
+        doc = {
+            'ts': item['ts'],
+            'forma': forma,
+            'colecao': item['comando'].get(nome) if isinstance(item['comando'].get(nome), str) else None,
+            'comando': nome,
+            'duracao_ms': item['duracao_ms'],
+            'plano': plano,
+            'request_id': (item.get('contexto') or {}).get('request_id'),
+            'endpoint': (item.get('contexto') or {}).get('endpoint'),
+        }
+        db = extensions.mongo_db
+        if db is not None:
+            self._local.ativo = True
+            try:
+                db[COLECAO].insert_one(doc)
+                self.registrados += 1
+            finally:
+                self._local.ativo = False
+        return doc
+
+    def processar_pendentes(self) -> list:
+        feitos = []
+        while True:
+            try:
+                item = self.fila.get_nowait()
+            except queue.Empty:
+                return feitos
+            feitos.append(self.processar(item))
+
+    # Ciclo de vida
+    def iniciar(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._executar, name='slow-query-recorder', daemon=True)
+        self._thread.start()
+
+    def encerrar(self, timeout: float = 5.0):
+        self._parar.set()
+        t = self._thread
+        if t is not None and t.is_alive():
+            t.join(timeout)
+
+    def _executar(self):
+        while not self._parar.is_set():
+            try:
+                item = self.fila.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            try:
+                self.processar(item)
+            except Exception as e:
+                logger.error(f'[Consultas lentas] Falha ao registrar: {e}')
+
+    def estatisticas(self) -> dict:
+        return {
+            'limite_ms': self.limite_ms,
+            'pendentes': self.fila.qsize(),
+            'registrados': self.registrados,
+            'descartados': self.descartados,
+            'explains': self.explains,
+        }
+
+
+registrador = RegistradorLento()
+_atexit_registrado = False
+
+
+def init_app(app):
+    """Aplica o limite (MONGO_SLOW_MS) e inicia a thread; MONGO_SLOW_ENABLED=False desliga."""
+    global _atexit_registrado
+    if not app.config.get('MONGO_SLOW_ENABLED', True):
+        registrador.limite_ms = None
+        return None
+    registrador.limite_ms = float(app.config.get('MONGO_SLOW_MS', 200))
+    registrador.intervalo_explain = float(app.config.get('MONGO_SLOW_EXPLAIN_INTERVAL', 300))
+    if not _atexit_registrado:
+        atexit.register(registrador.encerrar)
+        _atexit_registrado = True
+    registrador.iniciar()
+    return registrador
+
+
+def piores_formas(db, desde: datetime, limite: int = 20) -> list:
+    """Formas com maior tempo acumulado desde `desde`, com o último plano conhecido."""
+    pipeline = [
+        {'$match': {'ts': {'$gte': desde}}},
+        {'$sort': {'ts': 1}},
+        {'$group': {
+            '_id': '$forma',
+            'colecao': {'$last': '$colecao'},
+            'total_ms': {'$sum': '$duracao_ms'},
+            'ocorrencias': {'$sum': 1},
+            'max_ms': {'$max': '$duracao_ms'},
+            'ultima': {'$last': '$ts'},
+            'plano': {'$last': '$plano'},
+            'endpoint': {'$last': '$endpoint'},
+        }},
+        {'$sort': {'total_ms': -1}},
+        {'$limit': int(limite)},
+    ]
+    return list(db[COLECAO].aggregate(pipeline))
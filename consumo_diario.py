@@ -0,0 +1,166 @@
+"""Visão materializada de consumo/gastos por dia e produto ('relatorio_consumo_diario').
+
+O relatório administrativo de consumo/gastos soma os dias completos desta visão e agrega ao
+vivo só as bordas parciais do período. A visão é mantida por atualizar():
+
+- dias tocados por movimentações criadas/alteradas desde a marca d'água são reagregados por
+  inteiro. A varredura recomeça MARGEM_PADRAO_SEGUNDOS antes da marca: movimentações com
+  created_at/updated_at anterior que só ficaram visíveis depois (commit atrasado, relógio de
+  outro processo) não são perdidas. Reagregar um dia duas vezes é inofensivo.
+- exclusões e arquivamento não deixam rastro na coleção; quem remove movimentações chama
+  marcar_dias() com as datas removidas (arquivamento.arquivar faz isso) e os dias pendentes
+  são reagregados na próxima atualização, assim como alterações de data feitas nas rotas.
+
+A atualização roda no agendador em segundo plano (backups.BackupScheduler) a cada ciclo.
+Na rota do relatório atualizar_se_preciso() só reprocessa quando há dias pendentes ou a
+última atualização tem mais de CONSUMO_DIARIO_REFRESH_SEGUNDOS.
+"""
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ReplaceOne
+
+import movimentacoes_repo
+
+COLECAO = 'relatorio_consumo_diario'
+COLECAO_META = 'relatorios_materializados'
+META_ID = 'consumo_diario'
+MARGEM_PADRAO_SEGUNDOS = 300
+
+# Tipos de movimentação contabilizados como consumo nos relatórios
+TIPOS_SAIDA_CONSUMO = ['transferencia', 'saida', 'consumo', 'retirada']
+
+
+def group_stage():
+    """Estágio $group (por produto) compartilhado entre agregação ao vivo e materialização diária."""
+    return {
+        '$group': {
+            '_id': '$produto_id',
+            'total_consumo': {
+                '$sum': {
+                    '$cond': [
+                        {'$in': ['$tipo', TIPOS_SAIDA_CONSUMO]},
+                        '$quantidade',
+                        0
+                    ]
+                }
+            },
+            'total_gastos': {
+                '$sum': {
+                    '$cond': [
+                        {'$eq': ['$tipo', 'entrada']},
+                        {'$multiply': [
+                            {'$ifNull': ['$quantidade', 0]},
+                            {'$ifNull': ['$preco_unitario', 0]}
+                        ]},
+                        0
+                    ]
+                }
+            }
+        }
+    }
+
+
+def _naive_utc(dt):
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def dia_utc(dt):
+    """Trunca um datetime para o início do dia em UTC (naive, como o Mongo devolve)."""
+    if not isinstance(dt, datetime):
+        return None
+    dt = _naive_utc(dt)
+    return datetime(dt.year, dt.month, dt.day)
+
+
+def marcar_dias(db, datas) -> None:
+    """Marca os dias das datas informadas como pendentes de recálculo (data alterada, exclusão,
+    arquivamento)."""
+    dias = sorted({d for d in (dia_utc(x) for x in datas or []) if d is not None})
+    if not dias:
+        return
+    db[COLECAO_META].update_one(
+        {'_id': META_ID},
+        {'$addToSet': {'dias_pendentes': {'$each': dias}}},
+        upsert=True
+    )
+
+
+def _reagregar_dia(movs, diario, dia, agora):
+    fim = dia + timedelta(days=1)
+    keys = []
+    ops = []
+    for row in movs.aggregate([{'$match': {'data_movimentacao': {'$gte': dia, '$lt': fim}}}, group_stage()]):
+        key = str(row.get('_id'))
+        keys.append(key)
+        ops.append(ReplaceOne(
+            {'dia': dia, 'produto_key': key},
+            {
+                'dia': dia,
+                'produto_key': key,
+                'produto_id': row.get('_id'),
+                'total_consumo': float(row.get('total_consumo') or 0.0),
+                'total_gastos': float(row.get('total_gastos') or 0.0),
+                'updated_at': agora
+            },
+            upsert=True
+        ))
+    if ops:
+        diario.bulk_write(ops, ordered=False)
+    diario.delete_many({'dia': dia, 'produto_key': {'$nin': keys}})
+
+
+def atualizar(db, margem_segundos: float = MARGEM_PADRAO_SEGUNDOS) -> int:
+    """Atualiza incrementalmente a visão. Na primeira execução todos os dias são materializados.
+    Retorna o número de dias reagregados."""
+    movs = movimentacoes_repo.get_repo(db)
+    meta_coll = db[COLECAO_META]
+    meta = meta_coll.find_one({'_id': META_ID}) or {}
+    watermark = meta.get('watermark')
+    pendentes = list(meta.get('dias_pendentes') or [])
+
+    dias = {d for d in (dia_utc(x) for x in pendentes) if d is not None}
+    novo_watermark = watermark
+    if watermark is None:
+        query = {'data_movimentacao': {'$ne': None}}
+    else:
+        desde = watermark - timedelta(seconds=float(margem_segundos or 0))
+        query = {'$or': [{'created_at': {'$gte': desde}}, {'updated_at': {'$gte': desde}}]}
+    for m in movs.find(query, {'data_movimentacao': 1, 'created_at': 1, 'updated_at': 1}).batch_size(5000):
+        dia = dia_utc(m.get('data_movimentacao'))
+        if dia is not None:
+            dias.add(dia)
+        for campo in ('created_at', 'updated_at'):
+            ts = m.get(campo)
+            if isinstance(ts, datetime):
+                ts = _naive_utc(ts)
+                if novo_watermark is None or ts > novo_watermark:
+                    novo_watermark = ts
+
+    agora = datetime.utcnow()
+    if novo_watermark is None:
+        novo_watermark = agora
+    diario = db[COLECAO]
+    for dia in sorted(dias):
+        _reagregar_dia(movs, diario, dia, agora)
+
+    meta_update = {'$set': {'watermark': novo_watermark, 'updated_at': agora}}
+    if pendentes:
+        # só os dias lidos: marcações feitas durante a atualização ficam para a próxima
+        meta_update['$pullAll'] = {'dias_pendentes': pendentes}
+    meta_coll.update_one({'_id': META_ID}, meta_update, upsert=True)
+    return len(dias)
+
+
+def atualizar_se_preciso(db, intervalo_segundos: float, margem_segundos: float = MARGEM_PADRAO_SEGUNDOS) -> bool:
+    """Atualiza a visão se houver dias pendentes ou a última atualização tiver mais de
+    `intervalo_segundos` (0 = sempre). Retorna True quando atualizou."""
+    meta = db[COLECAO_META].find_one({'_id': META_ID}, {'dias_pendentes': 1, 'updated_at': 1}) or {}
+    ultima = meta.get('updated_at')
+    intervalo = float(intervalo_segundos or 0)
+    if (not meta.get('dias_pendentes') and intervalo > 0 and isinstance(ultima, datetime)
+            and datetime.utcnow() - _naive_utc(ultima) < timedelta(seconds=intervalo)):
+        return False
+    atualizar(db, margem_segundos)
+    return True
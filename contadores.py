@@ -0,0 +1,77 @@
+"""Contadores sequenciais atômicos (coleção 'contadores').
+
+Cada documento é {'_id': <chave>, 'valor': <último número emitido>}. O próximo número sai de
+um único find_one_and_update com $inc, então requisições concorrentes nunca recebem o mesmo
+valor. Os códigos de produto usam uma chave por prefixo <central>-<categoria>-; no primeiro uso
+o contador é semeado com a maior sequência já existente em 'produtos' para aquele prefixo
+(ou de uma vez para todos com scripts/semear_contadores_codigos.py).
+"""
+import re
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+COLECAO = 'contadores'
+_CODIGO_SEQUENCIAL = re.compile(r'^(.*-)(\d+)$')
+
+
+def chave_codigo_produto(prefixo: str) -> str:
+    return f'produto_codigo:{prefixo}'
+
+
+def _maior_sequencia(db, prefixo: str) -> int:
+    maior = 0
+    padrao = re.compile(rf'^{re.escape(prefixo)}(\d+)$')
+    for doc in db['produtos'].find({'codigo': {'$regex': f'^{re.escape(prefixo)}'}}, {'codigo': 1, '_id': 0}):
+        m = padrao.match(str(doc.get('codigo') or ''))
+        if m:
+            maior = max(maior, int(m.group(1)))
+    return maior
+
+
+def proximo_valor(db, chave: str, semente=None) -> int:
+    """Incrementa e retorna o contador. `semente` (int ou callable) só é usada quando o contador
+    ainda não existe; o valor devolvido é então semente + 1."""
+    coll = db[COLECAO]
+    doc = coll.find_one_and_update({'_id': chave}, {'$inc': {'valor': 1}}, return_document=ReturnDocument.AFTER)
+    if doc is not None:
+        return int(doc['valor'])
+    inicial = int((semente() if callable(semente) else semente) or 0)
+    try:
+        # $max: se outra requisição criou o contador nesse meio tempo, não volta o valor
+        coll.update_one({'_id': chave}, {'$max': {'valor': inicial}}, upsert=True)
+    except DuplicateKeyError:
+        pass
+    doc = coll.find_one_and_update({'_id': chave}, {'$inc': {'valor': 1}}, return_document=ReturnDocument.AFTER)
+    return int(doc['valor'])
+
+
+def proximo_codigo_produto(db, prefixo: str, digitos: int = 4) -> str:
+    seq = proximo_valor(db, chave_codigo_produto(prefixo), semente=lambda: _maior_sequencia(db, prefixo))
+    return f'{prefixo}{seq:0{digitos}d}'
+
+
+def registrar_codigo_produto(db, codigo) -> None:
+    """Código digitado/importado no formato <prefixo><número>: avança o contador do prefixo para
+    que a geração automática não o repita. Contador inexistente fica para a semeadura."""
+    m = _CODIGO_SEQUENCIAL.match(str(codigo or '').strip())
+    if not m:
+        return
+    try:
+        db[COLECAO].update_one({'_id': chave_codigo_produto(m.group(1))}, {'$max': {'valor': int(m.group(2))}})
+    except Exception:
+        pass
+
+
+def semear_contadores(db) -> dict:
+    """Semeia (com $max) os contadores de todos os prefixos a partir dos códigos existentes."""
+    maiores = {}
+    for doc in db['produtos'].find({'codigo': {'$type': 'string'}}, {'codigo': 1, '_id': 0}):
+        m = _CODIGO_SEQUENCIAL.match(doc.get('codigo') or '')
+        if m:
+            prefixo, n = m.group(1), int(m.group(2))
+            maiores[prefixo] = max(maiores.get(prefixo, 0), n)
+    ops = [UpdateOne({'_id': chave_codigo_produto(p)}, {'$max': {'valor': n}}, upsert=True) for p, n in maiores.items()]
+    if ops:
+        db[COLECAO].bulk_write(ops, ordered=False)
+    return {'prefixos': len(maiores)}
@@ -0,0 +1,286 @@
+"""Massa de dados sintética e determinística para medir desempenho.
+
+gerar() popula centrais, almoxarifados, sub-almoxarifados, setores, categorias, produtos,
+estoques, lotes e movimentações com insert_many em lotes, a partir de um RNG com semente: a
+mesma escala e semente produzem exatamente os mesmos documentos (inclusive os ObjectId), em um
+mongod local ou no mongomock. Os identificadores seguem a mistura encontrada em produção:
+documentos com 'id' sequencial (int) e _id ObjectId, documentos antigos sem 'id', e referências
+gravadas como int, ObjectId ou hex de 24 caracteres.
+
+A escala e a semente usadas ficam em 'dataset_info' (_id 'sintetico') para que os benchmarks
+confiram contra qual massa foram medidos. CLI: scripts/gerar_dataset_sintetico.py.
+"""
+import random
+import struct
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+COLECAO_INFO = 'dataset_info'
+COLECOES = ('centrais', 'almoxarifados', 'sub_almoxarifados', 'setores', 'categorias', 'produtos',
+            'estoques', 'lotes', 'movimentacoes')
+
+ESCALAS = {
+    'teste': {'centrais': 2, 'almoxarifados': 4, 'sub_almoxarifados': 8, 'setores': 20, 'categorias': 10,
+              'produtos': 200, 'estoques': 1000, 'lotes': 300, 'movimentacoes': 5000},
+    'media': {'centrais': 5, 'almoxarifados': 50, 'sub_almoxarifados': 150, 'setores': 500, 'categorias': 30,
+              'produtos': 10000, 'estoques': 100000, 'lotes': 20000, 'movimentacoes': 1000000},
+    'grande': {'centrais': 10, 'almoxarifados': 200, 'sub_almoxarifados': 600, 'setores': 2000, 'categorias': 50,
+               'produtos': 100000, 'estoques': 1000000, 'lotes': 200000, 'movimentacoes': 20000000},
+}
+
+# proporções da mistura de ids
+SEM_ID_SEQUENCIAL = 0.1   # documentos antigos só com _id
+REF_HEX = 0.1             # referência a documento com 'id' gravada como hex do _id
+REF_OBJECTID = 0.5        # referência a documento sem 'id': ObjectId (o resto, hex)
+
+_DATA_BASE = datetime(2026, 1, 1)
+_UNIDADES = ('un', 'cx', 'fr', 'amp', 'pct', 'ml', 'g')
+_NOMES = ('Seringa', 'Luva', 'Máscara', 'Cateter', 'Gaze', 'Soro', 'Dipirona', 'Agulha', 'Atadura',
+          'Equipo', 'Sonda', 'Compressa', 'Esparadrapo', 'Álcool', 'Clorexidina', 'Avental')
+_USUARIOS = tuple(f'operador{i:02d}' for i in range(1, 41))
+
+
+class _Gerador:
+    def __init__(self, seed: int):
+        self.rng = random.Random(seed)
+
+    def oid(self, quando: datetime = None) -> ObjectId:
+        ts = int(((quando or _DATA_BASE) - datetime(1970, 1, 1)).total_seconds())
+        return ObjectId(struct.pack('>I', ts) + self.rng.randbytes(8))
+
+    def entidade(self, seq: int, quando: datetime = None) -> dict:
+        doc = {'_id': self.oid(quando)}
+        if self.rng.random() >= SEM_ID_SEQUENCIAL:
+            doc['id'] = seq
+        return doc
+
+    def ref(self, doc: dict):
+        """Referência a `doc` como a aplicação grava: id sequencial quando existe, senão _id."""
+        r = self.rng.random()
+        if doc.get('id') is not None:
+            return str(doc['_id']) if r < REF_HEX else doc['id']
+        return doc['_id'] if r < REF_OBJECTID else str(doc['_id'])
+
+    def pid(self, doc: dict):
+        # estoques/movimentações usam o id sequencial do produto ou o hex do _id (pid_out)
+        return doc['id'] if doc.get('id') is not None else str(doc['_id'])
+
+    def popular(self, n: int) -> int:
+        # poucos itens concentram a maior parte das movimentações
+        return min(n - 1, int(n * (self.rng.random() ** 2.5)))
+
+
+def _inserir(db, nome: str, docs, batch_size: int, progresso=None) -> int:
+    total = 0
+    lote = []
+    for doc in docs:
+        lote.append(doc)
+        if len(lote) >= batch_size:
+            db[nome].insert_many(lote, ordered=False)
+            total += len(lote)
+            lote = []
+            if progresso is not None:
+                progresso(nome, total)
+    if lote:
+        db[nome].insert_many(lote, ordered=False)
+        total += len(lote)
+        if progresso is not None:
+            progresso(nome, total)
+    return total
+
+
+def _coprimo(n: int, inicio: int = 7919) -> int:
+    import math
+    p = inicio
+    while math.gcd(p, n) != 1:
+        p += 1
+    return p
+
+
+def gerar(db, escala: dict, seed: int = 42, batch_size: int = 5000, limpar: bool = False, progresso=None) -> dict:
+    """Gera a massa em `db`. `escala` é um dos ESCALAS (ou um dict com as mesmas chaves)."""
+    esc = dict(ESCALAS['teste'])
+    esc.update(escala or {})
+    g = _Gerador(seed)
+    if limpar:
+        for nome in COLECOES:
+            db[nome].delete_many({})
+    contagem = {}
+
+    # Hierarquia (pequena: fica em memória para as referências)
+    centrais = []
+    for i in range(1, esc['centrais'] + 1):
+        c = g.entidade(i)
+        c.update({'nome': f'Central {i:02d}', 'descricao': '', 'ativo': True, 'created_at': _DATA_BASE})
+        centrais.append(c)
+    almoxs = []
+    for i in range(1, esc['almoxarifados'] + 1):
+        central = centrais[(i - 1) % len(centrais)]
+        a = g.entidade(i)
+        a.update({'nome': f'Almoxarifado {i:03d}', 'descricao': '', 'ativo': True,
+                  'central_id': g.ref(central), 'created_at': _DATA_BASE})
+        almoxs.append(a)
+    subs = []
+    for i in range(1, esc['sub_almoxarifados'] + 1):
+        almox = almoxs[(i - 1) % len(almoxs)]
+        s = g.entidade(i)
+        s.update({'nome': f'Sub-Almoxarifado {i:04d}', 'descricao': '', 'ativo': True,
+                  'almoxarifado_id': g.ref(almox), 'created_at': _DATA_BASE})
+        s['_almox'] = almox
+        subs.append(s)
+    setores = []
+    for i in range(1, esc['setores'] + 1):
+        sub = subs[(i - 1) % len(subs)]
+        st = g.entidade(i)
+        sub_ref = g.ref(sub)
+        st.update({'nome': f'Setor {i:05d}', 'descricao': '', 'ativo': True,
+                   'sub_almoxarifado_id': sub_ref, 'sub_almoxarifado_ids': [sub_ref],
+                   'almoxarifado_ids': [g.ref(sub['_almox'])], 'created_at': _DATA_BASE})
+        st['_sub'] = sub
+        setores.append(st)
+    categorias = []
+    for i in range(1, esc['categorias'] + 1):
+        cat = g.entidade(i)
+        cat.update({'nome': f'Categoria {i:02d}', 'codigo': f'CAT{i:02d}', 'ativo': True, 'created_at': _DATA_BASE})
+        categorias.append(cat)
+
+    def _sem_privados(docs):
+        return ({k: v for k, v in d.items() if not k.startswith('_') or k == '_id'} for d in docs)
+
+    contagem['centrais'] = _inserir(db, 'centrais', _sem_privados(centrais), batch_size, progresso)
+    contagem['almoxarifados'] = _inserir(db, 'almoxarifados', _sem_privados(almoxs), batch_size, progresso)
+    contagem['sub_almoxarifados'] = _inserir(db, 'sub_almoxarifados', _sem_privados(subs), batch_size, progresso)
+    contagem['setores'] = _inserir(db, 'setores', _sem_privados(setores), batch_size, progresso)
+    contagem['categorias'] = _inserir(db, 'categorias', _sem_privados(categorias), batch_size, progresso)
+
+    # Produtos: só o necessário para referências fica em memória
+    produtos = []
+
+    def _produtos():
+        for i in range(1, esc['produtos'] + 1):
+            central = centrais[g.rng.randrange(len(centrais))]
+            categoria = categorias[g.rng.randrange(len(categorias))]
+            p = g.entidade(i, _DATA_BASE - timedelta(days=g.rng.randrange(1500)))
+            p.update({
+                'codigo': f"C{centrais.index(central) + 1:02d}-{categoria['codigo']}-{i:06d}",
+                'nome': f'{g.rng.choice(_NOMES)} {i}',
+                'unidade_medida': g.rng.choice(_UNIDADES),
+                'estoque_minimo': g.rng.choice((0, 5, 10, 20, 50, 100)),
+                'central_id': g.ref(central),
+                'categoria_id': g.ref(categoria),
+                'ativo': g.rng.random() > 0.03,
+                'created_at': p['_id'].generation_time.replace(tzinfo=None),
+            })
+            produtos.append({'_id': p['_id'], 'id': p.get('id')})
+            yield p
+
+    contagem['produtos'] = _inserir(db, 'produtos', _produtos(), batch_size, progresso)
+
+    # Locais: (tipo, doc, doc do almoxarifado, doc do sub)
+    locais = [('almoxarifado', a, a, None) for a in almoxs]
+    locais += [('sub_almoxarifado', s, s['_almox'], s) for s in subs]
+    locais += [('setor', st, st['_sub']['_almox'], st['_sub']) for st in setores]
+
+    def _local_ids(tipo, doc, almox, sub):
+        ids = {'almoxarifado_id': g.pid(almox), 'sub_almoxarifado_id': g.pid(sub) if sub else None,
+               'setor_id': g.pid(doc) if tipo == 'setor' else None}
+        return g.pid(doc), ids
+
+    # Estoques: pares (produto, local) distintos por permutação k -> k * primo mod (P*L)
+    pares = len(produtos) * len(locais)
+    n_estoques = min(esc['estoques'], pares)
+    primo = _coprimo(pares)
+
+    def _estoques():
+        for i in range(n_estoques):
+            k = (i * primo) % pares
+            prod = produtos[k // len(locais)]
+            tipo, doc, almox, sub = locais[k % len(locais)]
+            local_id, ids = _local_ids(tipo, doc, almox, sub)
+            qtd = float(g.rng.choice((0, 0, 1, 3, 5, 10, 20, 50, 100, 250, 1000)))
+            reservada = float(min(qtd, g.rng.choice((0, 0, 0, 1, 2, 5))))
+            quando = _DATA_BASE - timedelta(minutes=g.rng.randrange(60 * 24 * 365))
+            yield dict({
+                '_id': g.oid(quando),
+                'produto_id': g.pid(prod),
+                'local_tipo': tipo,
+                'local_id': local_id,
+                'nome_local': doc['nome'],
+                'quantidade': qtd,
+                'quantidade_disponivel': qtd - reservada,
+                'quantidade_reservada': reservada,
+                'created_at': quando,
+                'updated_at': quando,
+            }, **ids)
+
+    contagem['estoques'] = _inserir(db, 'estoques', _estoques(), batch_size, progresso)
+
+    def _lotes():
+        for i in range(esc['lotes']):
+            prod = produtos[g.popular(len(produtos))]
+            almox = almoxs[g.rng.randrange(len(almoxs))]
+            venc = _DATA_BASE + timedelta(days=g.rng.randrange(-60, 720))
+            yield {
+                '_id': g.oid(venc - timedelta(days=720)),
+                'produto_id': g.pid(prod),
+                'lote': f'L{i:07d}',
+                'local_tipo': 'almoxarifado',
+                'local_id': g.pid(almox),
+                'almoxarifado_id': g.pid(almox),
+                'data_fabricacao': venc - timedelta(days=720),
+                'data_vencimento': venc,
+                'quantidade_atual': float(g.rng.choice((0, 5, 10, 50, 200))),
+                'created_at': venc - timedelta(days=700),
+            }
+
+    contagem['lotes'] = _inserir(db, 'lotes', _lotes(), batch_size, progresso)
+
+    almox_locais = [l for l in locais if l[0] == 'almoxarifado']
+    sub_locais = [l for l in locais if l[0] == 'sub_almoxarifado']
+    setor_locais = [l for l in locais if l[0] == 'setor']
+    dias = 730
+
+    def _movimentacoes():
+        for _ in range(esc['movimentacoes']):
+            prod = produtos[g.popular(len(produtos))]
+            quando = _DATA_BASE - timedelta(seconds=g.rng.randrange(dias * 86400))
+            r = g.rng.random()
+            doc = {
+                '_id': g.oid(quando),
+                'produto_id': g.pid(prod),
+                'quantidade': float(g.rng.choice((1, 1, 2, 3, 5, 10, 20, 50))),
+                'data_movimentacao': quando,
+                'usuario_responsavel': g.rng.choice(_USUARIOS),
+                'created_at': quando,
+            }
+            if r < 0.15:
+                tipo, local, _, _ = almox_locais[g.rng.randrange(len(almox_locais))]
+                doc.update({'tipo': 'entrada', 'origem_nome': 'Fornecedor', 'destino_nome': local['nome'],
+                            'local_tipo': tipo, 'local_id': g.pid(local),
+                            'preco_unitario': round(g.rng.uniform(0.1, 300.0), 2),
+                            'nota_fiscal': f'NF{g.rng.randrange(10 ** 6):06d}'})
+            elif r < 0.75:
+                # almoxarifado -> sub ou sub -> setor
+                if g.rng.random() < 0.4:
+                    _, destino, origem, _ = sub_locais[g.rng.randrange(len(sub_locais))]
+                    origem_tipo, destino_tipo = 'almoxarifado', 'sub_almoxarifado'
+                else:
+                    _, destino, _, origem = setor_locais[g.rng.randrange(len(setor_locais))]
+                    origem_tipo, destino_tipo = 'sub_almoxarifado', 'setor'
+                doc.update({'tipo': 'transferencia', 'origem_tipo': origem_tipo, 'origem_id': g.pid(origem),
+                            'origem_nome': origem['nome'], 'destino_tipo': destino_tipo,
+                            'destino_id': g.pid(destino), 'destino_nome': destino['nome']})
+            else:
+                _, setor, _, _ = setor_locais[g.rng.randrange(len(setor_locais))]
+                doc.update({'tipo': g.rng.choice(('saida', 'consumo')), 'origem_tipo': 'setor',
+                            'origem_id': g.pid(setor), 'origem_nome': setor['nome'],
+                            'setor_id': g.pid(setor), 'local_tipo': 'setor', 'local_id': g.pid(setor)})
+            yield doc
+
+    contagem['movimentacoes'] = _inserir(db, 'movimentacoes', _movimentacoes(), batch_size, progresso)
+
+    db[COLECAO_INFO].replace_one({'_id': 'sintetico'}, {
+        '_id': 'sintetico', 'seed': seed, 'escala': esc, 'contagem': contagem, 'gerado_em': datetime.utcnow(),
+    }, upsert=True)
+    return contagem
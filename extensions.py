@@ -1,12 +1,17 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
-from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo import MongoClient, ASCENDING
 from pymongo.errors import ServerSelectionTimeoutError, AutoReconnect
 from werkzeug.security import generate_password_hash
 from datetime import datetime
 import os
 import time
 
+import consultas_lentas
+import indices
+import metricas
+import perfil_consultas
+
 # SQLAlchemy (mantido para compatibilidade em partes do código)
 db = SQLAlchemy()
 migrate = Migrate()
@@ -20,10 +25,17 @@ class SimpleTTLCache:
         self.store = {}
         self.order = []
         self.max_size = max_size
+        # contadores expostos em /metrics (metricas.py)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
 
     def get(self, key):
         val = self.store.get(key)
         if not val:
+            self.misses += 1
             return None
         data, exp = val
         if exp is not None and exp < time.time():
@@ -31,7 +43,10 @@ class SimpleTTLCache:
                 del self.store[key]
             except Exception:
                 pass
+            self.expirations += 1
+            self.misses += 1
             return None
+        self.hits += 1
         return data
 
     def set(self, key, data, ttl: int = 30):
@@ -42,6 +57,7 @@ class SimpleTTLCache:
             old = self.order.pop(0)
             try:
                 del self.store[old]
+                self.evictions += 1
             except Exception:
                 pass
 
@@ -51,6 +67,7 @@ class SimpleTTLCache:
             for k in keys:
                 try:
                     del self.store[k]
+                    self.invalidations += 1
                 except Exception:
                     pass
         except Exception:
@@ -58,6 +75,54 @@ class SimpleTTLCache:
 
 response_cache = SimpleTTLCache(2000)
 
+def supports_transactions(client=None) -> bool:
+    """Indica se o cliente está em replica set/sharded (transações multi-documento disponíveis)."""
+    client = client if client is not None else mongo_client
+    try:
+        topo = client.topology_description.topology_type_name
+        if topo == 'Unknown':
+            # connect=False: sem seleção de servidor a topologia ainda é desconhecida
+            client.admin.command('ping')
+            topo = client.topology_description.topology_type_name
+    except Exception:
+        # mongomock e clientes sem topologia conhecida
+        return False
+    return topo in ('ReplicaSetWithPrimary', 'Sharded')
+
+def run_transaction(callback, client=None):
+    """Executa callback(session) dentro de uma transação quando suportado.
+    Em standalone/mongomock executa callback(None) diretamente (cada escrita segue atômica por documento).
+    with_transaction já repete a transação inteira em erros transitórios (TransientTransactionError).
+    """
+    client = client if client is not None else mongo_client
+    if not supports_transactions(client):
+        return callback(None)
+    with client.start_session() as session:
+        return session.with_transaction(callback)
+
+def _ensure_produtos_codigo_unico(db, logger=None):
+    """Índice único em produtos.codigo (substitui o antigo idx_prod_codigo não único).
+    Com códigos duplicados na base o índice único não é criado: o antigo é mantido e o
+    problema registrado no log até que os duplicados sejam corrigidos."""
+    coll = db['produtos']
+    existentes = coll.index_information()
+    if 'idx_prod_codigo_unico' in existentes:
+        return
+    # Mesmo padrão de chave: o índice antigo precisa sair antes do novo
+    if 'idx_prod_codigo' in existentes:
+        coll.drop_index('idx_prod_codigo')
+    try:
+        coll.create_index([('codigo', ASCENDING)], unique=True, name='idx_prod_codigo_unico',
+                          partialFilterExpression={'codigo': {'$type': 'string'}})
+    except Exception as e:
+        msg = f'[Mongo Init] Índice único em produtos.codigo não criado (códigos duplicados?): {e}'
+        if logger is not None:
+            logger.warning(msg)
+        else:
+            print(msg)
+        coll.create_index([('codigo', ASCENDING)], name='idx_prod_codigo')
+
+
 def ensure_collections_and_indexes(db, logger=None):
     """Cria coleções essenciais e índices (idempotente)."""
     try:
@@ -78,37 +143,18 @@ def ensure_collections_and_indexes(db, logger=None):
         for name in required:
             if name not in existing:
                 db.create_collection(name)
-        # Índices essenciais
-        db['usuarios'].create_index([('username', ASCENDING)], unique=True, name='idx_unique_username')
-        db['produtos'].create_index([('codigo', ASCENDING)], name='idx_prod_codigo')
-        db['produtos'].create_index([('nome', ASCENDING)], name='idx_prod_nome')
-        try:
-            db['movimentacoes'].create_index([('data_movimentacao', ASCENDING)], name='idx_mov_data_movimentacao')
-        except Exception:
-            pass
-        try:
-            db['movimentacoes'].create_index([('tipo', ASCENDING)], name='idx_mov_tipo')
-            db['movimentacoes'].create_index([('produto_id', ASCENDING)], name='idx_mov_produto')
-            db['movimentacoes'].create_index([('created_at', DESCENDING)], name='idx_mov_created_at')
-            db['movimentacoes'].create_index([('produto_id', ASCENDING), ('data_movimentacao', DESCENDING)], name='idx_mov_prod_data')
-        except Exception:
-            pass
-        try:
-            db['estoques'].create_index([('produto_id', ASCENDING)], name='idx_est_produto')
-            db['estoques'].create_index([('local_tipo', ASCENDING), ('local_id', ASCENDING)], name='idx_est_local')
-            db['estoques'].create_index([('updated_at', DESCENDING)], name='idx_est_updated')
-        except Exception:
-            pass
-        try:
-            db['logs_auditoria'].create_index([('timestamp', ASCENDING)], name='idx_audit_time')
-            db['logs_auditoria'].create_index([('usuario_id', ASCENDING)], name='idx_audit_user')
-        except Exception:
-            pass
-        try:
-            db['listas_compras'].create_index([('usuario_id', ASCENDING)], name='idx_lista_usuario')
-            db['listas_compras'].create_index([('created_at', ASCENDING)], name='idx_lista_created')
-        except Exception:
-            pass
+        # migração do índice único de produtos.codigo (com fallback quando há duplicados)
+        _ensure_produtos_codigo_unico(db, logger)
+        # registro de consultas lentas (coleção limitada)
+        consultas_lentas.garantir_colecao(db)
+        # demais índices: catálogo declarativo em config/indices.py; falhas vão para o log
+        res = indices.sincronizar(db, logger=logger)
+        if res['criados']:
+            msg = f"[Mongo Init] Índices criados: {', '.join(res['criados'])}"
+            if logger is not None:
+                logger.info(msg)
+            else:
+                print(msg)
     except Exception as e:
         if logger is not None:
             logger.error(f'[Mongo Init] Falha ao criar coleções/índices: {e}')
@@ -127,286 +173,216 @@ def _sanitize_mongo_uri(uri: str) -> str:
     except Exception:
         return '<hidden>'
 
+def _mock_permitido(app) -> bool:
+    return bool(app.config.get('ALLOW_MOCK_DB')) or os.environ.get('USE_MONGOMOCK', 'false').lower() == 'true'
+
+
+def usando_mongomock() -> bool:
+    return mongo_client is not None and type(mongo_client).__module__.startswith('mongomock')
+
+
+def _conectar_mongomock(app, dbname):
+    global mongo_client, mongo_db
+    import mongomock
+    perfil_consultas.instrumentar_mongomock()
+    mongo_client = mongomock.MongoClient()
+    mongo_db = mongo_client[dbname]
+
+
 def init_mongo(app):
-    """Inicializa cliente MongoDB usando configurações do app e semeia usuário admin padrão se necessário."""
+    """Cria o cliente MongoDB sem nenhuma operação no banco (boot de worker rápido e sem escrita).
+
+    Com connect=False o pymongo só abre conexões no primeiro comando, já no processo do worker
+    (seguro após o fork do gunicorn). Coleções, índices e usuários iniciais ficam por conta de
+    inicializar_banco() (scripts/inicializar_banco.py), executado uma vez por deploy.
+    USE_MONGOMOCK=true usa um banco em memória, que por ser do processo já nasce inicializado.
+    """
     global mongo_client, mongo_db
     if mongo_client is None:
         mongo_uri = app.config.get('MONGO_URI')
         dbname = app.config.get('MONGO_DB')
+        if os.environ.get('USE_MONGOMOCK', 'false').lower() == 'true':
+            app.logger.info(f"[Mongo Init] Usando mongomock (USE_MONGOMOCK) DB={dbname}")
+            _conectar_mongomock(app, dbname)
+            inicializar_banco(app)
+            return mongo_client, mongo_db
         # Ler ajustes de tempo e TLS via ambiente
         timeout_select = int(os.environ.get('MONGO_TIMEOUT_SELECT_MS', '15000'))
         timeout_connect = int(os.environ.get('MONGO_TIMEOUT_CONNECT_MS', '12000'))
         timeout_socket = int(os.environ.get('MONGO_TIMEOUT_SOCKET_MS', '12000'))
         allow_invalid = os.environ.get('MONGO_TLS_ALLOW_INVALID', 'false').lower() == 'true'
-        app.logger.info(f"[Mongo Init] Conectando em URI={_sanitize_mongo_uri(mongo_uri)} DB={dbname}")
+        app.logger.info(f"[Mongo Init] Cliente para URI={_sanitize_mongo_uri(mongo_uri)} DB={dbname} (conexão no primeiro uso)")
         app.logger.info(f"[Mongo Init] Options: select={timeout_select}ms connect={timeout_connect}ms socket={timeout_socket}ms tlsAllowInvalid={allow_invalid}")
+        client_kwargs = {
+            'serverSelectionTimeoutMS': timeout_select,
+            'connectTimeoutMS': timeout_connect,
+            'socketTimeoutMS': timeout_socket,
+        }
+        if allow_invalid:
+            client_kwargs['tlsAllowInvalidCertificates'] = True
+        else:
+            # Preferir bundle CA do certifi, mas não travar se ausente
+            try:
+                import certifi
+                client_kwargs['tlsCAFile'] = certifi.where()
+            except Exception:
+                # Fallback: confiar no bundle do sistema sem definir tlsCAFile
+                pass
         try:
-            client_kwargs = {
-                'serverSelectionTimeoutMS': timeout_select,
-                'connectTimeoutMS': timeout_connect,
-                'socketTimeoutMS': timeout_socket,
-            }
-            if allow_invalid:
-                client_kwargs['tlsAllowInvalidCertificates'] = True
-            else:
-                # Preferir bundle CA do certifi, mas não travar se ausente
-                try:
-                    import certifi
-                    client_kwargs['tlsCAFile'] = certifi.where()
-                except Exception:
-                    # Fallback: confiar no bundle do sistema sem definir tlsCAFile
-                    pass
-
             mongo_client = MongoClient(
                 mongo_uri,
+                connect=False,
+                # perfil por requisição (Server-Timing, log, N+1), consultas lentas e /metrics
+                event_listeners=[perfil_consultas.listener, consultas_lentas.registrador] + metricas.listeners(),
                 **client_kwargs,
             )
-            # Testar conectividade rapidamente para evitar travar o startup
-            mongo_client.admin.command('ping')
             mongo_db = mongo_client[dbname]
+        except Exception as e:
+            # URI inválida/opções inválidas: erro de configuração, não de rede
+            app.logger.error(f"[Mongo Init] Cliente MongoDB inválido: {type(e).__name__}: {e}")
+            mongo_client = None
+            mongo_db = None
+            if not _mock_permitido(app):
+                raise RuntimeError(f"MongoDB indisponível: {type(e).__name__}: {e}")
+            app.logger.warning('[Mongo Init] Usando mongomock (fallback) por configuração inválida')
+            _conectar_mongomock(app, dbname)
+            inicializar_banco(app)
+    return mongo_client, mongo_db
 
-            # Em ambiente de testes, limpar coleções para isolamento dos testes
-            try:
-                if app.config.get('TESTING'):
-                    for name in ['usuarios','centrais','almoxarifados','sub_almoxarifados','setores','categorias','produtos','movimentacoes','locais','logs_auditoria','listas_compras','estoques','lotes','compras']:
-                        try:
-                            mongo_db.drop_collection(name)
-                        except Exception:
-                            pass
-            except Exception:
-                pass
 
-            # Garantir coleções e índices
-            ensure_collections_and_indexes(mongo_db, logger=app.logger)
-            
-            # Seed seguro do usuário admin e usuários de teste
-            try:
-                usuarios_col = mongo_db['usuarios']
-                usuarios_col.create_index([('username', ASCENDING)], unique=True, name='idx_unique_username')
-                is_dev_or_test = bool(app.config.get('DEBUG')) or bool(app.config.get('TESTING'))
-                initial_pwd = os.environ.get('INITIAL_ADMIN_PASSWORD') or ('admin' if is_dev_or_test else None)
-                existing = usuarios_col.find_one({'username': 'admin'})
-                if existing is None:
-                    if initial_pwd is not None:
-                        usuarios_col.insert_one({
-                            'username': 'admin',
-                            'email': 'admin@local',
-                            'nome': 'Administrador',
-                            'password_hash': generate_password_hash(initial_pwd),
-                            'ativo': True,
-                            'nivel_acesso': 'super_admin',
-                            'data_criacao': datetime.utcnow(),
-                            'ultimo_login': None,
-                            'central_id': None,
-                            'almoxarifado_id': None,
-                            'sub_almoxarifado_id': None,
-                            'setor_id': None,
-                        })
-                        app.logger.info('[Mongo Seed] Usuário admin criado.')
-                    else:
-                        app.logger.info('[Mongo Seed] Usuário admin NÃO criado (sem INITIAL_ADMIN_PASSWORD e ambiente de produção).')
-                else:
-                    update_fields = {
-                        'email': existing.get('email') or 'admin@local',
-                        'nome': existing.get('nome') or existing.get('nome_completo') or 'Administrador',
-                        'ativo': True,
-                        'nivel_acesso': 'super_admin',
-                    }
-                    if initial_pwd is not None:
-                        update_fields['password_hash'] = generate_password_hash(initial_pwd)
-                        app.logger.info('[Mongo Seed] Usuário admin existente atualizado.')
-                    usuarios_col.update_one({'_id': existing['_id']}, {'$set': update_fields})
-
-                if is_dev_or_test or (os.environ.get('SEED_TEST_USERS', 'true').lower() == 'true'):
-                    test_user = usuarios_col.find_one({'username': 'test_operator'})
-                    test_pwd = os.environ.get('TEST_OPERATOR_PASSWORD') or 'password123'
-                    if test_user is None:
-                        usuarios_col.insert_one({
-                            'username': 'test_operator',
-                            'email': 'test@local',
-                            'nome': 'Test Operator',
-                            'password_hash': generate_password_hash(test_pwd),
-                            'ativo': True,
-                            'nivel_acesso': 'admin_central',
-                            'data_criacao': datetime.utcnow(),
-                            'ultimo_login': None,
-                            'central_id': None,
-                            'almoxarifado_id': None,
-                            'sub_almoxarifado_id': None,
-                            'setor_id': None,
-                        })
-                        app.logger.info('[Mongo Seed] Usuário de testes \"test_operator\" criado.')
-                    else:
-                        usuarios_col.update_one({'_id': test_user['_id']}, {'$set': {
-                            'ativo': True,
-                            'nivel_acesso': 'admin_central',
-                        }})
-                    test_user2 = usuarios_col.find_one({'username': 'testuser'})
-                    test_pwd2 = os.environ.get('TEST_USER_PASSWORD') or 'testpassword'
-                    if test_user2 is None:
-                        usuarios_col.insert_one({
-                            'username': 'testuser',
-                            'email': 'testuser@local',
-                            'nome': 'Test User',
-                            'password_hash': generate_password_hash(test_pwd2),
-                            'ativo': True,
-                            'nivel_acesso': 'admin_central',
-                            'data_criacao': datetime.utcnow(),
-                            'ultimo_login': None,
-                            'central_id': None,
-                            'almoxarifado_id': None,
-                            'sub_almoxarifado_id': None,
-                            'setor_id': None,
-                        })
-                        app.logger.info('[Mongo Seed] Usuário de testes \"testuser\" criado.')
-                    else:
-                        usuarios_col.update_one({'_id': test_user2['_id']}, {'$set': {
-                            'ativo': True,
-                            'nivel_acesso': 'admin_central',
-                        }})
-            except Exception as e:
-                app.logger.error(f'[Mongo Seed] Falha ao semear usuários: {e}')
-            try:
-                now = datetime.utcnow()
-                db = mongo_db
-                cent = db['centrais']
-                alm = db['almoxarifados']
-                sub = db['sub_almoxarifados']
-                setr = db['setores']
-                cat = db['categorias']
-                prod = db['produtos']
-                est = db['estoques']
-                if cent.count_documents({}) == 0:
-                    cent.insert_one({'id': 1, 'nome': 'Central Demo', 'created_at': now})
-                if alm.count_documents({}) == 0:
-                    alm.insert_one({'id': 1, 'nome': 'Almox Demo', 'central_id': 1, 'created_at': now})
-                if sub.count_documents({}) == 0:
-                    sub.insert_one({'id': 1, 'nome': 'Sub Demo', 'almoxarifado_id': 1, 'created_at': now})
-                if setr.count_documents({}) == 0:
-                    setr.insert_many([
-                        {'id': 1, 'nome': 'Setor Demo A', 'sub_almoxarifado_id': 1, 'almoxarifado_id': 1, 'created_at': now, 'ativo': True},
-                        {'id': 2, 'nome': 'Setor Demo B', 'sub_almoxarifado_id': 1, 'almoxarifado_id': 1, 'created_at': now, 'ativo': True}
-                    ])
-                if cat.count_documents({}) == 0:
-                    cat.insert_one({'id': 1, 'nome': 'Geral', 'codigo': 'GER', 'created_at': now})
-                if prod.count_documents({}) == 0:
-                    prod.insert_one({'id': 1, 'nome': 'Produto Demo', 'codigo': 'GER-0001', 'unidade_medida': 'un', 'central_id': 1, 'ativo': True, 'created_at': now})
-                else:
-                    if prod.find_one({'id': 1}) is None:
-                        prod.insert_one({'id': 1, 'nome': 'Produto Demo', 'codigo': 'GER-0001', 'unidade_medida': 'un', 'central_id': 1, 'ativo': True, 'created_at': now})
-                # Garantir estoque inicial para pelo menos um produto existente
-                pfirst = prod.find_one({}, sort=[('_id', 1)]) or {}
-                pid_out = pfirst.get('id') if pfirst.get('id') is not None else (str(pfirst.get('_id')) if pfirst.get('_id') is not None else 1)
-                if est.count_documents({'local_tipo': 'setor', 'local_id': 1, 'produto_id': pid_out}) == 0:
-                    est.insert_one({'produto_id': pid_out, 'local_tipo': 'setor', 'local_id': 1, 'setor_id': 1, 'nome_local': 'Setor Demo A', 'quantidade': 500.0, 'quantidade_disponivel': 500.0, 'created_at': now, 'updated_at': now})
-                usuarios_col = db['usuarios']
-                usuarios_col.update_one({'username': 'test_operator'}, {'$set': {'central_id': 1, 'almoxarifado_id': 1, 'sub_almoxarifado_id': 1}}, upsert=False)
-                usuarios_col.update_one({'username': 'testuser'}, {'$set': {'central_id': 1, 'almoxarifado_id': 1, 'sub_almoxarifado_id': 1, 'setor_id': 1}}, upsert=False)
-            except Exception:
-                pass
+def inicializar_banco(app) -> dict:
+    """Inicialização única do banco (deploy, `python app.py`, testes). Idempotente.
+
+    Verifica a conexão (com ALLOW_MOCK_DB/USE_MONGOMOCK cai para mongomock quando o MongoDB não
+    responde), limpa as coleções em TESTING, cria coleções e índices do catálogo e semeia os
+    usuários iniciais e a hierarquia de demonstração. Retorna {'mongomock', 'db'}.
+    """
+    init_mongo(app)
+    dbname = app.config.get('MONGO_DB')
+    if not usando_mongomock():
+        try:
+            mongo_client.admin.command('ping')
         except (ServerSelectionTimeoutError, AutoReconnect, Exception) as e:
-            # Fallback controlado para ambiente de desenvolvimento/teste usando mongomock
+            if not _mock_permitido(app):
+                app.logger.error(f"[Mongo Init] Conexão MongoDB indisponível: {type(e).__name__}: {e}")
+                raise RuntimeError(f"MongoDB indisponível: {type(e).__name__}: {e}")
+            app.logger.warning(f"[Mongo Init] Usando mongomock (fallback) por indisponibilidade: {type(e).__name__}: {e}")
             try:
-                allow_mock = bool(app.config.get('ALLOW_MOCK_DB')) or (os.environ.get('USE_MONGOMOCK', 'false').lower() == 'true')
+                mongo_client.close()
             except Exception:
-                allow_mock = False
-            if allow_mock:
-                app.logger.warning(f"[Mongo Init] Usando mongomock (fallback) por indisponibilidade: {type(e).__name__}: {e}")
-                try:
-                    import mongomock
-                    mongo_client = mongomock.MongoClient()
-                    mongo_db = mongo_client[dbname]
-                    ensure_collections_and_indexes(mongo_db, logger=app.logger)
+                pass
+            _conectar_mongomock(app, dbname)
+        else:
+            # Em ambiente de testes, limpar coleções para isolamento dos testes
+            if app.config.get('TESTING'):
+                for name in ['usuarios','centrais','almoxarifados','sub_almoxarifados','setores','categorias','produtos','movimentacoes','locais','logs_auditoria','listas_compras','estoques','lotes','compras']:
                     try:
-                        usuarios_col = mongo_db['usuarios']
-                        usuarios_col.create_index([('username', ASCENDING)], unique=True, name='idx_unique_username')
-                        initial_pwd = os.environ.get('INITIAL_ADMIN_PASSWORD') or 'admin'
-                        if usuarios_col.find_one({'username': 'admin'}) is None:
-                            usuarios_col.insert_one({
-                                'username': 'admin',
-                                'email': 'admin@local',
-                                'nome': 'Administrador',
-                                'password_hash': generate_password_hash(initial_pwd),
-                                'ativo': True,
-                                'nivel_acesso': 'super_admin',
-                                'data_criacao': datetime.utcnow(),
-                                'ultimo_login': None,
-                                'central_id': None,
-                                'almoxarifado_id': None,
-                                'sub_almoxarifado_id': None,
-                                'setor_id': None,
-                            })
-                        if usuarios_col.find_one({'username': 'test_operator'}) is None:
-                            usuarios_col.insert_one({
-                                'username': 'test_operator',
-                                'email': 'test@local',
-                                'nome': 'Test Operator',
-                                'password_hash': generate_password_hash(os.environ.get('TEST_OPERATOR_PASSWORD') or 'password123'),
-                                'ativo': True,
-                                'nivel_acesso': 'admin_central',
-                                'data_criacao': datetime.utcnow(),
-                                'ultimo_login': None,
-                                'central_id': None,
-                                'almoxarifado_id': None,
-                                'sub_almoxarifado_id': None,
-                                'setor_id': None,
-                            })
-                        if usuarios_col.find_one({'username': 'testuser'}) is None:
-                            usuarios_col.insert_one({
-                                'username': 'testuser',
-                                'email': 'testuser@local',
-                                'nome': 'Test User',
-                                'password_hash': generate_password_hash(os.environ.get('TEST_USER_PASSWORD') or 'testpassword'),
-                                'ativo': True,
-                                'nivel_acesso': 'admin_central',
-                                'data_criacao': datetime.utcnow(),
-                                'ultimo_login': None,
-                                'central_id': None,
-                                'almoxarifado_id': None,
-                                'sub_almoxarifado_id': None,
-                                'setor_id': None,
-                            })
-                        now = datetime.utcnow()
-                        db = mongo_db
-                        cent = db['centrais']
-                        alm = db['almoxarifados']
-                        sub = db['sub_almoxarifados']
-                        setr = db['setores']
-                        cat = db['categorias']
-                        prod = db['produtos']
-                        est = db['estoques']
-                        if cent.count_documents({}) == 0:
-                            cent.insert_one({'id': 1, 'nome': 'Central Demo', 'created_at': now})
-                        if alm.count_documents({}) == 0:
-                            alm.insert_one({'id': 1, 'nome': 'Almox Demo', 'central_id': 1, 'created_at': now})
-                        if sub.count_documents({}) == 0:
-                            sub.insert_one({'id': 1, 'nome': 'Sub Demo', 'almoxarifado_id': 1, 'created_at': now})
-                        if setr.count_documents({}) == 0:
-                            setr.insert_many([
-                                {'id': 1, 'nome': 'Setor Demo A', 'sub_almoxarifado_id': 1, 'almoxarifado_id': 1, 'created_at': now, 'ativo': True},
-                                {'id': 2, 'nome': 'Setor Demo B', 'sub_almoxarifado_id': 1, 'almoxarifado_id': 1, 'created_at': now, 'ativo': True}
-                            ])
-                        if cat.count_documents({}) == 0:
-                            cat.insert_one({'id': 1, 'nome': 'Geral', 'codigo': 'GER', 'created_at': now})
-                        if prod.count_documents({}) == 0:
-                            prod.insert_one({'id': 1, 'nome': 'Produto Demo', 'codigo': 'GER-0001', 'unidade_medida': 'un', 'central_id': 1, 'ativo': True, 'created_at': now})
-                        pfirst = prod.find_one({}, sort=[('_id', 1)]) or {}
-                        pid_out = pfirst.get('id') if pfirst.get('id') is not None else (str(pfirst.get('_id')) if pfirst.get('_id') is not None else 1)
-                        if est.count_documents({'local_tipo': 'setor', 'local_id': 1, 'produto_id': pid_out}) == 0:
-                            est.insert_one({'produto_id': pid_out, 'local_tipo': 'setor', 'local_id': 1, 'setor_id': 1, 'nome_local': 'Setor Demo A', 'quantidade': 500.0, 'quantidade_disponivel': 500.0, 'created_at': now, 'updated_at': now})
-                        usuarios_col.update_one({'username': 'test_operator'}, {'$set': {'central_id': 1, 'almoxarifado_id': 1, 'sub_almoxarifado_id': 1}}, upsert=False)
-                        usuarios_col.update_one({'username': 'testuser'}, {'$set': {'central_id': 1, 'almoxarifado_id': 1, 'sub_almoxarifado_id': 1, 'setor_id': 1}}, upsert=False)
+                        mongo_db.drop_collection(name)
                     except Exception:
                         pass
-                except Exception as e2:
-                    app.logger.error(f"[Mongo Init] Fallback mongomock falhou: {type(e2).__name__}: {e2}")
-                    mongo_client = None
-                    mongo_db = None
-                    raise RuntimeError(f"MongoDB indisponível e fallback falhou: {type(e).__name__}: {e} / {type(e2).__name__}: {e2}")
+
+    # Garantir coleções e índices (inclui o índice único de usuarios.username)
+    ensure_collections_and_indexes(mongo_db, logger=app.logger)
+    try:
+        _semear_usuarios(mongo_db, app)
+    except Exception as e:
+        app.logger.error(f'[Mongo Seed] Falha ao semear usuários: {e}')
+    try:
+        _semear_demo(mongo_db)
+    except Exception as e:
+        app.logger.error(f'[Mongo Seed] Falha ao semear dados de demonstração: {e}')
+    return {'mongomock': usando_mongomock(), 'db': mongo_db.name}
+
+
+def _novo_usuario(username: str, email: str, nome: str, senha: str, nivel_acesso: str) -> dict:
+    return {
+        'username': username,
+        'email': email,
+        'nome': nome,
+        'password_hash': generate_password_hash(senha),
+        'ativo': True,
+        'nivel_acesso': nivel_acesso,
+        'data_criacao': datetime.utcnow(),
+        'ultimo_login': None,
+        'central_id': None,
+        'almoxarifado_id': None,
+        'sub_almoxarifado_id': None,
+        'setor_id': None,
+    }
+
+
+def _semear_usuarios(db, app):
+    """Admin e usuários de teste. O hash (PBKDF2, caro) só é gerado na criação do usuário ou
+    quando INITIAL_ADMIN_PASSWORD é informada para redefinir a senha do admin."""
+    usuarios_col = db['usuarios']
+    is_dev_or_test = bool(app.config.get('DEBUG')) or bool(app.config.get('TESTING')) or usando_mongomock()
+    senha_informada = os.environ.get('INITIAL_ADMIN_PASSWORD')
+    initial_pwd = senha_informada or ('admin' if is_dev_or_test else None)
+    existing = usuarios_col.find_one({'username': 'admin'})
+    if existing is None:
+        if initial_pwd is not None:
+            usuarios_col.insert_one(_novo_usuario('admin', 'admin@local', 'Administrador', initial_pwd, 'super_admin'))
+            app.logger.info('[Mongo Seed] Usuário admin criado.')
+        else:
+            app.logger.info('[Mongo Seed] Usuário admin NÃO criado (sem INITIAL_ADMIN_PASSWORD e ambiente de produção).')
+    else:
+        update_fields = {
+            'email': existing.get('email') or 'admin@local',
+            'nome': existing.get('nome') or existing.get('nome_completo') or 'Administrador',
+            'ativo': True,
+            'nivel_acesso': 'super_admin',
+        }
+        if senha_informada:
+            update_fields['password_hash'] = generate_password_hash(senha_informada)
+            app.logger.info('[Mongo Seed] Senha do usuário admin existente redefinida.')
+        usuarios_col.update_one({'_id': existing['_id']}, {'$set': update_fields})
+
+    if is_dev_or_test or (os.environ.get('SEED_TEST_USERS', 'true').lower() == 'true'):
+        for username, email, nome, senha in (
+            ('test_operator', 'test@local', 'Test Operator', os.environ.get('TEST_OPERATOR_PASSWORD') or 'password123'),
+            ('testuser', 'testuser@local', 'Test User', os.environ.get('TEST_USER_PASSWORD') or 'testpassword'),
+        ):
+            test_user = usuarios_col.find_one({'username': username})
+            if test_user is None:
+                usuarios_col.insert_one(_novo_usuario(username, email, nome, senha, 'admin_central'))
+                app.logger.info(f'[Mongo Seed] Usuário de testes "{username}" criado.')
             else:
-                # Não usar mongomock em produção: sempre exigir MongoDB real
-                app.logger.error(f"[Mongo Init] Conexão MongoDB indisponível: {type(e).__name__}: {e}")
-                mongo_client = None
-                mongo_db = None
-                raise RuntimeError(f"MongoDB indisponível: {type(e).__name__}: {e}")
-    return mongo_client, mongo_db
+                usuarios_col.update_one({'_id': test_user['_id']}, {'$set': {
+                    'ativo': True,
+                    'nivel_acesso': 'admin_central',
+                }})
+
+
+def _semear_demo(db):
+    """Hierarquia, produto e estoque de demonstração nas coleções vazias; vincula os usuários de teste."""
+    now = datetime.utcnow()
+    cent = db['centrais']
+    alm = db['almoxarifados']
+    sub = db['sub_almoxarifados']
+    setr = db['setores']
+    cat = db['categorias']
+    prod = db['produtos']
+    est = db['estoques']
+    if cent.count_documents({}) == 0:
+        cent.insert_one({'id': 1, 'nome': 'Central Demo', 'created_at': now})
+    if alm.count_documents({}) == 0:
+        alm.insert_one({'id': 1, 'nome': 'Almox Demo', 'central_id': 1, 'created_at': now})
+    if sub.count_documents({}) == 0:
+        sub.insert_one({'id': 1, 'nome': 'Sub Demo', 'almoxarifado_id': 1, 'created_at': now})
+    if setr.count_documents({}) == 0:
+        setr.insert_many([
+            {'id': 1, 'nome': 'Setor Demo A', 'sub_almoxarifado_id': 1, 'almoxarifado_id': 1, 'created_at': now, 'ativo': True},
+            {'id': 2, 'nome': 'Setor Demo B', 'sub_almoxarifado_id': 1, 'almoxarifado_id': 1, 'created_at': now, 'ativo': True}
+        ])
+    if cat.count_documents({}) == 0:
+        cat.insert_one({'id': 1, 'nome': 'Geral', 'codigo': 'GER', 'created_at': now})
+    if prod.find_one({'id': 1}) is None:
+        prod.insert_one({'id': 1, 'nome': 'Produto Demo', 'codigo': 'GER-0001', 'unidade_medida': 'un', 'central_id': 1, 'ativo': True, 'created_at': now})
+    # Garantir estoque inicial para pelo menos um produto existente
+    pfirst = prod.find_one({}, sort=[('_id', 1)]) or {}
+    pid_out = pfirst.get('id') if pfirst.get('id') is not None else (str(pfirst.get('_id')) if pfirst.get('_id') is not None else 1)
+    if est.count_documents({'local_tipo': 'setor', 'local_id': 1, 'produto_id': pid_out}) == 0:
+        est.insert_one({'produto_id': pid_out, 'local_tipo': 'setor', 'local_id': 1, 'setor_id': 1, 'nome_local': 'Setor Demo A', 'quantidade': 500.0, 'quantidade_disponivel': 500.0, 'created_at': now, 'updated_at': now})
+    usuarios_col = db['usuarios']
+    usuarios_col.update_one({'username': 'test_operator'}, {'$set': {'central_id': 1, 'almoxarifado_id': 1, 'sub_almoxarifado_id': 1}}, upsert=False)
+    usuarios_col.update_one({'username': 'testuser'}, {'$set': {'central_id': 1, 'almoxarifado_id': 1, 'sub_almoxarifado_id': 1, 'setor_id': 1}}, upsert=False)
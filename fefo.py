@@ -0,0 +1,236 @@
+"""Alocação FEFO (first-expired-first-out) dos lotes nas saídas de estoque.
+
+Cada documento de 'lotes' guarda o saldo (quantidade_atual) de um lote de produto em um local
+(local_tipo/local_id, os mesmos valores usados em 'estoques'). Toda saída consome primeiro os
+lotes que vencem antes, com baixa condicional (quantidade_atual >= retirada) para que o saldo
+do lote não fique negativo sob concorrência; transferências e distribuições creditam os lotes
+consumidos no local de destino. O detalhamento fica na movimentação em 'lotes_alocados'.
+
+Ordem de consumo: lotes dentro da validade (vencimento mais próximo primeiro), depois lotes sem
+data e por último os vencidos. Os vencidos continuam no saldo de 'estoques', então a saída
+precisa baixá-los para o saldo dos lotes não divergir; a alocação sai com 'vencido': True e
+fica registrada na movimentação. Datas de vencimento gravadas como texto (lotes antigos) são
+interpretadas na ordenação e convertidas por scripts/migrar_lotes_locais.py.
+
+A parte de uma saída que não encontra lote (estoque recebido sem número de lote) é registrada
+em 'quantidade_sem_lote'. Lotes gravados antes destes campos só têm almoxarifado_id: rode
+scripts/migrar_lotes_locais.py uma vez para preenchê-los.
+"""
+from datetime import date, datetime, timezone
+
+from pymongo import UpdateOne
+
+COLECAO = 'lotes'
+_EPS = 1e-9
+
+
+def _utc_naive(dt: datetime) -> datetime:
+    if dt.tzinfo is not None:
+        return dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def normalizar_data(valor):
+    """datetime UTC naive a partir de datetime/date ou texto ('AAAA-MM-DD[THH:MM...]', 'DD/MM/AAAA').
+    None quando vazio ou ilegível."""
+    if isinstance(valor, datetime):
+        return _utc_naive(valor)
+    if isinstance(valor, date):
+        return datetime(valor.year, valor.month, valor.day)
+    if not isinstance(valor, str) or not valor.strip():
+        return None
+    texto = valor.strip()
+    try:
+        return _utc_naive(datetime.fromisoformat(texto.replace('Z', '+00:00')))
+    except ValueError:
+        pass
+    try:
+        return datetime.strptime(texto[:10], '%d/%m/%Y')
+    except ValueError:
+        return None
+
+
+def _ordem_fefo(doc, agora_naive):
+    dv = normalizar_data(doc.get('data_vencimento'))
+    if dv is None:
+        return (1, datetime.max, str(doc.get('_id')))
+    if dv < agora_naive:
+        return (2, dv, str(doc.get('_id')))
+    return (0, dv, str(doc.get('_id')))
+
+
+def _filtro_local(produto_id, local_tipo, local_id) -> dict:
+    return {'produto_id': produto_id, 'local_tipo': local_tipo, 'local_id': local_id}
+
+
+def _ordenar(docs, agora) -> list:
+    agora_naive = _utc_naive(agora)
+    return sorted(docs, key=lambda d: _ordem_fefo(d, agora_naive))
+
+
+def _candidatos(lotes, produto_id, local_tipo, local_id, agora, session=None) -> list:
+    """Lotes com saldo no local, em ordem FEFO (uma leitura; poucos lotes por produto e local)."""
+    filtro = dict(_filtro_local(produto_id, local_tipo, local_id), quantidade_atual={'$gt': 0})
+    return _ordenar(lotes.find(filtro, session=session), agora)
+
+
+def candidatos_em_lote(lotes, locais, agora, session=None) -> dict:
+    """Candidatos de vários (produto_id, local_tipo, local_id) numa única consulta.
+    Retorna {(produto_id, local_tipo, local_id): [lotes em ordem FEFO]} para alocar(candidatos=...)."""
+    chaves = list(dict.fromkeys(locais))
+    out = {k: [] for k in chaves}
+    if not chaves:
+        return out
+    filtro = {'$or': [_filtro_local(*k) for k in chaves], 'quantidade_atual': {'$gt': 0}}
+    for doc in lotes.find(filtro, session=session):
+        k = (doc.get('produto_id'), doc.get('local_tipo'), doc.get('local_id'))
+        if k in out:
+            out[k].append(doc)
+    return {k: _ordenar(v, agora) for k, v in out.items()}
+
+
+def alocar(lotes, produto_id, local_tipo, local_id, quantidade: float, agora, session=None, candidatos=None):
+    """Baixa `quantidade` dos lotes do local em ordem FEFO.
+    `candidatos` (de candidatos_em_lote) evita a leitura na primeira passada; o saldo desses
+    documentos é atualizado em memória, então várias linhas do mesmo lote podem reusar a lista.
+    Retorna (alocados, sem_lote): alocados = [{'lote', 'quantidade', 'data_vencimento', 'data_fabricacao'}],
+    com 'vencido': True nos lotes fora da validade.
+    """
+    restante = float(quantidade)
+    alocados = []
+    agora_naive = _utc_naive(agora)
+    for passada in range(3):
+        conflito = False
+        docs = candidatos if (passada == 0 and candidatos is not None) else \
+            _candidatos(lotes, produto_id, local_tipo, local_id, agora, session=session)
+        for doc in docs:
+            if restante <= _EPS:
+                break
+            retirada = min(restante, float(doc.get('quantidade_atual') or 0))
+            if retirada <= _EPS:
+                continue
+            res = lotes.update_one(
+                {'_id': doc['_id'], 'quantidade_atual': {'$gte': retirada}},
+                {'$inc': {'quantidade_atual': -retirada}, '$set': {'updated_at': agora}},
+                session=session
+            )
+            if not res.modified_count:
+                # saldo do lote mudou desde a leitura: a próxima passada relê os candidatos
+                conflito = True
+                continue
+            doc['quantidade_atual'] = float(doc.get('quantidade_atual') or 0) - retirada
+            restante -= retirada
+            alocado = {
+                'lote': doc.get('lote') or doc.get('numero_lote'),
+                'quantidade': retirada,
+                'data_vencimento': normalizar_data(doc.get('data_vencimento')),
+                'data_fabricacao': normalizar_data(doc.get('data_fabricacao')),
+            }
+            if _ordem_fefo(doc, agora_naive)[0] == 2:
+                alocado['vencido'] = True
+            alocados.append(alocado)
+        if restante <= _EPS or not conflito:
+            break
+    return alocados, max(0.0, restante)
+
+
+def dividir(alocados: list, quantidades: list) -> list:
+    """Reparte uma alocação (em ordem FEFO) entre destinos, na ordem das quantidades."""
+    fila = [dict(a) for a in alocados]
+    partes = []
+    for q in quantidades:
+        falta = float(q)
+        parte = []
+        while falta > _EPS and fila:
+            a = fila[0]
+            usar = min(falta, a['quantidade'])
+            parte.append(dict(a, quantidade=usar))
+            a['quantidade'] -= usar
+            falta -= usar
+            if a['quantidade'] <= _EPS:
+                fila.pop(0)
+        partes.append(parte)
+    return partes
+
+
+def operacoes_credito(alocados: list, produto_id, local_tipo, local_id, agora) -> list:
+    """UpdateOne (upsert) que credita os lotes alocados no local de destino."""
+    ops = []
+    for a in alocados:
+        if not a.get('lote'):
+            continue
+        set_fields = {
+            'produto_id': produto_id,
+            'lote': a['lote'],
+            'local_tipo': local_tipo,
+            'local_id': local_id,
+            'updated_at': agora,
+        }
+        on_insert = {'created_at': agora}
+        for campo in ('data_vencimento', 'data_fabricacao'):
+            # data ausente não apaga a que o lote de destino já tem
+            (set_fields if a.get(campo) is not None else on_insert)[campo] = a.get(campo)
+        if local_tipo == 'almoxarifado':
+            # recebimentos localizam o lote do almoxarifado por almoxarifado_id
+            set_fields['almoxarifado_id'] = local_id
+        ops.append(UpdateOne(
+            {'produto_id': produto_id, 'lote': a['lote'], 'local_tipo': local_tipo, 'local_id': local_id},
+            {'$inc': {'quantidade_atual': a['quantidade']}, '$set': set_fields, '$setOnInsert': on_insert},
+            upsert=True
+        ))
+    return ops
+
+
+def resumo(alocados: list) -> list:
+    """Forma gravada na movimentação."""
+    out = []
+    for a in alocados:
+        item = {'lote': a['lote'], 'quantidade': a['quantidade'], 'data_vencimento': a.get('data_vencimento')}
+        if a.get('vencido'):
+            item['vencido'] = True
+        out.append(item)
+    return out
+
+
+def migrar_lotes_sem_local(db, batch_size: int = 1000) -> dict:
+    """Preenche local_tipo/local_id nos lotes de almoxarifado gravados antes da alocação FEFO."""
+    coll = db[COLECAO]
+    ops = []
+    total = 0
+    cursor = coll.find({'local_tipo': {'$exists': False}, 'almoxarifado_id': {'$ne': None}}, {'almoxarifado_id': 1})
+    for doc in cursor:
+        ops.append(UpdateOne({'_id': doc['_id']}, {'$set': {'local_tipo': 'almoxarifado', 'local_id': doc['almoxarifado_id']}}))
+        if len(ops) >= batch_size:
+            coll.bulk_write(ops, ordered=False)
+            total += len(ops)
+            ops = []
+    if ops:
+        coll.bulk_write(ops, ordered=False)
+        total += len(ops)
+    return {'lotes': total}
+
+
+def normalizar_datas_texto(db, batch_size: int = 1000) -> dict:
+    """Converte data_vencimento/data_fabricacao gravadas como texto em datas (ilegíveis ficam como estão)."""
+    coll = db[COLECAO]
+    ops = []
+    total = 0
+    filtro = {'$or': [{'data_vencimento': {'$type': 'string'}}, {'data_fabricacao': {'$type': 'string'}}]}
+    for doc in coll.find(filtro, {'data_vencimento': 1, 'data_fabricacao': 1}):
+        sets = {}
+        for campo in ('data_vencimento', 'data_fabricacao'):
+            if isinstance(doc.get(campo), str):
+                dt = normalizar_data(doc[campo])
+                if dt is not None:
+                    sets[campo] = dt
+        if not sets:
+            continue
+        ops.append(UpdateOne({'_id': doc['_id']}, {'$set': sets}))
+        if len(ops) >= batch_size:
+            coll.bulk_write(ops, ordered=False)
+            total += len(ops)
+            ops = []
+    if ops:
+        coll.bulk_write(ops, ordered=False)
+        total += len(ops)
+    return {'lotes': total}
@@ -0,0 +1,167 @@
+"""Chaves de idempotência para POSTs que criam movimentações.
+
+O cliente envia o cabeçalho 'Idempotency-Key' (um UUID por operação lógica) e pode repetir a
+requisição quantas vezes quiser: a primeira resposta fica gravada em 'idempotency_keys' e as
+repetições recebem a mesma resposta, sem reexecutar a rota. Os registros expiram pelo índice
+TTL em 'expira_em' (IDEMPOTENCY_TTL_SECONDS, padrão 24h).
+
+Se a rota executou mas a resposta não pôde ser gravada, o registro fica 'processando' e as
+repetições recebem 409 (também depois de LOCK_SEGUNDOS): a rota nunca é executada duas vezes
+para a mesma chave; o cliente confere o resultado e usa uma chave nova.
+
+Só as rotas com @idempotente deduplicam: o fetchJson (templates/base.html) repete após falha de
+rede apenas os POSTs dessas rotas, cuja lista (rotas_idempotentes) é injetada nos templates.
+"""
+import hashlib
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+
+from flask import request, jsonify, current_app, make_response
+from flask_login import current_user
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+import extensions
+
+COLECAO = 'idempotency_keys'
+HEADER = 'Idempotency-Key'
+# Tempo após o qual uma execução ainda 'processando' é dada como interrompida (resultado
+# indeterminado): as repetições deixam de ser convidadas a aguardar (sem Retry-After)
+LOCK_SEGUNDOS = 120
+# Tentativas de gravar a resposta depois que a rota executou
+TENTATIVAS_GRAVACAO = 3
+
+
+def _chave_do_request(raw_key: str) -> str:
+    usuario = getattr(current_user, 'id', None) or getattr(current_user, 'username', None) or 'anon'
+    return f"{usuario}:{request.method}:{request.path}:{raw_key}"
+
+
+def _fingerprint() -> str:
+    h = hashlib.sha256()
+    if request.mimetype in ('multipart/form-data', 'application/x-www-form-urlencoded'):
+        # ler o corpo bruto aqui impediria o parse do formulário na rota
+        for k, v in sorted(request.form.items(multi=True)):
+            h.update(f'{k}={v}\n'.encode('utf-8'))
+        for k, fs in sorted(request.files.items(multi=True), key=lambda kv: kv[0]):
+            h.update(k.encode('utf-8'))
+            h.update(fs.stream.read())
+            fs.stream.seek(0)
+    else:
+        h.update(request.get_data(cache=True) or b'')
+    return h.hexdigest()
+
+
+def _resposta_gravada(doc: dict):
+    resp = current_app.response_class(doc.get('corpo') or '', status=int(doc.get('status') or 200),
+                                      mimetype=doc.get('mimetype') or 'application/json')
+    resp.headers['Idempotent-Replayed'] = 'true'
+    return resp
+
+
+def idempotente(f):
+    """Decorator: grava a primeira resposta por Idempotency-Key e a devolve nas repetições.
+    Sem o cabeçalho a rota executa normalmente. Respostas 5xx não são gravadas (a operação pode
+    ser repetida com a mesma chave).
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        raw_key = (request.headers.get(HEADER) or request.headers.get('X-Idempotency-Key') or '').strip()
+        db = extensions.mongo_db
+        if not raw_key or db is None:
+            return f(*args, **kwargs)
+        if len(raw_key) > 200:
+            return jsonify({'error': 'Idempotency-Key muito longa (máx. 200 caracteres)'}), 400
+
+        coll = db[COLECAO]
+        chave = _chave_do_request(raw_key)
+        fp = _fingerprint()
+        now = datetime.now(timezone.utc)
+        ttl = int(current_app.config.get('IDEMPOTENCY_TTL_SECONDS') or 86400)
+        try:
+            coll.insert_one({
+                '_id': chave,
+                'status_execucao': 'processando',
+                'fingerprint': fp,
+                'lock_ate': now + timedelta(seconds=LOCK_SEGUNDOS),
+                'created_at': now,
+                'expira_em': now + timedelta(seconds=ttl),
+            })
+        except DuplicateKeyError:
+            doc = coll.find_one({'_id': chave}) or {}
+            if doc.get('fingerprint') != fp:
+                return jsonify({'error': 'Idempotency-Key já utilizada com outro conteúdo'}), 422
+            if doc.get('status_execucao') == 'concluido':
+                return _resposta_gravada(doc)
+            lock_ate = doc.get('lock_ate')
+            if isinstance(lock_ate, datetime) and lock_ate.replace(tzinfo=lock_ate.tzinfo or timezone.utc) < now:
+                # o processo caiu ou não gravou a resposta: a rota pode ter executado, não repete
+                return jsonify({'error': 'Resultado da requisição com esta Idempotency-Key é indeterminado; '
+                                         'confira a operação antes de repetir com uma nova chave'}), 409
+            resp = jsonify({'error': 'Requisição com esta Idempotency-Key ainda em processamento'})
+            resp.status_code = 409
+            resp.headers['Retry-After'] = '1'
+            return resp
+        except PyMongoError as e:
+            # Sem o registro de idempotência a rota segue como antes
+            try:
+                current_app.logger.warning(f'Idempotência indisponível: {e}')
+            except Exception:
+                pass
+            return f(*args, **kwargs)
+
+        try:
+            resp = make_response(f(*args, **kwargs))
+        except Exception:
+            coll.delete_one({'_id': chave})
+            raise
+        if resp.status_code >= 500 or resp.is_streamed:
+            coll.delete_one({'_id': chave})
+            return resp
+        final = {'$set': {
+            'status_execucao': 'concluido',
+            'status': resp.status_code,
+            'mimetype': resp.mimetype,
+            'corpo': resp.get_data(as_text=True),
+            'concluido_em': datetime.now(timezone.utc),
+        }, '$unset': {'lock_ate': ''}}
+        for tentativa in range(TENTATIVAS_GRAVACAO):
+            try:
+                coll.update_one({'_id': chave}, final)
+                break
+            except PyMongoError as e:
+                if tentativa + 1 == TENTATIVAS_GRAVACAO:
+                    # a rota já executou: o registro fica 'processando' e as repetições recebem 409
+                    current_app.logger.error(f'Idempotência: resposta de {chave} não gravada: {e}')
+                else:
+                    time.sleep(0.1 * (tentativa + 1))
+        return resp
+    decorated_function.idempotente = True
+    return decorated_function
+
+
+def _padrao_js(regra: str) -> str:
+    """Regra do werkzeug ('/api/x/<int:id>') como regex de path aceita também pelo JavaScript."""
+    partes = re.split(r'<[^>]+>', regra)
+    literais = [re.sub(r'([.*+?^${}()|\[\]\\])', r'\\\1', p) for p in partes]
+    return '^' + '[^/]+'.join(literais) + '$'
+
+
+def rotas_idempotentes(app) -> list:
+    """Regexes dos paths de POST atendidos por @idempotente (os únicos seguros para repetir)."""
+    rotas = []
+    for regra in app.url_map.iter_rules():
+        view = app.view_functions.get(regra.endpoint)
+        if 'POST' in (regra.methods or ()) and getattr(view, 'idempotente', False):
+            rotas.append(_padrao_js(regra.rule))
+    return sorted(rotas)
+
+
+def init_app(app):
+    """Expõe `rotas_idempotentes` aos templates (calculada uma vez, após registrar os blueprints)."""
+    @app.context_processor
+    def _injetar_rotas_idempotentes():
+        if 'rotas_idempotentes' not in app.extensions:
+            app.extensions['rotas_idempotentes'] = rotas_idempotentes(app)
+        return {'rotas_idempotentes': app.extensions['rotas_idempotentes']}
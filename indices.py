@@ -0,0 +1,136 @@
+"""Sincronização dos índices MongoDB com o catálogo declarativo (config/indices.py).
+
+diferencas() compara, coleção a coleção, os índices existentes com o catálogo:
+- faltando: no catálogo e não no banco (nem com outro nome);
+- divergentes: mesmo nome com chaves/opções diferentes (exige drop + create, não é automático);
+- renomeados: mesmas chaves e opções sob outro nome (funcionam; só o nome difere);
+- extras: existem no banco e não estão no catálogo (candidatos a remoção, ver sem_uso()).
+
+sincronizar() cria os que faltam (background=True; a partir do MongoDB 4.2 toda construção já
+é "híbrida" e não bloqueia a coleção) e registra cada falha no log em vez de ignorá-la.
+sem_uso() lê $indexStats e lista os índices sem nenhum acesso desde o último restart do mongod.
+
+CLI: scripts/sincronizar_indices.py.
+"""
+import logging
+
+from config.indices import CATALOGO
+
+logger = logging.getLogger(__name__)
+
+# opções que fazem parte da identidade do índice (as demais, como 'v' e 'ns', são do servidor)
+OPCOES_COMPARADAS = ('unique', 'sparse', 'partialFilterExpression', 'expireAfterSeconds')
+
+
+def _chaves(chaves) -> list:
+    return [(str(c), int(d) if isinstance(d, (int, float)) else d) for c, d in chaves]
+
+
+def _opcoes(info: dict) -> dict:
+    out = {}
+    for k in OPCOES_COMPARADAS:
+        v = info.get(k)
+        if v in (None, False):
+            continue
+        out[k] = int(v) if k == 'expireAfterSeconds' else v
+    return out
+
+
+def _log(log, nivel: str, msg: str):
+    getattr(log or logger, nivel)(msg)
+
+
+def diferencas(db, catalogo: dict = None) -> dict:
+    """{colecao: {'faltando': [...], 'divergentes': [...], 'renomeados': [...], 'extras': [...]}}
+    só com as coleções que têm alguma diferença."""
+    catalogo = CATALOGO if catalogo is None else catalogo
+    existentes_colecoes = set(db.list_collection_names())
+    resultado = {}
+    for colecao, especificacao in catalogo.items():
+        vivos = {}
+        if colecao in existentes_colecoes:
+            vivos = {nome: info for nome, info in db[colecao].index_information().items() if nome != '_id_'}
+        por_forma = {(tuple(_chaves(i['key'])), repr(sorted(_opcoes(i).items()))): nome for nome, i in vivos.items()}
+        dif = {'faltando': [], 'divergentes': [], 'renomeados': [], 'extras': []}
+        usados = set()
+        for spec in especificacao:
+            forma = (tuple(_chaves(spec['chaves'])), repr(sorted(_opcoes(spec['opcoes']).items())))
+            vivo = vivos.get(spec['nome'])
+            if vivo is not None:
+                usados.add(spec['nome'])
+                if (tuple(_chaves(vivo['key'])), repr(sorted(_opcoes(vivo).items()))) != forma:
+                    dif['divergentes'].append({'nome': spec['nome'], 'esperado': {'chaves': spec['chaves'], **spec['opcoes']},
+                                               'atual': {'chaves': _chaves(vivo['key']), **_opcoes(vivo)}})
+            elif forma in por_forma:
+                usados.add(por_forma[forma])
+                dif['renomeados'].append({'nome': spec['nome'], 'atual': por_forma[forma]})
+            else:
+                dif['faltando'].append(spec)
+        dif['extras'] = [{'nome': nome, 'chaves': _chaves(info['key']), **_opcoes(info)}
+                         for nome, info in vivos.items() if nome not in usados]
+        if any(dif.values()):
+            resultado[colecao] = dif
+    return resultado
+
+
+def criar(db, colecao: str, spec: dict, background: bool = True):
+    db[colecao].create_index(spec['chaves'], name=spec['nome'], background=background, **spec['opcoes'])
+
+
+def sincronizar(db, catalogo: dict = None, recriar_divergentes: bool = False, remover_extras: bool = False,
+                logger=None) -> dict:
+    """Cria os índices que faltam; opcionalmente recria os divergentes e remove os extras.
+    Retorna {'criados': [...], 'recriados': [...], 'removidos': [...], 'falhas': [...]}."""
+    res = {'criados': [], 'recriados': [], 'removidos': [], 'falhas': []}
+    for colecao, dif in diferencas(db, catalogo).items():
+        for spec in dif['faltando']:
+            try:
+                criar(db, colecao, spec)
+                res['criados'].append(f"{colecao}.{spec['nome']}")
+            except Exception as e:
+                res['falhas'].append(f"{colecao}.{spec['nome']}: {e}")
+                _log(logger, 'warning', f"[Índices] Falha ao criar {colecao}.{spec['nome']}: {e}")
+        for div in dif['divergentes']:
+            if not recriar_divergentes:
+                _log(logger, 'warning', f"[Índices] {colecao}.{div['nome']} difere do catálogo: {div['atual']} (esperado {div['esperado']})")
+                continue
+            spec = next(s for s in (catalogo or CATALOGO)[colecao] if s['nome'] == div['nome'])
+            try:
+                db[colecao].drop_index(div['nome'])
+                criar(db, colecao, spec)
+                res['recriados'].append(f"{colecao}.{div['nome']}")
+            except Exception as e:
+                res['falhas'].append(f"{colecao}.{div['nome']}: {e}")
+                _log(logger, 'error', f"[Índices] Falha ao recriar {colecao}.{div['nome']}: {e}")
+        if remover_extras:
+            for extra in dif['extras']:
+                try:
+                    db[colecao].drop_index(extra['nome'])
+                    res['removidos'].append(f"{colecao}.{extra['nome']}")
+                except Exception as e:
+                    res['falhas'].append(f"{colecao}.{extra['nome']}: {e}")
+                    _log(logger, 'error', f"[Índices] Falha ao remover {colecao}.{extra['nome']}: {e}")
+    return res
+
+
+def sem_uso(db, colecoes=None) -> list:
+    """Índices sem acesso segundo $indexStats (contadores zerados a cada restart do mongod).
+    Lista de {'colecao', 'nome', 'ops', 'desde'}; None quando o servidor não suporta $indexStats."""
+    nomes = colecoes or sorted(set(db.list_collection_names()))
+    out = []
+    for colecao in nomes:
+        try:
+            stats = list(db[colecao].aggregate([{'$indexStats': {}}]))
+        except NotImplementedError:
+            # mongomock
+            return None
+        except Exception as e:
+            logger.warning(f'[Índices] $indexStats falhou em {colecao}: {e}')
+            continue
+        for s in stats:
+            if s.get('name') == '_id_':
+                continue
+            acessos = s.get('accesses') or {}
+            if int(acessos.get('ops') or 0) == 0:
+                out.append({'colecao': colecao, 'nome': s.get('name'), 'ops': 0, 'desde': acessos.get('since')})
+    return out
@@ -0,0 +1,349 @@
+"""Execução em segundo plano de relatórios e tarefas administrativas demoradas.
+
+Uma rota marcada com @assincrono('<tipo>') atende normalmente, mas com '?async=1' (ou o
+cabeçalho 'Prefer: respond-async') grava a requisição em 'jobs' e responde 202 com o id do job;
+o mesmo job pode ser criado por POST /api/jobs {tipo, params}. Cada processo da aplicação tem
+um JobRunner: uma thread despachante reivindica jobs pendentes com find_one_and_update
+(status 'executando' + lease em 'lease_ate') e os executa em um ThreadPoolExecutor. A execução
+reproduz a requisição original (rota, query string e corpo JSON) com o usuário que a criou; a
+resposta fica gravada no job e é consultada em GET /api/jobs/<id>.
+
+Enquanto o job roda, o despachante renova o lease; se o processo cair, o lease expira e outro
+processo reivindica o job (até MAX_TENTATIVAS vezes). Rotas com checkpoint próprio (restauração,
+arquivamento) gravam no job o id da execução com registrar_checkpoint(); a nova tentativa
+reenvia o corpo com esse id e continua de onde a anterior parou, em vez de recomeçar. Jobs finalizados expiram pelo índice
+TTL em 'expira_em' (JOBS_TTL_DIAS).
+
+Configuração (config.Config):
+- JOBS_WORKERS: threads de execução por processo (0 desliga o runner, ex.: testes)
+- JOBS_POLL_SECONDS: intervalo de busca de jobs pendentes
+- JOBS_LEASE_SECONDS: validade do lease de um job em execução
+- JOBS_TTL_DIAS: dias que um job finalizado fica consultável
+"""
+import atexit
+import logging
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+from urllib.parse import urlencode
+
+from flask import g, has_app_context, jsonify, request, url_for
+from flask_login import current_user, login_user
+from pymongo import ReturnDocument
+
+import extensions
+
+logger = logging.getLogger(__name__)
+
+COLECAO = 'jobs'
+MAX_TENTATIVAS = 3
+STATUS_FINAIS = ('concluido', 'erro')
+
+_NIVEIS_ADMIN = ('super_admin', 'admin_central', 'secretario')
+
+# tipos aceitos em POST /api/jobs: (método, rota, níveis de acesso; None = qualquer nível)
+TIPOS = {
+    'backup_create': ('POST', '/api/admin/backup/create', _NIVEIS_ADMIN),
+    'backup_restore': ('POST', '/api/admin/backup/restore', _NIVEIS_ADMIN),
+    'archive': ('POST', '/api/admin/archive', _NIVEIS_ADMIN),
+    'relatorio_consumo_gastos': ('GET', '/api/relatorios/admin/consumo-gastos', _NIVEIS_ADMIN),
+    'compras_sugestoes': ('GET', '/api/compras/sugestoes', None),
+}
+
+
+def _agora() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def enfileirar(db, tipo: str, metodo: str, caminho: str, query_string: str = '', corpo=None,
+               usuario_id: str = None) -> dict:
+    agora = _agora()
+    job = {
+        'tipo': tipo,
+        'requisicao': {'metodo': metodo, 'caminho': caminho, 'query_string': query_string or '', 'corpo': corpo},
+        'status': 'pendente',
+        'progresso': None,
+        'usuario_id': usuario_id,
+        'tentativas': 0,
+        'created_at': agora,
+        'atualizado_em': agora,
+    }
+    job['_id'] = db[COLECAO].insert_one(job).inserted_id
+    r = _runner
+    if r is not None:
+        r.acordar()
+    return job
+
+
+def reportar_progresso(atual, total=None, mensagem: str = None) -> None:
+    """Progresso do job em execução nesta thread (sem job, não faz nada). Também renova o lease."""
+    if not has_app_context():
+        return
+    job_id = g.get('job_id')
+    db = extensions.mongo_db
+    if job_id is None or db is None:
+        return
+    agora = _agora()
+    campos = {'progresso': {'atual': atual, 'total': total, 'mensagem': mensagem}, 'atualizado_em': agora}
+    lease = g.get('job_lease_segundos')
+    if lease:
+        campos['lease_ate'] = agora + timedelta(seconds=lease)
+    try:
+        db[COLECAO].update_one({'_id': job_id, 'status': 'executando'}, {'$set': campos})
+    except Exception as e:
+        logger.warning(f'[Jobs] Progresso do job {job_id} não gravado: {e}')
+
+
+def registrar_checkpoint(**campos) -> None:
+    """Grava no job em execução nesta thread os campos que retomam a tarefa (ex.: restauracao_id);
+    uma nova tentativa do job os recebe no corpo da requisição. Sem job, não faz nada."""
+    if not has_app_context():
+        return
+    job_id = g.get('job_id')
+    db = extensions.mongo_db
+    if job_id is None or db is None:
+        return
+    g.job_checkpoint = dict(g.get('job_checkpoint') or {}, **campos)
+    db[COLECAO].update_one({'_id': job_id, 'status': 'executando'},
+                           {'$set': {f'checkpoint.{k}': v for k, v in campos.items()}})
+
+
+def checkpoint(campo: str):
+    """Valor gravado por registrar_checkpoint() em uma tentativa anterior do job atual (ou None)."""
+    if not has_app_context():
+        return None
+    return (g.get('job_checkpoint') or {}).get(campo)
+
+
+def _pedido_assincrono() -> bool:
+    if str(request.args.get('async') or '').lower() in ('1', 'true', 'yes'):
+        return True
+    return 'respond-async' in (request.headers.get('Prefer') or '').lower()
+
+
+def resposta_aceita(job: dict):
+    status_url = url_for('main.api_job_status', job_id=str(job['_id']))
+    resp = jsonify({'job_id': str(job['_id']), 'tipo': job.get('tipo'), 'status': job.get('status'), 'status_url': status_url})
+    resp.status_code = 202
+    resp.headers['Location'] = status_url
+    return resp
+
+
+def assincrono(tipo: str):
+    """Decorator (abaixo do require_*): com '?async=1' ou 'Prefer: respond-async' grava o job e
+    responde 202; sem o pedido, ou já dentro da execução do job, a rota roda normalmente."""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if g.get('job_id') is not None or not _pedido_assincrono():
+                return f(*args, **kwargs)
+            db = extensions.mongo_db
+            if db is None:
+                return jsonify({'error': 'MongoDB não inicializado'}), 503
+            if not current_user.is_authenticated:
+                return jsonify({'error': 'Usuário não autenticado'}), 401
+            query = urlencode([(k, v) for k, v in request.args.items(multi=True) if k != 'async'])
+            job = enfileirar(db, tipo, request.method, request.path, query,
+                             request.get_json(silent=True), current_user.get_id())
+            return resposta_aceita(job)
+        return decorated_function
+    return decorator
+
+
+class JobRunner:
+    def __init__(self, app, workers: int = 2, poll: float = 2.0, lease_segundos: float = 300.0,
+                 ttl_dias: float = 7.0):
+        self.app = app
+        self.workers = max(0, int(workers))
+        self.poll = max(0.1, float(poll))
+        self.lease_segundos = max(10.0, float(lease_segundos))
+        self.ttl = timedelta(days=float(ttl_dias))
+        self.dono = f'{socket.gethostname()}:{os.getpid()}:{id(self)}'
+        self._executor = None
+        self._thread = None
+        self._pid = None
+        self._parar = threading.Event()
+        self._acordar = threading.Event()
+        self._lock = threading.Lock()
+        self._ativos = {}
+
+    # Ciclo de vida
+    def iniciar(self):
+        with self._lock:
+            if self.workers <= 0 or (self._thread is not None and self._thread.is_alive()):
+                return
+            self._parar.clear()
+            self._pid = os.getpid()
+            self._ativos = {}
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='job')
+            self._thread = threading.Thread(target=self._executar, name='job-runner', daemon=True)
+            self._thread.start()
+
+    def encerrar(self, timeout: float = 5.0):
+        """Para de reivindicar jobs. Os que estão rodando são retomados por outro processo
+        quando o lease expirar."""
+        self._parar.set()
+        self._acordar.set()
+        t = self._thread
+        if t is not None and t.is_alive():
+            t.join(timeout)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def acordar(self):
+        if self._pid is not None and self._pid != os.getpid():
+            # processo filho (fork de servidor com preload): as threads não foram herdadas
+            self._thread = None
+            self.dono = f'{socket.gethostname()}:{os.getpid()}:{id(self)}'
+            self.iniciar()
+        self._acordar.set()
+
+    def _executar(self):
+        # primeiro ciclo só após um intervalo (ou um acordar()): o boot do worker não toca no banco
+        while not self._parar.is_set():
+            self._acordar.wait(self.poll)
+            self._acordar.clear()
+            if self._parar.is_set():
+                break
+            try:
+                self._ciclo()
+            except Exception as e:
+                logger.error(f'[Jobs] Despachante falhou: {e}')
+
+    def _ciclo(self):
+        db = extensions.mongo_db
+        if db is None:
+            return
+        with self._lock:
+            self._ativos = {k: f for k, f in self._ativos.items() if not f.done()}
+            ativos = list(self._ativos)
+        agora = _agora()
+        if ativos:
+            db[COLECAO].update_many({'_id': {'$in': ativos}, 'dono': self.dono, 'status': 'executando'},
+                                    {'$set': {'lease_ate': agora + timedelta(seconds=self.lease_segundos)}})
+        self.expirar_abandonados(db, agora)
+        while len(ativos) < self.workers and not self._parar.is_set():
+            job = self.reivindicar(db)
+            if job is None:
+                break
+            with self._lock:
+                self._ativos[job['_id']] = self._executor.submit(self.executar, job)
+            ativos.append(job['_id'])
+
+    # Reivindicação por lease
+    def reivindicar(self, db, agora: datetime = None) -> dict:
+        agora = agora or _agora()
+        return db[COLECAO].find_one_and_update(
+            {'$or': [{'status': 'pendente'}, {'status': 'executando', 'lease_ate': {'$lt': agora}}],
+             'tentativas': {'$lt': MAX_TENTATIVAS}},
+            {'$set': {'status': 'executando', 'dono': self.dono, 'iniciado_em': agora, 'atualizado_em': agora,
+                      'lease_ate': agora + timedelta(seconds=self.lease_segundos)},
+             '$inc': {'tentativas': 1}},
+            sort=[('created_at', 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    def expirar_abandonados(self, db, agora: datetime = None) -> int:
+        """Jobs cujo lease expirou depois da última tentativa: finaliza com erro."""
+        agora = agora or _agora()
+        res = db[COLECAO].update_many(
+            {'status': 'executando', 'lease_ate': {'$lt': agora}, 'tentativas': {'$gte': MAX_TENTATIVAS}},
+            {'$set': {'status': 'erro', 'erro': 'Job interrompido em todas as tentativas',
+                      'concluido_em': agora, 'atualizado_em': agora, 'expira_em': agora + self.ttl}}
+        )
+        return res.modified_count
+
+    # Execução
+    def executar(self, job: dict) -> dict:
+        """Reproduz a requisição do job com o usuário que o criou e grava a resposta."""
+        from auth import load_user
+
+        req = job.get('requisicao') or {}
+        opcoes = {'method': req.get('metodo') or 'GET', 'query_string': req.get('query_string') or ''}
+        corpo_req = req.get('corpo')
+        if job.get('checkpoint') and isinstance(corpo_req, (dict, type(None))):
+            # nova tentativa: continua a execução registrada pela anterior
+            corpo_req = dict(corpo_req or {}, **job['checkpoint'])
+        if corpo_req is not None:
+            opcoes['json'] = corpo_req
+        status_http, corpo, mimetype, erro = None, None, None, None
+        try:
+            with self.app.test_request_context(req.get('caminho') or '/', **opcoes):
+                g.job_id = job['_id']
+                g.job_lease_segundos = self.lease_segundos
+                g.job_checkpoint = dict(job.get('checkpoint') or {})
+                usuario = load_user(job['usuario_id']) if job.get('usuario_id') else None
+                if usuario is not None:
+                    login_user(usuario)
+                if request.url_rule is None:
+                    raise ValueError(f"Rota não encontrada: {req.get('caminho')}")
+                view = self.app.view_functions[request.url_rule.endpoint]
+                resp = self.app.make_response(view(**(request.view_args or {})))
+                status_http = resp.status_code
+                mimetype = resp.mimetype
+                corpo = resp.get_data(as_text=True)
+                if status_http >= 400:
+                    erro = ((resp.get_json(silent=True) or {}).get('error') if resp.is_json else None) or f'HTTP {status_http}'
+        except Exception as e:
+            erro = str(e)
+            logger.error(f"[Jobs] Job {job['_id']} ({job.get('tipo')}) falhou: {e}")
+        agora = _agora()
+        db = extensions.mongo_db
+        return db[COLECAO].find_one_and_update(
+            # só o dono atual grava: se o lease foi perdido, o job pertence a outro processo
+            {'_id': job['_id'], 'dono': job.get('dono'), 'status': 'executando'},
+            {'$set': {'status': 'erro' if erro else 'concluido', 'erro': erro, 'status_http': status_http,
+                      'mimetype': mimetype, 'resultado': corpo, 'concluido_em': agora, 'atualizado_em': agora,
+                      'expira_em': agora + self.ttl},
+             '$unset': {'lease_ate': ''}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    def executar_pendentes(self, limite: int = None) -> list:
+        """Executa na thread atual os jobs pendentes (testes e scripts). Retorna os jobs finalizados."""
+        db = extensions.mongo_db
+        feitos = []
+        while db is not None and (limite is None or len(feitos) < limite):
+            job = self.reivindicar(db)
+            if job is None:
+                break
+            feitos.append(self.executar(job))
+        return feitos
+
+
+_runner = None
+
+
+def get_runner():
+    return _runner
+
+
+def _encerrar_runner():
+    if _runner is not None:
+        _runner.encerrar()
+
+
+def init_app(app):
+    """Cria o runner do processo para este app (um runner de app anterior é encerrado, pois ele
+    executaria as rotas do app antigo); com JOBS_WORKERS=0 os jobs ficam para outro processo (ou
+    para executar_pendentes)."""
+    global _runner
+    if _runner is not None and _runner.app is app:
+        _runner.iniciar()
+        return _runner
+    if _runner is not None:
+        _runner.encerrar()
+    else:
+        atexit.register(_encerrar_runner)
+    _runner = JobRunner(
+        app,
+        workers=app.config.get('JOBS_WORKERS', 2),
+        poll=app.config.get('JOBS_POLL_SECONDS', 2),
+        lease_segundos=app.config.get('JOBS_LEASE_SECONDS', 300),
+        ttl_dias=app.config.get('JOBS_TTL_DIAS', 7),
+    )
+    _runner.iniciar()
+    return _runner
@@ -0,0 +1,496 @@
+"""Métricas no formato de exposição do Prometheus (GET /metrics).
+
+Cada processo acumula seus contadores e histogramas em memória e grava um retrato em
+METRICS_DIR/<pid>-<início>.json a cada METRICS_FLUSH_SECONDS (e no encerramento); /metrics soma
+os retratos de todos os processos do diretório, então qualquer worker do gunicorn responde pelo
+conjunto. Os retratos de processos encerrados (pid que não existe mais) são incorporados a
+METRICS_DIR/encerrados.json na coleta e apagados: os contadores não voltam atrás quando um
+worker é reciclado e o diretório não cresce com o número de reciclagens. O diretório é por host
+(a verificação do pid é local).
+
+Séries:
+- http_requests_total, http_request_duration_seconds, http_response_size_bytes (por endpoint)
+- response_cache_{hits,misses,evictions,expirations,invalidations}_total
+- mongo_commands_total, mongo_command_failures_total, mongo_command_duration_seconds
+  (por coleção e comando; CommandListener registrado em extensions.init_mongo)
+- mongo_pool_checkout_wait_seconds, mongo_pool_checkout_failures_total (ConnectionPoolListener)
+- jobs_queue_depth (pendentes/executando, lido do Mongo na coleta)
+
+Configuração (config.Config):
+- METRICS_ENABLED: liga a coleta por requisição e o /metrics
+- METRICS_DIR: diretório compartilhado entre os workers (padrão: <tmp>/vitaflow-metrics)
+- METRICS_FLUSH_SECONDS: intervalo de gravação do retrato do processo
+- METRICS_TOKEN: se definido, /metrics exige 'Authorization: Bearer <token>'; sem ele, exige
+  sessão de super_admin (exceto com DEBUG)
+"""
+import atexit
+import glob
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem compactação dos retratos
+    fcntl = None
+
+from flask import g, request
+from pymongo import monitoring
+
+import perfil_consultas
+
+logger = logging.getLogger(__name__)
+
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_TAMANHO = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+BUCKETS_MONGO = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+BUCKETS_CHECKOUT = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+# nome -> (tipo, ajuda, buckets)
+DEFINICOES = {
+    'http_requests_total': ('counter', 'Requisições HTTP por endpoint, método e status', None),
+    'http_request_duration_seconds': ('histogram', 'Latência das requisições HTTP', BUCKETS_LATENCIA),
+    'http_response_size_bytes': ('histogram', 'Tamanho das respostas HTTP', BUCKETS_TAMANHO),
+    'response_cache_hits_total': ('counter', 'Acertos do response_cache', None),
+    'response_cache_misses_total': ('counter', 'Faltas do response_cache', None),
+    'response_cache_evictions_total': ('counter', 'Entradas removidas do response_cache por tamanho', None),
+    'response_cache_expirations_total': ('counter', 'Entradas do response_cache expiradas na leitura', None),
+    'response_cache_invalidations_total': ('counter', 'Entradas do response_cache removidas por clear_prefix', None),
+    'mongo_commands_total': ('counter', 'Comandos MongoDB por coleção e comando', None),
+    'mongo_command_failures_total': ('counter', 'Comandos MongoDB com erro', None),
+    'mongo_command_duration_seconds': ('histogram', 'Duração dos comandos MongoDB', BUCKETS_MONGO),
+    'mongo_pool_checkout_wait_seconds': ('histogram', 'Espera para obter conexão do pool', BUCKETS_CHECKOUT),
+    'mongo_pool_checkout_failures_total': ('counter', 'Falhas ao obter conexão do pool', None),
+}
+
+
+class Registro:
+    """Contadores e histogramas do processo; séries indexadas pelos rótulos em JSON."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.dados = {}
+
+    def _serie(self, nome: str, rotulos: dict):
+        return json.dumps(sorted((rotulos or {}).items()), separators=(',', ':'))
+
+    def inc(self, nome: str, rotulos: dict = None, valor: float = 1.0):
+        chave = self._serie(nome, rotulos)
+        with self._lock:
+            series = self.dados.setdefault(nome, {})
+            series[chave] = series.get(chave, 0.0) + valor
+
+    def definir(self, nome: str, rotulos: dict, valor: float):
+        chave = self._serie(nome, rotulos)
+        with self._lock:
+            self.dados.setdefault(nome, {})[chave] = float(valor)
+
+    def observar(self, nome: str, rotulos: dict, valor: float):
+        buckets = DEFINICOES[nome][2]
+        chave = self._serie(nome, rotulos)
+        with self._lock:
+            series = self.dados.setdefault(nome, {})
+            h = series.get(chave)
+            if h is None:
+                # contagem por faixa (a última é +Inf), soma e total
+                h = series[chave] = {'b': [0] * (len(buckets) + 1), 'soma': 0.0, 'n': 0}
+            i = 0
+            while i < len(buckets) and valor > buckets[i]:
+                i += 1
+            h['b'][i] += 1
+            h['soma'] += valor
+            h['n'] += 1
+
+    def retrato(self) -> dict:
+        with self._lock:
+            return json.loads(json.dumps(self.dados))
+
+    def limpar(self):
+        with self._lock:
+            self.dados = {}
+
+
+registro = Registro()
+_pid = os.getpid()
+_inicio = int(time.time())
+
+
+def _registro_do_processo() -> Registro:
+    global _pid, _inicio
+    if _pid != os.getpid():
+        # processo filho (fork com preload): não herda o que o processo pai contou
+        _pid, _inicio = os.getpid(), int(time.time())
+        registro.limpar()
+        if _exportador is not None:
+            _exportador._thread = None
+            _exportador.iniciar()
+    return registro
+
+
+# Mongo
+def _colecao(cmd: dict, nome: str) -> str:
+    valor = cmd.get(nome) if nome != 'getMore' else cmd.get('collection')
+    return valor if isinstance(valor, str) else '-'
+
+
+class ComandosMetricasListener(monitoring.CommandListener):
+    def __init__(self):
+        self._pendentes = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        if event.command_name in perfil_consultas.COMANDOS_IGNORADOS:
+            return
+        with self._lock:
+            self._pendentes[(event.request_id, event.connection_id)] = _colecao(event.command, event.command_name)
+
+    def _concluir(self, event, ok: bool):
+        with self._lock:
+            colecao = self._pendentes.pop((event.request_id, event.connection_id), None)
+        if colecao is not None:
+            comando_observado(event.command_name, colecao, event.duration_micros / 1000.0, ok)
+
+    def succeeded(self, event):
+        self._concluir(event, True)
+
+    def failed(self, event):
+        self._concluir(event, False)
+
+
+class PoolMetricasListener(monitoring.ConnectionPoolListener):
+    """Mede a espera entre pedir e obter uma conexão (eventos na thread que pediu)."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def connection_check_out_started(self, event):
+        self._local.inicio = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        inicio = getattr(self._local, 'inicio', None)
+        if inicio is not None:
+            self._local.inicio = None
+            _registro_do_processo().observar('mongo_pool_checkout_wait_seconds', {}, time.perf_counter() - inicio)
+
+    def connection_check_out_failed(self, event):
+        self._local.inicio = None
+        _registro_do_processo().inc('mongo_pool_checkout_failures_total', {'reason': str(event.reason)})
+
+    def connection_checked_in(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+
+def comando_observado(comando: str, colecao: str, duracao_ms: float, ok: bool = True):
+    r = _registro_do_processo()
+    rotulos = {'collection': colecao or '-', 'command': comando}
+    r.inc('mongo_commands_total', rotulos)
+    if not ok:
+        r.inc('mongo_command_failures_total', rotulos)
+    r.observar('mongo_command_duration_seconds', rotulos, duracao_ms / 1000.0)
+
+
+comandos_listener = ComandosMetricasListener()
+pool_listener = PoolMetricasListener()
+
+
+def listeners() -> list:
+    return [comandos_listener, pool_listener]
+
+
+# Retratos por processo
+def diretorio(app) -> str:
+    return app.config.get('METRICS_DIR') or os.path.join(tempfile.gettempdir(), 'vitaflow-metrics')
+
+
+def _atualizar_cache(r: Registro):
+    import extensions
+    c = extensions.response_cache
+    for campo in ('hits', 'misses', 'evictions', 'expirations', 'invalidations'):
+        r.definir(f'response_cache_{campo}_total', {}, getattr(c, campo, 0))
+
+
+def gravar_retrato(pasta: str) -> str:
+    r = _registro_do_processo()
+    _atualizar_cache(r)
+    os.makedirs(pasta, exist_ok=True)
+    caminho = os.path.join(pasta, f'{_pid}-{_inicio}.json')
+    tmp = f'{caminho}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(r.retrato(), f)
+    os.replace(tmp, caminho)
+    return caminho
+
+
+def _somar(retratos: list) -> dict:
+    total = {}
+    for dados in retratos:
+        for nome, series in dados.items():
+            if nome not in DEFINICOES:
+                continue
+            destino = total.setdefault(nome, {})
+            for chave, valor in series.items():
+                atual = destino.get(chave)
+                if isinstance(valor, dict):
+                    if atual is None:
+                        destino[chave] = {'b': list(valor['b']), 'soma': valor['soma'], 'n': valor['n']}
+                    elif len(atual['b']) == len(valor['b']):
+                        atual['b'] = [x + y for x, y in zip(atual['b'], valor['b'])]
+                        atual['soma'] += valor['soma']
+                        atual['n'] += valor['n']
+                else:
+                    destino[chave] = (atual or 0.0) + valor
+    return total
+
+
+def _rotulos(pares, extra=None) -> str:
+    itens = list(pares) + list(extra or [])
+    if not itens:
+        return ''
+    def _esc(v):
+        return str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{k}="{_esc(v)}"' for k, v in itens) + '}'
+
+
+def _numero(v) -> str:
+    v = float(v)
+    return str(int(v)) if v.is_integer() else repr(v)
+
+
+def _formatar(total: dict, gauges: dict) -> str:
+    linhas = []
+    for nome, (tipo, ajuda, buckets) in DEFINICOES.items():
+        series = total.get(nome) or {}
+        linhas.append(f'# HELP {nome} {ajuda}')
+        linhas.append(f'# TYPE {nome} {tipo}')
+        for chave in sorted(series):
+            pares = json.loads(chave)
+            valor = series[chave]
+            if tipo == 'histogram':
+                acumulado = 0
+                for limite, n in zip(list(buckets) + ['+Inf'], valor['b']):
+                    acumulado += n
+                    le = limite if limite == '+Inf' else _numero(limite)
+                    linhas.append(f'{nome}_bucket{_rotulos(pares, [("le", le)])} {acumulado}')
+                linhas.append(f'{nome}_sum{_rotulos(pares)} {_numero(valor["soma"])}')
+                linhas.append(f'{nome}_count{_rotulos(pares)} {valor["n"]}')
+            else:
+                linhas.append(f'{nome}{_rotulos(pares)} {_numero(valor)}')
+    for nome, (ajuda, series) in gauges.items():
+        linhas.append(f'# HELP {nome} {ajuda}')
+        linhas.append(f'# TYPE {nome} gauge')
+        for rotulos, valor in series:
+            linhas.append(f'{nome}{_rotulos(sorted(rotulos.items()))} {_numero(valor)}')
+    return '\n'.join(linhas) + '\n'
+
+
+def _gauges_jobs() -> dict:
+    import extensions
+    import jobs
+    db = extensions.mongo_db
+    if db is None:
+        return {}
+    series = []
+    for status in ('pendente', 'executando'):
+        try:
+            series.append(({'status': status}, db[jobs.COLECAO].count_documents({'status': status})))
+        except Exception:
+            pass
+    return {'jobs_queue_depth': ('Jobs em segundo plano por status', series)}
+
+
+ENCERRADOS = 'encerrados.json'
+
+
+def _ler_json(caminho: str):
+    try:
+        with open(caminho, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _processo_encerrado(nome: str) -> bool:
+    try:
+        pid, inicio = (int(x) for x in nome[:-len('.json')].split('-', 1))
+    except ValueError:
+        return False
+    if pid == _pid:
+        # mesmo pid reaproveitado por outro processo: o retrato antigo é de um processo encerrado
+        return inicio != _inicio
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        pass
+    return False
+
+
+def compactar(pasta: str) -> int:
+    """Soma os retratos de processos encerrados em encerrados.json e apaga os arquivos.
+
+    O agregado guarda os nomes incorporados: quem ler o diretório entre a gravação do agregado
+    e a remoção dos arquivos não soma duas vezes. Retorna quantos retratos foram incorporados.
+    """
+    if fcntl is None:
+        return 0
+    os.makedirs(pasta, exist_ok=True)
+    with open(os.path.join(pasta, '.compactacao.lock'), 'a') as trava:
+        try:
+            fcntl.flock(trava, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            # outro worker está compactando
+            return 0
+        caminho = os.path.join(pasta, ENCERRADOS)
+        agregado = _ler_json(caminho) or {'dados': {}, 'incorporados': []}
+        ja = set(agregado.get('incorporados') or [])
+        novos, retratos = [], [agregado.get('dados') or {}]
+        for arq in sorted(os.listdir(pasta)):
+            if arq == ENCERRADOS or not arq.endswith('.json') or not _processo_encerrado(arq):
+                continue
+            if arq not in ja:
+                dados = _ler_json(os.path.join(pasta, arq))
+                if dados is None:
+                    continue
+                retratos.append(dados)
+            novos.append(arq)
+        if not novos:
+            return 0
+        tmp = f'{caminho}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'dados': _somar(retratos), 'incorporados': novos}, f)
+        os.replace(tmp, caminho)
+        for arq in novos:
+            try:
+                os.remove(os.path.join(pasta, arq))
+            except FileNotFoundError:
+                pass
+        return len([a for a in novos if a not in ja])
+
+
+def exposicao(pasta: str) -> str:
+    """Texto do /metrics: soma dos retratos de todos os processos + gauges lidos na hora."""
+    gravar_retrato(pasta)
+    try:
+        compactar(pasta)
+    except Exception as e:
+        logger.warning(f'[Métricas] Compactação dos retratos falhou: {e}')
+    # retratos antes do agregado: um arquivo incorporado nesse meio tempo é descartado abaixo,
+    # e um removido antes do glob já está no agregado
+    por_nome = {}
+    for caminho in glob.glob(os.path.join(pasta, '*.json')):
+        nome = os.path.basename(caminho)
+        if nome == ENCERRADOS:
+            continue
+        try:
+            with open(caminho, 'r', encoding='utf-8') as f:
+                por_nome[nome] = json.load(f)
+        except Exception:
+            # arquivo sendo substituído ou removido por outro processo: entra na próxima coleta
+            continue
+    try:
+        agregado = _ler_json(os.path.join(pasta, ENCERRADOS)) or {}
+    except Exception:
+        agregado = {}
+    incorporados = set(agregado.get('incorporados') or [])
+    retratos = [agregado.get('dados') or {}] + [d for n, d in por_nome.items() if n not in incorporados]
+    return _formatar(_somar(retratos), _gauges_jobs())
+
+
+class ExportadorRetratos:
+    def __init__(self, app, intervalo: float = 5.0):
+        self.app = app
+        self.intervalo = max(0.5, float(intervalo))
+        self._thread = None
+        self._parar = threading.Event()
+
+    def iniciar(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._executar, name='metrics-exporter', daemon=True)
+        self._thread.start()
+
+    def encerrar(self, timeout: float = 5.0):
+        self._parar.set()
+        t = self._thread
+        if t is not None and t.is_alive():
+            t.join(timeout)
+        self.gravar()
+
+    def gravar(self):
+        try:
+            gravar_retrato(diretorio(self.app))
+        except Exception as e:
+            logger.warning(f'[Métricas] Retrato não gravado: {e}')
+
+    def _executar(self):
+        while not self._parar.wait(self.intervalo):
+            self.gravar()
+
+
+_exportador = None
+
+
+def _observar_requisicao(resp):
+    inicio = g.pop('_metricas_inicio', None)
+    if inicio is None:
+        return resp
+    try:
+        r = _registro_do_processo()
+        endpoint = request.url_rule.endpoint if request.url_rule is not None else 'nao_encontrado'
+        r.inc('http_requests_total', {'endpoint': endpoint, 'method': request.method, 'status': str(resp.status_code)})
+        r.observar('http_request_duration_seconds', {'endpoint': endpoint, 'method': request.method}, time.perf_counter() - inicio)
+        if resp.content_length is not None:
+            r.observar('http_response_size_bytes', {'endpoint': endpoint}, resp.content_length)
+    except Exception:
+        pass
+    return resp
+
+
+def init_app(app):
+    """Coleta por requisição e exportação periódica do retrato do processo."""
+    global _exportador
+    if not app.config.get('METRICS_ENABLED', True):
+        return None
+
+    @app.before_request
+    def _metricas_inicio():
+        g._metricas_inicio = time.perf_counter()
+
+    app.after_request(_observar_requisicao)
+
+    if comando_observado not in perfil_consultas.observadores:
+        # fallback mongomock: sem eventos de monitoramento
+        perfil_consultas.observadores.append(comando_observado)
+    if _exportador is None:
+        _exportador = ExportadorRetratos(app, app.config.get('METRICS_FLUSH_SECONDS', 5))
+        atexit.register(_exportador.encerrar)
+    else:
+        _exportador.app = app
+    _exportador.iniciar()
+    return _exportador
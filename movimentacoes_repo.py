@@ -0,0 +1,497 @@
+"""Repositório do histórico de movimentações.
+
+Dois layouts de armazenamento atrás da mesma interface (subconjunto da API de Collection:
+find/find_one/count_documents/aggregate/insert_one/insert_many/update_one/delete_many):
+
+- 'colecao' (padrão): uma coleção 'movimentacoes' com um documento por movimentação.
+- 'buckets': só 'movimentacoes_buckets' (um documento por produto/mês, com até
+  BUCKET_MAX_ITENS movimentações em 'itens' e as datas mínima/máxima do bucket). A coleção
+  plana deixa de ser gravada e lida: menos documentos e entradas de índice por movimentação.
+  Consultas por produto/data leem só os buckets da faixa; listagens ordenadas por data com
+  limite percorrem os buckets pelo índice de datas e param assim que os próximos não podem
+  entrar na página; filtros por _id leem só os buckets com os itens (índice itens._id) e o
+  arquivamento avança bucket a bucket (proximo_bloco).
+
+Todo leitor e escritor do histórico (rotas, saldos, relatório materializado, arquivamento)
+passa por get_repo(). Migração: parar o app, rodar scripts/migrar_movimentacoes_buckets.py e
+então ativar MOVIMENTACOES_STORAGE=buckets.
+"""
+import os
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.results import DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+BUCKET_MAX_ITENS = 500
+
+
+def _datas_do_doc(doc: dict):
+    # UTC naive, como o Mongo grava: datas com e sem fuso no mesmo doc são comparáveis
+    datas = [d for d in (doc.get('data_movimentacao'), doc.get('created_at')) if isinstance(d, datetime)]
+    return [d.astimezone(timezone.utc).replace(tzinfo=None) if d.tzinfo else d for d in datas]
+
+
+def _mes_do_doc(doc: dict) -> str:
+    datas = _datas_do_doc(doc)
+    ref = datas[0] if datas else datetime.utcnow()
+    return ref.strftime('%Y-%m')
+
+
+def _valores(cond):
+    """Valores explícitos de uma condição de igualdade/$in, ou None quando não restringe."""
+    if isinstance(cond, dict):
+        if '$in' in cond and len(cond) == 1:
+            return set(str(v) for v in cond['$in'])
+        if '$eq' in cond and len(cond) == 1:
+            return {str(cond['$eq'])}
+        return None
+    return {str(cond)}
+
+
+def _faixa(cond):
+    if not isinstance(cond, dict):
+        if isinstance(cond, datetime):
+            return cond, cond
+        return None, None
+    lo = cond.get('$gte', cond.get('$gt'))
+    hi = cond.get('$lte', cond.get('$lt'))
+    return (lo if isinstance(lo, datetime) else None), (hi if isinstance(hi, datetime) else None)
+
+
+def _restricoes(query: dict) -> dict:
+    """Extrai de um filtro de movimentações as restrições aplicáveis ao nível do bucket.
+    O resultado é sempre mais amplo que o filtro original (nunca descarta um bucket que
+    contenha documento compatível): {'produtos': set|None, 'lo': datetime|None, 'hi': datetime|None}.
+    """
+    res = {'produtos': None, 'lo': None, 'hi': None}
+    for key, val in (query or {}).items():
+        if key == '$and':
+            for c in val:
+                _and(res, _restricoes(c))
+        elif key == '$or':
+            _and(res, _uniao([_restricoes(c) for c in val]))
+        elif key == 'produto_id':
+            vals = _valores(val)
+            if vals is not None:
+                _and(res, {'produtos': vals, 'lo': None, 'hi': None})
+        elif key in ('data_movimentacao', 'created_at'):
+            lo, hi = _faixa(val)
+            _and(res, {'produtos': None, 'lo': lo, 'hi': hi})
+    return res
+
+
+def _and(acc: dict, other: dict):
+    if other['produtos'] is not None:
+        acc['produtos'] = other['produtos'] if acc['produtos'] is None else (acc['produtos'] & other['produtos'])
+    if other['lo'] is not None:
+        acc['lo'] = other['lo'] if acc['lo'] is None else max(acc['lo'], other['lo'])
+    if other['hi'] is not None:
+        acc['hi'] = other['hi'] if acc['hi'] is None else min(acc['hi'], other['hi'])
+
+
+def _uniao(ramos: list) -> dict:
+    if not ramos:
+        return {'produtos': None, 'lo': None, 'hi': None}
+    produtos = None
+    if all(r['produtos'] is not None for r in ramos):
+        produtos = set().union(*[r['produtos'] for r in ramos])
+    lo = min(r['lo'] for r in ramos) if all(r['lo'] is not None for r in ramos) else None
+    hi = max(r['hi'] for r in ramos) if all(r['hi'] is not None for r in ramos) else None
+    return {'produtos': produtos, 'lo': lo, 'hi': hi}
+
+
+def _ids_do_filtro(cond):
+    """Lista de _id de uma condição de igualdade/$in sobre _id, ou None."""
+    if cond is None:
+        return None
+    if isinstance(cond, dict):
+        if set(cond) == {'$in'}:
+            return list(cond['$in'])
+        if set(cond) == {'$eq'}:
+            return [cond['$eq']]
+        return None
+    return [cond]
+
+
+class MovimentacoesRepository:
+    """Acesso ao histórico no layout de coleção única."""
+    layout = 'colecao'
+
+    def __init__(self, db):
+        self.db = db
+        self.coll = db['movimentacoes']
+
+    # Escrita
+    def insert_one(self, doc: dict, session=None):
+        return self.coll.insert_one(doc, session=session)
+
+    def insert_many(self, docs: list, ordered: bool = True, session=None):
+        return self.coll.insert_many(docs, ordered=ordered, session=session)
+
+    def update_one(self, filtro: dict, update: dict, session=None):
+        return self.coll.update_one(filtro, update, session=session)
+
+    def delete_many(self, filtro: dict, session=None):
+        return self.coll.delete_many(filtro, session=session)
+
+    # Leitura
+    def find(self, query: dict = None, projection=None, sort=None, skip: int = 0, limit: int = 0, session=None):
+        cursor = self.coll.find(query or {}, projection, session=session)
+        if sort:
+            cursor = cursor.sort(sort)
+        if skip:
+            cursor = cursor.skip(skip)
+        if limit:
+            cursor = cursor.limit(limit)
+        return cursor
+
+    def find_one(self, query: dict = None, projection=None, sort=None, session=None):
+        return self.coll.find_one(query or {}, projection, sort=sort, session=session)
+
+    def count(self, query: dict) -> int:
+        return self.coll.count_documents(query or {})
+
+    def count_documents(self, query: dict, session=None) -> int:
+        return self.coll.count_documents(query or {}, session=session)
+
+    def aggregate(self, pipeline: list, session=None):
+        return self.coll.aggregate(pipeline, allowDiskUse=True, session=session)
+
+    def proximo_bloco(self, query: dict, apos=None, chunk: int = 1000, session=None):
+        """Próximo bloco de `query` para percorrer o histórico inteiro (arquivamento).
+        Retorna (docs, posição); a posição vai em `apos` na chamada seguinte e é None no fim."""
+        q = {'$and': [query or {}, {'_id': {'$gt': apos}}]} if apos is not None else (query or {})
+        docs = list(self.coll.find(q, session=session).sort('_id', 1).limit(int(chunk)))
+        return docs, (docs[-1]['_id'] if docs else None)
+
+
+class _CursorBuckets:
+    """Cursor preguiçoso do layout buckets: aceita o encadeamento sort/skip/limit/batch_size
+    de um Cursor do pymongo e só consulta o banco ao ser iterado."""
+
+    def __init__(self, repo, query, projection, session=None):
+        self._repo = repo
+        self._query = query or {}
+        self._projection = projection
+        self._session = session
+        self._sort = None
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, chave, direcao=None):
+        self._sort = [(chave, direcao or ASCENDING)] if isinstance(chave, str) else list(chave)
+        return self
+
+    def skip(self, n: int):
+        self._skip = int(n or 0)
+        return self
+
+    def limit(self, n: int):
+        self._limit = int(n or 0)
+        return self
+
+    def batch_size(self, _n: int):
+        return self
+
+    def __iter__(self):
+        return iter(self._repo._buscar(self._query, self._projection, self._sort, self._skip, self._limit, self._session))
+
+
+def _projecao(projection):
+    if projection is None:
+        return None
+    if isinstance(projection, (list, tuple)):
+        return {c: 1 for c in projection}
+    return dict(projection)
+
+
+class MovimentacoesBucketRepository(MovimentacoesRepository):
+    """Layout agrupado por produto/mês, único armazenamento do histórico."""
+    layout = 'buckets'
+    # buckets lidos na primeira rodada da busca ordenada por data (dobra a cada rodada)
+    GRUPO_INICIAL = 8
+
+    def __init__(self, db):
+        super().__init__(db)
+        self.buckets = db['movimentacoes_buckets']
+
+    # Escrita
+    def _push(self, docs: list, session=None):
+        """Acrescenta docs do mesmo produto/mês num bucket com espaço (ou cria um novo)."""
+        datas = [d for doc in docs for d in _datas_do_doc(doc)] or [datetime.utcnow()]
+        self.buckets.update_one(
+            {'produto_key': str(docs[0].get('produto_id')), 'mes': _mes_do_doc(docs[0]),
+             'n': {'$lte': BUCKET_MAX_ITENS - len(docs)}},
+            {
+                '$push': {'itens': {'$each': docs}},
+                '$inc': {'n': len(docs)},
+                '$min': {'data_min': min(datas)},
+                '$max': {'data_max': max(datas)},
+            },
+            upsert=True,
+            session=session
+        )
+
+    def insert_one(self, doc: dict, session=None):
+        doc.setdefault('_id', ObjectId())
+        self._push([doc], session=session)
+        return InsertOneResult(doc['_id'], True)
+
+    def insert_many(self, docs: list, ordered: bool = True, session=None):
+        grupos = {}
+        for doc in docs:
+            doc.setdefault('_id', ObjectId())
+            grupos.setdefault((str(doc.get('produto_id')), _mes_do_doc(doc)), []).append(doc)
+        for itens in grupos.values():
+            for i in range(0, len(itens), BUCKET_MAX_ITENS):
+                self._push(itens[i:i + BUCKET_MAX_ITENS], session=session)
+        return InsertManyResult([d['_id'] for d in docs], True)
+
+    def update_one(self, filtro: dict, update: dict, session=None):
+        """$set/$unset de uma movimentação direto no item do bucket (operador posicional).
+        Mudança de produto_id move o item para o bucket do novo produto."""
+        if set(update) - {'$set', '$unset'}:
+            raise ValueError(f'operador não suportado no layout buckets: {sorted(update)}')
+        sets = dict(update.get('$set') or {})
+        unsets = dict(update.get('$unset') or {})
+        item_id = filtro.get('_id') if set(filtro) == {'_id'} and not isinstance(filtro.get('_id'), dict) else None
+        if item_id is None or 'produto_id' in sets:
+            atual = self.find_one(filtro, session=session)
+            if atual is None:
+                return UpdateResult({'n': 0, 'nModified': 0}, True)
+            item_id = atual['_id']
+            if 'produto_id' in sets and str(sets['produto_id']) != str(atual.get('produto_id')):
+                novo = dict(atual, **sets)
+                for campo in unsets:
+                    novo.pop(campo, None)
+                self.delete_many({'_id': item_id}, session=session)
+                self._push([novo], session=session)
+                return UpdateResult({'n': 1, 'nModified': 1}, True)
+        op = {}
+        if sets:
+            op['$set'] = {f'itens.$.{k}': v for k, v in sets.items()}
+        if unsets:
+            op['$unset'] = {f'itens.$.{k}': '' for k in unsets}
+        datas = _datas_do_doc({k: v for k, v in sets.items() if k in ('data_movimentacao', 'created_at')})
+        if datas:
+            op['$min'] = {'data_min': min(datas)}
+            op['$max'] = {'data_max': max(datas)}
+        return self.buckets.update_one({'itens._id': item_id}, op, session=session)
+
+    def delete_many(self, filtro: dict, session=None):
+        """Remove as movimentações do filtro com $pull nos buckets que as contêm; buckets
+        vazios são apagados. As datas mínima/máxima ficam como limites (ainda válidos)."""
+        ids = [d['_id'] for d in self._buscar(filtro, {'_id': 1}, None, 0, 0, session)]
+        if not ids:
+            return DeleteResult({'n': 0}, True)
+        por_bucket = {}
+        alvo = set(ids)
+        for b in self.buckets.find({'itens._id': {'$in': ids}}, {'itens._id': 1}, session=session):
+            por_bucket[b['_id']] = [i['_id'] for i in b.get('itens') or [] if i.get('_id') in alvo]
+        ops = [UpdateOne({'_id': bid}, {'$pull': {'itens': {'_id': {'$in': itens}}}, '$inc': {'n': -len(itens)}})
+               for bid, itens in por_bucket.items() if itens]
+        if ops:
+            self.buckets.bulk_write(ops, ordered=False, session=session)
+            self.buckets.delete_many({'_id': {'$in': list(por_bucket)}, 'n': {'$lte': 0}}, session=session)
+        return DeleteResult({'n': sum(len(v) for v in por_bucket.values())}, True)
+
+    # Leitura
+    def _pre_filtro(self, query: dict) -> dict:
+        r = _restricoes(query or {})
+        pre = {}
+        if r['produtos'] is not None:
+            pre['produto_key'] = {'$in': list(r['produtos'])}
+        if r['lo'] is not None:
+            pre['data_max'] = {'$gte': r['lo']}
+        if r['hi'] is not None:
+            pre['data_min'] = {'$lte': r['hi']}
+        ids = _ids_do_filtro((query or {}).get('_id'))
+        if ids is not None:
+            # por _id (update/delete/arquivamento): só os buckets com os itens (idx_bkt_item_id)
+            pre['itens._id'] = {'$in': ids}
+        return pre
+
+    def _desaninhar(self, query: dict, pre: dict = None) -> list:
+        etapas = [
+            {'$match': self._pre_filtro(query) if pre is None else pre},
+            {'$unwind': '$itens'},
+            {'$replaceRoot': {'newRoot': '$itens'}},
+        ]
+        if query:
+            etapas.append({'$match': query})
+        return etapas
+
+    @staticmethod
+    def _pagina(sort, skip: int, limit: int, projection) -> list:
+        etapas = []
+        if sort:
+            etapas.append({'$sort': {k: v for k, v in sort}})
+        if skip:
+            etapas.append({'$skip': int(skip)})
+        if limit:
+            etapas.append({'$limit': int(limit)})
+        projection = _projecao(projection)
+        if projection:
+            etapas.append({'$project': projection})
+        return etapas
+
+    def _buscar(self, query, projection, sort, skip, limit, session=None):
+        if limit and sort and sort[0][0] in ('data_movimentacao', 'created_at') and sort[0][1] in (-1, DESCENDING):
+            return self._buscar_recentes(query, projection, sort, skip, limit, session)
+        pipeline = self._desaninhar(query) + self._pagina(sort, skip, limit, projection)
+        return self.buckets.aggregate(pipeline, allowDiskUse=True, session=session)
+
+    def _buscar_recentes(self, query, projection, sort, skip, limit, session=None):
+        """Página ordenada por data decrescente sem desaninhar todos os buckets.
+
+        Os buckets são lidos em ordem de data_max (índice idx_bkt_datas/idx_bkt_produto_datas) em
+        grupos crescentes. Nenhum item de um bucket ainda não lido tem data maior que o data_max
+        dele: quando esse limite fica abaixo da data do N-ésimo item já encontrado (N = skip+limit),
+        a página está completa e só os buckets lidos entram na consulta final.
+        """
+        campo = sort[0][0]
+        necessarios = int(skip) + int(limit)
+        pre = self._pre_filtro(query)
+        cabecalhos = self.buckets.find(pre, {'_id': 1, 'data_max': 1, 'n': 1}, session=session).sort('data_max', DESCENDING)
+        cabecalhos = iter(cabecalhos)
+        lidos = []
+        itens_lidos = 0
+        proximo = next(cabecalhos, None)
+        grupo = self.GRUPO_INICIAL
+        while proximo is not None:
+            for _ in range(grupo):
+                if proximo is None:
+                    break
+                lidos.append(proximo['_id'])
+                itens_lidos += int(proximo.get('n') or 0)
+                proximo = next(cabecalhos, None)
+            if proximo is None:
+                break
+            if itens_lidos < necessarios:
+                # os buckets lidos não têm itens suficientes nem sem filtro: nada a conferir ainda
+                grupo *= 2
+                continue
+            enesimo = list(self.buckets.aggregate(
+                self._desaninhar(query, {'_id': {'$in': lidos}})
+                + self._pagina(sort, necessarios - 1, 1, {campo: 1}), allowDiskUse=True, session=session))
+            valor = enesimo[0].get(campo) if enesimo else None
+            limite = proximo.get('data_max')
+            if isinstance(valor, datetime) and isinstance(limite, datetime) and limite < valor:
+                break
+            grupo *= 2
+        pipeline = self._desaninhar(query, {'_id': {'$in': lidos}}) if proximo is not None else self._desaninhar(query, pre)
+        return self.buckets.aggregate(pipeline + self._pagina(sort, skip, limit, projection),
+                                      allowDiskUse=True, session=session)
+
+    def find(self, query: dict = None, projection=None, sort=None, skip: int = 0, limit: int = 0, session=None):
+        cursor = _CursorBuckets(self, query, projection, session=session)
+        if sort:
+            cursor.sort(sort)
+        return cursor.skip(skip).limit(limit)
+
+    def find_one(self, query: dict = None, projection=None, sort=None, session=None):
+        return next(iter(self._buscar(query or {}, projection, list(sort) if sort else None, 0, 1, session)), None)
+
+    def count(self, query: dict) -> int:
+        return self.count_documents(query)
+
+    def count_documents(self, query: dict, session=None) -> int:
+        if not query:
+            rows = list(self.buckets.aggregate([{'$group': {'_id': None, 'n': {'$sum': '$n'}}}], session=session))
+        else:
+            rows = list(self.buckets.aggregate(self._desaninhar(query) + [{'$count': 'n'}],
+                                               allowDiskUse=True, session=session))
+        return int(rows[0]['n']) if rows else 0
+
+    def proximo_bloco(self, query: dict, apos=None, chunk: int = 1000, session=None):
+        """Percorre os buckets em ordem de _id e desaninha só os do bloco (>= `chunk` itens,
+        buckets inteiros): cada bloco custa o mesmo, qualquer que seja o tamanho do histórico.
+        A posição é o _id do último bucket lido; um bloco pode vir vazio (nenhum item do filtro)."""
+        pre = self._pre_filtro(query)
+        if apos is not None:
+            pre['_id'] = {'$gt': apos}
+        ids, itens = [], 0
+        for b in self.buckets.find(pre, {'_id': 1, 'n': 1}, session=session).sort('_id', ASCENDING):
+            ids.append(b['_id'])
+            itens += int(b.get('n') or 0)
+            if itens >= int(chunk):
+                break
+        if not ids:
+            return [], None
+        docs = list(self.buckets.aggregate(self._desaninhar(query, {'_id': {'$in': ids}}) + [{'$sort': {'_id': 1}}],
+                                           allowDiskUse=True, session=session))
+        return docs, ids[-1]
+
+    def aggregate(self, pipeline: list, session=None):
+        pipeline = list(pipeline or [])
+        query = {}
+        if pipeline and '$match' in pipeline[0]:
+            query = pipeline.pop(0)['$match']
+        return self.buckets.aggregate(self._desaninhar(query) + pipeline, allowDiskUse=True, session=session)
+
+
+def get_repo(db, layout: str | None = None) -> MovimentacoesRepository:
+    """Repositório conforme MOVIMENTACOES_STORAGE ('colecao' | 'buckets')."""
+    if layout is None:
+        try:
+            from flask import current_app
+            layout = current_app.config.get('MOVIMENTACOES_STORAGE')
+        except Exception:
+            layout = None
+        layout = layout or os.environ.get('MOVIMENTACOES_STORAGE') or 'colecao'
+    if str(layout).lower() == 'buckets':
+        return MovimentacoesBucketRepository(db)
+    return MovimentacoesRepository(db)
+
+
+def reconstruir_buckets(db, batch_size: int = 1000, logger=None) -> dict:
+    """(Re)constrói 'movimentacoes_buckets' a partir da coleção plana, em ordem de produto/data.
+    Buckets são montados em memória por (produto, mês) e gravados com insert_many.
+    """
+    buckets = db['movimentacoes_buckets']
+    buckets.delete_many({})
+    buckets.create_index([('produto_key', ASCENDING), ('mes', ASCENDING), ('n', ASCENDING)], name='idx_bkt_produto_mes')
+    buckets.create_index([('produto_key', ASCENDING), ('data_max', DESCENDING), ('data_min', ASCENDING)], name='idx_bkt_produto_datas')
+    buckets.create_index([('data_max', DESCENDING), ('data_min', ASCENDING)], name='idx_bkt_datas')
+    buckets.create_index([('itens._id', ASCENDING)], name='idx_bkt_item_id')
+
+    total_docs = 0
+    total_buckets = 0
+    abertos = {}
+    pendentes = []
+
+    def _fechar(key):
+        b = abertos.pop(key, None)
+        if b and b['itens']:
+            pendentes.append(b)
+
+    cursor = db['movimentacoes'].find({}).sort([('produto_id', 1), ('data_movimentacao', 1)]).batch_size(batch_size)
+    for doc in cursor:
+        key = (str(doc.get('produto_id')), _mes_do_doc(doc))
+        b = abertos.get(key)
+        if b is None or b['n'] >= BUCKET_MAX_ITENS:
+            _fechar(key)
+            b = {'produto_key': key[0], 'mes': key[1], 'n': 0, 'itens': [], 'data_min': None, 'data_max': None}
+            abertos[key] = b
+        datas = _datas_do_doc(doc) or [datetime.utcnow()]
+        b['itens'].append(doc)
+        b['n'] += 1
+        b['data_min'] = min(datas + ([b['data_min']] if b['data_min'] else []))
+        b['data_max'] = max(datas + ([b['data_max']] if b['data_max'] else []))
+        total_docs += 1
+        # produto mudou: buckets anteriores não recebem mais itens
+        for k in [k for k in abertos if k[0] != key[0]]:
+            _fechar(k)
+        if len(pendentes) >= 50:
+            buckets.insert_many(pendentes, ordered=False)
+            total_buckets += len(pendentes)
+            pendentes = []
+    for k in list(abertos):
+        _fechar(k)
+    if pendentes:
+        buckets.insert_many(pendentes, ordered=False)
+        total_buckets += len(pendentes)
+    if logger is not None:
+        logger.info(f'[Buckets Movimentações] {total_docs} movimentações em {total_buckets} buckets')
+    return {'movimentacoes': total_docs, 'buckets': total_buckets}
@@ -0,0 +1,286 @@
+"""Perfil dos comandos MongoDB por requisição.
+
+Um pymongo CommandListener (registrado no MongoClient em extensions.init_mongo) soma, para a
+requisição em andamento na thread, o número de comandos, o tempo total no banco e quantas vezes
+cada forma de consulta se repetiu. A forma é o comando + coleção + filtro com os valores
+trocados por '?' (ex.: find estoques {"produto_id":"?"}), então a mesma consulta feita linha
+a linha aparece como uma forma repetida.
+
+Ao fim da requisição o perfil vai para o cabeçalho Server-Timing (db;dur=...;desc="N cmds"),
+para a linha de log da requisição (com as formas mais repetidas) e, quando uma forma passa de
+MONGO_PROFILER_NPLUS1 repetições, para um aviso de N+1.
+
+Com o fallback mongomock (dev/testes) não há eventos de monitoramento: instrumentar_mongomock()
+envolve os métodos de Collection para registrar as mesmas formas (o tempo medido é o da chamada
+em memória; em find, o cursor ainda não foi percorrido) e avisar os `observadores`.
+
+Configuração (config.Config):
+- MONGO_PROFILER_ENABLED: liga o perfil por requisição
+- MONGO_PROFILER_NPLUS1: repetições da mesma forma que geram o aviso de N+1
+- MONGO_PROFILER_TOP: formas listadas na linha de log
+"""
+import contextvars
+import functools
+import json
+import logging
+import threading
+import time
+from collections import Counter
+
+from flask import g, request
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# comandos de protocolo/autenticação que não são consultas da aplicação
+COMANDOS_IGNORADOS = {'hello', 'ismaster', 'isMaster', 'ping', 'saslStart', 'saslContinue', 'endSessions',
+              'buildInfo', 'getLastError', 'killCursors', 'abortTransaction', 'commitTransaction'}
+
+_perfil_atual = contextvars.ContextVar('perfil_consultas', default=None)
+
+
+class Perfil:
+    def __init__(self, pai=None):
+        # perfil aberto dentro de outro (requisição dentro de um orçamento de teste) soma nos dois
+        self.pai = pai
+        self.inicio = time.perf_counter()
+        self.comandos = 0
+        self.tempo_db_ms = 0.0
+        self.formas = Counter()
+
+    def registrar(self, forma: str, duracao_ms: float):
+        self.comandos += 1
+        self.tempo_db_ms += duracao_ms
+        self.formas[forma] += 1
+        if self.pai is not None:
+            self.pai.registrar(forma, duracao_ms)
+
+    def mais_repetidas(self, n: int = 3) -> list:
+        return self.formas.most_common(n)
+
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self.inicio) * 1000.0
+
+
+def iniciar():
+    """Ativa um perfil novo na thread atual. Retorna (perfil, token para encerrar)."""
+    perfil = Perfil(pai=_perfil_atual.get())
+    return perfil, _perfil_atual.set(perfil)
+
+
+def encerrar(token) -> None:
+    try:
+        _perfil_atual.reset(token)
+    except Exception:
+        _perfil_atual.set(None)
+
+
+def perfil_atual():
+    return _perfil_atual.get()
+
+
+# Formas de consulta
+def _normalizar(valor):
+    if isinstance(valor, dict):
+        return {k: _normalizar(v) for k, v in valor.items()}
+    if isinstance(valor, (list, tuple)):
+        if valor and all(isinstance(v, dict) for v in valor):
+            # $or/$and: uma entrada por forma distinta
+            vistos = []
+            for v in valor:
+                n = _normalizar(v)
+                if n not in vistos:
+                    vistos.append(n)
+            return vistos
+        return '?'
+    return '?'
+
+
+def forma(comando: str, colecao, filtro=None, sort=None) -> str:
+    partes = [comando, str(colecao or '-')]
+    if filtro:
+        partes.append(json.dumps(_normalizar(filtro), sort_keys=True, separators=(',', ':'), default=str))
+    if sort:
+        chaves = list(sort.keys()) if isinstance(sort, dict) else [s[0] if isinstance(s, (list, tuple)) else s for s in sort]
+        partes.append('sort=' + ','.join(str(c) for c in chaves))
+    return ' '.join(partes)
+
+
+def forma_do_comando(cmd: dict, nome: str) -> str:
+    """Forma de um comando do protocolo (evento do CommandListener)."""
+    colecao = cmd.get(nome)
+    if nome == 'find':
+        return forma('find', colecao, cmd.get('filter'), cmd.get('sort'))
+    if nome == 'aggregate':
+        pipeline = cmd.get('pipeline') or []
+        match = pipeline[0].get('$match') if pipeline and isinstance(pipeline[0], dict) else None
+        return forma('aggregate', colecao, match)
+    if nome in ('count', 'distinct'):
+        return forma(nome, colecao, cmd.get('query'))
+    if nome == 'findAndModify':
+        return forma(nome, colecao, cmd.get('query'), cmd.get('sort'))
+    if nome == 'update':
+        ups = cmd.get('updates') or []
+        return forma('update', colecao, ups[0].get('q') if len(ups) == 1 else None) + ('' if len(ups) <= 1 else f' x{len(ups)}')
+    if nome == 'delete':
+        dels = cmd.get('deletes') or []
+        return forma('delete', colecao, dels[0].get('q') if len(dels) == 1 else None) + ('' if len(dels) <= 1 else f' x{len(dels)}')
+    if nome == 'getMore':
+        return forma('getMore', cmd.get('collection'))
+    return forma(nome, colecao if isinstance(colecao, str) else None)
+
+
+class ComandosListener(monitoring.CommandListener):
+    """Soma os comandos no perfil ativo da thread que os executou."""
+
+    def __init__(self):
+        self._pendentes = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        perfil = _perfil_atual.get()
+        if perfil is None or event.command_name in COMANDOS_IGNORADOS:
+            return
+        try:
+            f = forma_do_comando(event.command, event.command_name)
+        except Exception:
+            f = event.command_name
+        with self._lock:
+            self._pendentes[(event.request_id, event.connection_id)] = (perfil, f)
+
+    def _concluir(self, event):
+        with self._lock:
+            item = self._pendentes.pop((event.request_id, event.connection_id), None)
+        if item is not None:
+            perfil, f = item
+            perfil.registrar(f, event.duration_micros / 1000.0)
+
+    def succeeded(self, event):
+        self._concluir(event)
+
+    def failed(self, event):
+        self._concluir(event)
+
+
+listener = ComandosListener()
+
+
+# mongomock: métodos de Collection -> (comando equivalente, argumento com o filtro)
+_METODOS_MONGOMOCK = {
+    'find': ('find', 'filter'),
+    'find_one': ('find', 'filter'),
+    'count_documents': ('aggregate', 'filter'),
+    'estimated_document_count': ('count', None),
+    'aggregate': ('aggregate', 'pipeline'),
+    'distinct': ('distinct', 'filter'),
+    'insert_one': ('insert', None),
+    'insert_many': ('insert', None),
+    'update_one': ('update', 'filter'),
+    'update_many': ('update', 'filter'),
+    'replace_one': ('update', 'filter'),
+    'delete_one': ('delete', 'filter'),
+    'delete_many': ('delete', 'filter'),
+    'find_one_and_update': ('findAndModify', 'filter'),
+    'find_one_and_replace': ('findAndModify', 'filter'),
+    'find_one_and_delete': ('findAndModify', 'filter'),
+    'bulk_write': ('bulkWrite', None),
+}
+_dentro_mongomock = threading.local()
+# funções (comando, coleção, duração_ms, ok) chamadas a cada comando do mongomock (ex.: metricas.py)
+observadores = []
+
+
+def _envolver(metodo, comando: str, arg_filtro):
+    nomes = list(metodo.__code__.co_varnames[1:metodo.__code__.co_argcount])
+
+    @functools.wraps(metodo)
+    def envolvido(self, *args, **kwargs):
+        perfil = _perfil_atual.get()
+        if (perfil is None and not observadores) or getattr(_dentro_mongomock, 'ativo', False):
+            return metodo(self, *args, **kwargs)
+        filtro = None
+        if arg_filtro is not None:
+            filtro = kwargs.get(arg_filtro)
+            if filtro is None and arg_filtro in nomes and nomes.index(arg_filtro) < len(args):
+                filtro = args[nomes.index(arg_filtro)]
+        if arg_filtro == 'pipeline':
+            filtro = filtro[0].get('$match') if filtro and isinstance(filtro[0], dict) else None
+        inicio = time.perf_counter()
+        # chamadas internas do mongomock (find_one -> find) contam uma vez só
+        _dentro_mongomock.ativo = True
+        ok = False
+        try:
+            resultado = metodo(self, *args, **kwargs)
+            ok = True
+            return resultado
+        finally:
+            _dentro_mongomock.ativo = False
+            duracao_ms = (time.perf_counter() - inicio) * 1000.0
+            if perfil is not None:
+                perfil.registrar(forma(comando, self.name, filtro, kwargs.get('sort')), duracao_ms)
+            for obs in observadores:
+                try:
+                    obs(comando, self.name, duracao_ms, ok)
+                except Exception:
+                    pass
+    envolvido._perfil_original = metodo
+    return envolvido
+
+
+def instrumentar_mongomock() -> bool:
+    try:
+        import mongomock
+    except Exception:
+        return False
+    cls = mongomock.collection.Collection
+    for nome, (comando, arg_filtro) in _METODOS_MONGOMOCK.items():
+        metodo = getattr(cls, nome, None)
+        if metodo is None or hasattr(metodo, '_perfil_original'):
+            continue
+        setattr(cls, nome, _envolver(metodo, comando, arg_filtro))
+    return True
+
+
+# Integração com o Flask
+def server_timing(perfil: Perfil) -> str:
+    return f'db;dur={perfil.tempo_db_ms:.1f};desc="{perfil.comandos} cmds", app;dur={perfil.total_ms():.1f}'
+
+
+def init_app(app):
+    if not app.config.get('MONGO_PROFILER_ENABLED', True):
+        return
+
+    @app.before_request
+    def _perfil_iniciar():
+        g._perfil_consultas = iniciar()
+
+    @app.after_request
+    def _perfil_emitir(resp):
+        item = g.pop('_perfil_consultas', None)
+        if item is None:
+            return resp
+        perfil, token = item
+        encerrar(token)
+        try:
+            resp.headers['Server-Timing'] = server_timing(perfil)
+            top = perfil.mais_repetidas(int(app.config.get('MONGO_PROFILER_TOP') or 3))
+            rid = g.get('request_id') or '-'
+            app.logger.info(
+                f'{request.method} {request.path} {resp.status_code} {perfil.total_ms():.1f}ms '
+                f'db={perfil.comandos}cmds/{perfil.tempo_db_ms:.1f}ms req={rid} '
+                f"top={'; '.join(f'{n}x {f}' for f, n in top) or '-'}"
+            )
+            limite = int(app.config.get('MONGO_PROFILER_NPLUS1', 10))
+            for f, n in top:
+                if n > limite:
+                    app.logger.warning(f'[N+1] {request.method} {request.path}: {n}x {f} (req={rid})')
+        except Exception:
+            pass
+        return resp
+
+    @app.teardown_request
+    def _perfil_limpar(exc):
+        # requisição que terminou em exceção não passa pelo after_request
+        item = g.pop('_perfil_consultas', None)
+        if item is not None:
+            encerrar(item[1])
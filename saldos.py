@@ -0,0 +1,285 @@
+"""Saldos de estoque no tempo: snapshots periódicos e cálculo de saldo em uma data.
+
+O saldo de um produto em um local numa data D é obtido a partir do checkpoint
+(snapshot) mais próximo de D, aplicando apenas o delta das movimentações entre
+o checkpoint e D. Assim auditorias de fim de mês não precisam reprocessar todo o
+razão de 'movimentacoes'.
+
+O agendador em segundo plano (backups.BackupScheduler) grava um snapshot por dia em
+SNAPSHOT_ESTOQUE_HORARIO e aplica aplicar_retencao_snapshots(): os snapshots dos últimos
+SNAPSHOT_ESTOQUE_RETENCAO_DIAS ficam todos; dos mais antigos fica só o último de cada mês.
+"""
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+
+import movimentacoes_repo
+
+
+def normalizar_tipo_local(tipo):
+    """Normaliza variações de tipo de local ('setores', 'subalmoxarifado', ...)."""
+    t = str(tipo or '').strip().lower()
+    if t in ('setor', 'setores'):
+        return 'setor'
+    if t in ('subalmoxarifado', 'sub_almoxarifado', 'sub_almoxarifados'):
+        return 'sub_almoxarifado'
+    if t in ('almoxarifado', 'almoxarifados'):
+        return 'almoxarifado'
+    if t in ('central', 'centrais'):
+        return 'central'
+    return None
+
+
+def id_candidates(raw):
+    """Variações de um id (original, string, int, ObjectId) para consultas tolerantes a tipo."""
+    cands = []
+    seen = set()
+    def _add(v):
+        key = f"{type(v).__name__}:{v}"
+        if key not in seen:
+            seen.add(key)
+            cands.append(v)
+    if raw is None:
+        return cands
+    _add(raw)
+    s = str(raw)
+    _add(s)
+    if s.isdigit():
+        _add(int(s))
+    if len(s) == 24:
+        try:
+            _add(ObjectId(s))
+        except Exception:
+            pass
+    return cands
+
+
+def _naive_utc(dt):
+    if not isinstance(dt, datetime):
+        return None
+    if dt.tzinfo is not None:
+        return dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def deltas_movimentacao(mov: dict):
+    """Efeito de uma movimentação nos saldos: lista de (local_tipo, str(local_id), delta).
+    - origem (quando for um local) perde a quantidade;
+    - destino (quando for um local) ganha a quantidade;
+    - entradas sem destino explícito creditam (local_tipo, local_id).
+    """
+    try:
+        q = float(mov.get('quantidade') or mov.get('quantidade_movimentada') or 0)
+    except Exception:
+        q = 0.0
+    if q == 0:
+        return []
+    out = []
+    o_tipo = normalizar_tipo_local(mov.get('origem_tipo'))
+    if o_tipo and mov.get('origem_id') is not None:
+        out.append((o_tipo, str(mov.get('origem_id')), -q))
+    d_tipo = normalizar_tipo_local(mov.get('destino_tipo'))
+    if d_tipo and mov.get('destino_id') is not None:
+        out.append((d_tipo, str(mov.get('destino_id')), q))
+    elif str(mov.get('tipo') or '').lower() == 'entrada':
+        l_tipo = normalizar_tipo_local(mov.get('local_tipo'))
+        if l_tipo and mov.get('local_id') is not None:
+            out.append((l_tipo, str(mov.get('local_id')), q))
+    return out
+
+
+def gerar_snapshot(db, batch_size: int = 1000, logger=None, slot: datetime = None, progresso=None) -> dict:
+    """Grava um checkpoint de saldo por (produto, local) a partir da coleção 'estoques'.
+    O checkpoint representa o saldo no instante em que a leitura começa (data_referencia): as
+    linhas alteradas durante a varredura (updated_at posterior) são corrigidas descontando as
+    movimentações criadas depois desse instante que já estavam aplicadas, que saldo_em() soma
+    no delta. A execução é registrada em 'estoque_snapshots_execucoes' somente ao final, para
+    que consultas nunca usem um snapshot parcial.
+    `slot` identifica o horário agendado que gerou o snapshot (um por dia no agendador);
+    `progresso()` é chamado a cada lote gravado (o agendador renova o lock por ele).
+    """
+    agora = datetime.utcnow()
+    snaps = db['estoque_snapshots']
+    linhas = 0
+    lote = []
+    # (produto_key, local_tipo, local_key) -> updated_at das linhas alteradas depois de 'agora'
+    alteradas = {}
+    projection = {'produto_id': 1, 'local_tipo': 1, 'local_id': 1, 'setor_id': 1, 'quantidade': 1, 'quantidade_atual': 1,
+                  'quantidade_disponivel': 1, 'updated_at': 1}
+    for est in db['estoques'].find({}, projection).batch_size(batch_size):
+        local_tipo = normalizar_tipo_local(est.get('local_tipo'))
+        local_id = est.get('local_id')
+        if local_tipo is None and est.get('setor_id') is not None:
+            local_tipo, local_id = 'setor', est.get('setor_id')
+        if local_tipo is None or local_id is None or est.get('produto_id') is None:
+            continue
+        qtd = est.get('quantidade', est.get('quantidade_atual', est.get('quantidade_disponivel', 0)))
+        alterada = _naive_utc(est.get('updated_at'))
+        if alterada is not None and alterada > agora:
+            alteradas[(str(est.get('produto_id')), local_tipo, str(local_id))] = alterada
+        lote.append({
+            'data_referencia': agora,
+            'produto_id': est.get('produto_id'),
+            'produto_key': str(est.get('produto_id')),
+            'local_tipo': local_tipo,
+            'local_id': local_id,
+            'local_key': str(local_id),
+            'quantidade': float(qtd or 0),
+        })
+        if len(lote) >= batch_size:
+            snaps.insert_many(lote, ordered=False)
+            linhas += len(lote)
+            lote = []
+            if progresso is not None:
+                progresso()
+    if lote:
+        snaps.insert_many(lote, ordered=False)
+        linhas += len(lote)
+    if alteradas:
+        _corrigir_alteradas(db, agora, alteradas)
+    db['estoque_snapshots_execucoes'].insert_one({
+        'data_referencia': agora,
+        'linhas': linhas,
+        'slot': slot,
+        'duracao_ms': int((datetime.utcnow() - agora).total_seconds() * 1000),
+        'created_at': datetime.utcnow(),
+    })
+    if logger is not None:
+        logger.info(f'[Snapshot Estoque] {linhas} saldos gravados em {agora.isoformat()}')
+    return {'data_referencia': agora, 'linhas': linhas}
+
+
+def _corrigir_alteradas(db, ref: datetime, alteradas: dict) -> None:
+    """Tira das linhas lidas depois de `ref` as movimentações criadas após `ref` que já estavam
+    aplicadas na leitura (created_at <= updated_at da linha): saldo_em() as aplica no delta."""
+    ultima = max(alteradas.values())
+    correcoes = {}
+    projection = {'produto_id': 1, 'quantidade': 1, 'quantidade_movimentada': 1, 'tipo': 1, 'origem_tipo': 1,
+                  'origem_id': 1, 'destino_tipo': 1, 'destino_id': 1, 'local_tipo': 1, 'local_id': 1, 'created_at': 1}
+    for mov in movimentacoes_repo.get_repo(db).find({'created_at': {'$gt': ref, '$lte': ultima}}, projection):
+        criada = _naive_utc(mov.get('created_at'))
+        for tipo, lkey, d in deltas_movimentacao(mov):
+            chave = (str(mov.get('produto_id')), tipo, lkey)
+            if chave in alteradas and criada is not None and criada <= alteradas[chave]:
+                correcoes[chave] = correcoes.get(chave, 0.0) - d
+    snaps = db['estoque_snapshots']
+    for (produto_key, local_tipo, local_key), valor in correcoes.items():
+        if valor:
+            snaps.update_one({'data_referencia': ref, 'produto_key': produto_key, 'local_tipo': local_tipo,
+                              'local_key': local_key}, {'$inc': {'quantidade': valor}})
+
+
+def aplicar_retencao_snapshots(db, dias: int, agora: datetime = None) -> int:
+    """Remove snapshots com mais de `dias` dias, mantendo o último de cada mês (fechamentos).
+    A execução sai antes das linhas, para que nenhuma consulta use um snapshot pela metade.
+    Linhas órfãs de snapshots interrompidos também são removidas. Retorna as execuções removidas."""
+    corte = _naive_utc(agora or datetime.now(timezone.utc)) - timedelta(days=int(dias))
+    execs = db['estoque_snapshots_execucoes']
+    fechamentos = {}
+    for e in execs.find({'data_referencia': {'$lt': corte}}, {'data_referencia': 1}).sort('data_referencia', 1):
+        fechamentos[e['data_referencia'].strftime('%Y-%m')] = e['data_referencia']
+    manter = list(fechamentos.values())
+    removidas = execs.delete_many({'data_referencia': {'$lt': corte, '$nin': manter}}).deleted_count
+    db['estoque_snapshots'].delete_many({'data_referencia': {'$lt': corte, '$nin': manter}})
+    return removidas
+
+
+def _checkpoint_mais_proximo(db, data):
+    """Execução de snapshot mais próxima de 'data' (antes ou depois); em empate prefere a anterior."""
+    execs = db['estoque_snapshots_execucoes']
+    antes = execs.find_one({'data_referencia': {'$lte': data}}, sort=[('data_referencia', -1)])
+    depois = execs.find_one({'data_referencia': {'$gt': data}}, sort=[('data_referencia', 1)])
+    if antes and depois:
+        if (depois['data_referencia'] - data) < (data - antes['data_referencia']):
+            return depois
+        return antes
+    return antes or depois
+
+
+def saldo_em(db, produto_ids, local_tipo: str, local_ids, data: datetime) -> dict:
+    """Calcula o saldo de um produto em um local na data informada.
+    'produto_ids' e 'local_ids' são as variações conhecidas do mesmo id (sequencial, ObjectId string...).
+    Sem nenhum snapshot gravado, o saldo atual em 'estoques' serve de checkpoint.
+    """
+    data = _naive_utc(data)
+    local_tipo = normalizar_tipo_local(local_tipo)
+    prod_cands = []
+    for p in produto_ids:
+        prod_cands.extend(id_candidates(p))
+    local_cands = []
+    for lid in local_ids:
+        local_cands.extend(id_candidates(lid))
+    prod_keys = list({str(p) for p in prod_cands})
+    local_keys = {str(x) for x in local_cands}
+
+    execucao = _checkpoint_mais_proximo(db, data)
+    if execucao is not None:
+        ref = execucao['data_referencia']
+        snap = db['estoque_snapshots'].find_one({
+            'produto_key': {'$in': prod_keys},
+            'local_tipo': local_tipo,
+            'local_key': {'$in': list(local_keys)},
+            'data_referencia': ref,
+        })
+        base = float((snap or {}).get('quantidade') or 0.0)
+        origem = 'snapshot'
+    else:
+        ref = datetime.utcnow()
+        est = db['estoques'].find_one({
+            'produto_id': {'$in': prod_cands},
+            'local_tipo': local_tipo,
+            'local_id': {'$in': local_cands},
+        })
+        base = float((est or {}).get('quantidade', (est or {}).get('quantidade_atual', 0)) or 0.0)
+        origem = 'estoque_atual'
+
+    # O checkpoint contém as movimentações registradas até ref (created_at), qualquer que seja a
+    # data_movimentacao; o saldo em 'data' contém as de data_movimentacao <= data. O delta soma as
+    # que entram só no saldo e subtrai as que estão só no checkpoint — inclusive lançamentos
+    # retroativos feitos depois do checkpoint.
+    lo, hi = min(ref, data), max(ref, data)
+    query = {
+        'produto_id': {'$in': prod_cands},
+        '$and': [
+            {'$or': [
+                {'origem_id': {'$in': local_cands}},
+                {'destino_id': {'$in': local_cands}},
+                {'local_id': {'$in': local_cands}},
+            ]},
+            {'$or': [
+                {'data_movimentacao': {'$gt': lo, '$lte': hi}},
+                {'created_at': {'$gt': ref}, 'data_movimentacao': {'$lte': data}},
+                {'created_at': {'$lte': ref}, 'data_movimentacao': {'$gt': data}},
+            ]},
+        ],
+    }
+    projection = {'quantidade': 1, 'quantidade_movimentada': 1, 'tipo': 1, 'origem_tipo': 1, 'origem_id': 1,
+                  'destino_tipo': 1, 'destino_id': 1, 'local_tipo': 1, 'local_id': 1,
+                  'data_movimentacao': 1, 'created_at': 1}
+    delta = 0.0
+    aplicadas = 0
+    for mov in movimentacoes_repo.get_repo(db).find(query, projection):
+        dm = _naive_utc(mov.get('data_movimentacao'))
+        if dm is None:
+            continue
+        # sem created_at (registros antigos): registrada na própria data da movimentação
+        criada = _naive_utc(mov.get('created_at')) or dm
+        sinal = (1 if dm <= data else 0) - (1 if criada <= ref else 0)
+        if sinal == 0:
+            continue
+        afetou = False
+        for tipo, lkey, d in deltas_movimentacao(mov):
+            if tipo == local_tipo and lkey in local_keys:
+                delta += sinal * d
+                afetou = True
+        if afetou:
+            aplicadas += 1
+
+    return {
+        'saldo': round(base + delta, 6),
+        'checkpoint': {
+            'origem': origem,
+            'data_referencia': ref,
+            'quantidade': base,
+        },
+        'movimentacoes_aplicadas': aplicadas,
+    }
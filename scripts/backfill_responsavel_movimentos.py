@@ -9,8 +9,10 @@ if BASE_DIR not in sys.path:
     sys.path.insert(0, BASE_DIR)
 
 # Inicializa o app para configurar Mongo automaticamente
-from app import app  # noqa: F401
+from app import create_script_app
+app = create_script_app()
 import extensions
+import movimentacoes_repo
 
 
 def parse_dt(v):
@@ -45,7 +47,7 @@ def resolve_full_name(users_coll, username: str):
 
 
 def backfill_consumo(db):
-    movs = db['movimentacoes']
+    movs = movimentacoes_repo.get_repo(db)
     registros = db['setor_registros']
     usuarios = db['usuarios']
 
@@ -130,7 +132,7 @@ def backfill_consumo(db):
 
 
 def backfill_entrada_setor(db):
-    movs = db['movimentacoes']
+    movs = movimentacoes_repo.get_repo(db)
     registros = db['setor_registros']
     usuarios = db['usuarios']
 
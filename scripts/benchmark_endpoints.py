@@ -0,0 +1,139 @@
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+
+# Garantir que o diretório raiz do projeto esteja no PYTHONPATH
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import benchmark_endpoints
+import dataset_sintetico
+
+BASELINE_PADRAO = os.path.join(ROOT_DIR, 'instance', 'benchmark_baseline.json')
+
+
+def _porta_livre() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _filhos(pid: int) -> list:
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            return [int(p) for p in f.read().split()]
+    except OSError:
+        return []
+
+
+def _subir_gunicorn(workers: int, env: dict):
+    porta = _porta_livre()
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-w', str(workers), '-b', f'127.0.0.1:{porta}', 'app:app'],
+        cwd=ROOT_DIR, env=env,
+    )
+    limite = time.time() + 60
+    while time.time() < limite:
+        if proc.poll() is not None:
+            raise RuntimeError('gunicorn encerrou durante a inicialização')
+        try:
+            with socket.create_connection(('127.0.0.1', porta), timeout=1):
+                return proc, f'http://127.0.0.1:{porta}'
+        except OSError:
+            time.sleep(0.5)
+    proc.terminate()
+    raise RuntimeError('gunicorn não respondeu em 60s')
+
+
+def main():
+    """Mede os endpoints quentes contra a massa sintética e compara com a linha de base.
+
+    Ex.: python scripts/gerar_dataset_sintetico.py --uri mongodb://localhost:27017 --db almox_bench --escala media --drop --indices
+         MONGO_URI=mongodb://localhost:27017/almox_bench MONGO_DB=almox_bench \\
+             python scripts/benchmark_endpoints.py --saida bench.json --comparar
+    Sai com código 1 quando algum cenário passou da tolerância da linha de base.
+    """
+    parser = argparse.ArgumentParser(description='Benchmark dos endpoints (latência, comandos Mongo, RSS)')
+    parser.add_argument('--repeticoes', type=int, default=30)
+    parser.add_argument('--aquecimento', type=int, default=3)
+    parser.add_argument('--cenario', action='append', default=None, help='mede só este cenário (repetível)')
+    parser.add_argument('--sem-escrita', action='store_true', help='não executa os POSTs de transferência/distribuição')
+    parser.add_argument('--gunicorn', type=int, default=0, metavar='WORKERS', help='mede via HTTP num gunicorn local')
+    parser.add_argument('--usuario', default='admin')
+    parser.add_argument('--senha', default=os.environ.get('INITIAL_ADMIN_PASSWORD') or 'admin')
+    parser.add_argument('--gerar', default=None, choices=sorted(dataset_sintetico.ESCALAS),
+                        help='gera a massa antes de medir se o banco não tiver uma')
+    parser.add_argument('--saida', default=None, help='grava o resultado em JSON')
+    parser.add_argument('--baseline', default=BASELINE_PADRAO)
+    parser.add_argument('--salvar-baseline', action='store_true', help='grava o resultado como nova linha de base')
+    parser.add_argument('--comparar', action='store_true', help='compara com a linha de base')
+    parser.add_argument('--tolerancia', type=float, default=0.2, help='fração tolerada no p95/RSS (padrão 0.2)')
+    args = parser.parse_args()
+
+    # O app lê MONGO_URI/MONGO_DB do ambiente (mesma massa para o test client e o gunicorn)
+    from app import create_script_app
+    app = create_script_app()
+    import extensions
+    # processo de ferramenta: garante coleções, índices e o usuário do login (também no mongomock)
+    extensions.inicializar_banco(app)
+    db = extensions.mongo_db
+    if db is None:
+        print('[Benchmark] MongoDB não inicializado. Verifique configuração do app.')
+        sys.exit(1)
+    if db[dataset_sintetico.COLECAO_INFO].find_one({'_id': 'sintetico'}) is None:
+        if not args.gerar:
+            print('[Benchmark] Banco sem massa sintética: rode scripts/gerar_dataset_sintetico.py ou use --gerar.')
+            sys.exit(1)
+        dataset_sintetico.gerar(db, dataset_sintetico.ESCALAS[args.gerar])
+    ctx = benchmark_endpoints.contexto(db)
+
+    def progresso(nome, r):
+        print(f"[Benchmark] {nome:<34} p50={r['p50_ms']:>8}ms p95={r['p95_ms']:>8}ms p99={r['p99_ms']:>8}ms "
+              f"cmds={r['comandos_p50']} status={r['status']}")
+
+    proc = None
+    try:
+        if args.gunicorn:
+            proc, base_url = _subir_gunicorn(args.gunicorn, dict(os.environ))
+            cliente = benchmark_endpoints.ClienteHttp(base_url, pids=lambda: _filhos(proc.pid))
+        else:
+            cliente = benchmark_endpoints.ClienteFlask(app)
+        if not cliente.login(args.usuario, args.senha):
+            print(f'[Benchmark] Falha no login de {args.usuario}.')
+            sys.exit(1)
+        resultado = benchmark_endpoints.executar(
+            cliente, ctx, repeticoes=args.repeticoes, aquecimento=args.aquecimento,
+            escrita=not args.sem_escrita, apenas=args.cenario, progresso=progresso,
+        )
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=30)
+    print(f"[Benchmark] pico de RSS: {resultado['rss_pico_mb']}MB")
+
+    if args.saida:
+        benchmark_endpoints.gravar(resultado, args.saida)
+    if args.salvar_baseline:
+        benchmark_endpoints.gravar(resultado, args.baseline)
+        print(f'[Benchmark] Linha de base gravada em {args.baseline}')
+    if args.comparar:
+        base = benchmark_endpoints.carregar(args.baseline)
+        if base is None:
+            print(f'[Benchmark] Linha de base não encontrada: {args.baseline}')
+            sys.exit(1)
+        if base.get('meta', {}).get('dataset') != resultado['meta']['dataset']:
+            print('[Benchmark] Aviso: a linha de base foi medida com outra massa (seed/escala).')
+        regressoes = benchmark_endpoints.comparar(resultado, base, args.tolerancia)
+        for r in regressoes:
+            print(f'[Benchmark] REGRESSÃO {r}')
+        if regressoes:
+            sys.exit(1)
+        print('[Benchmark] Dentro da tolerância da linha de base.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+import argparse
+import os
+import sys
+import time
+
+# Garantir que o diretório raiz do projeto esteja no PYTHONPATH
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import dataset_sintetico
+
+
+def _banco(args):
+    if args.mongomock:
+        import mongomock
+        return mongomock.MongoClient()[args.db or 'almox_bench']
+    if args.uri:
+        from pymongo import MongoClient
+        return MongoClient(args.uri)[args.db or 'almox_bench']
+    # sem --uri: o banco configurado no app (MONGO_URI/MONGO_DB)
+    from app import create_script_app
+    create_script_app()
+    import extensions
+    return extensions.mongo_db
+
+
+def main():
+    """Gera a massa sintética determinística (ver dataset_sintetico.py).
+
+    Ex.: python scripts/gerar_dataset_sintetico.py --uri mongodb://localhost:27017 --db almox_bench \\
+             --escala grande --drop --indices
+    O mongomock guarda tudo em memória: use-o só com as escalas 'teste'/'media'.
+    """
+    parser = argparse.ArgumentParser(description='Gera massa de dados sintética para benchmarks')
+    parser.add_argument('--escala', choices=sorted(dataset_sintetico.ESCALAS), default='teste')
+    for nome in ('centrais', 'almoxarifados', 'sub_almoxarifados', 'setores', 'categorias', 'produtos',
+                 'estoques', 'lotes', 'movimentacoes'):
+        parser.add_argument('--' + nome.replace('_', '-'), dest=nome, type=int, default=None,
+                            help='sobrepõe a quantidade da escala')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--batch', type=int, default=5000, help='documentos por insert_many')
+    parser.add_argument('--uri', default=None, help='grava direto neste mongod (não carrega o app)')
+    parser.add_argument('--db', default=None, help='banco usado com --uri/--mongomock (padrão: almox_bench)')
+    parser.add_argument('--mongomock', action='store_true', help='gera em memória (medir o gerador)')
+    parser.add_argument('--drop', action='store_true', help='apaga as coleções geradas antes de inserir')
+    parser.add_argument('--indices', action='store_true', help='cria as coleções e índices do app ao final')
+    parser.add_argument('--buckets', action='store_true', help='reconstrói movimentacoes_buckets ao final')
+    args = parser.parse_args()
+
+    db = _banco(args)
+    if db is None:
+        print('[Dataset Sintético] MongoDB não inicializado. Verifique configuração do app.')
+        sys.exit(1)
+
+    escala = dict(dataset_sintetico.ESCALAS[args.escala])
+    for nome in escala:
+        if getattr(args, nome, None) is not None:
+            escala[nome] = getattr(args, nome)
+
+    inicio = time.perf_counter()
+
+    def progresso(colecao, total):
+        alvo = escala.get(colecao) or total
+        if total == alvo or total % (args.batch * 20) == 0:
+            print(f'[Dataset Sintético] {colecao}: {total}/{alvo} ({time.perf_counter() - inicio:.0f}s)')
+
+    contagem = dataset_sintetico.gerar(db, escala, seed=args.seed, batch_size=args.batch,
+                                       limpar=args.drop, progresso=progresso)
+    if args.indices:
+        import extensions
+        extensions.ensure_collections_and_indexes(db)
+    if args.buckets:
+        import movimentacoes_repo
+        movimentacoes_repo.reconstruir_buckets(db)
+    resumo = ' '.join(f'{k}={v}' for k, v in contagem.items())
+    print(f'[Dataset Sintético] seed={args.seed} {resumo} em {time.perf_counter() - inicio:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+import argparse
+import os
+import sys
+import time
+
+# Garantir que o diretório raiz do projeto esteja no PYTHONPATH
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+# App sem threads de segundo plano (ScriptConfig); cria o cliente Mongo via extensions.init_mongo (sem I/O)
+from app import create_script_app
+app = create_script_app()
+import extensions
+
+
+def main():
+    """Inicialização única do banco: coleções, índices do catálogo, admin e dados de demonstração.
+
+    Idempotente; roda uma vez por deploy antes do gunicorn (render.yaml), que sobe os workers sem
+    tocar no banco. Sai com 1 se o MongoDB não responder (sem ALLOW_MOCK_DB/USE_MONGOMOCK).
+    """
+    parser = argparse.ArgumentParser(description='Inicializa o banco MongoDB (coleções, índices e seed)')
+    parser.parse_args()
+
+    inicio = time.perf_counter()
+    try:
+        res = extensions.inicializar_banco(app)
+    except RuntimeError as e:
+        print(f'[Init] {e}')
+        sys.exit(1)
+    ms = (time.perf_counter() - inicio) * 1000
+    origem = 'mongomock (memória)' if res['mongomock'] else 'MongoDB'
+    print(f"[Init] Banco '{res['db']}' inicializado em {ms:.0f}ms ({origem}).")
+
+
+if __name__ == '__main__':
+    main()
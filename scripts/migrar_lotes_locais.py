@@ -0,0 +1,33 @@
+import os
+import sys
+
+# Garantir que o diretório raiz do projeto esteja no PYTHONPATH
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+# App sem threads de segundo plano (ScriptConfig); cria o cliente Mongo via extensions.init_mongo
+from app import create_script_app
+app = create_script_app()
+import extensions
+import fefo
+
+
+def main():
+    """Preenche local_tipo/local_id nos lotes de almoxarifado gravados antes da alocação FEFO
+    e converte datas de vencimento/fabricação gravadas como texto.
+
+    Rodar uma vez após o deploy; sem esses campos os lotes antigos não são consumidos pelas saídas.
+    """
+    db = extensions.mongo_db
+    if db is None:
+        print('[Lotes FEFO] MongoDB não inicializado. Verifique configuração do app.')
+        sys.exit(1)
+    res = fefo.migrar_lotes_sem_local(db)
+    print(f"[Lotes FEFO] lotes atualizados={res['lotes']}")
+    res = fefo.normalizar_datas_texto(db)
+    print(f"[Lotes FEFO] datas em texto convertidas={res['lotes']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+import argparse
+import os
+import sys
+
+# Garantir que o diretório raiz do projeto esteja no PYTHONPATH
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+# App sem threads de segundo plano (ScriptConfig); cria o cliente Mongo via extensions.init_mongo
+from app import create_script_app
+app = create_script_app()
+import extensions
+import movimentacoes_repo
+
+
+def main():
+    """Popula 'movimentacoes_buckets' a partir de 'movimentacoes'.
+
+    Com o app parado: rodar, conferir as contagens e então ativar MOVIMENTACOES_STORAGE=buckets.
+    Nesse layout a coleção plana não é mais lida nem gravada; --remover-colecao a apaga depois
+    de conferir que os buckets têm todas as movimentações.
+    """
+    parser = argparse.ArgumentParser(description='Migra o histórico de movimentações para buckets')
+    parser.add_argument('--remover-colecao', action='store_true', help='apaga a coleção plana após a migração')
+    args = parser.parse_args()
+
+    db = extensions.mongo_db
+    if db is None:
+        print('[Buckets Movimentações] MongoDB não inicializado. Verifique configuração do app.')
+        sys.exit(1)
+    if movimentacoes_repo.get_repo(db).layout == 'buckets':
+        # os buckets já são o armazenamento: reconstruir a partir da coleção plana perderia dados
+        print('[Buckets Movimentações] MOVIMENTACOES_STORAGE=buckets já ativo; migração não executada.')
+        sys.exit(1)
+    res = movimentacoes_repo.reconstruir_buckets(db)
+    print(f"[Buckets Movimentações] movimentacoes={res['movimentacoes']} buckets={res['buckets']}")
+    if args.remover_colecao:
+        nos_buckets = movimentacoes_repo.get_repo(db, 'buckets').count_documents({})
+        if nos_buckets != db['movimentacoes'].count_documents({}):
+            print(f'[Buckets Movimentações] Contagens diferem ({nos_buckets} nos buckets); coleção plana mantida.')
+            sys.exit(1)
+        db.drop_collection('movimentacoes')
+        print('[Buckets Movimentações] Coleção plana removida.')
+
+
+if __name__ == '__main__':
+    main()
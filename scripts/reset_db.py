@@ -7,8 +7,9 @@ ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 if ROOT_DIR not in sys.path:
     sys.path.insert(0, ROOT_DIR)
 
-# Importa o app para inicializar o Mongo via extensions.init_mongo
-from app import app  # noqa: F401
+# App sem threads de segundo plano (ScriptConfig); cria o cliente Mongo via extensions.init_mongo
+from app import create_script_app
+app = create_script_app()
 import extensions
 from werkzeug.security import generate_password_hash
 
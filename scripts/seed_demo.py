@@ -8,7 +8,8 @@ ROOT = Path(__file__).resolve().parents[1]
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
-from app import app  # ensures extensions and mongo are initialized
+from app import create_script_app
+app = create_script_app()
 from extensions import mongo_db
 
 
@@ -0,0 +1,31 @@
+import os
+import sys
+
+# Garantir que o diretório raiz do projeto esteja no PYTHONPATH
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+# App sem threads de segundo plano (ScriptConfig); cria o cliente Mongo via extensions.init_mongo
+from app import create_script_app
+app = create_script_app()
+import extensions
+import contadores
+
+
+def main():
+    """Semeia 'contadores' com a maior sequência de cada prefixo <central>-<categoria>- em 'produtos'.
+
+    Execução única após o deploy (pode ser repetida: usa $max e nunca volta um contador).
+    Sem ela, cada prefixo é semeado no primeiro código gerado.
+    """
+    db = extensions.mongo_db
+    if db is None:
+        print('[Contadores] MongoDB não inicializado. Verifique configuração do app.')
+        sys.exit(1)
+    res = contadores.semear_contadores(db)
+    print(f"[Contadores] prefixos semeados={res['prefixos']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+import argparse
+import os
+import sys
+
+# Garantir que o diretório raiz do projeto esteja no PYTHONPATH
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+# App sem threads de segundo plano (ScriptConfig); cria o cliente Mongo via extensions.init_mongo
+from app import create_script_app
+app = create_script_app()
+import extensions
+import indices
+
+
+def _imprimir_diferencas(dif: dict) -> int:
+    total = 0
+    for colecao, d in sorted(dif.items()):
+        for spec in d['faltando']:
+            print(f"[Índices] FALTANDO   {colecao}.{spec['nome']} {spec['chaves']} {spec['opcoes'] or ''}")
+        for div in d['divergentes']:
+            print(f"[Índices] DIVERGENTE {colecao}.{div['nome']} atual={div['atual']} esperado={div['esperado']}")
+        for ren in d['renomeados']:
+            print(f"[Índices] RENOMEADO  {colecao}.{ren['atual']} (catálogo: {ren['nome']})")
+        for extra in d['extras']:
+            print(f"[Índices] EXTRA      {colecao}.{extra['nome']} {extra['chaves']}")
+        total += len(d['faltando']) + len(d['divergentes'])
+    return total
+
+
+def main():
+    """Compara os índices do banco com config/indices.py e, com --aplicar, cria os que faltam.
+
+    Sem opções só mostra as diferenças e sai com 1 se faltar índice ou houver divergente (CI/deploy).
+    --recriar-divergentes faz drop + create dos índices com mesmo nome e definição diferente;
+    --remover-extras remove os que não estão no catálogo (confira antes com --sem-uso).
+    """
+    parser = argparse.ArgumentParser(description='Sincroniza os índices MongoDB com o catálogo')
+    parser.add_argument('--aplicar', action='store_true', help='cria os índices que faltam (em background)')
+    parser.add_argument('--recriar-divergentes', action='store_true')
+    parser.add_argument('--remover-extras', action='store_true')
+    parser.add_argument('--sem-uso', action='store_true', help='lista índices sem acesso segundo $indexStats')
+    args = parser.parse_args()
+
+    db = extensions.mongo_db
+    if db is None:
+        print('[Índices] MongoDB não inicializado. Verifique configuração do app.')
+        sys.exit(1)
+
+    pendentes = _imprimir_diferencas(indices.diferencas(db))
+    if args.aplicar or args.recriar_divergentes or args.remover_extras:
+        res = indices.sincronizar(db, recriar_divergentes=args.recriar_divergentes, remover_extras=args.remover_extras)
+        for chave in ('criados', 'recriados', 'removidos', 'falhas'):
+            if res[chave]:
+                print(f"[Índices] {chave}: {', '.join(res[chave])}")
+        restantes = indices.diferencas(db).values()
+        pendentes = sum(len(d['faltando']) + len(d['divergentes']) for d in restantes)
+    elif not pendentes:
+        print('[Índices] Banco de acordo com o catálogo.')
+
+    if args.sem_uso:
+        sem_uso = indices.sem_uso(db)
+        if sem_uso is None:
+            print('[Índices] $indexStats não suportado por este servidor.')
+        else:
+            for item in sem_uso:
+                print(f"[Índices] SEM USO    {item['colecao']}.{item['nome']} (desde {item['desde']})")
+            if not sem_uso:
+                print('[Índices] Todos os índices tiveram acesso desde o último restart.')
+    if pendentes:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+import os
+import sys
+
+# Garantir que o diretório raiz do projeto esteja no PYTHONPATH
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+# App sem threads de segundo plano (ScriptConfig); cria o cliente Mongo via extensions.init_mongo
+from app import create_script_app
+app = create_script_app()
+import extensions
+import saldos
+
+
+def main():
+    """Grava um checkpoint de saldos por (produto, local).
+
+    O agendador do app já grava um por dia (SNAPSHOT_ESTOQUE_HORARIO); use este script para
+    checkpoints extras (ex.: no fechamento do mês, logo após o último lançamento).
+    """
+    db = extensions.mongo_db
+    if db is None:
+        print('[Snapshot Estoque] MongoDB não inicializado. Verifique configuração do app.')
+        sys.exit(1)
+    res = saldos.gerar_snapshot(db)
+    print(f"[Snapshot Estoque] data_referencia={res['data_referencia'].isoformat()} linhas={res['linhas']}")
+
+
+if __name__ == '__main__':
+    main()
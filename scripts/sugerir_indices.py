@@ -0,0 +1,85 @@
+import argparse
+import json
+import os
+import sys
+
+# Garantir que o diretório raiz do projeto esteja no PYTHONPATH
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import sugestao_indices
+
+
+def _banco(uri, nome):
+    from pymongo import MongoClient
+    return MongoClient(uri)[nome]
+
+
+def main():
+    """Sugere índices compostos (igualdade -> ordenação -> intervalo) a partir das formas observadas.
+
+    Ex.: python scripts/sugerir_indices.py --fonte lentas --horas 168 \\
+             --massa-uri mongodb://localhost:27017 --massa-db almox_bench
+    --fonte lentas lê 'consultas_lentas' do banco do app (produção); --fonte benchmark executa os
+    cenários de benchmark_endpoints no banco do app (use-o apontado para a massa sintética).
+    Com --massa-uri/--massa-db cada sugestão é medida na massa sintética (explain antes/depois).
+    As linhas impressas no fim podem ser copiadas para config/indices.py.
+    """
+    parser = argparse.ArgumentParser(description='Sugere índices a partir das formas de consulta observadas')
+    parser.add_argument('--fonte', choices=('lentas', 'benchmark'), action='append', default=None)
+    parser.add_argument('--horas', type=float, default=24 * 7, help='janela de consultas_lentas')
+    parser.add_argument('--repeticoes', type=int, default=3, help='repetições por cenário (fonte benchmark)')
+    parser.add_argument('--massa-uri', default=None, help='mongod com a massa sintética para estimar o ganho')
+    parser.add_argument('--massa-db', default='almox_bench')
+    parser.add_argument('--limite', type=int, default=20)
+    parser.add_argument('--saida', default=None, help='grava as sugestões em JSON')
+    args = parser.parse_args()
+
+    from app import create_script_app
+    app = create_script_app()
+    import benchmark_endpoints
+    import extensions
+    if 'benchmark' in (args.fonte or []):
+        # a fonte benchmark faz login no test client: garante o admin (também no mongomock)
+        extensions.inicializar_banco(app)
+    db = extensions.mongo_db
+    if db is None:
+        print('[Índices] MongoDB não inicializado. Verifique configuração do app.')
+        sys.exit(1)
+
+    formas = []
+    for fonte in args.fonte or ['lentas']:
+        if fonte == 'lentas':
+            formas += sugestao_indices.formas_de_lentas(db, horas=args.horas)
+        else:
+            ctx = benchmark_endpoints.contexto(db)
+            formas += sugestao_indices.formas_de_benchmark(app, ctx, repeticoes=args.repeticoes)
+    print(f'[Índices] {len(formas)} formas de consulta observadas')
+
+    massa = _banco(args.massa_uri, args.massa_db) if args.massa_uri else None
+    sugestoes = sugestao_indices.propor(formas, db=massa if massa is not None else db)[:args.limite]
+    for s in sugestoes:
+        print(f"[Índices] {s['colecao']}: {s['chaves']} ocorrencias={s['ocorrencias']} total_ms={s['total_ms']:.0f}")
+        for f in s['formas'][:3]:
+            print(f'           {f}')
+        if massa is not None:
+            s['estimativa'] = sugestao_indices.estimar(massa, s)
+            est = s['estimativa']
+            if est.get('metodo'):
+                print(f"           ganho ({est['metodo']}): {est['antes']} -> {est['depois']}")
+            else:
+                print(f"           {est.get('observacao')}")
+    if sugestoes:
+        print('[Índices] Para config/indices.py:')
+        for s in sugestoes:
+            print(f"    # {s['colecao']}\n    {sugestao_indices.linha_catalogo(s)}")
+    else:
+        print('[Índices] Nenhuma sugestão: as formas observadas já têm índice.')
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump(sugestoes, f, ensure_ascii=False, indent=2, default=str)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+"""Sugestão de índices a partir das formas de consulta observadas.
+
+As formas são as do perfil por requisição (perfil_consultas.forma: comando, coleção, filtro
+com os valores trocados por '?' e chaves do sort). Elas vêm de duas fontes:
+- formas_de_lentas(): a coleção 'consultas_lentas' de produção (ocorrências e tempo acumulado;
+  com MONGO_SLOW_MS baixo ela vira uma amostra de todo o tráfego);
+- formas_de_benchmark(): os cenários de benchmark_endpoints executados pelo test client dentro
+  de um perfil, contando cada forma.
+
+Para cada forma, os campos do filtro são classificados em igualdade (valor direto, $eq, $in),
+ordenação (sort) e intervalo ($gt/$lt/$ne/$regex/...) e o candidato segue a regra
+igualdade -> ordenação -> intervalo (ESR). $or gera um candidato por ramo. Candidatos já
+atendidos por um índice existente (ou do catálogo config/indices.py) são descartados.
+
+estimar() mede o ganho na massa sintética: com explain (mongod) compara documentos examinados e
+tempo antes e depois de criar o índice; sem explain (mongomock) estima pela seletividade do
+prefixo de igualdade contra a varredura completa. Direções do sort não são registradas na forma:
+as sugestões usam ordem crescente. CLI: scripts/sugerir_indices.py.
+"""
+import json
+import re
+from datetime import datetime, timedelta, timezone
+
+from config.indices import CATALOGO
+
+COMANDOS_COM_FILTRO = ('find', 'aggregate', 'count', 'distinct', 'findAndModify', 'update', 'delete')
+OPERADORES_IGUALDADE = ('$eq', '$in', '$elemMatch')
+_SUFIXO_LOTE = re.compile(r' x\d+$')
+
+
+def ler_forma(forma: str):
+    """(comando, coleção, filtro normalizado | None, [campos do sort]) ou None."""
+    forma = _SUFIXO_LOTE.sub('', forma or '')
+    partes = forma.split(' ', 2)
+    if len(partes) < 2:
+        return None
+    comando, colecao = partes[0], partes[1]
+    resto = partes[2] if len(partes) > 2 else ''
+    filtro, sort = None, []
+    if resto.startswith('{'):
+        try:
+            filtro, fim = json.JSONDecoder().raw_decode(resto)
+            resto = resto[fim:].strip()
+        except ValueError:
+            return None
+    if resto.startswith('sort='):
+        sort = [c for c in resto[len('sort='):].split(',') if c]
+    return comando, colecao, filtro, sort
+
+
+def _classificar(filtro: dict, igualdade: list, intervalo: list) -> list:
+    """Preenche igualdade/intervalo com os campos de `filtro`; devolve os ramos de $or."""
+    ramos = []
+    for campo, valor in (filtro or {}).items():
+        if campo == '$and':
+            for sub in valor if isinstance(valor, list) else []:
+                ramos.extend(_classificar(sub, igualdade, intervalo))
+        elif campo == '$or':
+            ramos.append(valor if isinstance(valor, list) else [])
+        elif campo.startswith('$'):
+            continue
+        elif isinstance(valor, dict) and any(k.startswith('$') for k in valor):
+            alvo = igualdade if any(k in OPERADORES_IGUALDADE for k in valor) else intervalo
+            if campo not in alvo:
+                alvo.append(campo)
+        elif campo not in igualdade:
+            igualdade.append(campo)
+    return ramos
+
+
+def candidatos_da_forma(filtro: dict, sort: list) -> list:
+    """Candidatos {'igualdade', 'sort', 'intervalo', 'chaves'} com as chaves em ordem ESR;
+    um por ramo de $or."""
+    igualdade, intervalo = [], []
+    ramos = _classificar(filtro, igualdade, intervalo)
+    combinacoes = [(igualdade, intervalo)]
+    for ramo in ramos:
+        novas = []
+        for eq, rg in combinacoes:
+            for sub in ramo:
+                eq2, rg2 = list(eq), list(rg)
+                _classificar(sub, eq2, rg2)
+                novas.append((eq2, rg2))
+        combinacoes = novas or combinacoes
+    saida = []
+    for eq, rg in combinacoes:
+        chaves = list(eq)
+        chaves += [c for c in sort if c not in chaves]
+        chaves += [c for c in rg if c not in chaves]
+        if chaves and chaves != ['_id']:
+            saida.append({'igualdade': list(eq), 'sort': [c for c in sort if c not in eq],
+                          'intervalo': [c for c in rg if c not in eq and c not in sort], 'chaves': chaves})
+    return saida
+
+
+def _atendido(candidato: dict, indices_existentes: list) -> bool:
+    """Um índice atende o candidato se começa pelos campos de igualdade (em qualquer ordem)
+    seguidos do sort e do intervalo, na ordem."""
+    n_eq = len(candidato['igualdade'])
+    resto = candidato['sort'] + candidato['intervalo']
+    for campos in indices_existentes:
+        if len(campos) < len(candidato['chaves']):
+            continue
+        if set(campos[:n_eq]) == set(candidato['igualdade']) and campos[n_eq:n_eq + len(resto)] == resto:
+            return True
+    return False
+
+
+def indices_conhecidos(db, colecao: str) -> list:
+    """Listas de campos dos índices existentes em `db` e dos declarados no catálogo."""
+    conhecidos = [[c for c, _ in s['chaves']] for s in CATALOGO.get(colecao, [])]
+    if db is None:
+        return conhecidos
+    try:
+        for info in db[colecao].index_information().values():
+            conhecidos.append([c for c, _ in info['key']])
+    except Exception:
+        pass
+    return conhecidos
+
+
+def nome_sugerido(colecao: str, chaves: list) -> str:
+    return 'idx_' + colecao + '_' + '_'.join(c.replace('.', '_') for c in chaves)
+
+
+def propor(formas: list, db=None) -> list:
+    """Agrupa as formas [{'forma', 'ocorrencias', 'total_ms'}] em candidatos por coleção.
+
+    Retorna candidatos não atendidos ordenados pelo peso (tempo acumulado, senão ocorrências):
+    {'colecao', 'chaves', 'nome', 'igualdade', 'sort', 'intervalo', 'ocorrencias', 'total_ms', 'formas'}.
+    """
+    agrupados = {}
+    for item in formas:
+        lida = ler_forma(item['forma'])
+        if lida is None:
+            continue
+        comando, colecao, filtro, sort = lida
+        if comando not in COMANDOS_COM_FILTRO or (not filtro and not sort):
+            continue
+        for cand in candidatos_da_forma(filtro or {}, sort):
+            chave = (colecao, tuple(cand['chaves']))
+            atual = agrupados.setdefault(chave, dict(cand, colecao=colecao, ocorrencias=0, total_ms=0.0, formas=[]))
+            atual['ocorrencias'] += int(item.get('ocorrencias') or 0)
+            atual['total_ms'] += float(item.get('total_ms') or 0)
+            if item['forma'] not in atual['formas']:
+                atual['formas'].append(item['forma'])
+    conhecidos = {}
+    saida = []
+    for (colecao, _), cand in agrupados.items():
+        if colecao not in conhecidos:
+            conhecidos[colecao] = indices_conhecidos(db, colecao)
+        if _atendido(cand, conhecidos[colecao]):
+            continue
+        cand['nome'] = nome_sugerido(colecao, cand['chaves'])
+        saida.append(cand)
+    # candidato que é prefixo de outro da mesma coleção (com mesma igualdade) fica de fora
+    finais = []
+    for cand in saida:
+        maior = [o for o in saida if o is not cand and o['colecao'] == cand['colecao']
+                 and len(o['chaves']) > len(cand['chaves']) and _atendido(cand, [o['chaves']])]
+        if maior:
+            o = max(maior, key=lambda m: len(m['chaves']))
+            o['ocorrencias'] += cand['ocorrencias']
+            o['total_ms'] += cand['total_ms']
+            o['formas'] += [f for f in cand['formas'] if f not in o['formas']]
+            continue
+        finais.append(cand)
+    finais.sort(key=lambda c: (c['total_ms'], c['ocorrencias']), reverse=True)
+    return finais
+
+
+# Fontes de formas
+def formas_de_lentas(db, horas: float = 24 * 7, limite: int = 200) -> list:
+    import consultas_lentas
+    desde = datetime.now(timezone.utc) - timedelta(hours=horas)
+    return [{'forma': f['_id'], 'ocorrencias': f['ocorrencias'], 'total_ms': f['total_ms']}
+            for f in consultas_lentas.piores_formas(db, desde, limite) if f.get('_id')]
+
+
+def formas_de_benchmark(app, ctx: dict, repeticoes: int = 3, usuario: str = 'admin', senha: str = 'admin') -> list:
+    import benchmark_endpoints
+    import perfil_consultas
+    cliente = benchmark_endpoints.ClienteFlask(app)
+    cliente.login(usuario, senha)
+    perfil, token = perfil_consultas.iniciar()
+    try:
+        benchmark_endpoints.medir(cliente, benchmark_endpoints.cenarios(ctx, escrita=False),
+                                  repeticoes=repeticoes, aquecimento=0)
+    finally:
+        perfil_consultas.encerrar(token)
+    return [{'forma': f, 'ocorrencias': n, 'total_ms': 0.0} for f, n in perfil.formas.items()]
+
+
+# Estimativa de ganho na massa sintética
+def _filtro_representativo(db, cand: dict):
+    campos = cand['igualdade'] + cand['intervalo']
+    exemplo = db[cand['colecao']].find_one({c: {'$exists': True, '$ne': None} for c in campos}) if campos else \
+        db[cand['colecao']].find_one({})
+    if exemplo is None:
+        return None
+
+    def _valor(doc, campo):
+        for parte in campo.split('.'):
+            doc = doc.get(parte) if isinstance(doc, dict) else None
+        return doc
+
+    filtro = {c: _valor(exemplo, c) for c in cand['igualdade']}
+    filtro.update({c: {'$gte': _valor(exemplo, c)} for c in cand['intervalo']})
+    return filtro
+
+
+def _explain(db, colecao: str, filtro: dict, sort: list) -> dict:
+    cmd = {'find': colecao, 'filter': filtro, 'limit': 50}
+    if sort:
+        cmd['sort'] = {c: 1 for c in sort}
+    res = db.command({'explain': cmd, 'verbosity': 'executionStats'})
+    stats = res.get('executionStats') or {}
+    return {'docs_examinados': stats.get('totalDocsExamined'), 'chaves_examinadas': stats.get('totalKeysExamined'),
+            'ms': stats.get('executionTimeMillis')}
+
+
+def estimar(db, cand: dict) -> dict:
+    """Ganho estimado do candidato em `db` (massa sintética). Cria e remove o índice no explain."""
+    filtro = _filtro_representativo(db, cand)
+    if filtro is None:
+        return {'metodo': None, 'observacao': 'sem documentos com esses campos na massa'}
+    coll = db[cand['colecao']]
+    try:
+        antes = _explain(db, cand['colecao'], filtro, cand['sort'])
+    except Exception:
+        # mongomock: sem explain; varredura completa contra o prefixo de igualdade
+        total = coll.estimated_document_count()
+        prefixo = {c: filtro[c] for c in cand['igualdade']}
+        return {'metodo': 'seletividade', 'filtro': filtro, 'antes': {'docs_examinados': total},
+                'depois': {'docs_examinados': coll.count_documents(prefixo) if prefixo else total}}
+    nome = cand['nome']
+    coll.create_index([(c, 1) for c in cand['chaves']], name=nome)
+    try:
+        depois = _explain(db, cand['colecao'], filtro, cand['sort'])
+    finally:
+        coll.drop_index(nome)
+    return {'metodo': 'explain', 'filtro': filtro, 'antes': antes, 'depois': depois}
+
+
+def linha_catalogo(cand: dict) -> str:
+    chaves = ', '.join(f"('{c}', ASCENDING)" for c in cand['chaves'])
+    return f"indice('{cand['nome']}', [{chaves}]),"
@@ -1,3 +1,4 @@
+import contextlib
 import os
 import sys
 import pytest
@@ -9,6 +10,14 @@ if PROJECT_ROOT not in sys.path:
 
 from app import create_app
 from config import TestingConfig
+import extensions
+import perfil_consultas
+
+
+@pytest.fixture(scope='session', autouse=True)
+def banco():
+    """Inicialização única do banco dos testes (o boot do app não toca no Mongo)."""
+    extensions.inicializar_banco(create_app(TestingConfig))
 
 
 @pytest.fixture
@@ -22,4 +31,23 @@ def app():
 
 @pytest.fixture
 def client(app):
-    return app.test_client()
\ No newline at end of file
+    return app.test_client()
+
+@pytest.fixture
+def max_queries():
+    """Orçamento de comandos Mongo: `with max_queries(5): client.get(...)`.
+
+    Conta todos os comandos feitos dentro do bloco (inclusive os das requisições do test client)
+    e falha listando as formas de consulta quando o total passa de `n`.
+    """
+    @contextlib.contextmanager
+    def _orcamento(n):
+        perfil, token = perfil_consultas.iniciar()
+        try:
+            yield perfil
+        finally:
+            perfil_consultas.encerrar(token)
+        if perfil.comandos > n:
+            formas = '\n'.join(f'  {qtd}x {forma}' for forma, qtd in perfil.mais_repetidas(15))
+            pytest.fail(f'{perfil.comandos} comandos Mongo (orçamento: {n}):\n{formas}', pytrace=False)
+    return _orcamento
@@ -0,0 +1,60 @@
+from datetime import datetime
+
+import extensions
+import arquivamento
+
+
+def test_arquivar_em_blocos_retoma_sem_duplicar(app, monkeypatch):
+    import mongomock
+
+    with app.app_context():
+        db = extensions.mongo_db
+        for nome in ('arq_teste', 'archive_arq_teste', arquivamento.COLECAO_EXECUCOES):
+            db[nome].delete_many({})
+        db['arq_teste'].insert_many([{'_id': i, 'data': datetime(2020, 1, 1)} for i in range(25)] +
+                                    [{'_id': 100 + i, 'data': datetime(2026, 1, 1)} for i in range(5)])
+        filtro = {'data': {'$lt': datetime(2024, 1, 1)}}
+
+        original = mongomock.collection.Collection.delete_many
+        chamadas = {'n': 0}
+
+        def _cai_no_segundo_bloco(self, *args, **kwargs):
+            if self.name == 'arq_teste':
+                chamadas['n'] += 1
+                if chamadas['n'] == 2:
+                    raise RuntimeError('processo encerrado')
+            return original(self, *args, **kwargs)
+
+        monkeypatch.setattr(mongomock.collection.Collection, 'delete_many', _cai_no_segundo_bloco)
+        estado = arquivamento.arquivar(db, 'arq_teste', filtro, chunk=10)
+        assert estado['status'] == 'erro'
+        assert estado['movidos'] == 10
+        # segundo bloco já foi copiado para o arquivo, mas continua na origem
+        assert db['archive_arq_teste'].count_documents({}) == 20
+
+        monkeypatch.setattr(mongomock.collection.Collection, 'delete_many', original)
+        estado = arquivamento.arquivar(db, None, None, chunk=10, execucao_id=estado['_id'])
+        assert estado['status'] == 'concluido'
+        assert estado['movidos'] == 25
+        assert db['archive_arq_teste'].count_documents({}) == 25
+        assert sorted(d['_id'] for d in db['arq_teste'].find({})) == [100, 101, 102, 103, 104]
+
+
+def test_politicas_de_retencao_uma_execucao_por_dia(app):
+    with app.app_context():
+        db = extensions.mongo_db
+        db['arq_pol'].delete_many({})
+        db['archive_arq_pol'].delete_many({})
+        db['arq_pol'].insert_many([
+            {'criado': datetime(2025, 2, 27)},
+            {'criado': datetime(2025, 3, 1)},
+        ])
+        politicas = [{'colecao': 'arq_pol', 'campo': 'criado', 'meses': 12}]
+        agora = datetime(2026, 2, 28, 3, 0)
+        execs = arquivamento.executar_politicas(db, politicas, agora=agora)
+        assert [e['status'] for e in execs] == ['concluido']
+        assert db['archive_arq_pol'].count_documents({}) == 1
+        assert db['arq_pol'].count_documents({}) == 1
+        # mesma data: a execução concluída não se repete
+        assert arquivamento.executar_politicas(db, politicas, agora=agora) == []
+        assert arquivamento.meses_atras(datetime(2026, 3, 31), 1) == datetime(2026, 2, 28)
@@ -0,0 +1,40 @@
+import time
+
+import auditoria
+import extensions
+
+
+def test_writer_grava_em_lote_e_esvazia_no_encerramento(app):
+    with app.app_context():
+        coll = extensions.mongo_db['logs_auditoria']
+        antes = coll.count_documents({'acao': 'TESTE_LOTE'})
+        w = auditoria.AuditWriter(queue_size=100, batch_size=10, flush_interval=0.05)
+        w.iniciar()
+        for i in range(25):
+            w.registrar({'acao': 'TESTE_LOTE', 'i': i})
+        deadline = time.time() + 5
+        while w.estatisticas()['gravados'] < 25 and time.time() < deadline:
+            time.sleep(0.02)
+        w.encerrar()
+        assert coll.count_documents({'acao': 'TESTE_LOTE'}) - antes == 25
+        assert w.estatisticas()['pendentes'] == 0
+
+
+def test_politicas_de_overflow(app):
+    with app.app_context():
+        coll = extensions.mongo_db['logs_auditoria']
+        # thread parada: a fila só esvazia no flush
+        w = auditoria.AuditWriter(queue_size=2, overflow='descartar')
+        for i in range(5):
+            w.registrar({'acao': 'TESTE_DESCARTE', 'i': i})
+        assert w.estatisticas()['descartados'] == 3
+        w.flush()
+        assert coll.count_documents({'acao': 'TESTE_DESCARTE'}) == 2
+
+        w = auditoria.AuditWriter(queue_size=2, overflow='sincrono')
+        for i in range(5):
+            w.registrar({'acao': 'TESTE_SINCRONO', 'i': i})
+        # excedentes gravados na hora, restantes no flush
+        assert coll.count_documents({'acao': 'TESTE_SINCRONO'}) == 3
+        w.flush()
+        assert coll.count_documents({'acao': 'TESTE_SINCRONO'}) == 5
@@ -0,0 +1,120 @@
+import gzip
+import json
+import os
+from datetime import datetime
+
+from bson import ObjectId
+
+import extensions
+import backups
+
+
+def test_backup_ndjson_gz_preserva_tipos_e_checksum(app, tmp_path):
+    with app.app_context():
+        db = extensions.mongo_db
+        coll = db['bkp_formato']
+        coll.delete_many({})
+        oid = ObjectId()
+        data = datetime(2026, 5, 4, 3, 2, 1, 123000)
+        coll.insert_many([{'_id': oid, 'quando': data, 'qtd': 1.5, 'ref': ObjectId()}] +
+                         [{'n': i} for i in range(25)])
+
+        res = backups.criar_backup(db, str(tmp_path), collections=['bkp_formato'], batch_size=10)
+        pasta = os.path.join(str(tmp_path), res['file'])
+        assert res['documentos'] == 26
+        manifest = backups.ler_manifest(pasta)
+        assert manifest['formato'] == 'ndjson-gz'
+        assert [c['nome'] for c in manifest['collections']] == ['bkp_formato']
+        assert backups.verificar_backup(pasta) == []
+
+        docs = list(backups.ler_colecao(pasta, 'bkp_formato.ndjson.gz'))
+        assert len(docs) == 26
+        primeiro = next(d for d in docs if d['_id'] == oid)
+        assert primeiro['quando'] == data and isinstance(primeiro['ref'], ObjectId)
+
+        # arquivo alterado depois do backup: o checksum acusa
+        with gzip.open(os.path.join(pasta, 'bkp_formato.ndjson.gz'), 'ab') as f:
+            f.write(b'{"n": 99}\n')
+        assert backups.verificar_backup(pasta)
+
+
+def test_restore_do_formato_novo(app, client, tmp_path):
+    app.config['BACKUP_DIR'] = str(tmp_path)
+    assert client.post('/auth/login', json={'username': 'admin', 'password': 'admin'}).status_code == 200
+    with app.app_context():
+        db = extensions.mongo_db
+        db['bkp_restore'].delete_many({})
+        db['bkp_restore'].insert_one({'_id': 'a', 'quando': datetime(2026, 1, 2)})
+        res = backups.criar_backup(db, str(tmp_path), collections=['bkp_restore'])
+        db['bkp_restore'].delete_many({})
+
+    nomes = [i['name'] for i in client.get('/api/admin/backup/list').get_json()['items']]
+    assert res['file'] in nomes
+    r = client.post('/api/admin/backup/restore', json={'file': res['file'], 'mode': 'merge'})
+    assert r.status_code == 200, r.get_json()
+    with app.app_context():
+        assert extensions.mongo_db['bkp_restore'].find_one({'_id': 'a'})['quando'] == datetime(2026, 1, 2)
+    assert client.post('/api/admin/backup/restore', json={'file': '../etc'}).status_code == 400
+
+
+def test_restore_em_lotes_retoma_do_ultimo_lote(app, tmp_path, monkeypatch):
+    import mongomock
+
+    with app.app_context():
+        db = extensions.mongo_db
+        db['bkp_retomar'].delete_many({})
+        db['bkp_retomar'].insert_many([{'_id': i, 'v': i} for i in range(25)])
+        res = backups.criar_backup(db, str(tmp_path), collections=['bkp_retomar'])
+        pasta = os.path.join(str(tmp_path), res['file'])
+
+        original = mongomock.collection.Collection.bulk_write
+        chamadas = {'n': 0}
+
+        def _falha_no_segundo_lote(self, *args, **kwargs):
+            chamadas['n'] += 1
+            if chamadas['n'] == 2:
+                raise RuntimeError('conexão perdida')
+            return original(self, *args, **kwargs)
+
+        monkeypatch.setattr(mongomock.collection.Collection, 'bulk_write', _falha_no_segundo_lote)
+        estado = backups.restaurar_backup(db, pasta, mode='replace', batch_size=10)
+        assert estado['status'] == 'erro'
+        assert estado['colecao_atual'] == 'bkp_retomar' and estado['aplicados_colecao'] == 10
+        assert db['bkp_retomar'].count_documents({}) == 10
+
+        monkeypatch.setattr(mongomock.collection.Collection, 'bulk_write', original)
+        estado = backups.restaurar_backup(db, pasta, batch_size=10, restauracao_id=estado['_id'])
+        assert estado['status'] == 'concluido'
+        assert estado['colecoes_concluidas'] == ['bkp_retomar']
+        assert estado['documentos'] == 25
+        assert db['bkp_retomar'].count_documents({}) == 25
+        assert 'idx_prod_codigo_unico' in db['produtos'].index_information()
+
+
+def test_restaurar_backup_feito_com_job_executando_nao_revive_o_job(app, tmp_path):
+    with app.app_context():
+        db = extensions.mongo_db
+        db['jobs'].delete_many({})
+        db['jobs'].insert_one({'_id': 'job-backup', 'tipo': 'backup_create', 'status': 'executando'})
+        db['contadores'].update_one({'_id': 'produto_codigo:BKP-'}, {'$set': {'valor': 5}}, upsert=True)
+        db['bkp_ctl'].delete_many({})
+        db['bkp_ctl'].insert_one({'_id': 1})
+        res = backups.criar_backup(db, str(tmp_path))
+        pasta = os.path.join(str(tmp_path), res['file'])
+        assert not {'jobs', 'contadores', 'idempotency_keys'} & {c['nome'] for c in backups.ler_manifest(pasta)['collections']}
+
+        # depois do backup: o job terminou, a restauração roda como job e o contador avançou
+        db['jobs'].update_one({'_id': 'job-backup'}, {'$set': {'status': 'concluido'}})
+        db['jobs'].insert_one({'_id': 'job-restore', 'tipo': 'backup_restore', 'status': 'executando'})
+        db['contadores'].update_one({'_id': 'produto_codigo:BKP-'}, {'$set': {'valor': 9}})
+        # backup do formato antigo com 'jobs' dentro também não sobrescreve a coleção
+        legado = os.path.join(str(tmp_path), 'legado.json')
+        with open(legado, 'w', encoding='utf-8') as f:
+            json.dump({'collections': {'jobs': [{'_id': 'job-backup', 'status': 'executando'}], 'bkp_ctl': [{'_id': 2}]}}, f)
+
+        assert backups.restaurar_backup(db, pasta, mode='replace')['status'] == 'concluido'
+        assert backups.restaurar_backup(db, legado, mode='merge')['status'] == 'concluido'
+        assert db['jobs'].find_one({'_id': 'job-backup'})['status'] == 'concluido'
+        assert db['jobs'].find_one({'_id': 'job-restore'}) is not None
+        assert db['contadores'].find_one({'_id': 'produto_codigo:BKP-'})['valor'] == 9
+        assert db['bkp_ctl'].count_documents({}) == 2
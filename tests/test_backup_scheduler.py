@@ -0,0 +1,155 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import extensions
+import backups
+
+
+def _agendar(db, **campos):
+    doc = {'_id': 'backup_schedule', 'enabled': True, 'interval': 'daily', 'time': '02:00', 'retention': 2}
+    doc.update(campos)
+    db[backups.COLECAO_CONFIG].replace_one({'_id': 'backup_schedule'}, doc, upsert=True)
+
+
+def test_agendador_executa_uma_vez_por_horario_com_retencao(app, tmp_path):
+    app.config['BACKUP_DIR'] = str(tmp_path)
+    with app.app_context():
+        db = extensions.mongo_db
+        db[backups.COLECAO_LOCKS].delete_many({})
+        db[backups.COLECAO_EXECUCOES].delete_many({})
+        _agendar(db)
+        sched = backups.BackupScheduler(app, janela_horas=4)
+
+        # fora da janela (horário comercial): não executa
+        assert sched.verificar(datetime(2026, 3, 2, 10, 0)) is None
+
+        dia = datetime(2026, 3, 2, 2, 30)
+        for n in range(3):
+            exec_doc = sched.verificar(dia + timedelta(days=n))
+            assert exec_doc['status'] == 'sucesso'
+            assert exec_doc['duracao_segundos'] >= 0
+            # mesmo horário de novo (outro poll ou outro worker): nada a fazer
+            assert sched.verificar(dia + timedelta(days=n, minutes=5)) is None
+
+        arquivos = sorted(os.listdir(tmp_path))
+        assert len(arquivos) == 2
+        assert all(backups.SUFIXO_AGENDADO in a for a in arquivos)
+        assert db[backups.COLECAO_EXECUCOES].count_documents({'origem': 'agendado', 'status': 'sucesso'}) == 3
+        assert len(exec_doc['removidos']) == 1
+
+
+def test_apenas_o_lider_executa(app, tmp_path):
+    app.config['BACKUP_DIR'] = str(tmp_path)
+    with app.app_context():
+        db = extensions.mongo_db
+        db[backups.COLECAO_LOCKS].delete_many({})
+        db[backups.COLECAO_EXECUCOES].delete_many({})
+        _agendar(db, interval='weekly')
+        lider = backups.BackupScheduler(app)
+        outro = backups.BackupScheduler(app)
+        assert lider.obter_lock()
+        assert not outro.obter_lock()
+        assert outro.verificar(datetime(2026, 3, 2, 2, 30)) is None
+        assert lider.verificar(datetime(2026, 3, 2, 2, 30))['status'] == 'sucesso'
+        # semanal: o dia seguinte não executa
+        assert lider.verificar(datetime(2026, 3, 3, 2, 30)) is None
+
+        # lock expirado (processo líder caiu): outro processo assume
+        db[backups.COLECAO_LOCKS].update_one({'_id': backups.LOCK_ID}, {'$set': {'expira_em': datetime.now(timezone.utc) - timedelta(seconds=1)}})
+        assert outro.obter_lock()
+        assert outro.verificar(datetime(2026, 3, 9, 2, 30))['status'] == 'sucesso'
+
+
+def test_execucao_abandonada_e_retomada_e_lock_renovado_durante_o_backup(app, tmp_path, monkeypatch):
+    app.config['BACKUP_DIR'] = str(tmp_path)
+    with app.app_context():
+        db = extensions.mongo_db
+        db[backups.COLECAO_LOCKS].delete_many({})
+        db[backups.COLECAO_EXECUCOES].delete_many({})
+        _agendar(db)
+        sched = backups.BackupScheduler(app, janela_horas=4, lock_segundos=0.03)
+        exec_id = 'agendado:2026-03-02T02:00'
+
+        # execução em andamento (batimento recente): não duplica
+        db[backups.COLECAO_EXECUCOES].insert_one({'_id': exec_id, 'origem': 'agendado', 'status': 'executando',
+                                                  'inicio': datetime.now(timezone.utc),
+                                                  'atualizado_em': datetime.now(timezone.utc) + timedelta(minutes=1)})
+        assert sched.verificar(datetime(2026, 3, 2, 2, 30)) is None
+
+        # processo caiu no meio do backup: o registro ficou 'executando' sem batimento
+        db[backups.COLECAO_EXECUCOES].update_one({'_id': exec_id}, {'$set': {
+            'atualizado_em': datetime.now(timezone.utc) - timedelta(minutes=5)}})
+        original = backups.criar_backup
+        renovacoes = []
+
+        def criar_lento(db_, backup_dir, progresso=None, **kw):
+            # backup mais longo que o lock: o batimento renova antes de outro assumir
+            import time
+            time.sleep(0.02)
+            progresso()
+            renovacoes.append(db_[backups.COLECAO_LOCKS].find_one({'_id': backups.LOCK_ID}))
+            return original(db_, backup_dir, progresso=progresso, **kw)
+
+        monkeypatch.setattr(backups, 'criar_backup', criar_lento)
+        exec_doc = sched.verificar(datetime(2026, 3, 2, 2, 30))
+        assert exec_doc['status'] == 'sucesso' and exec_doc['tentativas'] == 1
+        assert renovacoes[0]['dono'] == sched.dono
+        assert renovacoes[0]['renovado_em'].replace(tzinfo=timezone.utc) > exec_doc['inicio'].replace(tzinfo=timezone.utc)
+        assert exec_doc['atualizado_em'] >= exec_doc['inicio']
+
+        # outro processo tomou o lock durante o backup: a execução aborta em vez de duplicar
+        def criar_sem_lock(db_, backup_dir, progresso=None, **kw):
+            import time
+            db_[backups.COLECAO_LOCKS].update_one({'_id': backups.LOCK_ID}, {'$set': {
+                'dono': 'outro', 'expira_em': datetime.now(timezone.utc) + timedelta(minutes=1)}})
+            time.sleep(0.02)
+            progresso()
+
+        monkeypatch.setattr(backups, 'criar_backup', criar_sem_lock)
+        with pytest.raises(backups.LiderancaPerdida):
+            sched.verificar(datetime(2026, 3, 3, 2, 30))
+        exec_doc = db[backups.COLECAO_EXECUCOES].find_one({'_id': 'agendado:2026-03-03T02:00'})
+        assert exec_doc['status'] == 'erro' and 'lock' in exec_doc['erro']
+        db[backups.COLECAO_LOCKS].delete_many({})
+
+
+def test_retencao_renova_o_lock_por_bloco_e_para_ao_perder_a_lideranca(app, monkeypatch):
+    import time
+
+    import arquivamento
+
+    with app.app_context():
+        db = extensions.mongo_db
+        db[backups.COLECAO_LOCKS].delete_many({})
+        db['retencao_lider_a'].insert_many([{'created_at': datetime(2020, 1, 1), 'n': i} for i in range(30)])
+        db['retencao_lider_b'].insert_many([{'created_at': datetime(2020, 1, 1), 'n': i} for i in range(5)])
+        configs = {k: app.config.get(k) for k in ('RETENCAO_ATIVA', 'RETENCAO_POLITICAS', 'RETENCAO_CHUNK')}
+        app.config.update(RETENCAO_ATIVA=True, RETENCAO_CHUNK=10, RETENCAO_POLITICAS=[
+            {'colecao': 'retencao_lider_a', 'meses': 1}, {'colecao': 'retencao_lider_b', 'meses': 1}])
+        sched = backups.BackupScheduler(app, janela_horas=24, lock_segundos=0.03)
+        original = arquivamento._inserir_ignorando_duplicados
+        blocos = []
+
+        def inserir_lento(coll, docs):
+            original(coll, docs)
+            blocos.append(len(docs))
+            if len(blocos) == 2:
+                # outro processo assume o lock no meio da política
+                db[backups.COLECAO_LOCKS].update_one({'_id': backups.LOCK_ID}, {'$set': {
+                    'dono': 'outro', 'expira_em': datetime.now(timezone.utc) + timedelta(minutes=1)}})
+            time.sleep(0.02)
+
+        monkeypatch.setattr(arquivamento, '_inserir_ignorando_duplicados', inserir_lento)
+        try:
+            with pytest.raises(backups.LiderancaPerdida):
+                sched.verificar_retencao(datetime.now())
+        finally:
+            app.config.update(configs)
+            db[backups.COLECAO_LOCKS].delete_many({})
+        # o primeiro bloco renovou o lock; depois do segundo a perda foi vista: sem terceiro bloco
+        # e a política B não começou
+        assert len(blocos) == 2
+        assert db['retencao_lider_a'].count_documents({}) == 10
+        assert db['retencao_lider_b'].count_documents({}) == 5
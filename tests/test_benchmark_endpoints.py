@@ -0,0 +1,28 @@
+import extensions
+import benchmark_endpoints
+
+
+def test_executar_mede_latencia_e_comandos(app, client):
+    with app.app_context():
+        ctx = benchmark_endpoints.contexto(extensions.mongo_db)
+    cliente = benchmark_endpoints.ClienteFlask(app)
+    assert cliente.login('admin', 'admin')
+    res = benchmark_endpoints.executar(cliente, ctx, repeticoes=4, aquecimento=1,
+                                       apenas=['dashboard_stats_general', 'produtos_busca_rapida'])
+    assert set(res['cenarios']) == {'dashboard_stats_general', 'produtos_busca_rapida'}
+    r = res['cenarios']['produtos_busca_rapida']
+    assert r['n'] == 4 and r['status'] == {'200': 4}
+    assert r['p50_ms'] <= r['p95_ms'] <= r['p99_ms']
+    assert r['comandos_p50'] is not None
+    assert res['rss_pico_mb'] > 0
+
+
+def test_comparar_aponta_regressoes_acima_da_tolerancia():
+    base = {'cenarios': {'movimentacoes': {'p95_ms': 100.0, 'comandos_p50': 3, 'status': {'200': 30}}}, 'rss_pico_mb': 200}
+    dentro = {'cenarios': {'movimentacoes': {'p95_ms': 115.0, 'comandos_p50': 4, 'status': {'200': 30}}}, 'rss_pico_mb': 210}
+    assert benchmark_endpoints.comparar(dentro, base, tolerancia=0.2) == []
+    fora = {'cenarios': {'movimentacoes': {'p95_ms': 130.0, 'comandos_p50': 40, 'status': {'200': 29, '500': 1}}}, 'rss_pico_mb': 300}
+    regressoes = benchmark_endpoints.comparar(fora, base, tolerancia=0.2)
+    assert len(regressoes) == 4
+    assert benchmark_endpoints.percentil([5, 1, 4, 2, 3], 50) == 3
+    assert benchmark_endpoints.ler_server_timing('db;dur=12.5;desc="7 cmds", app;dur=30.0') == (7, 12.5)
@@ -0,0 +1,46 @@
+import extensions
+import perfil_consultas
+from app import create_app
+from config import TestingConfig
+
+
+def test_boot_do_app_nao_acessa_o_mongo(monkeypatch):
+    monkeypatch.delenv('USE_MONGOMOCK', raising=False)
+    monkeypatch.setattr(extensions, 'mongo_client', None)
+    monkeypatch.setattr(extensions, 'mongo_db', None)
+
+    def _sem_hash(*a, **k):
+        raise AssertionError('hash de senha no boot')
+    monkeypatch.setattr(extensions, 'generate_password_hash', _sem_hash)
+
+    perfil, token = perfil_consultas.iniciar()
+    try:
+        app = create_app(TestingConfig)
+    finally:
+        perfil_consultas.encerrar(token)
+    cliente = extensions.mongo_client
+    try:
+        assert app.config['MONGO_AVAILABLE'] is True
+        assert perfil.comandos == 0
+        assert extensions.mongo_db.name == TestingConfig.MONGO_DB
+        assert not extensions.usando_mongomock()
+    finally:
+        cliente.close()
+
+
+def test_inicializar_banco_e_idempotente(app):
+    extensions.inicializar_banco(app)
+    extensions.inicializar_banco(app)
+    usuarios = extensions.mongo_db['usuarios']
+    assert usuarios.count_documents({'username': {'$in': ['admin', 'test_operator', 'testuser']}}) == 3
+    assert extensions.mongo_db['produtos'].count_documents({'id': 1}) == 1
+    assert 'idx_unique_username' in usuarios.index_information()
+
+
+def test_app_de_script_nao_sobe_threads_de_segundo_plano():
+    import jobs
+    from app import create_script_app
+    app = create_script_app()
+    assert not app.config['BACKUP_SCHEDULER_ENABLED'] and not app.config['METRICS_ENABLED']
+    assert not app.config['MONGO_SLOW_ENABLED']
+    assert jobs._runner.app is app and jobs._runner._thread is None
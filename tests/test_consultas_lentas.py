@@ -0,0 +1,48 @@
+from types import SimpleNamespace
+
+import extensions
+import consultas_lentas
+
+EXPLAIN_COLLSCAN = {
+    'queryPlanner': {'winningPlan': {'stage': 'SORT', 'inputStage': {'stage': 'COLLSCAN', 'direction': 'forward'}}},
+    'executionStats': {'nReturned': 3, 'totalDocsExamined': 50000, 'totalKeysExamined': 0, 'executionTimeMillis': 95},
+}
+
+
+def _comando(reg, request_id, valor, duracao_ms):
+    cmd = {'find': 'estoques', 'filter': {'setor_id': valor}, 'lsid': {'id': 'x'}, '$db': 'almox_sms'}
+    reg.started(SimpleNamespace(command=cmd, command_name='find', database_name='almox_sms',
+                                request_id=request_id, connection_id=('h', 1)))
+    reg.succeeded(SimpleNamespace(command_name='find', request_id=request_id, connection_id=('h', 1), duration_micros=duracao_ms * 1000))
+
+
+def test_lentas_gravam_ocorrencias_com_um_explain_por_forma(app, client):
+    explicados = []
+
+    def _explain(item):
+        explicados.append(item['comando'])
+        return EXPLAIN_COLLSCAN
+
+    with app.app_context():
+        extensions.mongo_db[consultas_lentas.COLECAO].delete_many({})
+    reg = consultas_lentas.RegistradorLento(limite_ms=50, executar_explain=_explain)
+    _comando(reg, 1, 'a', 120)
+    _comando(reg, 2, 'b', 80)
+    _comando(reg, 3, 'c', 10)  # abaixo do limite
+    docs = reg.processar_pendentes()
+
+    assert len(docs) == 2
+    assert len(explicados) == 1
+    assert 'lsid' not in explicados[0] and '$db' not in explicados[0]
+    plano = docs[1]['plano']
+    assert plano['collscan'] is True and plano['estagios'] == ['SORT', 'COLLSCAN']
+    assert plano['docs_examinados'] == 50000 and plano['retornados'] == 3
+    assert docs[0]['forma'] == docs[1]['forma'] == 'find estoques {"setor_id":"?"}'
+
+    assert client.post('/auth/login', json={'username': 'admin', 'password': 'admin'}).status_code == 200
+    r = client.get('/api/admin/consultas-lentas?horas=1')
+    assert r.status_code == 200
+    item = r.get_json()['items'][0]
+    assert item['forma'] == 'find estoques {"setor_id":"?"}'
+    assert item['ocorrencias'] == 2 and item['total_ms'] == 200.0 and item['max_ms'] == 120.0
+    assert item['plano']['collscan'] is True
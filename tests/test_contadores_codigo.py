@@ -0,0 +1,68 @@
+import extensions
+import contadores
+
+
+def _get_csrf_token(client):
+    client.get('/')
+    with client.session_transaction() as sess:
+        return sess.get('csrf_token')
+
+
+def _json_headers(token):
+    return {
+        'Accept': 'application/json',
+        'Content-Type': 'application/json',
+        'X-CSRF-Token': token,
+    }
+
+
+def test_gerar_codigo_usa_contador_semeado(app, client):
+    assert client.post('/auth/login', json={'username': 'admin', 'password': 'admin'}).status_code == 200
+    csrf = _get_csrf_token(client)
+    r = client.post('/api/centrais', json={'nome': 'Central Cnt', 'ativo': True}, headers=_json_headers(csrf))
+    central_id = r.get_json().get('id')
+    r = client.post('/api/categorias', json={'nome': 'Contadores', 'codigo': 'CNT'}, headers=_json_headers(csrf))
+    assert r.status_code == 200
+    categoria_id = r.get_json().get('id')
+
+    with app.app_context():
+        central = extensions.mongo_db['centrais'].find_one({'id': central_id}) or {}
+    prefixo = f"{central.get('id', central_id)}-CNT-"
+    # códigos já existentes (inclusive com lacuna) definem a semente do contador
+    for codigo in (f'{prefixo}0001', f'{prefixo}0007'):
+        r = client.post('/api/produtos', json={'central_id': central_id, 'codigo': codigo, 'nome': codigo}, headers=_json_headers(csrf))
+        assert r.status_code == 200
+
+    gerados = []
+    for _ in range(2):
+        r = client.post('/api/produtos/gerar-codigo', json={'central_id': central_id, 'categoria_id': categoria_id}, headers=_json_headers(csrf))
+        assert r.status_code == 200, r.get_json()
+        gerados.append(r.get_json()['codigo'])
+    assert gerados == [f'{prefixo}0008', f'{prefixo}0009']
+
+    # código digitado à frente do contador: a geração pula para depois dele
+    r = client.post('/api/produtos', json={'central_id': central_id, 'codigo': f'{prefixo}0020', 'nome': 'Manual'}, headers=_json_headers(csrf))
+    assert r.status_code == 200
+    r = client.post('/api/produtos/gerar-codigo', json={'central_id': central_id, 'categoria_id': categoria_id}, headers=_json_headers(csrf))
+    assert r.get_json()['codigo'] == f'{prefixo}0021'
+
+
+def test_semear_contadores_e_indice_unico(app):
+    from pymongo.errors import DuplicateKeyError
+
+    with app.app_context():
+        db = extensions.mongo_db
+        db['produtos'].insert_one({'nome': 'Semente A', 'codigo': '90-SEM-0041'})
+        db['produtos'].insert_one({'nome': 'Semente B', 'codigo': '90-SEM-0003'})
+        assert contadores.semear_contadores(db)['prefixos'] >= 1
+        assert db['contadores'].find_one({'_id': contadores.chave_codigo_produto('90-SEM-')})['valor'] == 41
+        # repetir a semeadura não volta o contador
+        contadores.proximo_valor(db, contadores.chave_codigo_produto('90-SEM-'))
+        contadores.semear_contadores(db)
+        assert contadores.proximo_codigo_produto(db, '90-SEM-') == '90-SEM-0043'
+
+        try:
+            db['produtos'].insert_one({'nome': 'Duplicado', 'codigo': '90-SEM-0041'})
+            assert False, 'índice único em produtos.codigo não aplicado'
+        except DuplicateKeyError:
+            pass
@@ -0,0 +1,31 @@
+import mongomock
+from bson import ObjectId
+
+import dataset_sintetico
+
+
+def _gerar(seed=7):
+    db = mongomock.MongoClient()['bench']
+    contagem = dataset_sintetico.gerar(db, dataset_sintetico.ESCALAS['teste'], seed=seed, batch_size=500)
+    return db, contagem
+
+
+def test_mesma_semente_gera_mesmos_documentos():
+    db1, contagem = _gerar()
+    db2, _ = _gerar()
+    assert contagem == dataset_sintetico.ESCALAS['teste']
+    for nome in dataset_sintetico.COLECOES:
+        assert list(db1[nome].find().sort('_id', 1)) == list(db2[nome].find().sort('_id', 1))
+    db3, _ = _gerar(seed=8)
+    assert list(db3['produtos'].find().sort('_id', 1)) != list(db1['produtos'].find().sort('_id', 1))
+
+
+def test_mistura_de_ids_e_estoques_unicos():
+    db, _ = _gerar()
+    refs = [a['central_id'] for a in db['almoxarifados'].find()] + [s['almoxarifado_id'] for s in db['sub_almoxarifados'].find()]
+    refs += [p['categoria_id'] for p in db['produtos'].find()]
+    assert {type(r) for r in refs} == {int, str, ObjectId}
+    assert db['produtos'].count_documents({'id': {'$exists': False}}) > 0
+    pares = {(e['produto_id'], e['local_tipo'], e['local_id']) for e in db['estoques'].find()}
+    assert len(pares) == db['estoques'].count_documents({})
+    assert {m['tipo'] for m in db['movimentacoes'].find()} == {'entrada', 'transferencia', 'saida', 'consumo'}
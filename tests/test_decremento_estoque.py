@@ -0,0 +1,162 @@
+import extensions
+import movimentacoes_repo
+
+
+def _get_csrf_token(client):
+    client.get('/')
+    with client.session_transaction() as sess:
+        return sess.get('csrf_token')
+
+
+def _json_headers(token):
+    return {
+        'Accept': 'application/json',
+        'Content-Type': 'application/json',
+        'X-CSRF-Token': token,
+    }
+
+
+def _bootstrap(client, csrf, codigo='DEC-0001'):
+    r = client.post('/api/centrais', json={'nome': 'Central Dec', 'ativo': True}, headers=_json_headers(csrf))
+    central_id = r.get_json().get('id')
+    r = client.post('/api/almoxarifados', json={'nome': 'Almox Dec', 'ativo': True, 'central_id': central_id}, headers=_json_headers(csrf))
+    almox_id = r.get_json().get('id')
+    r = client.post('/api/sub-almoxarifados', json={'nome': 'Sub Dec', 'ativo': True, 'almoxarifado_id': almox_id}, headers=_json_headers(csrf))
+    sub_id = r.get_json().get('id')
+    r = client.post('/api/setores', json={'nome': 'Setor Dec', 'ativo': True, 'sub_almoxarifado_ids': [sub_id]}, headers=_json_headers(csrf))
+    setor_id = r.get_json().get('id')
+    r = client.post('/api/produtos', json={'central_id': central_id, 'codigo': codigo, 'nome': 'Compressa', 'ativo': True}, headers=_json_headers(csrf))
+    produto_id = r.get_json().get('id')
+    assert central_id and almox_id and setor_id and produto_id
+    return almox_id, setor_id, produto_id
+
+
+def _saldo_almox(produto_id, almox_id):
+    doc = extensions.mongo_db['estoques'].find_one({'produto_id': produto_id, 'local_tipo': 'almoxarifado', 'local_id': almox_id})
+    return float(doc.get('quantidade_disponivel'))
+
+
+def test_distribuicao_nao_deixa_estoque_negativo(app, client):
+    assert client.post('/auth/login', json={'username': 'admin', 'password': 'admin'}).status_code == 200
+    csrf = _get_csrf_token(client)
+    almox_id, setor_id, produto_id = _bootstrap(client, csrf)
+
+    r = client.post(f'/api/produtos/{produto_id}/recebimento', json={'almoxarifado_id': almox_id, 'quantidade': 10}, headers=_json_headers(csrf))
+    assert r.status_code == 200
+
+    payload = {
+        'produto_id': produto_id,
+        'origem': {'tipo': 'almoxarifado', 'id': almox_id},
+        'destinos': [{'id': setor_id, 'quantidade': 6.0}],
+    }
+    r = client.post('/api/movimentacoes/distribuicao', json=payload, headers=_json_headers(csrf))
+    assert r.status_code == 200
+    assert r.get_json()['saldo_origem'] == 4.0
+
+    # Segunda saída de 6 não passa pela guarda do update e nada é gravado
+    with app.app_context():
+        movs_antes = movimentacoes_repo.get_repo(extensions.mongo_db).count_documents({'produto_id': produto_id})
+    r = client.post('/api/movimentacoes/distribuicao', json=payload, headers=_json_headers(csrf))
+    assert r.status_code == 400
+    assert 'excede' in r.get_json()['error']
+    with app.app_context():
+        assert _saldo_almox(produto_id, almox_id) == 4.0
+        assert movimentacoes_repo.get_repo(extensions.mongo_db).count_documents({'produto_id': produto_id}) == movs_antes
+
+    r = client.post('/api/movimentacoes/transferencia', json={
+        'produto_id': produto_id, 'quantidade': 5.0,
+        'origem': {'tipo': 'almoxarifado', 'id': almox_id},
+        'destino': {'tipo': 'setor', 'id': setor_id},
+    }, headers=_json_headers(csrf))
+    assert r.status_code == 400
+    assert r.get_json()['error'] == 'Quantidade insuficiente na origem'
+
+
+def test_decremento_condicional_concorrente(app):
+    import threading
+    from datetime import datetime, timezone
+    from blueprints.main import _decrementar_estoque
+
+    with app.app_context():
+        estoques = extensions.mongo_db['estoques']
+        estoques.insert_one({'produto_id': 'DEC-X', 'local_tipo': 'almoxarifado', 'local_id': 77, 'quantidade': 10.0, 'quantidade_disponivel': 10.0})
+        filtros = [{'produto_id': 'DEC-X', 'local_tipo': 'almoxarifado', 'local_id': 77}]
+        now = datetime.now(timezone.utc)
+        # 8 saídas de 3 disparadas juntas sobre saldo 10: só 3 cabem
+        largada = threading.Barrier(8)
+        aplicadas = []
+
+        def _saida():
+            largada.wait()
+            if _decrementar_estoque(estoques, filtros, 3.0, now) is not None:
+                aplicadas.append(1)
+
+        threads = [threading.Thread(target=_saida) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(10)
+        assert len(aplicadas) == 3
+        assert estoques.find_one(filtros[0])['quantidade_disponivel'] == 1.0
+
+
+class _ClienteSemTopologia:
+    """Cliente com connect=False: a topologia só é conhecida após a primeira seleção de servidor."""
+
+    def __init__(self):
+        self.tipo = 'Unknown'
+        self.admin = self
+
+    @property
+    def topology_description(self):
+        return type('Topologia', (), {'topology_type_name': self.tipo})()
+
+    def command(self, nome):
+        self.tipo = 'ReplicaSetWithPrimary'
+        return {'ok': 1}
+
+
+def test_supports_transactions_seleciona_servidor_antes_de_decidir():
+    assert extensions.supports_transactions(_ClienteSemTopologia()) is True
+
+
+def test_distribuicao_multiplos_setores_em_lote(app, client):
+    assert client.post('/auth/login', json={'username': 'admin', 'password': 'admin'}).status_code == 200
+    csrf = _get_csrf_token(client)
+    almox_id, setor_id, produto_id = _bootstrap(client, csrf, 'DEC-0002')
+    with app.app_context():
+        sub_id = extensions.mongo_db['setores'].find_one({'id': setor_id}).get('sub_almoxarifado_ids')[0]
+    setores = [setor_id]
+    for i in range(3):
+        r = client.post('/api/setores', json={'nome': f'Setor Lote {i}', 'ativo': True, 'sub_almoxarifado_ids': [sub_id]}, headers=_json_headers(csrf))
+        setores.append(r.get_json().get('id'))
+
+    r = client.post(f'/api/produtos/{produto_id}/recebimento', json={'almoxarifado_id': almox_id, 'quantidade': 100}, headers=_json_headers(csrf))
+    assert r.status_code == 200
+
+    r = client.post('/api/movimentacoes/distribuicao', json={
+        'produto_id': produto_id,
+        'origem': {'tipo': 'almoxarifado', 'id': almox_id},
+        'destinos': [{'id': sid, 'quantidade': 5.0} for sid in setores],
+    }, headers=_json_headers(csrf))
+    assert r.status_code == 200, r.get_json()
+    j = r.get_json()
+    assert j['movimentacoes_criadas'] == 4
+    assert j['saldo_origem'] == 80.0
+
+    # formato antigo: divisão igual entre os setores
+    r = client.post('/api/movimentacoes/distribuicao', json={
+        'produto_id': produto_id,
+        'origem': {'tipo': 'almoxarifado', 'id': almox_id},
+        'quantidade_total': 40,
+        'setores_destino': setores,
+    }, headers=_json_headers(csrf))
+    assert r.status_code == 200, r.get_json()
+    assert r.get_json()['saldo_origem'] == 40.0
+
+    with app.app_context():
+        db = extensions.mongo_db
+        for sid in setores:
+            doc = db['estoques'].find_one({'produto_id': produto_id, 'local_tipo': 'setor', 'local_id': sid})
+            assert doc['quantidade_disponivel'] == 15.0
+        assert movimentacoes_repo.get_repo(db).count_documents({'produto_id': produto_id, 'tipo': 'saida'}) == 8
@@ -0,0 +1,99 @@
+import re
+
+import extensions
+import movimentacoes_repo
+import idempotencia
+
+
+def _get_csrf_token(client):
+    client.get('/')
+    with client.session_transaction() as sess:
+        return sess.get('csrf_token')
+
+
+def _json_headers(token, key=None):
+    h = {
+        'Accept': 'application/json',
+        'Content-Type': 'application/json',
+        'X-CSRF-Token': token,
+    }
+    if key:
+        h['Idempotency-Key'] = key
+    return h
+
+
+def test_repeticao_com_mesma_chave_nao_duplica_recebimento(app, client):
+    assert client.post('/auth/login', json={'username': 'admin', 'password': 'admin'}).status_code == 200
+    csrf = _get_csrf_token(client)
+    h = _json_headers(csrf)
+    central_id = client.post('/api/centrais', json={'nome': 'Central Idem', 'ativo': True}, headers=h).get_json().get('id')
+    almox_id = client.post('/api/almoxarifados', json={'nome': 'Almox Idem', 'ativo': True, 'central_id': central_id}, headers=h).get_json().get('id')
+    produto_id = client.post('/api/produtos', json={'central_id': central_id, 'codigo': 'IDEM-0001', 'nome': 'Cateter', 'ativo': True}, headers=h).get_json().get('id')
+
+    url = f'/api/produtos/{produto_id}/recebimento'
+    body = {'almoxarifado_id': almox_id, 'quantidade': 4}
+    r1 = client.post(url, json=body, headers=_json_headers(csrf, 'chave-1'))
+    r2 = client.post(url, json=body, headers=_json_headers(csrf, 'chave-1'))
+    assert r1.status_code == 200 and r2.status_code == 200
+    assert r2.headers.get('Idempotent-Replayed') == 'true'
+    assert r2.get_json()['movimentacao_id'] == r1.get_json()['movimentacao_id']
+
+    # mesma chave com outro conteúdo é rejeitada
+    r3 = client.post(url, json={'almoxarifado_id': almox_id, 'quantidade': 5}, headers=_json_headers(csrf, 'chave-1'))
+    assert r3.status_code == 422
+
+    # chave nova executa de novo
+    r4 = client.post(url, json=body, headers=_json_headers(csrf, 'chave-2'))
+    assert r4.status_code == 200 and r4.headers.get('Idempotent-Replayed') is None
+
+    with app.app_context():
+        db = extensions.mongo_db
+        est = db['estoques'].find_one({'produto_id': produto_id, 'local_tipo': 'almoxarifado', 'local_id': almox_id})
+        assert est['quantidade_disponivel'] == 8.0
+        assert movimentacoes_repo.get_repo(db).count_documents({'produto_id': produto_id, 'tipo': 'entrada'}) == 2
+        assert db['idempotency_keys'].count_documents({'status_execucao': 'concluido'}) >= 2
+
+
+def test_fetchjson_so_repete_rotas_com_idempotente(app):
+    rotas = idempotencia.rotas_idempotentes(app)
+    assert '^/api/movimentacoes/transferencia$' in rotas
+    assert '^/api/produtos/[^/]+/recebimento$' in rotas
+    assert not any(re.match(p, '/api/compras/finalizar') or re.match(p, '/api/admin/reset-db') for p in rotas)
+
+
+def test_resposta_nao_gravada_nao_reexecuta_a_rota(app, client, monkeypatch):
+    from datetime import datetime, timedelta, timezone
+    from pymongo.errors import AutoReconnect
+
+    assert client.post('/auth/login', json={'username': 'admin', 'password': 'admin'}).status_code == 200
+    csrf = _get_csrf_token(client)
+    h = _json_headers(csrf)
+    central_id = client.post('/api/centrais', json={'nome': 'Central Idem 2', 'ativo': True}, headers=h).get_json().get('id')
+    almox_id = client.post('/api/almoxarifados', json={'nome': 'Almox Idem 2', 'ativo': True, 'central_id': central_id}, headers=h).get_json().get('id')
+    produto_id = client.post('/api/produtos', json={'central_id': central_id, 'codigo': 'IDEM-0002', 'nome': 'Sonda', 'ativo': True}, headers=h).get_json().get('id')
+
+    with app.app_context():
+        coll = extensions.mongo_db[idempotencia.COLECAO]
+    original = type(coll).update_one
+
+    def update_falha(self, filtro, update, *a, **kw):
+        if self.name == idempotencia.COLECAO and update.get('$set', {}).get('status_execucao') == 'concluido':
+            raise AutoReconnect('primário indisponível')
+        return original(self, filtro, update, *a, **kw)
+
+    url = f'/api/produtos/{produto_id}/recebimento'
+    body = {'almoxarifado_id': almox_id, 'quantidade': 3}
+    monkeypatch.setattr(type(coll), 'update_one', update_falha)
+    assert client.post(url, json=body, headers=_json_headers(csrf, 'chave-falha')).status_code == 200
+    monkeypatch.setattr(type(coll), 'update_one', original)
+
+    # registro ficou 'processando': a repetição aguarda e, vencido o prazo, não reexecuta
+    r = client.post(url, json=body, headers=_json_headers(csrf, 'chave-falha'))
+    assert r.status_code == 409 and r.headers.get('Retry-After') == '1'
+    with app.app_context():
+        extensions.mongo_db[idempotencia.COLECAO].update_one({'status_execucao': 'processando', '_id': {'$regex': 'chave-falha$'}},
+                                                             {'$set': {'lock_ate': datetime.now(timezone.utc) - timedelta(seconds=1)}})
+    r = client.post(url, json=body, headers=_json_headers(csrf, 'chave-falha'))
+    assert r.status_code == 409 and r.headers.get('Retry-After') is None
+    with app.app_context():
+        assert movimentacoes_repo.get_repo(extensions.mongo_db).count_documents({'produto_id': produto_id, 'tipo': 'entrada'}) == 1
@@ -0,0 +1,32 @@
+import mongomock
+from pymongo import ASCENDING
+
+import indices
+from config.indices import indice
+
+
+def test_diferencas_e_sincronizacao_com_o_catalogo():
+    db = mongomock.MongoClient()['indices_teste']
+    catalogo = {
+        'estoques': [indice('idx_est_produto_local', [('produto_id', ASCENDING), ('local_tipo', ASCENDING), ('local_id', ASCENDING)])],
+        'compras': [indice('idx_compras_status', [('status', ASCENDING)]),
+                    indice('idx_compras_codigo', [('codigo', ASCENDING)], unique=True)],
+        'lotes': [indice('idx_lotes_venc', [('data_vencimento', ASCENDING)])],
+    }
+    db['estoques'].create_index([('produto_id', ASCENDING)], name='idx_est_produto')
+    db['compras'].create_index([('status', ASCENDING)], name='idx_compras_status')
+    db['compras'].create_index([('codigo', ASCENDING)], name='idx_compras_codigo')
+    db['lotes'].create_index([('data_vencimento', ASCENDING)], name='vencimento_1')
+
+    dif = indices.diferencas(db, catalogo)
+    assert [s['nome'] for s in dif['estoques']['faltando']] == ['idx_est_produto_local']
+    assert [e['nome'] for e in dif['estoques']['extras']] == ['idx_est_produto']
+    assert [d['nome'] for d in dif['compras']['divergentes']] == ['idx_compras_codigo']
+    assert dif['lotes'] == {'faltando': [], 'divergentes': [], 'renomeados': [{'nome': 'idx_lotes_venc', 'atual': 'vencimento_1'}], 'extras': []}
+
+    res = indices.sincronizar(db, catalogo, recriar_divergentes=True, remover_extras=True)
+    assert res['criados'] == ['estoques.idx_est_produto_local']
+    assert res['recriados'] == ['compras.idx_compras_codigo']
+    assert res['removidos'] == ['estoques.idx_est_produto']
+    assert db['compras'].index_information()['idx_compras_codigo'].get('unique') is True
+    assert set(indices.diferencas(db, catalogo)) == {'lotes'}
@@ -0,0 +1,117 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+
+import extensions
+import jobs
+
+
+def _get_csrf_token(client):
+    client.get('/')
+    with client.session_transaction() as sess:
+        return sess.get('csrf_token')
+
+
+def test_rota_assincrona_e_post_api_jobs(app, client, tmp_path):
+    app.config['BACKUP_DIR'] = str(tmp_path)
+    with app.app_context():
+        extensions.mongo_db[jobs.COLECAO].delete_many({})
+    assert client.post('/auth/login', json={'username': 'admin', 'password': 'admin'}).status_code == 200
+    h = {'Accept': 'application/json', 'Content-Type': 'application/json', 'X-CSRF-Token': _get_csrf_token(client)}
+
+    r = client.post('/api/admin/backup/create?async=1', json={'collections': ['produtos']}, headers=h)
+    assert r.status_code == 202
+    job_id = r.get_json()['job_id']
+    assert r.headers['Location'] == f'/api/jobs/{job_id}'
+    assert client.get(f'/api/jobs/{job_id}').get_json()['job']['status'] == 'pendente'
+
+    r = client.post('/api/jobs', json={'tipo': 'compras_sugestoes', 'params': {'low_stock_threshold': 3}}, headers=h)
+    assert r.status_code == 202
+    sugestoes_id = r.get_json()['job_id']
+    assert client.post('/api/jobs', json={'tipo': 'inexistente'}, headers=h).status_code == 400
+
+    feitos = jobs.JobRunner(app, workers=0).executar_pendentes()
+    assert len(feitos) == 2
+
+    job = client.get(f'/api/jobs/{job_id}').get_json()['job']
+    assert job['status'] == 'concluido' and job['status_http'] == 200
+    assert job['resultado']['ok'] is True
+    assert len(list(tmp_path.iterdir())) == 1
+
+    job = client.get(f'/api/jobs/{sugestoes_id}').get_json()['job']
+    assert job['status'] == 'concluido' and job['status_http'] == 200
+    # params do job chegaram à rota como query string
+    assert job['resultado']['params']['low_stock_threshold'] == 3
+    assert {j['id'] for j in client.get('/api/jobs').get_json()['items']} >= {job_id, sugestoes_id}
+    assert client.get('/api/jobs?limit=abc').status_code == 400
+    assert client.get('/api/admin/backup/historico?limit=abc').status_code == 400
+
+
+def test_lease_expirado_passa_o_job_para_outro_processo(app):
+    with app.app_context():
+        db = extensions.mongo_db
+        db[jobs.COLECAO].delete_many({})
+        job = jobs.enfileirar(db, 'teste', 'GET', '/api/rota-inexistente')
+        a = jobs.JobRunner(app, workers=0, lease_segundos=60)
+        b = jobs.JobRunner(app, workers=0, lease_segundos=60)
+        assert a.reivindicar(db)['_id'] == job['_id']
+        # lease válido: outro processo não pega o mesmo job
+        assert b.reivindicar(db) is None
+
+        # processo A caiu: lease expira e B assume
+        depois = datetime.now(timezone.utc) + timedelta(seconds=61)
+        assumido = b.reivindicar(db, agora=depois)
+        assert assumido['dono'] == b.dono and assumido['tentativas'] == 2
+        # A não sobrescreve o job que já pertence a B
+        assert a.executar(dict(job, dono=a.dono)) is None
+        final = b.executar(assumido)
+        assert final['status'] == 'erro' and 'Rota não encontrada' in final['erro']
+
+        # esgotadas as tentativas, o job abandonado é finalizado com erro
+        outro = jobs.enfileirar(db, 'teste', 'GET', '/api/rota-inexistente')
+        db[jobs.COLECAO].update_one({'_id': outro['_id']}, {'$set': {
+            'status': 'executando', 'tentativas': jobs.MAX_TENTATIVAS,
+            'lease_ate': datetime.now(timezone.utc) - timedelta(seconds=1)}})
+        assert b.reivindicar(db) is None
+        assert b.expirar_abandonados(db) == 1
+        assert db[jobs.COLECAO].find_one({'_id': outro['_id']})['status'] == 'erro'
+
+
+def test_job_de_arquivamento_retomado_continua_do_checkpoint(app):
+    import arquivamento
+
+    with app.app_context():
+        db = extensions.mongo_db
+        db[jobs.COLECAO].delete_many({})
+        db['jobs_retomada'].insert_many([{'n': i} for i in range(30)])
+        job = jobs.enfileirar(db, 'archive', 'POST', '/api/admin/archive',
+                              corpo={'collection': 'jobs_retomada', 'query': {}, 'chunk': 10},
+                              usuario_id=str(db['usuarios'].find_one({'username': 'admin'})['_id']))
+        a = jobs.JobRunner(app, workers=0, lease_segundos=60)
+        reivindicado = a.reivindicar(db)
+
+        # 1ª tentativa: a rota registra o checkpoint, move um bloco e o processo cai
+        execucao_id = ObjectId()
+        db[jobs.COLECAO].update_one({'_id': job['_id']}, {'$set': {'checkpoint.execucao_id': str(execucao_id)}})
+        arquivamento.arquivar(db, 'jobs_retomada', {}, chunk=10, execucao_id=execucao_id, limite_blocos=1)
+        assert db['jobs_retomada'].count_documents({}) == 20
+
+        b = jobs.JobRunner(app, workers=0, lease_segundos=60)
+        assumido = b.reivindicar(db, agora=reivindicado['lease_ate'] + timedelta(seconds=1))
+        final = b.executar(assumido)
+        assert final['status'] == 'concluido', final.get('erro')
+        assert db['jobs_retomada'].count_documents({}) == 0
+        assert db['archive_jobs_retomada'].count_documents({}) == 30
+        # a mesma execução foi continuada, não uma nova
+        assert db[arquivamento.COLECAO_EXECUCOES].count_documents({'origem': 'jobs_retomada'}) == 1
+        assert db[arquivamento.COLECAO_EXECUCOES].find_one({'_id': execucao_id})['movidos'] == 30
+
+        # a rota grava o checkpoint no job: é o id da execução devolvida
+        db['jobs_retomada'].insert_many([{'n': i} for i in range(5)])
+        novo = jobs.enfileirar(db, 'archive', 'POST', '/api/admin/archive',
+                               corpo={'collection': 'jobs_retomada', 'query': {}},
+                               usuario_id=str(db['usuarios'].find_one({'username': 'admin'})['_id']))
+        feito = b.executar_pendentes()[0]
+        assert feito['_id'] == novo['_id'] and feito['status'] == 'concluido'
+        assert feito['checkpoint']['execucao_id'] == json.loads(feito['resultado'])['execucao_id']
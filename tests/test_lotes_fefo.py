@@ -0,0 +1,121 @@
+import extensions
+import movimentacoes_repo
+
+
+def _get_csrf_token(client):
+    client.get('/')
+    with client.session_transaction() as sess:
+        return sess.get('csrf_token')
+
+
+def _json_headers(token):
+    return {
+        'Accept': 'application/json',
+        'Content-Type': 'application/json',
+        'X-CSRF-Token': token,
+    }
+
+
+def _bootstrap(client, csrf, codigo):
+    r = client.post('/api/centrais', json={'nome': 'Central FEFO', 'ativo': True}, headers=_json_headers(csrf))
+    central_id = r.get_json().get('id')
+    r = client.post('/api/almoxarifados', json={'nome': 'Almox FEFO', 'ativo': True, 'central_id': central_id}, headers=_json_headers(csrf))
+    almox_id = r.get_json().get('id')
+    r = client.post('/api/sub-almoxarifados', json={'nome': 'Sub FEFO', 'ativo': True, 'almoxarifado_id': almox_id}, headers=_json_headers(csrf))
+    sub_id = r.get_json().get('id')
+    r = client.post('/api/setores', json={'nome': 'Setor FEFO', 'ativo': True, 'sub_almoxarifado_ids': [sub_id]}, headers=_json_headers(csrf))
+    setor_id = r.get_json().get('id')
+    r = client.post('/api/produtos', json={'central_id': central_id, 'codigo': codigo, 'nome': 'Soro', 'ativo': True}, headers=_json_headers(csrf))
+    produto_id = r.get_json().get('id')
+    assert central_id and almox_id and setor_id and produto_id
+    return almox_id, setor_id, produto_id
+
+
+def test_distribuicao_consome_lotes_fefo(app, client):
+    assert client.post('/auth/login', json={'username': 'admin', 'password': 'admin'}).status_code == 200
+    csrf = _get_csrf_token(client)
+    almox_id, setor_id, produto_id = _bootstrap(client, csrf, 'FEFO-0001')
+
+    recebimentos = [
+        {'lote': 'L-B', 'quantidade': 5, 'data_vencimento': '2031-06-01'},
+        {'lote': 'L-A', 'quantidade': 4, 'data_vencimento': '2030-01-01'},
+        {'quantidade': 3},
+    ]
+    for rec in recebimentos:
+        r = client.post(f'/api/produtos/{produto_id}/recebimento', json=dict(rec, almoxarifado_id=almox_id), headers=_json_headers(csrf))
+        assert r.status_code == 200, r.get_json()
+
+    r = client.post('/api/movimentacoes/distribuicao', json={
+        'produto_id': produto_id,
+        'origem': {'tipo': 'almoxarifado', 'id': almox_id},
+        'destinos': [{'id': setor_id, 'quantidade': 6.0}],
+    }, headers=_json_headers(csrf))
+    assert r.status_code == 200, r.get_json()
+
+    with app.app_context():
+        db = extensions.mongo_db
+        pid = db['estoques'].find_one({'local_tipo': 'setor', 'local_id': setor_id})['produto_id']
+        lotes = {(l['lote'], l['local_tipo']): l['quantidade_atual'] for l in db['lotes'].find({'produto_id': pid})}
+        assert lotes[('L-A', 'almoxarifado')] == 0
+        assert lotes[('L-B', 'almoxarifado')] == 3
+        assert lotes[('L-A', 'setor')] == 4
+        assert lotes[('L-B', 'setor')] == 2
+
+        mov = movimentacoes_repo.get_repo(db).find_one({'produto_id': pid, 'tipo': 'saida'})
+        assert [(a['lote'], a['quantidade']) for a in mov['lotes_alocados']] == [('L-A', 4), ('L-B', 2)]
+        assert mov['quantidade_sem_lote'] == 0
+
+
+def test_alocar_vencidos_por_ultimo_datas_texto_e_sem_lote(app):
+    from datetime import datetime, timezone
+    import fefo
+
+    with app.app_context():
+        lotes = extensions.mongo_db['lotes']
+        base = {'produto_id': 'FEFO-X', 'local_tipo': 'setor', 'local_id': 991}
+        lotes.insert_many([
+            dict(base, lote='VENCIDO', quantidade_atual=10.0, data_vencimento=datetime(2020, 1, 1)),
+            dict(base, lote='SEM-DATA', quantidade_atual=2.0, data_vencimento=None),
+            dict(base, lote='OK', quantidade_atual=3.0, data_vencimento=datetime(2099, 1, 1)),
+            dict(base, lote='TEXTO', quantidade_atual=1.0, data_vencimento='2098-05-01'),
+        ])
+        agora = datetime.now(timezone.utc)
+        candidatos = fefo.candidatos_em_lote(lotes, [('FEFO-X', 'setor', 991)], agora)
+        alocados, sem_lote = fefo.alocar(lotes, 'FEFO-X', 'setor', 991, 6.0, agora,
+                                         candidatos=candidatos[('FEFO-X', 'setor', 991)])
+        assert [(a['lote'], a['quantidade']) for a in alocados] == [('TEXTO', 1.0), ('OK', 3.0), ('SEM-DATA', 2.0)]
+        assert alocados[0]['data_vencimento'] == datetime(2098, 5, 1)
+        assert sem_lote == 0
+
+        partes = fefo.dividir(alocados, [4.0, 2.0])
+        assert [[(a['lote'], a['quantidade']) for a in p] for p in partes] == [[('TEXTO', 1.0), ('OK', 3.0)], [('SEM-DATA', 2.0)]]
+
+        # só restam vencidos: são baixados (saldo de 'estoques' já os inclui) e marcados na movimentação
+        alocados, sem_lote = fefo.alocar(lotes, 'FEFO-X', 'setor', 991, 12.0, agora)
+        assert fefo.resumo(alocados) == [{'lote': 'VENCIDO', 'quantidade': 10.0, 'data_vencimento': datetime(2020, 1, 1), 'vencido': True}]
+        assert sem_lote == 2.0
+
+        # crédito no destino: lote sem data não apaga a data que o lote de destino já tem
+        lotes.insert_one(dict(base, local_id=992, lote='SEM-DATA', quantidade_atual=1.0, data_vencimento=datetime(2099, 2, 1)))
+        lotes.bulk_write(fefo.operacoes_credito([{'lote': 'SEM-DATA', 'quantidade': 2.0, 'data_vencimento': None}],
+                                                'FEFO-X', 'setor', 992, agora))
+        destino = lotes.find_one({'produto_id': 'FEFO-X', 'local_id': 992, 'lote': 'SEM-DATA'})
+        assert destino['quantidade_atual'] == 3.0 and destino['data_vencimento'] == datetime(2099, 2, 1)
+
+
+def test_dashboard_vencimentos_mantem_lotes_antigos_sem_saldo_por_lote(app, client):
+    from datetime import datetime, timedelta
+
+    assert client.post('/auth/login', json={'username': 'admin', 'password': 'admin'}).status_code == 200
+    with app.app_context():
+        extensions.mongo_db['lotes'].insert_many([
+            {'produto_id': 'FEFO-LEG', 'lote': 'LEGADO', 'almoxarifado_id': 1,
+             'data_vencimento': datetime.utcnow() + timedelta(days=5)},
+            {'produto_id': 'FEFO-LEG', 'lote': 'ZERADO', 'local_tipo': 'almoxarifado', 'local_id': 1,
+             'quantidade_atual': 0.0, 'data_vencimento': datetime.utcnow() + timedelta(days=5)},
+        ])
+    r = client.get('/api/dashboard/vencimentos?dias_aviso=30&limit=50')
+    assert r.status_code == 200
+    lotes = {it['numero_lote'] for it in r.get_json()['items']}
+    assert 'LEGADO' in lotes
+    assert 'ZERADO' not in lotes
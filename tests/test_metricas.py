@@ -0,0 +1,60 @@
+import json
+
+import metricas
+
+
+def test_metrics_soma_processos_e_expoe_histogramas(app, client, tmp_path):
+    app.config['METRICS_DIR'] = str(tmp_path)
+    # retrato de outro worker já gravado no diretório compartilhado
+    outro = metricas.Registro()
+    outro.inc('http_requests_total', {'endpoint': 'main.api_movimentacoes', 'method': 'GET', 'status': '200'}, 5)
+    outro.observar('http_request_duration_seconds', {'endpoint': 'main.api_movimentacoes', 'method': 'GET'}, 0.3)
+    (tmp_path / '999999-1.json').write_text(json.dumps(outro.retrato()))
+
+    assert client.get('/health/app').status_code == 200
+    # sem METRICS_TOKEN e fora do DEBUG: exige sessão de super_admin
+    app.config['METRICS_TOKEN'] = None
+    assert client.get('/metrics').status_code == 401
+    assert client.post('/auth/login', json={'username': 'admin', 'password': 'admin'}).status_code == 200
+    r = client.get('/metrics')
+    assert r.status_code == 200
+    assert r.mimetype == 'text/plain'
+    texto = r.get_data(as_text=True)
+    assert '# TYPE http_request_duration_seconds histogram' in texto
+    assert 'http_requests_total{endpoint="main.health_app",method="GET",status="200"}' in texto
+    assert 'http_requests_total{endpoint="main.api_movimentacoes",method="GET",status="200"} 5' in texto
+    assert 'http_request_duration_seconds_bucket{endpoint="main.api_movimentacoes",method="GET",le="0.5"} 1' in texto
+    assert 'http_request_duration_seconds_bucket{endpoint="main.api_movimentacoes",method="GET",le="0.25"} 0' in texto
+    assert 'response_cache_hits_total' in texto
+    assert 'mongo_commands_total{collection=' in texto
+    assert 'jobs_queue_depth{status="pendente"}' in texto
+
+    app.config['METRICS_TOKEN'] = 'segredo'
+    try:
+        assert client.get('/metrics').status_code == 401
+        assert client.get('/metrics', headers={'Authorization': 'Bearer segredo'}).status_code == 200
+    finally:
+        app.config['METRICS_TOKEN'] = None
+
+
+def test_retratos_de_processos_encerrados_sao_incorporados(app, tmp_path):
+    rotulos = {'endpoint': 'main.api_movimentacoes', 'method': 'GET', 'status': '200'}
+    for pid in (999991, 999992):
+        morto = metricas.Registro()
+        morto.inc('http_requests_total', rotulos, 3)
+        (tmp_path / f'{pid}-1.json').write_text(json.dumps(morto.retrato()))
+    linha = 'http_requests_total{endpoint="main.api_movimentacoes",method="GET",status="200"} '
+
+    with app.app_context():
+        assert linha + '6' in metricas.exposicao(str(tmp_path))
+    restantes = {p.name for p in tmp_path.glob('*.json')}
+    assert restantes == {metricas.ENCERRADOS, f'{metricas._pid}-{metricas._inicio}.json'}
+
+    # outro worker reciclado: soma ao agregado; o contador não volta atrás
+    (tmp_path / '999993-1.json').write_text(json.dumps(morto.retrato()))
+    with app.app_context():
+        assert linha + '9' in metricas.exposicao(str(tmp_path))
+        # agregado gravado e processo caiu antes de apagar o retrato: não soma duas vezes
+        (tmp_path / '999993-1.json').write_text(json.dumps(morto.retrato()))
+        assert linha + '9' in metricas.exposicao(str(tmp_path))
+    assert not (tmp_path / '999993-1.json').exists()
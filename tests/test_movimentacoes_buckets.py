@@ -0,0 +1,140 @@
+from datetime import datetime, timedelta, timezone
+
+import extensions
+import movimentacoes_repo
+
+
+def _login_admin(client):
+    resp = client.post('/auth/login', json={'username': 'admin', 'password': 'admin'})
+    assert resp.status_code == 200
+
+
+def _seed(db, produto_id, n):
+    base = datetime(2025, 1, 15, tzinfo=timezone.utc)
+    for i in range(n):
+        db['movimentacoes'].insert_one({
+            'produto_id': produto_id,
+            'tipo': 'saida' if i % 2 else 'entrada',
+            'quantidade': float(i + 1),
+            'origem_tipo': 'almoxarifado',
+            'origem_id': 1,
+            'data_movimentacao': base + timedelta(days=i * 7),
+            'created_at': base + timedelta(days=i * 7),
+        })
+
+
+def test_repositorio_buckets_equivale_a_colecao(app):
+    with app.app_context():
+        db = extensions.mongo_db
+        db['produtos'].insert_one({'id': 9301, 'nome': 'Cateter', 'codigo': 'BKT-0001'})
+        _seed(db, 9301, 30)
+        movimentacoes_repo.reconstruir_buckets(db)
+
+        colecao = movimentacoes_repo.get_repo(db, 'colecao')
+        buckets = movimentacoes_repo.get_repo(db, 'buckets')
+        assert isinstance(buckets, movimentacoes_repo.MovimentacoesBucketRepository)
+
+        inicio = datetime(2025, 3, 1)
+        fim = datetime(2025, 5, 31)
+        query = {'$and': [
+            {'produto_id': {'$in': [9301, '9301']}},
+            {'$or': [{'data_movimentacao': {'$gte': inicio, '$lte': fim}}, {'created_at': {'$gte': inicio, '$lte': fim}}]},
+        ]}
+        sort = [('data_movimentacao', -1), ('_id', 1)]
+        esperado = [d['_id'] for d in colecao.find(query, {'_id': 1}, sort=sort, skip=2, limit=5)]
+        obtido = [d['_id'] for d in buckets.find(query, {'_id': 1}, sort=sort, skip=2, limit=5)]
+        assert obtido == esperado
+        assert buckets.count(query) == colecao.count(query) > 0
+
+        # Escrita pelo repositório vai só para os buckets (a coleção plana não é gravada)
+        planos = colecao.count({})
+        novo = {'produto_id': 9301, 'tipo': 'saida', 'quantidade': 99.0,
+                'data_movimentacao': datetime(2025, 4, 2), 'created_at': datetime(2025, 4, 2)}
+        buckets.insert_one(novo)
+        assert buckets.count(query) == colecao.count(query) + 1 and colecao.count({}) == planos
+        buckets.update_one({'_id': novo['_id']}, {'$set': {'quantidade': 100.0}})
+        assert buckets.find_one({'_id': novo['_id']})['quantidade'] == 100.0
+        assert buckets.delete_many({'_id': novo['_id']}).deleted_count == 1
+        assert buckets.count(query) == colecao.count(query)
+
+
+def test_listagem_recente_le_so_os_buckets_necessarios(app, monkeypatch):
+    with app.app_context():
+        db = extensions.mongo_db
+        for pid in range(9310, 9330):
+            _seed(db, pid, 12)
+        movimentacoes_repo.reconstruir_buckets(db)
+        colecao = movimentacoes_repo.get_repo(db, 'colecao')
+        buckets = movimentacoes_repo.get_repo(db, 'buckets')
+        monkeypatch.setattr(buckets, 'GRUPO_INICIAL', 2)
+
+        query = {'tipo': 'saida'}
+        sort = [('data_movimentacao', -1), ('_id', 1)]
+        esperado = [d['_id'] for d in colecao.find(query, {'_id': 1}, sort=sort, skip=3, limit=10)]
+        lidos = []
+        original = buckets.buckets.aggregate
+
+        def _registrar(pipeline, **kw):
+            lidos.append(pipeline[0]['$match'])
+            return original(pipeline, **kw)
+        monkeypatch.setattr(buckets.buckets, 'aggregate', _registrar)
+        obtido = [d['_id'] for d in buckets.find(query, {'_id': 1}).sort(sort).skip(3).limit(10)]
+        assert obtido == esperado
+        # a consulta final lê só parte dos buckets, por _id, em vez de desaninhar todos
+        assert '_id' in lidos[-1] and len(lidos[-1]['_id']['$in']) < db['movimentacoes_buckets'].count_documents({})
+
+
+def test_arquivamento_no_layout_buckets_desaninha_so_os_buckets_do_bloco(app, monkeypatch):
+    import arquivamento
+
+    with app.app_context():
+        db = extensions.mongo_db
+        db['movimentacoes'].delete_many({})
+        for pid in range(9340, 9350):
+            _seed(db, pid, 12)
+        movimentacoes_repo.reconstruir_buckets(db)
+        db['archive_movimentacoes'].delete_many({})
+        monkeypatch.setitem(app.config, 'MOVIMENTACOES_STORAGE', 'buckets')
+        buckets = db['movimentacoes_buckets']
+        total_buckets = buckets.count_documents({})
+        corte = datetime(2025, 2, 20)
+        esperado = db['movimentacoes'].count_documents({'data_movimentacao': {'$lt': corte}})
+
+        desaninhados = []
+        original = buckets.aggregate
+
+        def _registrar(pipeline, **kw):
+            if any('$unwind' in e for e in pipeline):
+                pre = pipeline[0]['$match']
+                desaninhados.append(len(pre['_id']['$in']) if '_id' in pre else
+                                    len(pre['itens._id']['$in']) if 'itens._id' in pre else total_buckets)
+            return original(pipeline, **kw)
+        monkeypatch.setattr(buckets, 'aggregate', _registrar)
+
+        estado = arquivamento.arquivar(db, 'movimentacoes', {'data_movimentacao': {'$lt': corte}}, chunk=6)
+        # cada bloco desaninha só os buckets dele (e a remoção só os que têm os itens)
+        assert desaninhados and max(desaninhados) < total_buckets
+        monkeypatch.setattr(buckets, 'aggregate', original)
+        assert estado['status'] == 'concluido' and estado['movidos'] == esperado
+        assert db['archive_movimentacoes'].count_documents({}) == esperado
+        repo = movimentacoes_repo.get_repo(db)
+        assert repo.count_documents({'data_movimentacao': {'$lt': corte}}) == 0
+        assert repo.count_documents({}) == 120 - esperado
+
+
+def test_api_movimentacoes_le_pelo_layout_buckets(app, client):
+    _login_admin(client)
+    with app.app_context():
+        db = extensions.mongo_db
+        db['produtos'].insert_one({'id': 9302, 'nome': 'Sonda', 'codigo': 'BKT-0002'})
+        _seed(db, 9302, 12)
+        movimentacoes_repo.reconstruir_buckets(db)
+
+    r1 = client.get('/api/produtos/9302/movimentacoes?limit=50')
+    app.config['MOVIMENTACOES_STORAGE'] = 'buckets'
+    r2 = client.get('/api/produtos/9302/movimentacoes?limit=50')
+    r3 = client.get('/api/movimentacoes?produto=BKT-0002&per_page=50')
+    assert r1.status_code == r2.status_code == r3.status_code == 200
+    assert r1.get_json()['pagination']['total'] == r2.get_json()['pagination']['total'] == 12
+    assert [it['quantidade'] for it in r1.get_json()['items']] == [it['quantidade'] for it in r2.get_json()['items']]
+    assert r3.get_json()['pagination']['total'] == 12
@@ -0,0 +1,60 @@
+import extensions
+import movimentacoes_repo
+
+
+def _get_csrf_token(client):
+    client.get('/')
+    with client.session_transaction() as sess:
+        return sess.get('csrf_token')
+
+
+def _json_headers(token):
+    return {
+        'Accept': 'application/json',
+        'Content-Type': 'application/json',
+        'X-CSRF-Token': token,
+    }
+
+
+def test_lote_aplica_linhas_e_retorna_resultado_por_linha(app, client):
+    assert client.post('/auth/login', json={'username': 'admin', 'password': 'admin'}).status_code == 200
+    csrf = _get_csrf_token(client)
+    h = _json_headers(csrf)
+    central_id = client.post('/api/centrais', json={'nome': 'Central Lote', 'ativo': True}, headers=h).get_json().get('id')
+    almox_id = client.post('/api/almoxarifados', json={'nome': 'Almox Lote', 'ativo': True, 'central_id': central_id}, headers=h).get_json().get('id')
+    sub_id = client.post('/api/sub-almoxarifados', json={'nome': 'Sub Lote', 'ativo': True, 'almoxarifado_id': almox_id}, headers=h).get_json().get('id')
+    setor_id = client.post('/api/setores', json={'nome': 'Setor Lote', 'ativo': True, 'sub_almoxarifado_ids': [sub_id]}, headers=h).get_json().get('id')
+    p1 = client.post('/api/produtos', json={'central_id': central_id, 'codigo': 'LOTE-0001', 'nome': 'Gaze', 'ativo': True}, headers=h).get_json().get('id')
+    p2 = client.post('/api/produtos', json={'central_id': central_id, 'codigo': 'LOTE-0002', 'nome': 'Esparadrapo', 'ativo': True}, headers=h).get_json().get('id')
+    assert client.post(f'/api/produtos/{p1}/recebimento', json={'almoxarifado_id': almox_id, 'quantidade': 10}, headers=h).status_code == 200
+    assert client.post(f'/api/produtos/{p2}/recebimento', json={'almoxarifado_id': almox_id, 'quantidade': 5}, headers=h).status_code == 200
+
+    def _linha(pid, q, tipo='transferencia'):
+        return {'tipo': tipo, 'produto_id': pid, 'quantidade': q,
+                'origem': {'tipo': 'almoxarifado', 'id': almox_id}, 'destino': {'tipo': 'setor', 'id': setor_id}}
+
+    r = client.post('/api/movimentacoes/lote', json={
+        'motivo': 'Atendimento de demanda',
+        'linhas': [_linha(p1, 6), _linha(p1, 6), _linha(p2, 5, 'distribuicao'), _linha('999999', 1), _linha(p1, 0)],
+    }, headers=h)
+    assert r.status_code == 200, r.get_json()
+    j = r.get_json()
+    assert j['aplicadas'] == 2 and j['falhas'] == 3
+    res = j['resultados']
+    assert res[0]['success'] and res[2]['success']
+    assert res[1]['error'] == 'Quantidade insuficiente na origem'
+    assert res[3]['error'] == 'Produto não encontrado'
+    assert res[4]['error'] == 'Quantidade deve ser maior que zero'
+
+    with app.app_context():
+        db = extensions.mongo_db
+        orig = db['estoques'].find_one({'produto_id': p1, 'local_tipo': 'almoxarifado', 'local_id': almox_id})
+        dest = db['estoques'].find_one({'produto_id': p1, 'local_tipo': 'setor', 'local_id': setor_id})
+        assert orig['quantidade_disponivel'] == 4.0
+        assert dest['quantidade_disponivel'] == 6.0
+        mov = movimentacoes_repo.get_repo(db).find_one({'produto_id': p2, 'tipo': 'saida'})
+        assert mov and mov['motivo'] == 'Atendimento de demanda'
+
+    r = client.post('/api/movimentacoes/lote', json={'linhas': [_linha(p2, 1)]}, headers=h)
+    assert r.status_code == 400
+    assert r.get_json()['resultados'][0]['error'] == 'Quantidade insuficiente na origem'
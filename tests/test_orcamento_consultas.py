@@ -0,0 +1,130 @@
+import pytest
+
+import consumo_diario
+import dataset_sintetico
+import extensions
+import movimentacoes_repo
+
+ESCALA = {'centrais': 2, 'almoxarifados': 3, 'sub_almoxarifados': 6, 'setores': 10, 'categorias': 5,
+          'produtos': 40, 'estoques': 200, 'lotes': 60, 'movimentacoes': 400}
+# hierarquia e produtos em dobro; estoques/lotes/movimentações x4 (também o dobro de linhas por produto)
+ESCALA_MAIOR = {'centrais': 4, 'almoxarifados': 6, 'sub_almoxarifados': 12, 'setores': 20, 'categorias': 10,
+                'produtos': 80, 'estoques': 800, 'lotes': 240, 'movimentacoes': 1600}
+
+# Orçamento fixo por listagem (comandos Mongo), cobrado nas duas massas: não depende do número
+# de linhas, então uma consulta nova por linha estoura na massa maior. '{produto}', '{usuario}',
+# '{local_tipo}' e '{local_id}' são preenchidos com documentos da massa.
+ORCAMENTOS = [
+    ('/api/centrais', 3),
+    ('/api/almoxarifados', 5),
+    ('/api/sub-almoxarifados', 7),
+    ('/api/setores', 9),
+    ('/api/produtos?per_page=50', 5),
+    ('/api/produtos/busca-rapida?q=ser', 8),
+    ('/api/usuarios', 3),
+    ('/api/hierarquia/locais', 9),
+    # buckets: até 3 sondagens da página ordenada por data (cresce com log da página, não da massa)
+    ('/api/movimentacoes?per_page=100', 10),
+    ('/api/dashboard/movimentacoes-recentes', 14),
+    ('/api/dashboard/stats-general', 2),
+    ('/api/compras/lista', 2),
+    ('/api/compras/solicitacoes', 2),
+    ('/api/compras/minhas', 2),
+    ('/api/demandas', 3),
+    ('/api/demandas/lista', 2),
+    ('/api/jobs', 2),
+    ('/api/relatorios/admin/consumo-gastos', 12),
+    ('/api/estoque/saldo-em?produto_id={produto}&local_tipo={local_tipo}&local_id={local_id}&data=2026-03-01T00:00:00', 8),
+    ('/api/admin/backup/list', 1),
+    ('/api/admin/backup/historico', 2),
+    ('/api/admin/backup/schedule', 4),
+    ('/api/admin/archive/execucoes', 2),
+    ('/api/admin/consultas-lentas', 2),
+    ('/api/produtos/{produto}/estoque', 2),
+    ('/api/produtos/{produto}/lotes', 2),
+    ('/api/produtos/{produto}/almoxarifados', 3),
+    ('/api/produtos/{produto}/entradas/sem-lote', 2),
+    ('/api/usuarios/{usuario}/categorias-especificas', 2),
+    # contagens de produtos/usuários da página numa consulta por coleção
+    ('/api/categorias', 4),
+    # produtos e locais resolvidos em lote: uma consulta por coleção de local (até 4)
+    ('/api/estoque/hierarquia?per_page=50', 7),
+    ('/api/estoque/hierarquia/export', 6),
+    ('/api/dashboard/estoque-baixo', 2),
+    ('/api/dashboard/vencimentos', 2),
+    ('/api/compras/sugestoes', 4),
+    # locais da página em lote; buckets: sondagens da página ordenada, como em /api/movimentacoes
+    ('/api/produtos/{produto}/movimentacoes', 10),
+]
+
+
+def _gerar_massa(nome: str, escala: dict, admin: dict):
+    db = extensions.mongo_client[nome]
+    for colecao in db.list_collection_names():
+        db.drop_collection(colecao)
+    db['usuarios'].insert_one(admin)
+    dataset_sintetico.gerar(db, escala, seed=3)
+    if isinstance(movimentacoes_repo.get_repo(db), movimentacoes_repo.MovimentacoesBucketRepository):
+        movimentacoes_repo.reconstruir_buckets(db)
+    # a visão de consumo diário é mantida pelo agendador; a materialização inicial não conta
+    consumo_diario.atualizar(db)
+    estoque = db['estoques'].find_one({'local_tipo': 'almoxarifado'}, sort=[('_id', 1)])
+    valores = {
+        'produto': estoque['produto_id'],
+        'local_tipo': estoque['local_tipo'],
+        'local_id': estoque['local_id'],
+        'usuario': str(admin['_id']),
+    }
+    return db, valores
+
+
+@pytest.fixture(scope='module')
+def massas():
+    """Dois bancos isolados com a massa sintética em tamanhos diferentes; o admin é copiado do
+    banco dos testes."""
+    original = extensions.mongo_db
+    admin = original['usuarios'].find_one({'username': 'admin'})
+    out = [_gerar_massa('orcamento_consultas', ESCALA, admin),
+           _gerar_massa('orcamento_consultas_maior', ESCALA_MAIOR, admin)]
+    try:
+        yield out
+    finally:
+        extensions.mongo_db = original
+
+
+@pytest.mark.parametrize('caminho,orcamento', ORCAMENTOS)
+def test_orcamento_de_consultas_nao_cresce_com_a_massa(app, client, massas, max_queries, caminho, orcamento):
+    assert client.post('/auth/login', json={'username': 'admin', 'password': 'admin'}).status_code == 200
+    for db, valores in massas:
+        extensions.mongo_db = db
+        extensions.response_cache.clear_prefix('')
+        with max_queries(orcamento):
+            r = client.get(caminho.format(**valores), headers={'Accept': 'application/json'})
+        assert r.status_code == 200, r.get_json()
+
+
+def test_orcamento_estourado_lista_as_formas(app, massas, max_queries):
+    db = massas[0][0]
+    with pytest.raises(pytest.fail.Exception) as exc:
+        with max_queries(2):
+            for pid in (1, 2, 3):
+                db['produtos'].find_one({'id': pid})
+    assert '3 comandos Mongo (orçamento: 2)' in str(exc.value)
+    assert '3x find produtos {"id":"?"}' in str(exc.value)
+
+
+def test_categorias_contagens_em_lote_batem_com_a_contagem_por_categoria(app, client, massas):
+    assert client.post('/auth/login', json={'username': 'admin', 'password': 'admin'}).status_code == 200
+    db = massas[1][0]
+    extensions.mongo_db = db
+    r = client.get('/api/categorias?per_page=100', headers={'Accept': 'application/json'})
+    assert r.status_code == 200
+    items = r.get_json()['items']
+    assert items
+    for item in items:
+        c = db['categorias'].find_one({'id': item['id']}) or db['categorias'].find_one({'_id': item['id']})
+        candidatos = [v for v in (c.get('id'), c['_id'], str(c['_id'])) if v is not None]
+        assert item['produtos_count'] == db['produtos'].count_documents({'categoria_id': {'$in': candidatos}})
+        assert item['usuarios_count'] == db['usuarios'].count_documents({'$or': [
+            {'categoria_id': {'$in': candidatos}}, {'categorias_especificas': {'$in': [str(c['_id'])]}}]})
+    assert sum(item['produtos_count'] for item in items) > 0
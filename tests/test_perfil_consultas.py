@@ -0,0 +1,45 @@
+import logging
+from types import SimpleNamespace
+
+import extensions
+import perfil_consultas
+
+
+def test_server_timing_e_aviso_de_n_mais_1(app, client, caplog):
+    app.config['MONGO_PROFILER_NPLUS1'] = 2
+
+    @app.route('/_teste/n-mais-1')
+    def _n_mais_1():
+        db = extensions.mongo_db
+        for i in range(3):
+            db['produtos'].find_one({'_id': f'p{i}'})
+        db['estoques'].count_documents({'produto_id': {'$in': ['a', 'b']}})
+        return {'ok': True}
+
+    with caplog.at_level(logging.INFO):
+        r = client.get('/_teste/n-mais-1')
+    assert r.status_code == 200
+    assert r.headers['Server-Timing'].startswith('db;dur=')
+    assert 'desc="4 cmds"' in r.headers['Server-Timing']
+    rid = r.headers['X-Request-ID']
+    linhas = [rec.getMessage() for rec in caplog.records]
+    assert any(f'req={rid}' in m and 'db=4cmds' in m and '3x find produtos {"_id":"?"}' in m for m in linhas)
+    assert any(m.startswith('[N+1]') and 'find produtos' in m for m in linhas)
+    assert not any(m.startswith('[N+1]') and 'estoques' in m for m in linhas)
+
+
+def test_listener_agrupa_comandos_por_forma():
+    perfil, token = perfil_consultas.iniciar()
+    try:
+        for i, valor in enumerate(['x', 'y']):
+            cmd = {'find': 'estoques', 'filter': {'produto_id': valor, 'quantidade': {'$gt': i}}, 'sort': {'updated_at': -1}}
+            perfil_consultas.listener.started(SimpleNamespace(command=cmd, command_name='find', request_id=i, connection_id=('h', 1)))
+            perfil_consultas.listener.succeeded(SimpleNamespace(request_id=i, connection_id=('h', 1), duration_micros=1500))
+        perfil_consultas.listener.started(SimpleNamespace(command={'ping': 1}, command_name='ping', request_id=9, connection_id=('h', 1)))
+        perfil_consultas.listener.succeeded(SimpleNamespace(request_id=9, connection_id=('h', 1), duration_micros=10))
+    finally:
+        perfil_consultas.encerrar(token)
+    assert perfil.comandos == 2
+    assert perfil.tempo_db_ms == 3.0
+    assert perfil.mais_repetidas(1) == [('find estoques {"produto_id":"?","quantidade":{"$gt":"?"}} sort=updated_at', 2)]
+    assert perfil_consultas.perfil_atual() is None
@@ -0,0 +1,97 @@
+import time
+
+import extensions
+import movimentacoes_repo
+
+
+def _get_csrf_token(client):
+    client.get('/')
+    with client.session_transaction() as sess:
+        return sess.get('csrf_token')
+
+
+def _json_headers(token):
+    return {
+        'Accept': 'application/json',
+        'Content-Type': 'application/json',
+        'X-CSRF-Token': token,
+    }
+
+
+def _bootstrap(client, h):
+    central_id = client.post('/api/centrais', json={'nome': 'Central NF', 'ativo': True}, headers=h).get_json().get('id')
+    almox_id = client.post('/api/almoxarifados', json={'nome': 'Almox NF', 'ativo': True, 'central_id': central_id}, headers=h).get_json().get('id')
+    produtos = []
+    for i in range(3):
+        r = client.post('/api/produtos', json={'central_id': central_id, 'codigo': f'NF-000{i}', 'nome': f'Item NF {i}', 'ativo': True}, headers=h)
+        produtos.append(r.get_json().get('id'))
+    return almox_id, produtos
+
+
+def test_recebimento_lote_json_com_relatorio_por_linha(app, client):
+    assert client.post('/auth/login', json={'username': 'admin', 'password': 'admin'}).status_code == 200
+    h = _json_headers(_get_csrf_token(client))
+    almox_id, produtos = _bootstrap(client, h)
+
+    itens = [{'codigo': 'NF-0000', 'quantidade': 1, 'lote': 'L1', 'data_vencimento': '2027-01-31', 'preco_unitario': 2.5}
+             for _ in range(500)]
+    itens.append({'produto_id': produtos[1], 'quantidade': 7})
+    itens.append({'codigo': 'NAO-EXISTE', 'quantidade': 1})
+    itens.append({'codigo': 'NF-0002', 'quantidade': 0})
+
+    inicio = time.perf_counter()
+    r = client.post('/api/recebimentos/lote', json={'almoxarifado_id': almox_id, 'nota_fiscal': 'NF-123', 'itens': itens}, headers=h)
+    assert time.perf_counter() - inicio < 5
+    assert r.status_code == 200, r.get_json()
+    j = r.get_json()
+    assert j['aplicadas'] == 501 and j['falhas'] == 2
+    assert [e['linha'] for e in j['erros']] == [502, 503]
+
+    with app.app_context():
+        db = extensions.mongo_db
+        est = db['estoques'].find_one({'produto_id': produtos[0], 'local_tipo': 'almoxarifado', 'local_id': almox_id})
+        assert est['quantidade_disponivel'] == 500.0
+        lote = db['lotes'].find_one({'produto_id': produtos[0], 'lote': 'L1', 'almoxarifado_id': almox_id})
+        assert lote['quantidade_atual'] == 500.0
+        assert movimentacoes_repo.get_repo(db).count_documents({'nota_fiscal': 'NF-123'}) == 501
+        vencimento = lote['data_vencimento']
+        assert vencimento is not None
+
+    # nova entrada no mesmo lote sem datas/fornecedor: não apaga o que o lote já tem
+    r = client.post('/api/recebimentos/lote', json={'almoxarifado_id': almox_id, 'fornecedor': 'Distribuidora X',
+                                                    'itens': [{'codigo': 'NF-0000', 'quantidade': 2, 'lote': 'L1'}]}, headers=h)
+    assert r.status_code == 200, r.get_json()
+    r = client.post('/api/recebimentos/lote', json={'almoxarifado_id': almox_id,
+                                                    'itens': [{'codigo': 'NF-0000', 'quantidade': 1, 'lote': 'L1'}]}, headers=h)
+    assert r.status_code == 200, r.get_json()
+    with app.app_context():
+        lote = extensions.mongo_db['lotes'].find_one({'produto_id': produtos[0], 'lote': 'L1', 'almoxarifado_id': almox_id})
+        assert lote['quantidade_atual'] == 503.0
+        assert lote['data_vencimento'] == vencimento and lote['fornecedor'] == 'Distribuidora X'
+
+    # parcial=false: nada é gravado quando há erro
+    r = client.post('/api/recebimentos/lote', json={'almoxarifado_id': almox_id, 'parcial': False, 'itens': [
+        {'codigo': 'NF-0002', 'quantidade': 3}, {'codigo': 'NAO-EXISTE', 'quantidade': 1}]}, headers=h)
+    assert r.status_code == 400
+    with app.app_context():
+        assert extensions.mongo_db['estoques'].find_one({'produto_id': produtos[2]}) is None
+
+
+def test_recebimento_lote_csv(app, client):
+    assert client.post('/auth/login', json={'username': 'admin', 'password': 'admin'}).status_code == 200
+    token = _get_csrf_token(client)
+    h = _json_headers(token)
+    central_id = client.post('/api/centrais', json={'nome': 'Central CSV', 'ativo': True}, headers=h).get_json().get('id')
+    almox_id = client.post('/api/almoxarifados', json={'nome': 'Almox CSV', 'ativo': True, 'central_id': central_id}, headers=h).get_json().get('id')
+    pid = client.post('/api/produtos', json={'central_id': central_id, 'codigo': 'CSV-0001', 'nome': 'Item CSV', 'ativo': True}, headers=h).get_json().get('id')
+
+    corpo = 'produto;quantidade;lote;vencimento;preco\nCSV-0001;10;A1;31/12/2027;1,25\nCSV-0001;abc;A1;;\n'
+    r = client.post(f'/api/recebimentos/lote?almoxarifado_id={almox_id}&nota_fiscal=NF-CSV', data=corpo,
+                    headers={'Content-Type': 'text/csv', 'Accept': 'application/json', 'X-CSRF-Token': token})
+    assert r.status_code == 200, r.get_json()
+    j = r.get_json()
+    assert j['aplicadas'] == 1
+    assert j['erros'] == [{'linha': 3, 'produto': 'CSV-0001', 'error': 'Quantidade deve ser maior que zero'}]
+    with app.app_context():
+        mov = movimentacoes_repo.get_repo(extensions.mongo_db).find_one({'nota_fiscal': 'NF-CSV'})
+        assert mov['produto_id'] == pid and mov['preco_unitario'] == 1.25 and mov['lote'] == 'A1'
@@ -0,0 +1,114 @@
+from datetime import datetime, timedelta, timezone
+
+import arquivamento
+import extensions
+import movimentacoes_repo
+
+
+def _login_admin(client):
+    resp = client.post('/auth/login', json={'username': 'admin', 'password': 'admin'})
+    assert resp.status_code == 200
+
+
+def _item(payload, produto_id):
+    for it in payload.get('items') or []:
+        if str(it.get('produto_id')) == str(produto_id):
+            return it
+    return None
+
+
+def test_consumo_gastos_materializado_e_refresh_incremental(app, client):
+    _login_admin(client)
+    now = datetime.now(timezone.utc)
+
+    with app.app_context():
+        db = extensions.mongo_db
+        db['produtos'].insert_one({'id': 9101, 'nome': 'Luva P', 'codigo': 'REL-0001'})
+        oid = db['produtos'].insert_one({'nome': 'Seringa 10ml', 'codigo': 'REL-0002'}).inserted_id
+        for i in range(40):
+            movimentacoes_repo.get_repo(db).insert_one({
+                'produto_id': 9101, 'tipo': 'saida', 'quantidade': 1.0,
+                'data_movimentacao': now - timedelta(days=i, hours=1), 'created_at': now,
+            })
+            movimentacoes_repo.get_repo(db).insert_one({
+                'produto_id': str(oid), 'tipo': 'entrada', 'quantidade': 2.0, 'preco_unitario': 1.5,
+                'data_movimentacao': now - timedelta(days=i, hours=1), 'created_at': now,
+            })
+
+    r = client.get('/api/relatorios/admin/consumo-gastos')
+    assert r.status_code == 200
+    j = r.get_json()
+    luva = _item(j, 9101)
+    seringa = _item(j, oid)
+    assert luva and seringa
+    assert luva['produto_codigo'] == 'REL-0001'
+    assert luva['total_consumo'] == 30.0
+    assert seringa['produto_codigo'] == 'REL-0002'
+    assert seringa['total_gastos'] == 90.0
+
+    # Nova movimentação em um dia já materializado deve ser refletida (refresh incremental)
+    with app.app_context():
+        movimentacoes_repo.get_repo(extensions.mongo_db).insert_one({
+            'produto_id': 9101, 'tipo': 'consumo', 'quantidade': 5.0,
+            'data_movimentacao': now - timedelta(days=3), 'created_at': datetime.now(timezone.utc),
+        })
+    r = client.get('/api/relatorios/admin/consumo-gastos')
+    assert r.status_code == 200
+    assert _item(r.get_json(), 9101)['total_consumo'] == 35.0
+
+
+def test_consumo_diario_pega_commit_atrasado_e_arquivamento(app, client):
+    _login_admin(client)
+    now = datetime.now(timezone.utc)
+    dia = now - timedelta(days=5)
+
+    with app.app_context():
+        db = extensions.mongo_db
+        repo = movimentacoes_repo.get_repo(db)
+        repo.insert_one({'produto_id': 9201, 'tipo': 'saida', 'quantidade': 4.0,
+                         'data_movimentacao': dia, 'created_at': now})
+    r = client.get('/api/relatorios/admin/consumo-gastos')
+    assert _item(r.get_json(), 9201)['total_consumo'] == 4.0
+
+    with app.app_context():
+        db = extensions.mongo_db
+        watermark = db['relatorios_materializados'].find_one({'_id': 'consumo_diario'})['watermark']
+        # gravada antes da marca d'água, mas só visível depois da última atualização
+        movimentacoes_repo.get_repo(db).insert_one({
+            'produto_id': 9201, 'tipo': 'saida', 'quantidade': 3.0,
+            'data_movimentacao': dia, 'created_at': watermark - timedelta(seconds=30),
+        })
+    r = client.get('/api/relatorios/admin/consumo-gastos')
+    assert _item(r.get_json(), 9201)['total_consumo'] == 7.0
+
+    with app.app_context():
+        arquivamento.arquivar(extensions.mongo_db, 'movimentacoes', {'produto_id': 9201})
+    r = client.get('/api/relatorios/admin/consumo-gastos')
+    assert _item(r.get_json(), 9201) is None
+
+
+def test_arquivamento_com_atualizacao_concorrente_nao_deixa_dias_na_visao(app, client, monkeypatch):
+    import consumo_diario
+
+    _login_admin(client)
+    dia = datetime.now(timezone.utc) - timedelta(days=6)
+    with app.app_context():
+        db = extensions.mongo_db
+        movimentacoes_repo.get_repo(db).insert_one({'produto_id': 9301, 'tipo': 'saida', 'quantidade': 2.0,
+                                                    'data_movimentacao': dia, 'created_at': dia})
+    assert _item(client.get('/api/relatorios/admin/consumo-gastos').get_json(), 9301)['total_consumo'] == 2.0
+
+    original = consumo_diario.marcar_dias
+    chamadas = []
+
+    def marcar_e_atualizar(db_, datas):
+        original(db_, datas)
+        chamadas.append(1)
+        if len(chamadas) == 1:
+            # o agendador atualiza a visão entre a marcação e a remoção do bloco
+            consumo_diario.atualizar(db_)
+
+    monkeypatch.setattr(consumo_diario, 'marcar_dias', marcar_e_atualizar)
+    with app.app_context():
+        arquivamento.arquivar(extensions.mongo_db, 'movimentacoes', {'produto_id': 9301})
+    assert _item(client.get('/api/relatorios/admin/consumo-gastos').get_json(), 9301) is None
@@ -0,0 +1,147 @@
+from datetime import datetime, timedelta, timezone
+
+import backups
+import extensions
+import movimentacoes_repo
+import saldos
+
+
+def _get_csrf_token(client):
+    client.get('/')
+    with client.session_transaction() as sess:
+        return sess.get('csrf_token')
+
+
+def _json_headers(token):
+    return {
+        'Accept': 'application/json',
+        'Content-Type': 'application/json',
+        'X-CSRF-Token': token,
+    }
+
+
+def _bootstrap(client, csrf):
+    r = client.post('/api/centrais', json={'nome': 'Central Saldo', 'ativo': True}, headers=_json_headers(csrf))
+    central_id = r.get_json().get('id')
+    r = client.post('/api/almoxarifados', json={'nome': 'Almox Saldo', 'ativo': True, 'central_id': central_id}, headers=_json_headers(csrf))
+    almox_id = r.get_json().get('id')
+    r = client.post('/api/sub-almoxarifados', json={'nome': 'Sub Saldo', 'ativo': True, 'almoxarifado_id': almox_id}, headers=_json_headers(csrf))
+    sub_id = r.get_json().get('id')
+    r = client.post('/api/setores', json={'nome': 'Setor Saldo', 'ativo': True, 'sub_almoxarifado_ids': [sub_id]}, headers=_json_headers(csrf))
+    setor_id = r.get_json().get('id')
+    r = client.post('/api/produtos', json={'central_id': central_id, 'codigo': 'SALDO-0001', 'nome': 'Atadura', 'ativo': True}, headers=_json_headers(csrf))
+    produto_id = r.get_json().get('id')
+    assert central_id and almox_id and setor_id and produto_id
+    return almox_id, setor_id, produto_id
+
+
+def _saldo(client, produto_id, tipo, local_id, data):
+    r = client.get('/api/estoque/saldo-em', query_string={
+        'produto_id': produto_id, 'local_tipo': tipo, 'local_id': local_id, 'data': data.isoformat(),
+    })
+    assert r.status_code == 200, r.get_json()
+    return r.get_json()
+
+
+def test_saldo_em_usa_snapshot_e_aplica_delta(app, client):
+    assert client.post('/auth/login', json={'username': 'admin', 'password': 'admin'}).status_code == 200
+    csrf = _get_csrf_token(client)
+    almox_id, setor_id, produto_id = _bootstrap(client, csrf)
+
+    antes = datetime.now(timezone.utc) - timedelta(minutes=1)
+    r = client.post(f'/api/produtos/{produto_id}/recebimento', json={'almoxarifado_id': almox_id, 'quantidade': 20}, headers=_json_headers(csrf))
+    assert r.status_code == 200
+    r = client.post('/api/movimentacoes/distribuicao', json={
+        'produto_id': produto_id,
+        'origem': {'tipo': 'almoxarifado', 'id': almox_id},
+        'destinos': [{'id': setor_id, 'quantidade': 5.0}],
+    }, headers=_json_headers(csrf))
+    assert r.status_code == 200
+
+    # Sem snapshot: checkpoint é o saldo atual
+    res = _saldo(client, produto_id, 'setor', setor_id, antes)
+    assert res['checkpoint']['origem'] == 'estoque_atual'
+    assert res['saldo'] == 0.0
+
+    with app.app_context():
+        db = extensions.mongo_db
+        ref = saldos.gerar_snapshot(db)['data_referencia'].replace(tzinfo=timezone.utc)
+        # consumo lançado 1 min depois do snapshot
+        movimentacoes_repo.get_repo(db).insert_one({
+            'produto_id': produto_id, 'tipo': 'consumo', 'quantidade': 2.0,
+            'origem_tipo': 'setor', 'origem_id': setor_id,
+            'data_movimentacao': ref + timedelta(minutes=1), 'created_at': ref + timedelta(minutes=1),
+        })
+
+    res = _saldo(client, produto_id, 'setor', setor_id, ref + timedelta(seconds=30))
+    assert res['checkpoint']['origem'] == 'snapshot'
+    assert res['saldo'] == 5.0
+    assert _saldo(client, produto_id, 'setor', setor_id, ref + timedelta(minutes=2))['saldo'] == 3.0
+    assert _saldo(client, produto_id, 'almoxarifado', almox_id, ref + timedelta(seconds=30))['saldo'] == 15.0
+    assert _saldo(client, produto_id, 'almoxarifado', almox_id, antes)['saldo'] == 0.0
+
+
+def test_saldo_em_considera_lancamento_retroativo_feito_apos_snapshot(app, client):
+    assert client.post('/auth/login', json={'username': 'admin', 'password': 'admin'}).status_code == 200
+    ref = datetime(2026, 3, 10, 12, 0, tzinfo=timezone.utc)
+    with app.app_context():
+        db = extensions.mongo_db
+        db['estoque_snapshots_execucoes'].insert_one({'data_referencia': ref, 'linhas': 1})
+        db['estoque_snapshots'].insert_one({'data_referencia': ref, 'produto_id': 'RET-1', 'produto_key': 'RET-1',
+                                            'local_tipo': 'setor', 'local_id': 'S-RET', 'local_key': 'S-RET',
+                                            'quantidade': 10.0})
+        # registrada dois dias depois do snapshot, com data de uma hora antes dele
+        movimentacoes_repo.get_repo(db).insert_one({
+            'produto_id': 'RET-1', 'tipo': 'consumo', 'quantidade': 4.0, 'origem_tipo': 'setor', 'origem_id': 'S-RET',
+            'data_movimentacao': ref - timedelta(hours=1), 'created_at': ref + timedelta(days=2),
+        })
+        assert saldos.saldo_em(db, ['RET-1'], 'setor', ['S-RET'], ref)['saldo'] == 6.0
+        assert saldos.saldo_em(db, ['RET-1'], 'setor', ['S-RET'], ref - timedelta(hours=2))['saldo'] == 10.0
+
+
+def test_snapshot_desconta_movimentacao_aplicada_durante_a_varredura(app):
+    with app.app_context():
+        db = extensions.mongo_db
+        depois = datetime.utcnow() + timedelta(minutes=1)
+        # entrada criada depois do início da varredura, mas já somada na linha de 'estoques' lida
+        db['estoques'].insert_one({'produto_id': 'VAR-1', 'local_tipo': 'setor', 'local_id': 'S-VAR',
+                                   'quantidade': 10.0, 'updated_at': depois})
+        movimentacoes_repo.get_repo(db).insert_one({
+            'produto_id': 'VAR-1', 'tipo': 'entrada', 'quantidade': 4.0, 'local_tipo': 'setor', 'local_id': 'S-VAR',
+            'data_movimentacao': depois, 'created_at': depois,
+        })
+        ref = saldos.gerar_snapshot(db)['data_referencia']
+        snap = db['estoque_snapshots'].find_one({'data_referencia': ref, 'produto_key': 'VAR-1'})
+        assert snap['quantidade'] == 6.0
+        # a entrada entra uma única vez, pelo delta
+        assert saldos.saldo_em(db, ['VAR-1'], 'setor', ['S-VAR'], depois + timedelta(minutes=1))['saldo'] == 10.0
+        assert saldos.saldo_em(db, ['VAR-1'], 'setor', ['S-VAR'], ref)['saldo'] == 6.0
+
+
+def test_snapshot_diario_agendado_e_retencao(app):
+    with app.app_context():
+        db = extensions.mongo_db
+        db[backups.COLECAO_LOCKS].delete_many({})
+        ativo = app.config.get('SNAPSHOT_ESTOQUE_ATIVO')
+        app.config['SNAPSHOT_ESTOQUE_ATIVO'] = True
+        try:
+            agendador = backups.BackupScheduler(app)
+            agora = datetime(2026, 5, 4, 0, 30)
+            res = agendador.verificar_snapshot_estoque(agora)
+            assert res is not None
+            # mesmo dia: não grava outro
+            assert agendador.verificar_snapshot_estoque(agora) is None
+        finally:
+            app.config['SNAPSHOT_ESTOQUE_ATIVO'] = ativo
+            agendador._liberar_lock()
+
+        execs = db['estoque_snapshots_execucoes']
+        velhas = [datetime(2025, 1, 5), datetime(2025, 1, 20), datetime(2025, 2, 3)]
+        for d in velhas:
+            execs.insert_one({'data_referencia': d, 'linhas': 1})
+            db['estoque_snapshots'].insert_one({'data_referencia': d, 'produto_key': 'X', 'local_tipo': 'setor',
+                                                'local_key': 'Y', 'quantidade': 1.0})
+        assert saldos.aplicar_retencao_snapshots(db, 90, agora=datetime(2025, 6, 1)) == 1
+        restantes = {e['data_referencia'] for e in execs.find({'data_referencia': {'$lt': datetime(2025, 12, 1)}})}
+        assert restantes == {datetime(2025, 1, 20), datetime(2025, 2, 3)}
+        assert db['estoque_snapshots'].count_documents({'data_referencia': datetime(2025, 1, 5)}) == 0
@@ -0,0 +1,30 @@
+import mongomock
+
+import dataset_sintetico
+import sugestao_indices
+
+
+def test_propoe_indice_esr_e_ignora_formas_ja_indexadas():
+    formas = [
+        {'forma': 'find movimentacoes {"data_movimentacao":{"$gte":"?"},"origem_id":"?"} sort=created_at', 'ocorrencias': 40, 'total_ms': 900.0},
+        {'forma': 'find movimentacoes {"origem_id":"?"}', 'ocorrencias': 10, 'total_ms': 50.0},
+        {'forma': 'find estoques {"setor_id":"?"}', 'ocorrencias': 5, 'total_ms': 300.0},
+        {'forma': 'find demandas {"status":"?"} sort=created_at', 'ocorrencias': 7, 'total_ms': 120.0},
+        {'forma': 'find produtos {"_id":"?"}', 'ocorrencias': 99, 'total_ms': 99.0},
+    ]
+    sugestoes = sugestao_indices.propor(formas)
+    por_colecao = {s['colecao']: s for s in sugestoes}
+    # igualdade -> ordenação -> intervalo; o candidato só com origem_id é prefixo e é absorvido
+    assert por_colecao['movimentacoes']['chaves'] == ['origem_id', 'created_at', 'data_movimentacao']
+    assert por_colecao['movimentacoes']['ocorrencias'] == 50
+    assert por_colecao['estoques']['chaves'] == ['setor_id']
+    # demandas (status, created_at) e produtos._id já estão no catálogo
+    assert set(por_colecao) == {'movimentacoes', 'estoques'}
+    assert [s['colecao'] for s in sugestoes] == ['movimentacoes', 'estoques']
+    assert sugestao_indices.linha_catalogo(por_colecao['estoques']) == "indice('idx_estoques_setor_id', [('setor_id', ASCENDING)]),"
+
+    db = mongomock.MongoClient()['sugestao']
+    dataset_sintetico.gerar(db, dataset_sintetico.ESCALAS['teste'], seed=5)
+    est = sugestao_indices.estimar(db, por_colecao['estoques'])
+    assert est['metodo'] == 'seletividade'
+    assert est['depois']['docs_examinados'] < est['antes']['docs_examinados']